@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare packet whitening and CRC32 throughput per packet and per batch
+
+The gnuradio path whitens each packet with its own numpy XOR and computes its CRC
+with gnuradio.digital.crc, the way the packet utilities used to. The per packet path
+uses the single packet packet_batch functions the packet utilities now call, and
+the batch path runs the packet_batch batch functions over all the packets at once.
+The make/unmake paths time whole packets built and taken apart one at a time by
+packet_utils2.make_packet and unmake_packet, against make_packets and unmake_packets
+doing all of them in one call. All paths are checked against each other before they
+are timed.
+'''
+
+# standard python library imports
+from optparse import OptionParser
+import random
+import time
+
+# third party library imports
+from gnuradio.digital import crc
+import numpy
+
+# project specific imports
+from digital_ll import packet_batch
+from digital_ll import packet_utils2
+from digital_ll.packet_utils2 import random_mask_vec8
+
+
+def make_payloads(num_pkts, min_len, max_len, seed):
+    rng = random.Random(seed)
+    return [''.join(chr(rng.randrange(256)) for _ in range(rng.randint(min_len, max_len)))
+            for _ in range(num_pkts)]
+
+def gr_tx(payloads, whitener_offsets):
+    pkts = []
+    for payload, o in zip(payloads, whitener_offsets):
+        payload_with_crc = crc.gen_and_append_crc32(payload)
+        sa = numpy.fromstring(payload_with_crc, numpy.uint8)
+        pkts.append( (sa ^ random_mask_vec8[o:len(sa)+o]).tostring())
+    return pkts
+
+def gr_rx(pkts, whitener_offsets):
+    results = []
+    for pkt, o in zip(pkts, whitener_offsets):
+        sa = numpy.fromstring(pkt, numpy.uint8)
+        results.append(crc.check_crc32( (sa ^ random_mask_vec8[o:len(sa)+o]).tostring()))
+    return results
+
+def per_packet_tx(payloads, whitener_offsets):
+    return [packet_batch.whiten(packet_batch.gen_and_append_crc32(payload), o,
+                                random_mask_vec8)[0]
+            for payload, o in zip(payloads, whitener_offsets)]
+
+def per_packet_rx(pkts, whitener_offsets):
+    return [packet_batch.check_crc32(packet_batch.whiten(pkt, o, random_mask_vec8)[0])
+            for pkt, o in zip(pkts, whitener_offsets)]
+
+def batch_tx(payloads, whitener_offsets):
+    buf, offsets = packet_batch.pack_payloads(payloads)
+    buf, offsets = packet_batch.append_crc32_batch(buf, offsets)
+    buf, success = packet_batch.whiten_batch(buf, offsets, whitener_offsets,
+                                             random_mask_vec8)
+    return packet_batch.unpack_payloads(buf, offsets)
+
+def batch_rx(pkts, whitener_offsets):
+    buf, offsets = packet_batch.pack_payloads(pkts)
+    buf, success = packet_batch.dewhiten_batch(buf, offsets, whitener_offsets,
+                                               random_mask_vec8)
+    ok, buf, offsets = packet_batch.check_crc32_batch(buf, offsets)
+    return zip(ok.tolist(), packet_batch.unpack_payloads(buf, offsets))
+
+def make_packet_tx(payloads, whitener_offsets):
+    return [packet_utils2.make_packet(payload, 1, 1, None, pad_for_usrp=False, 
+                                      whitener_offset=o)
+            for payload, o in zip(payloads, whitener_offsets)]
+
+def make_packets_tx(payloads, whitener_offsets):
+    return packet_utils2.make_packets(payloads, 1, 1, None, pad_for_usrp=False,
+                                      whitener_offsets=whitener_offsets)
+
+def unmake_packet_rx(pkts, whitener_offsets):
+    return [packet_utils2.unmake_packet(pkt, None, whitener_offset=o)
+            for pkt, o in zip(pkts, whitener_offsets)]
+
+def unmake_packets_rx(pkts, whitener_offsets):
+    return packet_utils2.unmake_packets(pkts, None, whitener_offsets=whitener_offsets)
+
+def time_it(func, args, num_reps):
+    start = time.time()
+    for k in range(num_reps):
+        func(*args)
+    return (time.time() - start)/num_reps
+
+def main():
+
+    parser = OptionParser(description=__doc__.strip().splitlines()[0])
+    parser.add_option("--num-packets", type="int", default=1000,
+                      help="packets per batch [default=%default]")
+    parser.add_option("--min-len", type="int", default=40,
+                      help="smallest payload in bytes [default=%default]")
+    parser.add_option("--max-len", type="int", default=1500,
+                      help="largest payload in bytes [default=%default]")
+    parser.add_option("--num-reps", type="int", default=20,
+                      help="number of times to time each path [default=%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="random seed for the payloads [default=%default]")
+    (options, args) = parser.parse_args()
+
+    payloads = make_payloads(options.num_packets, options.min_len, options.max_len,
+                             options.seed)
+    whitener_offsets = [k % 16 for k in range(options.num_packets)]
+    num_bytes = sum(len(p) for p in payloads)
+
+    # make sure all paths agree before timing them
+    pkts = gr_tx(payloads, whitener_offsets)
+    results = gr_rx(pkts, whitener_offsets)
+    for name, tx, rx in [("per packet", per_packet_tx, per_packet_rx),
+                         ("batch", batch_tx, batch_rx)]:
+        if tx(payloads, whitener_offsets) != pkts:
+            raise RuntimeError("%s and gnuradio transmit paths disagree" % name)
+        if rx(pkts, whitener_offsets) != results:
+            raise RuntimeError("%s and gnuradio receive paths disagree" % name)
+    if make_packets_tx(payloads, whitener_offsets) != make_packet_tx(payloads, 
+                                                                     whitener_offsets):
+        raise RuntimeError("make_packets and make_packet disagree")
+    if unmake_packets_rx(pkts, whitener_offsets) != results:
+        raise RuntimeError("unmake_packets and gnuradio receive paths disagree")
+    if unmake_packet_rx(pkts, whitener_offsets) != results:
+        raise RuntimeError("unmake_packet and gnuradio receive paths disagree")
+
+    print "%d packets, %d payload bytes per batch" % (options.num_packets, num_bytes)
+    print "%-20s %12s %12s" % ("path", "ms/batch", "MB/s")
+
+    for name, func, args in [("gnuradio tx", gr_tx, (payloads, whitener_offsets)),
+                             ("per packet tx", per_packet_tx, (payloads, whitener_offsets)),
+                             ("batch tx", batch_tx, (payloads, whitener_offsets)),
+                             ("gnuradio rx", gr_rx, (pkts, whitener_offsets)),
+                             ("per packet rx", per_packet_rx, (pkts, whitener_offsets)),
+                             ("batch rx", batch_rx, (pkts, whitener_offsets)),
+                             ("make_packet", make_packet_tx, (payloads, whitener_offsets)),
+                             ("make_packets", make_packets_tx, (payloads, whitener_offsets)),
+                             ("unmake_packet", unmake_packet_rx, (pkts, whitener_offsets)),
+                             ("unmake_packets", unmake_packets_rx, (pkts, whitener_offsets))]:
+        t = time_it(func, args, options.num_reps)
+        print "%-20s %12.3f %12.2f" % (name, t*1e3, num_bytes/t/1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measure how many packets per second each modulation's PHY chain sustains
+
+Every modulation registered with digital_ll.modulation_utils as both a type 1
+modulator and demodulator is run headless, with no USRP. Packets are built with
+packet_utils2.make_packet, the way packet_framer builds them, then modulated, passed
+through an AWGN channel and decoded by receive_path_narrowband. The benchmark sweeps
+payload size, samples per symbol, coding and SNR, and each configuration runs as
+fast as the CPU allows. For each configuration it reports packets/s, samples/s and
+the number of cores kept busy.
+'''
+
+# standard python library imports
+from itertools import product
+import logging
+from optparse import OptionParser
+import os
+import random
+import threading
+import time
+
+# third party library imports
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+import numpy
+
+# project specific imports
+from digital_ll import lincolnlog
+from digital_ll import modulation_utils
+from digital_ll import packet_utils2
+from digital_ll import pkt2
+from digital_ll import receive_path_narrowband
+from digital_ll import uhd_receiver
+
+
+# zero bytes sent between packets, so each packet's preamble starts from idle
+GAP_BYTES = 16
+
+
+class packet_counter(object):
+    '''
+    Receive path callback that counts packets and notes when the last one arrived
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_ok = 0
+        self.num_failed = 0
+        self.last_time = None
+
+    def __call__(self, ok, payload, *args):
+        with self.lock:
+            if ok:
+                self.num_ok += 1
+            else:
+                self.num_failed += 1
+            self.last_time = time.time()
+
+    def total(self):
+        with self.lock:
+            return self.num_ok + self.num_failed
+
+
+def make_tx_bytes(num_pkts, payload_len, samples_per_symbol, bits_per_symbol,
+                  access_code, use_coding, seed):
+    '''
+    Build the modulator input for num_pkts random packets, separated by idle bytes
+    '''
+    rng = random.Random(seed)
+    gap = '\x00'*GAP_BYTES
+
+    pkts = [gap]
+    for k in range(num_pkts):
+        payload = ''.join(chr(rng.randrange(256)) for _ in range(payload_len))
+        pkts.append(packet_utils2.make_packet(payload, samples_per_symbol, bits_per_symbol,
+                                              None, access_code, False, use_coding,
+                                              None, k % 16))
+        pkts.append(gap)
+
+    return numpy.fromstring(''.join(pkts), numpy.uint8)
+
+
+class loopback_top_block(gr.top_block):
+    def __init__(self, mod_class, demod_class, tx_bytes, snr_db, callback, options):
+        gr.top_block.__init__(self)
+
+        # fork the packet decode workers before any radio objects start threads
+        pkt2.start_decode_pool(options.rx_decode_workers)
+
+        self.source = gr.vector_source_b(tx_bytes.tolist(), False)
+
+        mod_kwargs = mod_class.extract_kwargs_from_options(options)
+        self.modulator = mod_class(**mod_kwargs)
+
+        # modulators put out unit power, so the noise voltage sets the SNR per sample
+        noise_voltage = 10**(-snr_db/20.0)
+        self.channel = gr.channel_model(noise_voltage, 0.0, 1.0, (1.0,),
+                                        options.noise_seed)
+
+        self.rx_path = receive_path_narrowband(demod_class, callback, options,
+                                               use_new_pkt=True)
+
+        self.connect(self.source, self.modulator, self.channel, self.rx_path)
+
+
+def run_config(mod_name, mods, demods, payload_len, sps, use_coding, snr_db, options):
+    '''
+    Run one configuration. Returns a dict of results
+    '''
+    options.modulation = mod_name
+    options.samples_per_symbol = sps
+    options.modulation_samples_per_symbol = sps
+    options.coding = use_coding
+
+    bits_per_symbol = mods[mod_name].bits_per_symbol()
+
+    tx_bytes = make_tx_bytes(options.num_packets, payload_len, sps, bits_per_symbol,
+                             options.rx_access_code, use_coding, options.seed)
+    num_samples = len(tx_bytes)*8/bits_per_symbol*sps
+
+    counter = packet_counter()
+    tb = loopback_top_block(mods[mod_name], demods[mod_name], tx_bytes, snr_db, counter,
+                            options)
+
+    cpu_start = sum(os.times()[0:2])
+    start = time.time()
+
+    tb.run()
+    graph_end = time.time()
+
+    # let the packet receiver finish with anything still queued for decoding
+    num_pkts = counter.total()
+    while True:
+        time.sleep(options.drain_timeout)
+        if counter.total() == num_pkts:
+            break
+        num_pkts = counter.total()
+
+    end = max(graph_end, counter.last_time or graph_end)
+    cpu = sum(os.times()[0:2]) - cpu_start
+    wall = end - start
+
+    return {"modulation":mod_name,
+            "payload_len":payload_len,
+            "sps":sps,
+            "coding":use_coding,
+            "snr_db":snr_db,
+            "num_ok":counter.num_ok,
+            "num_failed":counter.num_failed,
+            "pkts_per_sec":counter.num_ok/wall,
+            "samples_per_sec":num_samples/wall,
+            "cores":cpu/wall,
+            "cpu_per_pkt":cpu/max(counter.num_ok, 1)}
+
+def parse_list(s, conv):
+    return [conv(x) for x in s.split(',') if x.strip()]
+
+def main():
+
+    mods = modulation_utils.type_1_mods()
+    demods = modulation_utils.type_1_demods()
+    mod_names = sorted(set(mods.keys()) & set(demods.keys()))
+
+    parser = OptionParser(option_class=eng_option, conflict_handler="resolve",
+                          description=__doc__.strip().splitlines()[0])
+    expert_grp = parser.add_option_group("Expert")
+
+    parser.add_option("--modulations", type="string", default=",".join(mod_names),
+                      help="comma separated modulations to run [default=%default]")
+    parser.add_option("--payload-sizes", type="string", default="64,512,1500",
+                      help="comma separated payload sizes in bytes [default=%default]")
+    parser.add_option("--sps-list", type="string", default="2,4",
+                      help="comma separated samples per symbol [default=%default]")
+    parser.add_option("--coding-list", type="string", default="0,1",
+                      help="comma separated coding settings, 0 or 1 [default=%default]")
+    parser.add_option("--snr-list", type="string", default="inf,20,10",
+                      help=("comma separated SNRs per sample in dB. inf runs without " +
+                            "noise [default=%default]"))
+    parser.add_option("--num-packets", type="int", default=500,
+                      help="packets per configuration [default=%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="random seed for the payloads [default=%default]")
+    parser.add_option("--noise-seed", type="int", default=0,
+                      help="random seed for the channel noise [default=%default]")
+    parser.add_option("--drain-timeout", type="float", default=0.5,
+                      help=("seconds to wait for packets still being decoded after " +
+                            "the flow graph finishes [default=%default]"))
+
+    receive_path_narrowband.add_options(parser, expert_grp)
+
+    for mod in mods.values():
+        mod.add_options(expert_grp)
+
+    for demod in demods.values():
+        demod.add_options(expert_grp)
+
+    uhd_receiver.add_options(parser)
+
+    (options, args) = parser.parse_args()
+
+    run_mods = parse_list(options.modulations, str)
+    for mod_name in run_mods:
+        if mod_name not in mod_names:
+            parser.error(("modulation %s is not registered as both a modulator and a " +
+                          "demodulator. Choose from %s") % (mod_name, ", ".join(mod_names)))
+
+    if options.rf_rx_freq is None:
+        options.rf_rx_freq = 0
+
+    # receive_path_narrowband reads the threshold under the name receive_path_gmsk
+    # gives it
+    options.access_code_threshold = options.threshold
+
+    # transmit and receive have to agree on the access code
+    options.rx_access_code = packet_utils2.default_access_code
+
+    logging.basicConfig()
+    lincolnlog.LincolnLogLayout('debug', -1, -1, -1, -1)
+
+    print "cpus available: %d" % os.sysconf('SC_NPROCESSORS_ONLN')
+    print "%-8s %7s %4s %6s %6s %8s %8s %10s %12s %6s %10s" % (
+           "mod", "payload", "sps", "coding", "snr", "ok", "failed", "pkts/s",
+           "samples/s", "cores", "cpu us/pkt")
+
+    for mod_name, payload_len, sps, use_coding, snr_db in product(
+            run_mods,
+            parse_list(options.payload_sizes, int),
+            parse_list(options.sps_list, int),
+            parse_list(options.coding_list, int),
+            parse_list(options.snr_list, float)):
+
+        r = run_config(mod_name, mods, demods, payload_len, sps, use_coding, snr_db,
+                       options)
+
+        print "%-8s %7d %4d %6d %6.1f %8d %8d %10.1f %12.0f %6.2f %10.1f" % (
+               r["modulation"], r["payload_len"], r["sps"], r["coding"], r["snr_db"],
+               r["num_ok"], r["num_failed"], r["pkts_per_sec"], r["samples_per_sec"],
+               r["cores"], r["cpu_per_pkt"]*1e6)
+
+
+if __name__ == '__main__':
+    main()
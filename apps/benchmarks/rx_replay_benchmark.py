@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Replay a recorded IQ capture through a receive path as fast as it will run
+
+Captures are made by running any of the tdma apps with --rx-capture-file. The
+capture is played through the rx channelizer and the selected receive path the same
+way the apps connect them, with the capture's rx_time and rx_rate tags reinjected,
+and no USRP is needed. The report compares the time it took to decode the capture
+against how long the capture lasts, so it shows how much CPU headroom a receive path
+has at the capture's sample rate.
+'''
+
+# standard python library imports
+import logging
+from optparse import OptionParser
+import os
+import sys
+import threading
+import time
+
+# third party library imports
+from gnuradio import gr
+from gnuradio.eng_option import eng_option
+
+# project specific imports
+from digital_ll import channelizer
+from digital_ll import iq_replay_source
+from digital_ll import lincolnlog
+from digital_ll import modulation_utils
+from digital_ll import pkt2
+from digital_ll import receive_path_gmsk
+from digital_ll import receive_path_narrowband
+from digital_ll import uhd_receiver
+
+
+rx_paths = {"gmsk":receive_path_gmsk,
+            "narrowband":receive_path_narrowband}
+
+
+class packet_counter(object):
+    '''
+    Receive path callback that counts packets and notes when the last one arrived
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_ok = 0
+        self.num_failed = 0
+        self.num_bytes = 0
+        self.last_time = None
+
+    def __call__(self, ok, payload, *args):
+        with self.lock:
+            if ok:
+                self.num_ok += 1
+                self.num_bytes += len(payload)
+            else:
+                self.num_failed += 1
+            self.last_time = time.time()
+
+    def total(self):
+        with self.lock:
+            return self.num_ok + self.num_failed
+
+
+class replay_top_block(gr.top_block):
+    def __init__(self, demodulator, callback, options):
+        gr.top_block.__init__(self)
+
+        # fork the packet decode workers before any radio objects start threads
+        pkt2.start_decode_pool(options.rx_decode_workers)
+
+        self.source = iq_replay_source(options.replay_file, options.num_passes)
+
+        if self.source.sample_rate is not None:
+            self.sample_rate = self.source.sample_rate
+        else:
+            self.sample_rate = options.sample_rate
+
+        self.rx_channelizer = channelizer.rx_channelizer(options)
+        self.rx_channelizer.switch_channels(options.replay_channel)
+
+        if options.rx_path == "gmsk":
+            self.rx_path = receive_path_gmsk(demodulator, callback, options,
+                                             use_new_pkt=True)
+        else:
+            self.rx_path = receive_path_narrowband(demodulator, callback, options,
+                                                   use_new_pkt=True)
+
+        self.connect(self.source, self.rx_channelizer, self.rx_path)
+
+
+def main():
+
+    demods = modulation_utils.type_1_demods()
+
+    parser = OptionParser(option_class=eng_option, conflict_handler="resolve",
+                          description=__doc__.strip().splitlines()[0])
+    expert_grp = parser.add_option_group("Expert")
+
+    parser.add_option("--replay-file", type="string", default="",
+                      help="capture file to replay")
+    parser.add_option("--num-passes", type="int", default=1,
+                      help="number of times to play the capture [default=%default]")
+    parser.add_option("--rx-path", type="choice", choices=sorted(rx_paths.keys()),
+                      default="gmsk",
+                      help="receive path to decode with: %s [default=%%default]" %
+                           ", ".join(sorted(rx_paths.keys())))
+    parser.add_option("-m", "--modulation", type="choice", choices=demods.keys(),
+                      default="gmsk",
+                      help="demodulator for the receive path: %s [default=%%default]" %
+                           ", ".join(demods.keys()))
+    parser.add_option("--replay-channel", type="int", default=0,
+                      help="digital channel to decode [default=%default]")
+    parser.add_option("--sample-rate", type="eng_float", default=0,
+                      help=("sample rate of the capture, used only if the capture " +
+                            "has no rx_rate tag [default=%default]"))
+    parser.add_option("--drain-timeout", type="float", default=1.0,
+                      help=("seconds to wait for packets still being decoded after " +
+                            "the capture runs out [default=%default]"))
+
+    for rx_path in rx_paths.values():
+        rx_path.add_options(parser, expert_grp)
+
+    for demod in demods.values():
+        demod.add_options(expert_grp)
+
+    uhd_receiver.add_options(parser)
+    channelizer.rx_channelizer.add_options(parser)
+
+    (options, args) = parser.parse_args()
+
+    if not options.replay_file:
+        parser.error("--replay-file is required")
+
+    if not os.path.exists(options.replay_file):
+        parser.error("capture %s does not exist" % options.replay_file)
+
+    if options.num_passes < 1:
+        parser.error("--num-passes must be at least 1")
+
+    if options.rf_rx_freq is None:
+        options.rf_rx_freq = 0
+
+    logging.basicConfig()
+    lincolnlog.LincolnLogLayout('debug', -1, -1, -1, -1)
+
+    counter = packet_counter()
+    tb = replay_top_block(demods[options.modulation], counter, options)
+
+    if not tb.sample_rate:
+        sys.stderr.write("capture has no rx_rate tag, so --sample-rate must be set\n")
+        sys.exit(1)
+
+    num_samples = tb.source.total_samples()
+    duration = num_samples/tb.sample_rate
+
+    cpu_start = sum(os.times()[0:2])
+    start = time.time()
+
+    tb.run()
+    graph_end = time.time()
+
+    # let the packet receiver finish with anything still queued for decoding
+    num_pkts = counter.total()
+    while True:
+        time.sleep(options.drain_timeout)
+        if counter.total() == num_pkts:
+            break
+        num_pkts = counter.total()
+
+    end = max(graph_end, counter.last_time or graph_end)
+    cpu = sum(os.times()[0:2]) - cpu_start
+    wall = end - start
+
+    print "capture:          %s" % options.replay_file
+    print "receive path:     %s, %s demodulator, channel %d" % (options.rx_path,
+                                                                options.modulation,
+                                                                options.replay_channel)
+    print "samples:          %d (%d passes)" % (num_samples, options.num_passes)
+    print "capture duration: %.3f s at %.1f sps" % (duration, tb.sample_rate)
+    print "wall time:        %.3f s" % wall
+    print "cpu time:         %.3f s" % cpu
+    print "realtime factor:  %.2f" % (duration/wall)
+    print "cpu headroom:     %.1f %%" % (100*(1 - cpu/duration))
+    print "packets:          %d passed, %d failed" % (counter.num_ok, counter.num_failed)
+    print "decode rate:      %.1f packets/s, %.1f kB/s" % (
+            (counter.num_ok + counter.num_failed)/wall, counter.num_bytes/wall/1e3)
+
+
+if __name__ == '__main__':
+    main()
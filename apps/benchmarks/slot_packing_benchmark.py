@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare slot utilization of the SlotManager.fill_slot packing modes
+
+A backlogged queue of tunnel sized packets is used to fill a series of uplink slots
+with each packing mode. Utilization is the fraction of the slot covered by the
+packets fill_slot chose, and goodput is the number of data bytes sent per slot.
+'''
+
+# standard python library imports
+from collections import deque
+from optparse import OptionParser
+import random
+import time
+
+# third party library imports
+
+# project specific imports
+from digital_ll import packet_utils2
+from digital_ll import tdma_types_to_ints
+from digital_ll import time_spec_t
+from digital_ll.FrameSchedule import SlotParamTuple
+from mac_ll import mobile_slot_manager_static
+from mac_ll import tdma_shared
+
+# (size in bytes, relative weight) of the packets in the simulated tunnel traffic:
+# TCP acks, small datagrams, and full MTU frames
+PACKET_SIZE_MIX = [(66, 4), (200, 2), (576, 2), (1514, 3)]
+
+PACKING_MODES = [("fifo", 0), ("first_fit", 0), ("best_fit", 0), ("first_fit", 1500),
+                 ("best_fit", 1500)]
+
+
+class bench_tdma_mac(tdma_shared):
+    '''
+    Just enough of a tdma mac for fill_slot to compute packet durations
+    '''
+    def __init__(self, samples_per_symbol, bits_per_symbol, use_coding):
+        self.samples_per_symbol = samples_per_symbol
+        self.bits_per_symbol = bits_per_symbol
+        self.use_coding = use_coding
+
+    def num_phy_bytes_to_num_samples(self, payload_len):
+        return packet_utils2.ncomplex_samples(payload_len, self.samples_per_symbol,
+                                              self.bits_per_symbol, self.use_coding)
+
+
+def make_packets(num_pkts, num_flows, seed):
+    '''
+    Make a list of (meta,data) packets with sizes drawn from PACKET_SIZE_MIX
+    '''
+    rng = random.Random(seed)
+    sizes = []
+    for size, weight in PACKET_SIZE_MIX:
+        sizes += [size]*weight
+
+    pkts = []
+    for k in range(num_pkts):
+        meta = {"sourceID":rng.randint(1, num_flows),
+                "destinationID":1}
+        pkts.append( (meta, 'x'*rng.choice(sizes)) )
+    return pkts
+
+
+def run_mode(options, mode, aggregate_max_bytes, pkts):
+    '''
+    Fill slots from a copy of pkts with one packing mode and return the utilization,
+    bytes sent per slot and fill_slot run time per slot
+    '''
+    options.slot_packing_mode = mode
+    options.slot_aggregate_max_bytes = aggregate_max_bytes
+
+    tdma_mac = bench_tdma_mac(options.samples_per_symbol, 1, options.use_coding)
+    manager = mobile_slot_manager_static(tdma_types_to_ints, options, tdma_mac)
+
+    mac_config = {"fs":options.sample_rate,
+                  "my_id":2,
+                  "phyCode":0,
+                  "macCode":1}
+
+    slot = SlotParamTuple(owner=2, len=options.slot_len, offset=0, type="uplink",
+                          rf_freq=0, bb_freq=0, bw=0, tx_gain=0)
+
+    # copy the metadata since fill_slot updates it in place
+    pkt_in = deque( (dict(meta), data) for meta, data in pkts)
+
+    packet_count = 0
+    used_time = 0.0
+    sent_bytes = 0
+    num_slots = 0
+    run_time = 0.0
+    while num_slots < options.num_slots and len(pkt_in) > 0:
+        start = time.time()
+        result = manager.fill_slot(mac_config, packet_count, slot, 0, time_spec_t(0),
+                                   num_slots, pkt_in, "up", 0, 1)
+        run_time += time.time() - start
+
+        slot_pkts, packet_count, pkt_in, dropped, num_slot_bytes = result
+
+        for meta, payload in slot_pkts:
+            used_time += tdma_mac.num_bytes_to_num_samples(len(payload))/options.sample_rate
+        sent_bytes += num_slot_bytes
+        num_slots += 1
+
+    utilization = used_time/(num_slots*options.slot_len)
+    return utilization, float(sent_bytes)/num_slots, run_time/num_slots
+
+
+def main():
+
+    parser = OptionParser()
+    parser.add_option("--num-slots", type="int", default=1000,
+                      help="Number of slots to fill per mode [default=%default]")
+    parser.add_option("--slot-len", type="float", default=0.02,
+                      help="Slot length in seconds [default=%default]")
+    parser.add_option("--sample-rate", type="float", default=1e6,
+                      help="Sample rate in samples per second [default=%default]")
+    parser.add_option("--samples-per-symbol", type="int", default=4,
+                      help="Samples per symbol [default=%default]")
+    parser.add_option("--use-coding", action="store_true", default=False,
+                      help="Account for Reed-Solomon coding overhead")
+    parser.add_option("--num-flows", type="int", default=4,
+                      help="Number of distinct flows in the traffic [default=%default]")
+    parser.add_option("--slot-packing-lookahead", type="int", default=8,
+                      help="Look-ahead depth for the packing modes [default=%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="Random seed for the traffic mix [default=%default]")
+    (options, args) = parser.parse_args()
+
+    # settings the slot managers need that don't matter here
+    options.frame_validaton_history_depth = 10
+    options.beacon_sense_block_size = 0.5
+    options.rf_tx_freq = 0
+
+    # make enough traffic to keep the queue backlogged through every slot
+    pkts = make_packets(options.num_slots*200, options.num_flows, options.seed)
+
+    print "%-10s %10s %12s %14s %14s" % ("mode", "aggregate", "utilization",
+                                          "bytes/slot", "usec/slot")
+    for mode, aggregate_max_bytes in PACKING_MODES:
+        utilization, bytes_per_slot, secs_per_slot = run_mode(options, mode,
+                                                              aggregate_max_bytes, pkts)
+        print "%-10s %10d %12.3f %14.1f %14.1f" % (mode, aggregate_max_bytes, utilization,
+                                                  bytes_per_slot, secs_per_slot*1e6)
+
+if __name__ == '__main__':
+    main()
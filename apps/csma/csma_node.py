@@ -107,6 +107,9 @@ class my_top_block(gr.top_block):
                  rx_callback, options):
 
         gr.top_block.__init__(self)
+
+        # fork the packet decode workers before any radio objects start threads
+        digital_ll.pkt2.start_decode_pool(getattr(options, "rx_decode_workers", 0))
         
         print "using rx tap: %s" % options.use_rx_tap
         
@@ -19,7 +19,6 @@
 
 # standard python library imports
 import argparse
-from collections import deque
 from collections import namedtuple
 from decimal import Decimal
 import os
@@ -44,12 +43,22 @@ from numpy import ma
 # project specific imports
 from log_plotter_utils import readerThread
 from log_plotter_utils import bulk_data_reader
+from log_plotter_utils import get_queued_entries
+from log_plotter_utils import GrowingBuffer
+from log_plotter_utils import LogTailer
 from log_plotter_utils import shut_down
 from log_plotter_utils import plot_pattern
+from log_plotter_utils import StreamingPlot
+from log_plotter_utils import to_float
+from log_plotter_utils import wait_for_events
 
 
 visitThresh = 1
 coverageThresh = 1
+
+# number of points drawn per line before long histories are thinned out
+max_plot_points = 4000
+
 # set up custom color map with light blue mapped to smallest numbers
 #myCmap = mpl.colors.ListedColormap(cm.Greys(np.arange(.2,1,1/256.0)))
 #myCmap.set_bad('k', .80)
@@ -68,8 +77,8 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
     
     # set up any custom plot formatting functions
     def format_q_table_coord(x, y):
-        if data["q_tables"]:
-            q_table = data["q_tables"][-1].T
+        if data["q_table"] is not None:
+            q_table = data["q_table"].T
             
             (num_actions, num_states) = q_table.shape
             col = int(x)
@@ -86,14 +95,14 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
         
     fig=figure(fignum)
     # make sure there is data to plot
-    if data["q_tables"]:
+    if data["q_table"] is not None:
         
         epoch_nums = data["epoch_nums"]
         
         # check if mesh exists
         if not fig.axes[0].collections:
             # if plotting for the first time, make a new mesh
-            plot_data = data["q_tables"][-1].T
+            plot_data = data["q_table"].T
             pcolormesh(plot_data,edgecolors="black")
             ax = fig.axes[0]
             #cbaxes = fig.add_axes([0.8, 0.1, 0.03, 0.8])
@@ -116,7 +125,7 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
         else:
             # otherwise update existing mesh data values
             ax = fig.axes[0]
-            plot_data = data["q_tables"][-1].T
+            plot_data = data["q_table"].T
             ax.collections[0].set_array(plot_data.ravel())
             ax.set_title('Q Table for Epoch %i\n'%epoch_nums[-1], fontsize=figTitleFontSize, weight='bold')
             min_clim = np.min( [np.min(plot_data), -100])
@@ -124,7 +133,7 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
             clim(min_clim,max_clim)
         # plot the action logged in epoch N-1 since that is the action used
         # during epoch N
-        if len(data["q_tables"]) >= 2:
+        if len(data["actions"]) >= 2:
             
             # remove all annotations from figure in reverse order so items
             # aren't skipped 
@@ -169,8 +178,6 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
             else:
                 arrow_y3 = y3
                 
-            print "dx: ", dx, " dy: ", dy
-                
             # only plot arrow if it has length greater than zero
             if (np.abs(dx) > 0) or (np.abs(dy) > 0):
                     
@@ -186,7 +193,7 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
             
             
             
-            if len(data["q_tables"]) >= 3:
+            if len(data["actions"]) >= 3:
                 x1 = data["state_estimates"][-3] + .5
                 y1 = data["actions"][-3] + .5
             
@@ -207,9 +214,7 @@ def plot_q_tables(fignum, data, explore_img, exploit_img):
                 else:
                     arrow_y2 = y2
                 
-                print "dx: ", dx, " dy: ", dy
-                
-                # only plot arrow if it has length greater than zero
+                    # only plot arrow if it has length greater than zero
                 if (np.abs(dx) > 0) or (np.abs(dy) > 0):
                     
                     ax.annotate("",
@@ -268,223 +273,78 @@ def plot_current_action(fignum, data):
             # needed to display in engineering notation correctly
             rf_freq = rf_freq.normalize()
             
-            plot_pattern(fignum, data["action_space"][data["actions"][-1]], 
-                         data["number_digital_channels"], 
-                         data["unique_ids"])
+            # drawing a pattern is slow, so only redraw it when the action changes
+            if data["actions"][-1] != data["plotted_action"]:
+                plot_pattern(fignum, data["action_space"][data["actions"][-1]], 
+                             data["number_digital_channels"], 
+                             data["unique_ids"])
 #                        ax.collections[0].set_array(data["q_tables"][-1].ravel())
 #                        ax.set_title('Q Table for Epoch %i\n'%epoch_nums[-1], fontsize=figTitleFontSize, weight='bold')
             ax.set_title('Action for Epoch %i: %i\n'%(epoch_nums[-1], data["actions"][-1]), fontsize=figTitleFontSize, weight='bold')
             ax.set_xlabel("Time (s)\nRF Freq: %s"%rf_freq.to_eng_string(), fontsize=yTitleFontSize, weight='bold')
-            
+        
+        data["plotted_action"] = data["actions"][-1]
         fig.canvas.draw()            
 
-def plot_agent_vars(fignum, data):
+def plot_agent_vars(plot, data):
     
     #TODO: What parameters should be shifted left/right by one index? 
-    epoch_nums = np.array(data["epoch_nums"])
-    fig = figure(fignum)          
-    ax = fig.axes[0]
-    ax.clear()
-    ax.plot(epoch_nums, data["alphas"],label="alpha", marker='.')
-    #ax.locator_params(axis='y', prune='lower')
-    ax.set_ylim(-.1,1.1)
-    ax.set_yticks(np.arange(0,1.2,.2))
-    #ax.margins(.1,.2)
-    #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-#    ax.set_ylabel("Alpha", rotation=yTitleRotation, 
-#                  fontsize=yTitleFontSize, weight='bold',
-#                  horizontalalignment='center')
-    
-    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-    setp(ax.get_xticklabels(), visible=False)
-    ax.grid(True)
-    
-#    if len(epoch_nums) > 0:
-#        ax.set_title('Current Epoch %i\n'%epoch_nums[-1], fontsize=figTitleFontSize, weight='bold')
-#
-#    # plot epsilon vs epoch color coded by epsilon decay state
-#    ax = fig.axes[1]
-#    ax.clear()
-    ax.plot(epoch_nums, data["epsilons"], 'r', label="Epsilon", marker='.')
-    #ax.locator_params(axis='y', prune='both', nbins=6)
-#    ax.set_yticks(np.arange(.1,1,.2))
-#    ax.set_ylim(0,1)
-#    ax.margins(.1,.2)
-    #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    
-#    if len(data["epsilons"])>0:
-#        ax.plot(epoch_nums, data["epsilons"], 'r', marker='.')
-
-    if len(data["sum_epsilons"])>0:    
-#        ax.plot(data["sum_epsilon_epochs"], data["sum_epsilons"], 'ko',
-#                label="Sum Decay", mfc="None", markeredgecolor='k',
-#                markeredgewidth=2)
-        ax.plot(data["sum_epsilon_epochs"], data["sum_epsilons"], 'k.',
-                label="Sum Decay")    
-#    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    
-    
-#    ax.set_ylabel("Epsilon", rotation=yTitleRotation, 
-#                  fontsize=yTitleFontSize, weight='bold',
-#                  horizontalalignment='center')
-    
-#    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-#    setp(ax.get_xticklabels(), visible=False)
-#    ax.grid(True)
-#    
-#    # plot coverage vs epoch
-#    ax = fig.axes[2]
-#    ax.clear()
-    ax.plot(epoch_nums, data["coverage"], 'g', label="coverage", marker='.')
-    #ax.locator_params(axis='y', prune='upper',nbins=6)
-    ax.margins(.1,.2)
-    #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.set_ylabel("Rate", rotation=yTitleRotation, 
-                  fontsize=yTitleFontSize, weight='bold',
-                  horizontalalignment='center')
-                  
-#    ax.set_yticks(np.arange(.1,1,.2))
-#    ax.set_ylim(0,1)
-    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-    setp(ax.get_xticklabels(), visible=False)
-    ax.grid(True)
-    ax.legend(bbox_to_anchor=(1.05, 0.5), loc=6, borderaxespad=0.)
-
-    # draw vertical lines to show change detections on this subplot
-    # TODO: FIXME
-    change_epochs = [epoch_nums[ind]-1 for ind, y in enumerate(data["change_detections"]) if y > 0]
-    if len(change_epochs) > 0:
-        ax.vlines(change_epochs, -.1, 1.1, 'c')
-
-    
-    
-    # plot action index color coded by explore decision
-    ax = fig.axes[1]
-    ax.clear()
-    
-    if len(data["actions"])>0:
-        ax.plot(epoch_nums, data["actions"], 'r', marker='.')
-
-    if len(data["explore_epochs"])>0:    
-        ax.plot(data["explore_epochs"], data["explore_actions"], 'ko',
-                label="Explore", mfc="None", markeredgecolor='k',
-                markeredgewidth=2)
-        
-    # plot changes in exploring locked
-    explore_locked_epochs = [epoch_nums[ind] for ind, y in enumerate(data["exploring_frozen_changes"]) if y > 0]
-    explore_unlocked_epochs = [epoch_nums[ind] for ind, y in enumerate(data["exploring_frozen_changes"]) if y < 0]
-    
-    if len(explore_locked_epochs) > 0:
-        ax.vlines(explore_locked_epochs, -.1, 1.1, 'g')
-    
-    if len(explore_unlocked_epochs) > 0:
-        ax.vlines(explore_locked_epochs, -.1, 1.1, 'c')
-        
-    ax.locator_params(axis='y', prune='both',nbins=6)
-    ax.margins(.1,.2)
-    ax.legend(bbox_to_anchor=(1.05, 0.5), loc=6, borderaxespad=0.)
-    ax.set_ylabel("Action\nIndex", rotation=yTitleRotation, 
-                  fontsize=yTitleFontSize, weight='bold',
-                  horizontalalignment='center')
+    epoch_nums = data["epoch_nums"]
+    fig = plot.fig
     
-    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-    setp(ax.get_xticklabels(), visible=False)
-    ax.grid(True)
-
-
-    # plot reward vs epoch   
-    ax = fig.axes[2]
-    ax.clear()
-    if len(epoch_nums) > 0:
-        ax.plot(epoch_nums-1, data["rewards"], 'g', label="Reward", marker='.')
-        #ax.locator_params(axis='y', prune='both', nbins=6)
-        ax.set_yticks(np.arange(-100,70,50))
-        ax.set_ylim(-110,60)
-        ax.margins(.1,.2)
-        #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-        ax.set_ylabel("Reward", rotation=yTitleRotation, 
-                      fontsize=yTitleFontSize, weight='bold',
-                      horizontalalignment='center')
-    
-    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-    setp(ax.get_xticklabels(), visible=False)
-    ax.grid(True)
-
-
-    
-    # plot state index vs epoch
-    ax = fig.axes[3]
-    ax.clear()
-    ax.plot(epoch_nums, data["state_estimates"], 'b', label="State", marker='.')
-    ax.locator_params(axis='y', prune='upper',nbins=6)
-    ax.margins(.1,.2)
-    #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.set_ylabel("State\nIndex", rotation=yTitleRotation, 
-                  fontsize=yTitleFontSize, weight='bold',
-                  horizontalalignment='center')
-    
-    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-    setp(ax.get_xticklabels(), visible=False)
-    ax.grid(True)
-    
-#    # plot change intermediate statistics vs epoch
-#    ax = fig.axes[6]
-#    ax.clear()
-#    if len(epoch_nums) > 0:
-#        ax.plot(epoch_nums-1, data["old_reward_medians"], 'bx', label="Old Reward Median",)
-#        ax.plot(epoch_nums-1, data["new_reward_medians"], 'r+', label="New Reward Median",)
-#        ax.locator_params(axis='y', prune='upper',nbins=6)
-#        ax.margins(.1,.2)
-#        #ax.set_ylim(-.1,1.1)
-#        ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-#        ax.set_ylabel("Median\nRewards", rotation=yTitleRotation, 
-#                      fontsize=yTitleFontSize, weight='bold',
-#                      horizontalalignment='center')
-#    
-#    ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-#    setp(ax.get_xticklabels(), visible=False)
-#    ax.grid(True)
-
-#    # plot change detections vs epoch
-#    ax = fig.axes[4]
-#    ax.clear()
-#    if len(epoch_nums) > 0:
-#        ax.plot(epoch_nums-1, data["change_detections"],label="Change Detection", marker='.')
-#        ax.locator_params(axis='y', prune='upper',nbins=6)
-#        ax.margins(.1,.2)
-#        ax.set_ylim(-.1,1.1)
-#        #ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-#        ax.set_ylabel("Change\nDetection", rotation=yTitleRotation, 
-#                      fontsize=yTitleFontSize, weight='bold',
-#                      horizontalalignment='center')
-#    
-#        ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
-#    
-#    setp(ax.get_xticklabels(), visible=False)
-#    ax.grid(True)
-#
-#    if not np.all(np.isnan(data["old_reward_medians"])):
-        
-        
-
-    setp(ax.get_xticklabels(), visible=True)
-    ax.set_xlabel("Epoch", fontsize=yTitleFontSize, weight='bold')
-    
-    # workaround for autoscaling bug
-    ax = fig.axes[0]
-    if len(epoch_nums) > 0:
-        ax.set_xlim([epoch_nums[0]-1, epoch_nums[-1]+1])
+    if len(epoch_nums) == 0:
+        return
     
-#            fig.tight_layout()
-    fig.subplots_adjust(hspace=0.0,right=.785, left=0.125)
-    fig.canvas.draw()
+    # the lines are set up on the first call and only have their data swapped out after
+    # that
+    if "alphas" not in plot:
+        ax = fig.axes[0]
+        plot.add_line("alphas", ax, epoch_nums, data["alphas"], label="alpha", marker='.')
+        plot.add_line("epsilons", ax, epoch_nums, data["epsilons"], color='r', 
+                      label="Epsilon", marker='.')
+        plot.add_line("sum_epsilons", ax, data["sum_epsilon_epochs"], data["sum_epsilons"],
+                      color='k', linestyle='None', marker='.', label="Sum Decay")
+        plot.add_line("coverage", ax, epoch_nums, data["coverage"], color='g', 
+                      label="coverage", marker='.')
+        
+        # draw vertical lines to show change detections on this subplot
+        plot.add_vlines("change_detections", ax, data["change_epochs"], -.1, 1.1, 
+                        color='c')
+        ax.legend(bbox_to_anchor=(1.05, 0.5), loc=6, borderaxespad=0.)
+        
+        # plot action index color coded by explore decision
+        ax = fig.axes[1]
+        plot.add_line("actions", ax, epoch_nums, data["actions"], color='r', marker='.')
+        plot.add_line("explore_actions", ax, data["explore_epochs"], 
+                      data["explore_actions"], color='k', linestyle='None', marker='o',
+                      label="Explore", mfc="None", markeredgecolor='k', 
+                      markeredgewidth=2)
+        
+        # plot changes in exploring locked
+        plot.add_vlines("explore_locked", ax, data["explore_locked_epochs"], -.1, 1.1, 
+                        color='g')
+        plot.add_vlines("explore_unlocked", ax, data["explore_unlocked_epochs"], -.1, 1.1,
+                        color='c')
+        ax.legend(bbox_to_anchor=(1.05, 0.5), loc=6, borderaxespad=0.)
+        
+        # plot reward vs epoch   
+        ax = fig.axes[2]
+        plot.add_line("rewards", ax, epoch_nums, data["rewards"], x_shift=-1, color='g', 
+                      label="Reward", marker='.')
+        
+        # plot state index vs epoch
+        ax = fig.axes[3]
+        plot.add_line("state_estimates", ax, epoch_nums, data["state_estimates"], 
+                      color='b', label="State", marker='.')
+        
+    plot.update()
 
 def plot_visit_table(fignum, data):
     
     # set up any custom plot formatting functions
     def format_visit_table_coord(x, y):
-        if data["visit_tables"]:
-            visit_table = data["visit_tables"][-1].T
+        if data["visit_table"] is not None:
+            visit_table = data["visit_table"].T
             
             (num_actions, num_states) = visit_table.shape
             col = int(x)
@@ -501,14 +361,14 @@ def plot_visit_table(fignum, data):
     
     fig=figure(fignum)
     # make sure there is data to plot
-    if data["visit_tables"]:
+    if data["visit_table"] is not None:
         
         epoch_nums = data["epoch_nums"]
         
         # check if mesh exists
         if fig.axes and not fig.axes[0].collections:
             # if plotting for the first time, make a new mesh
-            plot_data = ma.masked_less_equal(data["visit_tables"][-1].T, visitThresh)
+            plot_data = ma.masked_less_equal(data["visit_table"].T, visitThresh)
             
             pcolormesh(plot_data,edgecolors="black", cmap=myCmap)
             
@@ -531,7 +391,7 @@ def plot_visit_table(fignum, data):
         elif fig.axes:
             # otherwise update existing mesh data values
             ax = fig.axes[0]
-            plot_data = ma.masked_less_equal(data["visit_tables"][-1].T, visitThresh)
+            plot_data = ma.masked_less_equal(data["visit_table"].T, visitThresh)
             clim(0, np.max( [np.max(plot_data),10]))
             ax.collections[0].set_array(plot_data.ravel())
             ax.set_title('Visitation Table for Epoch %i\n'%epoch_nums[-1], fontsize=figTitleFontSize, weight='bold')
@@ -541,8 +401,6 @@ def plot_visit_table(fignum, data):
             
 def update_plots(data, explore_img, exploit_img, figs):
 
-    start = time.time()
-
     cur_figs = plt.get_fignums()
     if cur_figs:        
         
@@ -559,51 +417,85 @@ def update_plots(data, explore_img, exploit_img, figs):
         # plot agent vars in a subplot if it hasn't been closed yet
         fignum = figs[2].number
         if fignum in cur_figs:
-            plot_agent_vars(fignum, data)
+            plot_agent_vars(figs[2], data)
             
         # plot visit table if it hasn't been closed yet
         fignum = figs[3].number
         if fignum in cur_figs:
             plot_visit_table(fignum, data)           
 
-        draw()
-        plt.pause(.1)
-        
-        end = time.time()
-
-        print "Plotting time was: ", end-start, " seconds"
+        for fig in figs:
+            if fig.number in cur_figs:
+                fig.canvas.flush_events()
     else:
         time.sleep(1)
 
-def process_data_points(entries,data):
+def get_agent_tables(d):
+    '''
+    Get the q and visit tables from a log entry as (num_states x num_actions) arrays.
+    Agents using sparse tables only log the rows for states they have seen, so the
+    q values of the other states are filled in as nan and their visit counts as 0
+    '''
+    if "q_table" in d:
+        return np.array(d["q_table"]), np.array(d["visit_table"])
+    
+    shape = (d["num_states"], d["num_actions"])
+    q_table = np.empty(shape)
+    q_table.fill(np.nan)
+    visit_table = np.zeros(shape, dtype='int')
+    
+    states = d["q_table_states"]
+    if len(states) > 0:
+        q_table[states,:] = d["q_table_rows"]
+        visit_table[states,:] = d["visit_table_rows"]
+        
+    return q_table, visit_table
+
+def count_visited(d, thresh):
+    '''
+    Count the state-action pairs in a log entry visited at least thresh times, without
+    building the full table of a sparse log entry. thresh must be at least 1
+    '''
+    if "visit_table" in d:
+        return np.count_nonzero(np.array(d["visit_table"]) >= thresh)
+    
+    if len(d["visit_table_rows"]) == 0:
+        return 0
+    
+    return np.count_nonzero(np.array(d["visit_table_rows"]) >= thresh)
 
+def process_data_points(entries,data):
+    '''
+    Append a batch of agent log entries to the plot buffers. Only the q and visit 
+    tables of the newest entry are kept
+    '''
+    if not entries:
+        return
+    
+    data["epoch_nums"].extend([d["epoch_num"] for d in entries])
+    data["frame_nums"].extend([d["frame_num"] for d in entries])
+    # reward not present for first iteration, insert nan
+    data["rewards"].extend([to_float(d.get("reward")) for d in entries]) 
+    data["exploit_decisions"].extend([d["exploiting"] for d in entries])
+    data["state_estimates"].extend([d["state"] for d in entries])
+    data["epsilons"].extend([d["epsilon"] for d in entries])
+    data["epsilon_decay_states"].extend([d["epsilon_decay_state"] for d in entries])
+    data["actions"].extend([d["action"] for d in entries])
+    data["alphas"].extend([d["alpha"] for d in entries])
+    
+    # check for existence of change detection fields and use defaults if they aren't
+    # present
+    change_detections = [bool(d.get("change_detected", False)) for d in entries]
+    data["change_detections"].extend(change_detections)
+    data["change_epochs"].extend([d["epoch_num"]-1 for d, y 
+                                  in zip(entries, change_detections) if y])
+    
+    data["old_reward_medians"].extend([to_float(d.get("old_reward_median")) 
+                                       for d in entries])
+    data["new_reward_medians"].extend([to_float(d.get("new_reward_median")) 
+                                       for d in entries])
+    
     for d in entries:
-        data["epoch_nums"].append(d["epoch_num"])
-        data["frame_nums"].append(d["frame_num"])
-        data["rewards"].append(d.get("reward",np.nan)) # reward not present for first iteration, insert nan
-        data["exploit_decisions"].append(d["exploiting"])
-        data["state_estimates"].append(d["state"])
-        data["epsilons"].append(d["epsilon"])
-        data["epsilon_decay_states"].append(d["epsilon_decay_state"])
-        data["actions"].append(d["action"])
-        data["alphas"].append(d["alpha"])
-        data["q_tables"].append(np.array(d["q_table"]))
-        data["visit_tables"].append(np.array(d["visit_table"]))
-        
-        # check for existence of change detection field and use False as default
-        # if it isn't present
-        if "change_detected" in d:
-            data["change_detections"].append(d["change_detected"])
-        else:
-            data["change_detections"].append(False)
-            
-        if "old_reward_median" in d:
-            data["old_reward_medians"].append(d["old_reward_median"])
-            data["new_reward_medians"].append(d["new_reward_median"])
-        else:
-            data["old_reward_medians"].append(np.nan)
-            data["new_reward_medians"].append(np.nan)    
-            
         if d["epsilon_decay_state"] == "median":
             data["median_epsilon_epochs"].append(d["epoch_num"])
             data["median_epsilons"].append(d["epsilon"])
@@ -611,22 +503,28 @@ def process_data_points(entries,data):
             data["sum_epsilon_epochs"].append(d["epoch_num"])
             data["sum_epsilons"].append(d["epsilon"])
         
-        if "exploring_frozen" in d:
-            data["exploring_frozen"].append(d["exploring_frozen"])
-        else:
-            data["exploring_frozen"].append(False)
-        
-        if len(data["exploring_frozen"]) == 1:
-            data["exploring_frozen_changes"].append(0)
-        else:
-            data["exploring_frozen_changes"].append(data["exploring_frozen"][-1] - data["exploring_frozen"][-2])
-        
         if d["exploiting"]:
             data["exploit_epochs"].append(d["epoch_num"])
             data["exploit_actions"].append(d["action"])
         else:
             data["explore_epochs"].append(d["epoch_num"])
             data["explore_actions"].append(d["action"])
+    
+    exploring_frozen = [int(d.get("exploring_frozen", False)) for d in entries]
+    if len(data["exploring_frozen"]) == 0:
+        last_frozen = exploring_frozen[0]
+    else:
+        last_frozen = data["exploring_frozen"][-1]
+    data["exploring_frozen"].extend(exploring_frozen)
+    
+    frozen_changes = np.diff([last_frozen] + exploring_frozen)
+    data["exploring_frozen_changes"].extend(frozen_changes)
+    
+    epoch_nums = np.array([d["epoch_num"] for d in entries])
+    data["explore_locked_epochs"].extend(epoch_nums[frozen_changes > 0])
+    data["explore_unlocked_epochs"].extend(epoch_nums[frozen_changes < 0])
+    
+    for d in entries:
         
         if "action_space" in d and "action_space_pattern_fields" in d and "number_digital_channels" in d:
             data["number_digital_channels"] = d["number_digital_channels"]
@@ -641,7 +539,6 @@ def process_data_points(entries,data):
             # convert bare tuples in pattern slots into named tuples for easier 
             # processing later
             data["unique_ids"] = set()
-            print data["unique_ids"]
             for act_ind, action in enumerate(data["action_space"]):
                 
                 # handle both formats of pattern file so we can still plot old logs
@@ -676,53 +573,49 @@ def process_data_points(entries,data):
             
             data["num_slots"] = len(data["action_space"][0]["slots"])
             
+        if "num_states" not in data:
             # derive the number of total states, number of actions, and number of
             # stochastic states
-            (data["num_states"], data["num_actions"])  = data["q_tables"][0].shape
+            (data["num_states"], data["num_actions"])  = get_agent_tables(d)[0].shape
             data["num_stochastic_states"] = data["num_states"]/data["num_actions"]
             
-            #print data["action_space"]
-            print "\n\n"
-            print data["unique_ids"]
-            print "\n\n"
-            
-        
         # count how many states have been visited
-        num_visited = np.count_nonzero(data["visit_tables"][-1]>=coverageThresh)
+        num_visited = count_visited(d, coverageThresh)
         num_visit_elements = data["num_states"] * data["num_actions"]
          
         data["coverage"].append(float(num_visited)/float(num_visit_elements))
         
-            
+    data["q_table"], data["visit_table"] = get_agent_tables(entries[-1])
 
 
 def initialize_figs():
 
-    epoch_nums = deque()
-    frame_nums = deque()
-    rewards = deque()
-    exploit_decisions = deque()
-    exploit_epochs = deque()
-    exploit_actions = deque()
-    explore_epochs = deque()
-    explore_actions = deque()
-    explore_frozen = deque()
-    explore_frozen_changes = deque()
-    state_estimates = deque()
-    epsilons = deque()
-    epsilon_decay_states = deque()
-    median_epsilon_epochs = deque()
-    median_epsilons = deque()
-    sum_epsilon_epochs = deque()
-    sum_epsilons = deque()
-    actions = deque()
-    alphas = deque()
-    q_tables = deque()
-    visit_tables = deque()
-    coverage = deque()
-    change_detections = deque()
-    old_medians = deque()
-    new_medians = deque()
+    epoch_nums = GrowingBuffer(dtype=int)
+    frame_nums = GrowingBuffer(dtype=int)
+    rewards = GrowingBuffer()
+    exploit_decisions = GrowingBuffer(dtype=bool)
+    exploit_epochs = GrowingBuffer(dtype=int)
+    exploit_actions = GrowingBuffer(dtype=int)
+    explore_epochs = GrowingBuffer(dtype=int)
+    explore_actions = GrowingBuffer(dtype=int)
+    explore_frozen = GrowingBuffer(dtype=int)
+    explore_frozen_changes = GrowingBuffer(dtype=int)
+    explore_locked_epochs = GrowingBuffer(dtype=int)
+    explore_unlocked_epochs = GrowingBuffer(dtype=int)
+    state_estimates = GrowingBuffer(dtype=int)
+    epsilons = GrowingBuffer()
+    epsilon_decay_states = []
+    median_epsilon_epochs = GrowingBuffer(dtype=int)
+    median_epsilons = GrowingBuffer()
+    sum_epsilon_epochs = GrowingBuffer(dtype=int)
+    sum_epsilons = GrowingBuffer()
+    actions = GrowingBuffer(dtype=int)
+    alphas = GrowingBuffer()
+    coverage = GrowingBuffer()
+    change_detections = GrowingBuffer(dtype=bool)
+    change_epochs = GrowingBuffer(dtype=int)
+    old_medians = GrowingBuffer()
+    new_medians = GrowingBuffer()
     
     figs = []
     
@@ -739,18 +632,22 @@ def initialize_figs():
             "sum_epsilons":sum_epsilons,
             "actions":actions,
             "alphas":alphas,
-            "q_tables":q_tables,
-            "visit_tables":visit_tables,
+            "q_table":None,
+            "visit_table":None,
             "exploit_epochs":exploit_epochs,
             "exploit_actions":exploit_actions,
             "explore_epochs":explore_epochs,
             "explore_actions":explore_actions,
             "exploring_frozen":explore_frozen,
             "exploring_frozen_changes":explore_frozen_changes,
+            "explore_locked_epochs":explore_locked_epochs,
+            "explore_unlocked_epochs":explore_unlocked_epochs,
             "coverage":coverage,
             "change_detections":change_detections,
+            "change_epochs":change_epochs,
             "old_reward_medians":old_medians,
             "new_reward_medians":new_medians,
+            "plotted_action":None,
             }
 
     # initialize figures
@@ -767,7 +664,7 @@ def initialize_figs():
 
     # this looked miserable at 115 dpi so bumping up to standard printer dpi
     dpi_high=96.0
-    figs.append( figure(figsize=(1024.0/dpi_high,768.0/dpi_high), dpi=dpi_high) )
+    fig = figure(figsize=(1024.0/dpi_high,768.0/dpi_high), dpi=dpi_high)
     ax1=subplot(411)
     subplot(412,sharex=ax1)
     subplot(413,sharex=ax1)
@@ -777,6 +674,47 @@ def initialize_figs():
 #    subplot(817,sharex=ax1)
 #    subplot(818,sharex=ax1)
     
+    # the agent vars are streamed into this figure, so the axes are only formatted once
+    ax = fig.axes[0]
+    ax.set_ylim(-.1,1.1)
+    ax.set_yticks(np.arange(0,1.2,.2))
+    ax.set_ylabel("Rate", rotation=yTitleRotation, 
+                  fontsize=yTitleFontSize, weight='bold',
+                  horizontalalignment='center')
+    
+    ax = fig.axes[1]
+    ax.locator_params(axis='y', prune='both',nbins=6)
+    ax.set_ylabel("Action\nIndex", rotation=yTitleRotation, 
+                  fontsize=yTitleFontSize, weight='bold',
+                  horizontalalignment='center')
+    
+    ax = fig.axes[2]
+    ax.set_yticks(np.arange(-100,70,50))
+    ax.set_ylim(-110,60)
+    ax.set_ylabel("Reward", rotation=yTitleRotation, 
+                  fontsize=yTitleFontSize, weight='bold',
+                  horizontalalignment='center')
+    
+    ax = fig.axes[3]
+    ax.locator_params(axis='y', prune='upper',nbins=6)
+    ax.set_ylabel("State\nIndex", rotation=yTitleRotation, 
+                  fontsize=yTitleFontSize, weight='bold',
+                  horizontalalignment='center')
+    
+    for ax in fig.axes:
+        ax.yaxis.set_label_coords(yTitleXPosition, yTitleYPosition)
+        ax.grid(True)
+        
+    # tick_params sticks when the x limits grow, where hiding the current tick labels 
+    # would not
+    for ax in fig.axes[:-1]:
+        ax.tick_params(labelbottom=False)
+        
+    ax.set_xlabel("Epoch", fontsize=yTitleFontSize, weight='bold')
+    
+    fig.subplots_adjust(hspace=0.0,right=.785, left=0.125)
+    figs.append( StreamingPlot(fig, max_plot_points) )
+    
 #    figs.append( figure(figsize=(12,4)) )
 #    subplot(111)    
     figs.append( figure(figsize=(1380.0/dpi,460.0/dpi), dpi=dpi) )
@@ -866,7 +804,7 @@ def main():
     log_name = os.path.expandvars(os.path.expanduser(log_name))
     log_name = os.path.abspath(log_name)
     
-    fp = open(log_name, 'r')
+    tailer = LogTailer(log_name)
 
 
     workQueue = Queue.Queue(100)
@@ -880,7 +818,7 @@ def main():
         show(block=False)
         
         # read in the backlog in one go
-        entries = bulk_data_reader(fp)
+        entries = tailer.read_entries()
         
         # process and plot the accumulated data
         process_data_points(entries,data)
@@ -900,28 +838,30 @@ def main():
 
         
         reader_stop = threading.Event()
-        reader = readerThread(threadID, tName, workQueue, fp, reader_stop)
+        reader = readerThread(threadID, tName, workQueue, tailer, reader_stop)
         reader.start()
 
 
         while plt.get_fignums():
             
-            if not workQueue.empty():
-                d = workQueue.get()
-                print "processing new data"
-                process_data_points([d],data)
+            # take everything the reader has queued up and plot it in one update
+            entries = get_queued_entries(workQueue)
+            if entries:
+                process_data_points(entries,data)
                 plotLock.acquire()
                 update_plots(data, explore_imbox, exploit_imbox, figs)
                 plotLock.release()
             else:
-                print "waiting for new data from reader"
-                pause(.5)
+                wait_for_events(figs, .1)
                 
         reader_stop.set()
+        reader.join()
             
     except KeyboardInterrupt: 
         shut_down(reader, reader_stop, plotLock)  
         print "shut down complete"
+        
+    tailer.close()
 
         
 if __name__ == '__main__':
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Sweep learning agent settings against a simulated radio network
+
+The simulated network follows the same model as the extrasy2network problem in
+matlab/mdpSim: an environment steps through a set of interference states, either in
+sequence or at random, and the network state (the number of mobiles with working
+beacon, uplink, and downlink) is looked up from the environment state and the action
+the agent picked. Each good mobile can also independently be lost with some
+probability. The agent sees the same state RL_Agent_Wrapper gives it, the network
+state combined with the last action, and gets the reward RL_Agent_Wrapper would give
+it from the reward lookup table.
+
+Every combination of the agent settings on the command line is run for a number of
+trials spread across a process pool. Trial k uses the same random seed for every
+combination so combinations are compared on the same environment draws. For each
+combination this reports:
+
+regret      expected reward of the best action for the coming environment state, minus
+            the expected reward of the action the agent picked, summed over the run
+convergence first epoch after which the moving average of the per epoch regret stays
+            within --convergence-tolerance of zero (as a fraction of the reward range)
+            for the rest of the run
+'''
+
+# standard python library imports
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+from mac_ll import Q_Learner
+from mac_ll import Sarsa_Learner
+from mac_ll import Sequential_Pattern_Agent
+
+
+# network state for each environment state (rows) and agent action (columns), from the
+# extrasy2network problem in matlab/mdpSim
+DEFAULT_NETWORK_STATES = "2 0 1; 0 0 2; 1 2 0"
+
+AGENT_TYPES = ["q_learner", "sarsa", "sequential"]
+
+
+class Synthetic_Network_MDP(object):
+    '''
+    Simulated network an agent can be run against
+    '''
+
+    def __init__(self, network_states, reward_lookup, environment_model="sequential",
+                 link_loss_prob=0.0):
+        '''
+        network_states (int array) (num environment states x num actions) network state
+                                   for each environment state and agent action
+        reward_lookup       (dict) reward keyed by network state
+        environment_model (string) "sequential" steps through the environment states in
+                                   order, "random" picks the next one at random
+        link_loss_prob     (float) probability that each good mobile is lost
+        '''
+        self.network_states = np.asarray(network_states, dtype=int)
+        self.num_env_states, self.num_actions = self.network_states.shape
+
+        missing = set(self.network_states.ravel().tolist()) - set(reward_lookup.keys())
+        if missing:
+            raise ValueError("network states %s are not in the reward lookup table" %
+                             sorted(missing))
+
+        if environment_model not in ("sequential", "random"):
+            raise ValueError("unknown environment model %s" % environment_model)
+
+        self.reward_lookup = reward_lookup
+        self.environment_model = environment_model
+        self.link_loss_prob = link_loss_prob
+
+        # RL_Agent_Wrapper has one stochastic state per possible number of good mobiles
+        self.num_stochastic_states = max(reward_lookup.keys()) + 1
+        self.num_states = self.num_stochastic_states*self.num_actions
+
+        self.expected_rewards = self._get_expected_rewards()
+
+        self._env_state = 0
+
+    def _get_expected_rewards(self):
+        '''
+        Get the expected reward for each environment state and action, averaged over
+        which good mobiles get lost
+        '''
+        num_mobiles = self.num_stochastic_states - 1
+        rewards = np.array([self.reward_lookup.get(k, np.nan)
+                            for k in range(num_mobiles+1)])
+
+        expected_rewards = np.zeros(self.network_states.shape)
+        for (env_state, action), num_good in np.ndenumerate(self.network_states):
+            # the number of mobiles left is binomial in the number that were good
+            k = np.arange(num_good+1)
+            probs = np.array([_binomial_pmf(num_good, j, 1.0-self.link_loss_prob)
+                              for j in k])
+            reachable = probs > 0
+            if np.any(np.isnan(rewards[k[reachable]])):
+                raise ValueError("link losses can reach network states that are not in " +
+                                 "the reward lookup table")
+            expected_rewards[env_state, action] = np.dot(probs[reachable],
+                                                         rewards[k[reachable]])
+
+        return expected_rewards
+
+    def next_env_probs(self):
+        '''
+        Get the probability of each environment state on the next step
+        '''
+        probs = np.zeros(self.num_env_states)
+        if self.environment_model == "sequential":
+            probs[(self._env_state + 1) % self.num_env_states] = 1.0
+        else:
+            probs[:] = 1.0/self.num_env_states
+
+        return probs
+
+    def reset(self):
+        '''
+        Put the environment back in its first state and get the first agent observation
+        '''
+        self._env_state = 0
+        return self.observe(0, 0)
+
+    def observe(self, network_state, action):
+        '''
+        Get the agent state the way RL_Agent_Wrapper.estimate_state does
+        '''
+        return int(np.ravel_multi_index((network_state, action),
+                                        dims=(self.num_stochastic_states,
+                                              self.num_actions)))
+
+    def step(self, action):
+        '''
+        Move the environment forward one epoch with the agent using action
+
+        Returns (reward, observation)
+        '''
+        self._env_state = int(np.random.choice(self.num_env_states, p=self.next_env_probs()))
+
+        network_state = int(self.network_states[self._env_state, action])
+        if self.link_loss_prob > 0:
+            network_state = int(np.random.binomial(network_state, 1.0-self.link_loss_prob))
+
+        return self.reward_lookup[network_state], self.observe(network_state, action)
+
+
+def _binomial_pmf(n, k, p):
+    num_ways = 1
+    for j in range(k):
+        num_ways = num_ways*(n-j)//(j+1)
+
+    return num_ways*(p**k)*((1-p)**(n-k))
+
+
+def make_agent(config, mdp):
+    '''
+    Build the agent a sweep configuration asks for
+    '''
+    if config["agent_type"] == "sequential":
+        return Sequential_Pattern_Agent(config["sequential_pattern_order"])
+
+    if config["agent_type"] == "q_learner":
+        return Q_Learner(mdp.num_states, mdp.num_actions, config["learning_rate"],
+                         config["discount_factor"], config["greedy_epsilon"],
+                         dynamic_alpha=config["dynamic_alpha"],
+                         dynamic_epsilon=config["dynamic_epsilon"],
+                         reward_history_len=config["reward_history_len"],
+                         use_change_detection=config["change_detection"],
+                         min_visit_count=config["epsilon_adaptation_threshold"])
+
+    return Sarsa_Learner(mdp.num_states, mdp.num_actions, config["learning_rate"],
+                         config["discount_factor"], config["greedy_epsilon"],
+                         dynamic_alpha=config["dynamic_alpha"],
+                         dynamic_epsilon=config["dynamic_epsilon"],
+                         reward_history_len=config["reward_history_len"],
+                         use_change_detection=config["change_detection"])
+
+
+def run_trial(task):
+    '''
+    Run one agent configuration against the simulated network for one seed
+
+    task is a (config index, config, mdp settings, seed) tuple. Returns the config index
+    and an array of the expected regret of each epoch
+    '''
+    config_ind, config, mdp_settings, seed = task
+
+    # agents draw from both random generators
+    random.seed(seed)
+    np.random.seed(seed)
+
+    mdp = Synthetic_Network_MDP(**mdp_settings)
+    agent = make_agent(config, mdp)
+
+    num_epochs = config["num_epochs"]
+    regret = np.zeros(num_epochs)
+
+    action = agent.start(mdp.reset())
+    for epoch in range(num_epochs):
+        env_probs = mdp.next_env_probs()
+        action_vals = np.dot(env_probs, mdp.expected_rewards)
+        regret[epoch] = action_vals.max() - action_vals[action]
+
+        reward, observation = mdp.step(action)
+        action = agent.step(reward, observation)
+
+    agent.end(reward)
+
+    return config_ind, regret
+
+
+def convergence_epoch(regret, window, tolerance):
+    '''
+    Get the first epoch after which the moving average of regret stays at or below
+    tolerance, or None if it never settles
+    '''
+    if len(regret) < window:
+        return None
+
+    sums = np.cumsum(np.concatenate(([0.0], regret)))
+    moving_avg = (sums[window:] - sums[:-window])/window
+
+    # moving_avg[k] covers epochs k to k+window-1
+    above = np.flatnonzero(moving_avg > tolerance)
+    if len(above) == 0:
+        return 0
+    if above[-1] == len(moving_avg) - 1:
+        return None
+
+    return int(above[-1] + 1)
+
+
+def make_configs(opts):
+    '''
+    Expand the command line settings into a list of agent configurations
+    '''
+    configs = []
+
+    for agent_type in opts.agent_type:
+        if agent_type == "sequential":
+            for order in opts.sequential_pattern_order:
+                configs.append({"agent_type":agent_type,
+                                "sequential_pattern_order":[int(x) for x in
+                                                            order.split(',')]})
+            continue
+
+        grid = itertools.product(opts.learning_rate, opts.discount_factor,
+                                 opts.greedy_epsilon, opts.dynamic_alpha,
+                                 opts.dynamic_epsilon, opts.reward_history_len,
+                                 opts.change_detection)
+
+        for (alpha, gamma, epsilon, dynamic_alpha, dynamic_epsilon, history_len,
+             change_detection) in grid:
+            configs.append({"agent_type":agent_type,
+                            "learning_rate":alpha,
+                            "discount_factor":gamma,
+                            "greedy_epsilon":epsilon,
+                            "dynamic_alpha":bool(dynamic_alpha),
+                            "dynamic_epsilon":bool(dynamic_epsilon),
+                            "epsilon_adaptation_threshold":
+                                opts.agent_epsilon_adaptation_threshold,
+                            "reward_history_len":tuple(int(x) for x in
+                                                       history_len.split(',')),
+                            "change_detection":bool(change_detection)})
+
+    for config in configs:
+        config["num_epochs"] = opts.num_epochs
+
+    return configs
+
+
+def summarize(config, regrets, window, tolerance):
+    '''
+    Collect the regret and convergence stats of every trial of one configuration
+    '''
+    regrets = np.array(regrets)
+    total_regret = regrets.sum(axis=1)
+    converged = [convergence_epoch(r, window, tolerance) for r in regrets]
+    converged_epochs = [c for c in converged if c is not None]
+
+    summary = dict(config)
+    summary.update({"num_trials":len(regrets),
+                    "regret_mean":float(np.mean(total_regret)),
+                    "regret_std":float(np.std(total_regret)),
+                    "final_regret_per_epoch":float(np.mean(regrets[:, -window:])),
+                    "fraction_converged":float(len(converged_epochs))/len(regrets),
+                    "convergence_epoch_median":(float(np.median(converged_epochs))
+                                                if converged_epochs else None)})
+    return summary
+
+
+def config_label(config):
+    if config["agent_type"] == "sequential":
+        return "sequential order=%s" % ",".join(str(x) for x in
+                                                config["sequential_pattern_order"])
+
+    return ("%s a=%g g=%g e=%g dyn_a=%d dyn_e=%d hist=%s cd=%d" %
+            (config["agent_type"], config["learning_rate"], config["discount_factor"],
+             config["greedy_epsilon"], config["dynamic_alpha"], config["dynamic_epsilon"],
+             ",".join(str(x) for x in config["reward_history_len"]),
+             config["change_detection"]))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                         description=__doc__.strip().splitlines()[0])
+
+    arg_parser.add_argument("--agent-type", nargs="+", choices=AGENT_TYPES,
+                            default=AGENT_TYPES, help="agents to sweep")
+    arg_parser.add_argument("--learning-rate", nargs="+", type=float, default=[0.9],
+                            help="learning rates to sweep")
+    arg_parser.add_argument("--discount-factor", nargs="+", type=float, default=[0.9],
+                            help="discount factors to sweep")
+    arg_parser.add_argument("--greedy-epsilon", nargs="+", type=float, default=[0.1],
+                            help="greedy epsilons to sweep")
+    arg_parser.add_argument("--dynamic-alpha", nargs="+", type=int, choices=[0, 1],
+                            default=[0], help="adaptive alpha settings to sweep")
+    arg_parser.add_argument("--dynamic-epsilon", nargs="+", type=int, choices=[0, 1],
+                            default=[0], help="adaptive greedy epsilon settings to sweep")
+    arg_parser.add_argument("--agent-epsilon-adaptation-threshold", type=int, default=2,
+                            help=("visits at which adaptive epsilon switches from median " +
+                                  "to sum mode"))
+    arg_parser.add_argument("--reward-history-len", nargs="+", default=["5,5,5"],
+                            help=("reward history sizes to sweep, each as comma " +
+                                  "separated old, guard, and new buffer sizes"))
+    arg_parser.add_argument("--change-detection", nargs="+", type=int, choices=[0, 1],
+                            default=[0], help="reward change detection settings to sweep")
+    arg_parser.add_argument("--sequential-pattern-order", nargs="+", default=["0, 1, 2"],
+                            help="pattern orders to sweep for the sequential agent")
+
+    arg_parser.add_argument("--network-states", default=DEFAULT_NETWORK_STATES,
+                            help=("network state for each environment state and action, " +
+                                  "with rows separated by ';'"))
+    arg_parser.add_argument("--environment-model", choices=["sequential", "random"],
+                            default="sequential",
+                            help="how the environment picks its next state")
+    arg_parser.add_argument("--link-loss-prob", type=float, default=0.0,
+                            help="probability that each good mobile is lost in an epoch")
+    arg_parser.add_argument("--agent-reward-states", default="0, 1, 2",
+                            help="network states in the reward lookup table")
+    arg_parser.add_argument("--agent-reward-vals", default="-100, -10, 10",
+                            help="rewards for each of the reward states")
+
+    arg_parser.add_argument("--num-epochs", type=int, default=2000,
+                            help="agent epochs per trial")
+    arg_parser.add_argument("--num-trials", type=int, default=10,
+                            help="trials per configuration")
+    arg_parser.add_argument("--seed", type=int, default=0,
+                            help="seed of the first trial. Trial k uses seed+k")
+    arg_parser.add_argument("--convergence-window", type=int, default=100,
+                            help="epochs in the moving average used to find convergence")
+    arg_parser.add_argument("--convergence-tolerance", type=float, default=0.05,
+                            help=("moving average regret counted as converged, as a " +
+                                  "fraction of the reward range"))
+    arg_parser.add_argument("--processes", type=int, default=None,
+                            help="worker processes. Defaults to one per cpu")
+    arg_parser.add_argument("--output", default=None,
+                            help="write one json summary per configuration to this file")
+
+    opts = arg_parser.parse_args()
+
+    if opts.num_epochs < 1:
+        arg_parser.error("--num-epochs must be at least 1")
+
+    reward_states = [int(x) for x in opts.agent_reward_states.split(',')]
+    reward_vals = [float(x) for x in opts.agent_reward_vals.split(',')]
+    reward_lookup = dict(zip(reward_states, reward_vals))
+
+    network_states = [[int(x) for x in row.split()]
+                      for row in opts.network_states.split(';')]
+
+    mdp_settings = {"network_states":network_states,
+                    "reward_lookup":reward_lookup,
+                    "environment_model":opts.environment_model,
+                    "link_loss_prob":opts.link_loss_prob}
+
+    # build one here to check the settings before starting any workers
+    mdp = Synthetic_Network_MDP(**mdp_settings)
+
+    configs = make_configs(opts)
+    for config in configs:
+        if config["agent_type"] == "sequential":
+            if not all(0 <= a < mdp.num_actions for a in config["sequential_pattern_order"]):
+                arg_parser.error("sequential pattern order %s has actions outside 0 to %d" %
+                                 (config["sequential_pattern_order"], mdp.num_actions-1))
+
+    tasks = [(config_ind, config, mdp_settings, opts.seed + trial)
+             for config_ind, config in enumerate(configs)
+             for trial in range(opts.num_trials)]
+
+    print "running %d configurations x %d trials of %d epochs" % (len(configs),
+                                                                   opts.num_trials,
+                                                                   opts.num_epochs)
+
+    regrets = [[] for config in configs]
+
+    pool = multiprocessing.Pool(opts.processes)
+    try:
+        for config_ind, regret in pool.imap_unordered(run_trial, tasks):
+            regrets[config_ind].append(regret)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    tolerance = opts.convergence_tolerance*(max(reward_vals) - min(reward_vals))
+    summaries = [summarize(config, config_regrets, opts.convergence_window, tolerance)
+                 for config, config_regrets in zip(configs, regrets)]
+    summaries.sort(key=lambda s: s["regret_mean"])
+
+    for s in summaries:
+        if s["convergence_epoch_median"] is None:
+            convergence = "never"
+        else:
+            convergence = "%d" % s["convergence_epoch_median"]
+
+        print ("%-70s regret %10.1f +/- %8.1f  converged %3d%% median epoch %s" %
+               (config_label(s), s["regret_mean"], s["regret_std"],
+                100*s["fraction_converged"], convergence))
+
+    if opts.output is not None:
+        with open(opts.output, 'w') as fp:
+            for s in summaries:
+                fp.write(json.dumps(s) + "\n")
+        print "saved summaries to %s" % opts.output
+
+
+if __name__ == '__main__':
+    main()
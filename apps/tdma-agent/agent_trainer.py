@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Train a Q table offline from recorded agent logs
+
+Each agent log entry after the first holds the reward for the action chosen in the
+entry before it, so consecutive entries give (state, action, reward, next state,
+next action) transitions. Those transitions are used for tabular fitted Q
+iteration: every pass updates each visited state-action pair to the mean of
+reward + discount*(value of the next state) over all of its transitions at once.
+
+Rewards are taken from the agent log unless a reward table is given, in which case
+they are recomputed from the network state recorded in the matching database log.
+The resulting table is saved as a .npy file that tdma_agent.py can start from with
+--agent-q-seed-file.
+'''
+
+# standard python library imports
+import argparse
+import json
+import os
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+
+
+def read_log(log_name):
+    '''
+    Read a log file with one json object per line
+    '''
+    log_name = os.path.abspath(os.path.expandvars(os.path.expanduser(log_name)))
+
+    with open(log_name, 'r') as fp:
+        entries = [json.loads(line) for line in fp if line.strip()]
+
+    return entries
+
+
+def get_table_shape(entries):
+    '''
+    Get (num_states, num_actions) from the q table in an agent log, which may have
+    been logged as a dense or a sparse table
+    '''
+    for d in entries:
+        if "num_states" in d and "num_actions" in d:
+            return d["num_states"], d["num_actions"]
+        if "q_table" in d:
+            return np.array(d["q_table"]).shape
+
+    raise ValueError("agent log does not include a q table")
+
+
+def get_transitions(agent_entries, db_entries=None, reward_lookup=None):
+    '''
+    Pull transitions out of one run's agent log entries
+
+    Returns a tuple of int arrays (states, actions, next_states, next_actions) and a
+    float array of rewards. If reward_lookup is given, rewards are looked up from the
+    network state of the db log entry with the same epoch number, and transitions
+    without a usable network state are dropped.
+    '''
+    # entries are logged in order, but sort to be safe with concatenated logs
+    entries = sorted(agent_entries, key=lambda d: d["epoch_num"])
+
+    states = np.array([d["state"] for d in entries], dtype=np.int64)
+    actions = np.array([d["action"] for d in entries], dtype=np.int64)
+
+    if reward_lookup is None:
+        rewards = np.array([d.get("reward", np.nan) for d in entries[1:]], dtype=float)
+    else:
+        network_states = dict( (d["epoch_num"], d["network_state"]) for d in db_entries)
+        rewards = np.empty(len(entries)-1)
+        for k, d in enumerate(entries[1:]):
+            network_state = network_states.get(d["epoch_num"])
+            if network_state is None or np.isnan(network_state):
+                rewards[k] = np.nan
+            else:
+                rewards[k] = reward_lookup.get(int(network_state), np.nan)
+
+    keep = ~np.isnan(rewards)
+
+    return (states[:-1][keep], actions[:-1][keep], states[1:][keep], actions[1:][keep],
+            rewards[keep])
+
+
+def fitted_q_iteration(transitions, num_states, num_actions, discount_factor,
+                       method="q_learner", max_iterations=1000, tolerance=1e-6):
+    '''
+    Run tabular fitted Q iteration over a batch of transitions
+
+    method "q_learner" values the next state with its best action, and "sarsa" with
+    the action that was actually taken next. Returns the q table, the number of
+    transitions for each state-action pair, and the number of iterations run
+    '''
+    states, actions, next_states, next_actions, rewards = transitions
+
+    inds = states*num_actions + actions
+    num_entries = num_states*num_actions
+
+    counts = np.bincount(inds, minlength=num_entries)
+    reward_sums = np.bincount(inds, weights=rewards, minlength=num_entries)
+    visited = counts > 0
+
+    # start unvisited entries at the same tiny random values a live agent uses so ties
+    # are broken the same way
+    q_table = np.spacing(1)*np.random.rand(num_entries)
+
+    for iteration in range(1, max_iterations+1):
+        q_rows = q_table.reshape(num_states, num_actions)
+
+        if method == "sarsa":
+            next_vals = q_rows[next_states, next_actions]
+        else:
+            next_vals = q_rows.max(axis=1)[next_states]
+
+        target_sums = reward_sums + discount_factor*np.bincount(inds, weights=next_vals,
+                                                                minlength=num_entries)
+        new_q = q_table.copy()
+        new_q[visited] = target_sums[visited]/counts[visited]
+
+        delta = np.max(np.abs(new_q - q_table))
+        q_table = new_q
+
+        if delta < tolerance:
+            break
+
+    return (q_table.reshape(num_states, num_actions),
+            counts.reshape(num_states, num_actions), iteration)
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                         description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--agent-log", nargs="+", required=True,
+                            help="agent log files to train from, one per run")
+    arg_parser.add_argument("--db-log", nargs="*", default=[],
+                            help=("database log files in the same order as the agent " +
+                                  "logs. Only needed with --reward-vals"))
+    arg_parser.add_argument("--reward-states", default="0, 1, 2",
+                            help="network states in the reward lookup table")
+    arg_parser.add_argument("--reward-vals", default=None,
+                            help=("rewards for each of the reward states. If not set, " +
+                                  "use the rewards in the agent logs"))
+    arg_parser.add_argument("--agent-type", choices=["q_learner", "sarsa"],
+                            default="q_learner", help="update rule to train with")
+    arg_parser.add_argument("--discount-factor", type=float, default=0.9,
+                            help="discount factor on the value of the next state")
+    arg_parser.add_argument("--max-iterations", type=int, default=1000,
+                            help="max number of fitted Q iterations")
+    arg_parser.add_argument("--tolerance", type=float, default=1e-6,
+                            help="stop once no q value changes by more than this")
+    arg_parser.add_argument("--output", default="q_seed.npy",
+                            help="file to save the trained q table to")
+
+    opts = arg_parser.parse_args()
+
+    if opts.reward_vals is not None:
+        reward_states = [int(x) for x in opts.reward_states.split(',')]
+        reward_vals = [float(x) for x in opts.reward_vals.split(',')]
+        reward_lookup = dict(zip(reward_states, reward_vals))
+
+        if len(opts.db_log) != len(opts.agent_log):
+            arg_parser.error("recomputing rewards needs one --db-log per --agent-log")
+    else:
+        reward_lookup = None
+
+    table_shape = None
+    all_transitions = []
+    for k, agent_log in enumerate(opts.agent_log):
+        agent_entries = read_log(agent_log)
+
+        log_shape = tuple(get_table_shape(agent_entries))
+        if table_shape is None:
+            table_shape = log_shape
+        elif log_shape != table_shape:
+            raise ValueError("agent log %s has a %s q table, expected %s" %
+                             (agent_log, log_shape, table_shape))
+
+        if reward_lookup is not None:
+            db_entries = read_log(opts.db_log[k])
+        else:
+            db_entries = None
+
+        transitions = get_transitions(agent_entries, db_entries, reward_lookup)
+        print "%s: %d transitions" % (agent_log, len(transitions[0]))
+        all_transitions.append(transitions)
+
+    # stack each field across runs
+    transitions = tuple(np.concatenate(field) for field in zip(*all_transitions))
+
+    num_states, num_actions = table_shape
+    q_table, counts, num_iterations = fitted_q_iteration(transitions, num_states,
+                                                         num_actions, opts.discount_factor,
+                                                         opts.agent_type,
+                                                         opts.max_iterations,
+                                                         opts.tolerance)
+
+    print "trained on %d transitions in %d iterations" % (len(transitions[0]),
+                                                          num_iterations)
+    print "%d of %d state-action pairs visited" % (np.count_nonzero(counts), counts.size)
+    print "greedy action per state: %s" % np.argmax(q_table, axis=1).tolist()
+
+    np.save(opts.output, q_table)
+    print "saved q table to %s" % opts.output
+
+
+if __name__ == '__main__':
+    main()
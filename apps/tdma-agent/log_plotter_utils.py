@@ -16,8 +16,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # standard python library imports
+import ctypes
+import ctypes.util
 import json
+import os
+import Queue
+import select
 import threading
+import time
 
 # third party library imports
 import matplotlib as mpl
@@ -115,13 +121,11 @@ def plot_pattern(fignum, pattern, num_channels, unique_ids):
     for slot_num, slot in enumerate(slots):
         # figure out what color this box should be
         color_ind = unique_ids.index(slot.owner)            
-        print "color_ind ", color_ind
         # now get x and y coordinates 
         x = 2*slot_num+1
         y = chan_num_to_y_coord(slot.bb_freq, num_channels)
         t[2*slot_num+1] = slot.offset
         t[2*slot_num+2] = slot.offset + slot.len
-        print "x %i, y %i"%(x,y)
         
         # xy reversed due to plotting
         slot_grid[y,x]=color_ind
@@ -149,47 +153,417 @@ def plot_pattern(fignum, pattern, num_channels, unique_ids):
 
 
 class readerThread (threading.Thread):
-    def __init__(self, threadID, name, q, fp, stop_me):
+    def __init__(self, threadID, name, q, tailer, stop_me):
         threading.Thread.__init__(self)
         self.threadID = threadID
         self.name = name
         self.q = q
-        self.fp = fp
+        self.tailer = tailer
         self.stop_me = stop_me
     def run(self):
         print "Starting " + self.name
-        watchFileThreaded(self.fp, self.q, self.stop_me)  
+        watchFileThreaded(self.tailer, self.q, self.stop_me)  
         print "Exiting " + self.name
 
 
-def watchFileThreaded(fp, q, stop_me):
+def watchFileThreaded(tailer, q, stop_me):
+    '''
+    Put each batch of new log entries from tailer on q as a list until stop_me is set
+    '''
     while not stop_me.is_set():
         
-        if not q.full():
-            cur_pos = fp.tell()
-            new = fp.readline()
-            # either returns a new line or '' if all lines have been read
-            # until the file changes and a new line appears
+        entries = tailer.read_entries()
         
-            if new:
+        if entries:
+            # wait for the plotter to catch up rather than dropping entries, but keep
+            # checking for shutdown
+            while not stop_me.is_set():
                 try:
-                    d = json.loads(new)
-                    q.put(d)
-                    print "read new data"
-                except:
-                    fp.seek(cur_pos,0)
-                    print "problem parsing data" 
-                
-                print "read new data"
-          
+                    q.put(entries, timeout=.5)
+                    break
+                except Queue.Full:
+                    pass
+        else:
+            tailer.wait(.5)
+
+
+def get_queued_entries(q):
+    '''
+    Empty a queue filled by watchFileThreaded without blocking and return every entry
+    in it as one list
+    '''
+    entries = []
+    while True:
+        try:
+            entries.extend(q.get_nowait())
+        except Queue.Empty:
+            return entries
+
+
+# inotify event mask for a watched file being written to
+IN_MODIFY = 0x00000002
+
+def inotify_watch(file_name):
+    '''
+    Get a non blocking inotify file descriptor that becomes readable when file_name is
+    modified, or None if inotify is not available
+    '''
+    lib_name = ctypes.util.find_library("c")
+    if lib_name is None:
+        return None
+    
+    try:
+        libc = ctypes.CDLL(lib_name, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+    except (OSError, AttributeError):
+        return None
+    
+    if fd < 0:
+        return None
+    
+    if libc.inotify_add_watch(fd, file_name, IN_MODIFY) < 0:
+        os.close(fd)
+        return None
+    
+    return fd
+
+
+class LogTailer(object):
+    '''
+    Reads json log entries as they are appended to a file, without blocking
+
+    Entries are only returned once their whole line has been written. Waiting for new
+    data uses select on an inotify watch of the file where inotify is available, and
+    falls back to polling the file size otherwise.
+    '''
+    def __init__(self, file_name, chunk_size=1<<20):
+        self._fd = os.open(file_name, os.O_RDONLY)
+        self._chunk_size = chunk_size
+        self._partial_line = ""
+        self._watch_fd = inotify_watch(file_name)
+        
+        # count of complete lines that were not valid json
+        self.num_bad_lines = 0
+        
+    def read_entries(self):
+        '''
+        Get every complete log entry written since the last call
+        '''
+        # start over if the file was truncated
+        pos = os.lseek(self._fd, 0, os.SEEK_CUR)
+        if os.fstat(self._fd).st_size < pos:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            self._partial_line = ""
+        
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, self._chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            
+        if not chunks:
+            return []
+        
+        lines = (self._partial_line + "".join(chunks)).split("\n")
+        
+        # the last piece is the start of a line that is still being written
+        self._partial_line = lines.pop()
+        
+        entries = []
+        for line in lines:
+            if line.strip():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    self.num_bad_lines += 1
+                    
+        return entries
+    
+    def wait(self, timeout):
+        '''
+        Wait up to timeout seconds for the file to be written to
+        '''
+        if self._watch_fd is not None:
+            readable, _, _ = select.select([self._watch_fd], [], [], timeout)
+            if readable:
+                # clear out the pending events
+                try:
+                    os.read(self._watch_fd, 4096)
+                except OSError:
+                    pass
+        else:
+            pos = os.lseek(self._fd, 0, os.SEEK_CUR)
+            end_time = time.time() + timeout
+            while time.time() < end_time and os.fstat(self._fd).st_size == pos:
+                time.sleep(min(.05, timeout))
+    
+    def close(self):
+        os.close(self._fd)
+        if self._watch_fd is not None:
+            os.close(self._watch_fd)
+            self._watch_fd = None
+
+
+class GrowingBuffer(object):
+    '''
+    A numpy array that can be appended to
+
+    Storage is allocated ahead of time and doubled when it fills up, so appends do not
+    copy the whole history. values is a view of the filled part of the array.
+    '''
+    def __init__(self, dtype=float, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._len = 0
+        
+    def __len__(self):
+        return self._len
+    
+    def __getitem__(self, key):
+        return self.values[key]
+    
+    @property
+    def values(self):
+        return self._data[:self._len]
+    
+    def extend(self, vals):
+        vals = np.asarray(vals, dtype=self._data.dtype)
+        new_len = self._len + len(vals)
+        
+        if new_len > len(self._data):
+            data = np.empty(max(new_len, 2*len(self._data)), dtype=self._data.dtype)
+            data[:self._len] = self._data[:self._len]
+            self._data = data
+            
+        self._data[self._len:new_len] = vals
+        self._len = new_len
+        
+    def append(self, val):
+        self.extend([val])
+
+
+def to_float(val):
+    '''
+    Convert a logged value to a float, with missing values as nan
+    '''
+    if val is None:
+        return np.nan
+    return float(val)
+
+
+def extend_keyed_buffers(buffers, entries, num_prior):
+    '''
+    Append a batch of per key values, such as per mobile link states, to a dict of
+    GrowingBuffers. entries is a list with one dict of values per log entry. Keys
+    missing from an entry get nan, and buffers for keys seen for the first time are
+    back filled with num_prior nans so every buffer lines up with the epoch numbers
+    '''
+    keys = set(buffers.keys())
+    for vals in entries:
+        keys.update(vals.keys())
+        
+    for key in keys:
+        if key not in buffers:
+            buffers[key] = GrowingBuffer()
+            buffers[key].extend(np.nan*np.ones(num_prior))
+            
+        buffers[key].extend([to_float(vals.get(key)) for vals in entries])
+
+
+def decimate(x, y, max_points):
+    '''
+    Thin out a long series to about max_points points for drawing. The samples are
+    split into runs and only the min and max of y in each run are kept, so spikes stay
+    visible. Series shorter than max_points are returned as is
+    '''
+    n = len(x)
+    if n <= max_points:
+        return x, y
+    
+    run_len = int(np.ceil(2.0*n/max_points))
+    num_runs = n//run_len
+    runs = y[:num_runs*run_len].reshape(num_runs, run_len)
+    
+    nans = np.isnan(runs)
+    min_inds = np.where(nans, np.inf, runs).argmin(axis=1)
+    max_inds = np.where(nans, -np.inf, runs).argmax(axis=1)
+    
+    starts = np.arange(num_runs)*run_len
+    inds = np.unique(np.concatenate((starts + min_inds, starts + max_inds,
+                                     np.arange(num_runs*run_len, n))))
+    
+    return x[inds], y[inds]
+
+
+class StreamingPlot(object):
+    '''
+    Figure of time series that are redrawn in place as new data arrives
+
+    Lines are drawn from GrowingBuffers, thinned out with decimate once they get long,
+    and blitted over a saved background. The full figure is only redrawn when an axis
+    has to grow to fit new data or a line is added.
+    '''
+    def __init__(self, fig, max_points=4000):
+        self.fig = fig
+        self.max_points = max_points
+        
+        self._lines = []
+        self._line_keys = set()
+        self._artists = []
+        
+        # axes that have had their limits fit to data at least once
+        self._fitted_x = set()
+        self._fitted_y = set()
+        
+        self._background = None
+        self._needs_redraw = True
+        
+        self._can_blit = hasattr(fig.canvas, "copy_from_bbox")
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+        
+    @property
+    def number(self):
+        return self.fig.number
+    
+    @property
+    def canvas(self):
+        return self.fig.canvas
+    
+    def __contains__(self, key):
+        return key in self._line_keys
+        
+    def add_line(self, key, ax, x, y, x_shift=0, **kwargs):
+        '''
+        Plot GrowingBuffer y against GrowingBuffer x on ax. Extra keyword arguments go
+        to ax.plot
+        '''
+        line, = ax.plot([], [], **kwargs)
+        self._add(key, {"line":line, "x":x, "y":y, "x_shift":x_shift, "vlines":False})
+        return line
+        
+    def add_vlines(self, key, ax, x, ymin, ymax, x_shift=0, **kwargs):
+        '''
+        Draw a vertical line from ymin to ymax at each value in GrowingBuffer x
+        '''
+        line, = ax.plot([], [], **kwargs)
+        self._add(key, {"line":line, "x":x, "ymin":ymin, "ymax":ymax, 
+                        "x_shift":x_shift, "vlines":True})
+        return line
+    
+    def add_artist(self, artist):
+        '''
+        Blit an artist that changes often but does not move, such as a title
+        '''
+        artist.set_animated(True)
+        self._artists.append(artist)
+    
+    def request_redraw(self):
+        self._needs_redraw = True
+    
+    def _add(self, key, line_info):
+        line_info["line"].set_animated(True)
+        self._lines.append(line_info)
+        self._line_keys.add(key)
+        self._artists.append(line_info["line"])
+        self._needs_redraw = True
+    
+    def _on_draw(self, event):
+        if self._can_blit:
+            self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+        
+    def _draw_artists(self):
+        for artist in self._artists:
+            self.fig.draw_artist(artist)
+    
+    def update(self):
+        '''
+        Redraw the figure with the latest data
+        '''
+        axes_data = {}
+        
+        for line_info in self._lines:
+            x = line_info["x"].values.astype(float) + line_info["x_shift"]
+            
+            if line_info["vlines"]:
+                # one segment per line, separated by nans
+                xs = np.repeat(x, 3)
+                xs[2::3] = np.nan
+                ys = np.tile([line_info["ymin"], line_info["ymax"], np.nan], len(x))
             else:
-                stop_me.wait(.5)
-                print "waiting for new data in file"
-          
+                xs, ys = decimate(x, line_info["y"].values, self.max_points)
+                
+            line_info["line"].set_data(xs, ys)
+            
+            if len(xs) > 0:
+                axes_data.setdefault(line_info["line"].axes, []).append( (xs, ys) )
+                
+        for ax, series in axes_data.iteritems():
+            self._fit_limits(ax, np.concatenate([xs for xs, ys in series]),
+                             np.concatenate([ys for xs, ys in series]))
+            
+        if self._needs_redraw or self._background is None:
+            self._needs_redraw = False
+            self.fig.canvas.draw()
         else:
-            stop_me.wait(.5)
-            print "waiting for space in queue"
+            self.fig.canvas.restore_region(self._background)
+            self._draw_artists()
+            self.fig.canvas.blit(self.fig.bbox)
             
+        self.fig.canvas.flush_events()
+        
+    def _fit_limits(self, ax, xs, ys):
+        '''
+        Grow the limits of an autoscaling axis to fit its data, leaving headroom along x
+        so the axis does not have to grow again on the next few updates
+        '''
+        xs = xs[np.isfinite(xs)]
+        ys = ys[np.isfinite(ys)]
+        if len(xs) == 0:
+            return
+        
+        if ax.get_autoscalex_on():
+            fitted = ax in self._fitted_x
+            x_min = xs.min()
+            x_max = xs.max()
+            lo, hi = ax.get_xlim()
+            if not fitted or x_min < lo or x_max > hi:
+                if fitted:
+                    x_min = min(x_min, lo)
+                span = max(x_max - x_min, 1.0)
+                ax.set_xlim(x_min - 1, x_max + .25*span + 1, auto=True)
+                self._needs_redraw = True
+                
+                # axes sharing x with this one now have their limits set too
+                self._fitted_x.update(ax.get_shared_x_axes().get_siblings(ax))
+                
+        if ax.get_autoscaley_on() and len(ys) > 0:
+            fitted = ax in self._fitted_y
+            y_min = ys.min()
+            y_max = ys.max()
+            lo, hi = ax.get_ylim()
+            if not fitted or y_min < lo or y_max > hi:
+                if fitted:
+                    y_min = min(y_min, lo)
+                    y_max = max(y_max, hi)
+                pad = max(.1*(y_max - y_min), .5)
+                ax.set_ylim(y_min - pad, y_max + pad, auto=True)
+                self._needs_redraw = True
+                self._fitted_y.add(ax)
+
+
+def wait_for_events(figs, interval):
+    '''
+    Run the gui event loop for interval seconds without redrawing any figure, which
+    plt.pause would do. figs may hold figures or StreamingPlots
+    '''
+    fignums = plt.get_fignums()
+    for fig in figs:
+        if fig.number in fignums:
+            fig.canvas.start_event_loop(interval)
+            return
+    time.sleep(interval)
+
 def bulk_data_reader(fp):
     lines = fp.readlines()
     entries = [json.loads(line) for line in lines]
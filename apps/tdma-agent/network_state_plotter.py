@@ -19,9 +19,6 @@
 
 # standard python library imports
 import argparse
-from collections import deque
-from collections import defaultdict
-import json
 import os
 import Queue
 import time
@@ -37,7 +34,14 @@ import numpy as np
 # project specific imports
 from log_plotter_utils import readerThread
 from log_plotter_utils import bulk_data_reader
+from log_plotter_utils import extend_keyed_buffers
+from log_plotter_utils import get_queued_entries
+from log_plotter_utils import GrowingBuffer
+from log_plotter_utils import LogTailer
 from log_plotter_utils import shut_down
+from log_plotter_utils import StreamingPlot
+from log_plotter_utils import to_float
+from log_plotter_utils import wait_for_events
 
 yTitleFontSize=14
 yTitleRotation="vertical"
@@ -49,201 +53,168 @@ styles= {'2':'x', '3':'+'}
 styles2= {'2':'<', '3':'>'}
 styles3= {'2':'o', '3':'d'}
 
-def plot_verbose_network_states(fignum, data):
-    
-    epoch_nums = data["epoch_nums"]
+# number of points drawn per line before long histories are thinned out
+max_plot_points = 4000
+
+def add_mobile_lines(plot, ax, data, field, label, style_map, **kwargs):
+    '''
+    Add a line for each mobile in data[field] that does not have one yet. Returns True
+    if any lines were added
+    '''
+    added = False
+    for key in sorted(data[field].keys()):
+        if (field, key) not in plot:
+            plot.add_line( (field, key), ax, data["epoch_nums"], data[field][key],
+                           label=label + key, marker=style_map.get(key, '.'), **kwargs)
+            added = True
+    return added
     
-    fig = figure(fignum)
-    ax = fig.axes[0]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="mobile " + key, marker=styles[key]) for key,val in data["Od"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Od epoch %i'%epoch_nums[-1])
+def set_epoch_title(ax, title, epoch_nums):
+    if len(epoch_nums):
+        ax.title.set_text('%s epoch %i'%(title, epoch_nums[-1]))
 
-    ax = fig.axes[1]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="mobile " + key, marker=styles[key]) for key,val in data["Ou"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Ou epoch %i'%epoch_nums[-1])
+def plot_verbose_network_states(plot, data):
     
-    ax = fig.axes[2]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="mobile " + key, marker=styles[key]) for key,val in data["Ob"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Ob epoch %i'%epoch_nums[-1])
-
-    fig.tight_layout()
-    fig.subplots_adjust(right=.8)
-    fig.canvas.draw()
-
-def plot_network_states(fignum,data):
+    fig = plot.fig
+    added = False
     
-    epoch_nums = data["epoch_nums"]
+    for ax, field in zip(fig.axes, ["Od", "Ou", "Ob"]):
+        if add_mobile_lines(plot, ax, data, field, "mobile ", styles):
+            ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+            added = True
+        set_epoch_title(ax, field, data["epoch_nums"])
+
+    if added:
+        fig.tight_layout()
+        fig.subplots_adjust(right=.8)
+    plot.update()
+
+def plot_network_states(plot,data):
     
-    fig = figure(fignum)
+    fig = plot.fig
             
     ax = fig.axes[0]
-    ax.clear()
-    ax.plot(epoch_nums, data["net_states"],label="network state", marker='x')
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Network State epoch %i'%epoch_nums[-1])
+    if "net_states" not in plot:
+        plot.add_line("net_states", ax, data["epoch_nums"], data["net_states"],
+                      label="network state", marker='x')
+        ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+    set_epoch_title(ax, 'Network State', data["epoch_nums"])
     
     ax = fig.axes[1]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="mobile " + key, marker=styles[key]) for key,val in data["v_net_states"].iteritems()]
-    ax.set_ylim(-.1,1.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Verbose Network State epoch %i'%epoch_nums[-1])
+    added = add_mobile_lines(plot, ax, data, "v_net_states", "mobile ", styles)
+    if added:
+        ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+        fig.tight_layout()
+        fig.subplots_adjust(right=.75)
+    set_epoch_title(ax, 'Verbose Network State', data["epoch_nums"])
     
-    fig.tight_layout()
-    fig.subplots_adjust(right=.75)
-    fig.canvas.draw()
+    plot.update()
              
-def plot_db_vars(fignum, data):
+def plot_db_vars(plot, data):
     
-    epoch_nums = data["epoch_nums"]
+    fig = plot.fig
+    added = False
     
-    fig = figure(fignum)
-    ax = fig.axes[0]
-    ax.clear()
+    # (axis, [(field, label, marker styles)])
+    axis_lines = [(fig.axes[0], [("dl_pkts_total", "total pkts mobile ", styles),
+                                 ("dl_pkts_known", "known pkts mobile ", styles2),
+                                 ("dl_pkts_good", "good pkts mobile ", styles3)]),
+                  (fig.axes[1], [("ul_pkts_total", "total pkts mobile ", styles),
+                                 ("ul_pkts_good", "good pkts mobile ", styles2)]),
+                  (fig.axes[2], [("b_pkts_known", "known pkts mobile ", styles),
+                                 ("b_pkts_good", "good pkts mobile ", styles2)]),
+                  (fig.axes[3], [("fb_pkts_good", "good pkts mobile ", styles)])]
     
-    [ax.plot(epoch_nums, val,label="total pkts mobile " + key, marker=styles[key], fillstyle='full') for key,val in data["dl_pkts_total"].iteritems()]
-    [ax.plot(epoch_nums, val,label="known pkts mobile " + key, marker=styles2[key], fillstyle='full') for key,val in data["dl_pkts_known"].iteritems()]
-    [ax.plot(epoch_nums, val,label="good pkts mobile " + key, marker=styles3[key], fillstyle='full') for key,val in data["dl_pkts_good"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Downlink Packets epoch %i'%epoch_nums[-1])
+    for ax, lines in axis_lines:
+        ax_added = False
+        for field, label, style_map in lines:
+            if add_mobile_lines(plot, ax, data, field, label, style_map, fillstyle='full'):
+                ax_added = True
+        if ax_added:
+            ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+            added = True
+            
+    set_epoch_title(fig.axes[0], 'Downlink Packets', data["epoch_nums"])
 
-    ax = fig.axes[1]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="total pkts mobile " + key, marker=styles[key], fillstyle='full') for key,val in data["ul_pkts_total"].iteritems()]
-    [ax.plot(epoch_nums, val,label="good pkts mobile " + key, marker=styles2[key], fillstyle='full') for key,val in data["ul_pkts_good"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Uplink Packets')
-    
-    ax = fig.axes[2]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="known pkts mobile " + key, marker=styles[key], fillstyle='full') for key,val in data["b_pkts_known"].iteritems()]
-    [ax.plot(epoch_nums, val,label="good pkts mobile " + key, marker=styles2[key], fillstyle='full') for key,val in data["b_pkts_good"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Beacon Packets')    
-        
-        
-    ax = fig.axes[3]
-    ax.clear()
-    [ax.plot(epoch_nums, val,label="good pkts mobile " + key, marker=styles[key]) for key,val in data["fb_pkts_good"].iteritems()]
-    ax.margins(.1,.1)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-    ax.grid(True)
-    if epoch_nums:
-        ax.set_title('Feedback Packets')                        
-
-    fig.tight_layout()
-    fig.subplots_adjust(right=.8)
-    fig.canvas.draw()
+    if added:
+        fig.tight_layout()
+        fig.subplots_adjust(right=.8)
+    plot.update()
 
            
                         
 def update_plots(data, figs):
 
-    start = time.time()
-
     cur_figs = plt.get_fignums()
     if cur_figs:
         
         # plot verbose link states
-        fignum = figs[0].number
-        if fignum in cur_figs:
-            plot_verbose_network_states(fignum, data)
+        if figs[0].number in cur_figs:
+            plot_verbose_network_states(figs[0], data)
         
         # plot all network states
-        fignum = figs[1].number
-        if fignum in cur_figs:
-            plot_network_states(fignum, data)
+        if figs[1].number in cur_figs:
+            plot_network_states(figs[1], data)
 
         # plot lower level database vars
-        fignum = figs[2].number
-        if fignum in cur_figs:
-            plot_db_vars(fignum, data)
+        if figs[2].number in cur_figs:
+            plot_db_vars(figs[2], data)
             
-        draw()
-        plt.pause(.1)  
-        
-        end = time.time()
-
-        print "Plotting time was: ", end-start, " seconds"
     else:
         time.sleep(1)
             
 
         
 def process_data_points(entries,data):
+    '''
+    Append a batch of database log entries to the plot buffers
+    '''
+    if not entries:
+        return
+    
+    num_prior = len(data["epoch_nums"])
+    
+    data["epoch_nums"].extend([d["epoch_num"] for d in entries])
+    data["frame_nums"].extend([d["frame_num"] for d in entries])
+    data["net_states"].extend([to_float(d["network_state"]) for d in entries])
 
+    # unknown downlink states are drawn halfway between bad and good
+    Od = []
     for d in entries:
-        data["epoch_nums"].append(d["epoch_num"])
-        data["frame_nums"].append(d["frame_num"])
-        data["net_states"].append(d["network_state"])
-
-            
-        for key,val in d["verbose_link_state"]["Od"].iteritems():
-            if np.isnan(val):
-                data["Od"][key].append(1.0)
-            else:
-                data["Od"][key].append(2.0*val)      
-        #[ Od[key].append(val) for key,val in d["verbose_link_state"]["Od"].iteritems()]
-        [ data["Ou"][key].append(val) for key,val in d["verbose_link_state"]["Ou"].iteritems()]
-        [ data["Ob"][key].append(val) for key,val in d["verbose_link_state"]["Ob"].iteritems()]
-        [data["v_net_states"][key].append(val) for key,val in d["verbose_network_state"].iteritems()]
-        [data["dl_pkts_total"][key].append(val) for key,val in d["dl_pkts_total"].iteritems()]
-        [data["dl_pkts_good"][key].append(val) for key,val in d["dl_pkts_good"].iteritems()]
-        [data["dl_pkts_known"][key].append(val) for key,val in d["dl_pkts_known"].iteritems()]
-        [data["fb_pkts_good"][key].append(val) for key,val in d["fb_pkts_good"].iteritems()]
-        [data["ul_pkts_total"][key].append(val) for key,val in d["ul_pkts_total"].iteritems()]
-        [data["ul_pkts_good"][key].append(val) for key,val in d["ul_pkts_good"].iteritems()]
-        [data["b_pkts_good"][key].append(val) for key,val in d["b_pkts_good"].iteritems()]
-        [data["b_pkts_known"][key].append(val) for key,val in d["b_pkts_known"].iteritems()]
+        Od.append(dict( (key, 1.0 if val is None or np.isnan(val) else 2.0*val)
+                        for key,val in d["verbose_link_state"]["Od"].iteritems()))
+    extend_keyed_buffers(data["Od"], Od, num_prior)
+    
+    extend_keyed_buffers(data["Ou"], [d["verbose_link_state"]["Ou"] for d in entries],
+                         num_prior)
+    extend_keyed_buffers(data["Ob"], [d["verbose_link_state"]["Ob"] for d in entries],
+                         num_prior)
+    extend_keyed_buffers(data["v_net_states"], [d["verbose_network_state"] for d in entries],
+                         num_prior)
+    
+    for field in ["dl_pkts_total", "dl_pkts_good", "dl_pkts_known", "fb_pkts_good",
+                  "ul_pkts_total", "ul_pkts_good", "b_pkts_good", "b_pkts_known"]:
+        extend_keyed_buffers(data[field], [d[field] for d in entries], num_prior)
 
 def initialize_figs():
     
-    epoch_nums = deque()
-    frame_nums = deque()
-    net_states = deque()
-    v_net_states = defaultdict(deque)
-
-    Od = defaultdict(deque) 
-    Ob = defaultdict(deque)
-    Ou = defaultdict(deque)
-
-    dl_pkts_total = defaultdict(deque)
-    dl_pkts_good = defaultdict(deque)
-    dl_pkts_known = defaultdict(deque)
-    fb_pkts_good = defaultdict(deque)
-    ul_pkts_total = defaultdict(deque)
-    ul_pkts_good = defaultdict(deque)
-    b_pkts_good = defaultdict(deque)
-    b_pkts_known = defaultdict(deque)
+    epoch_nums = GrowingBuffer()
+    frame_nums = GrowingBuffer()
+    net_states = GrowingBuffer()
+    v_net_states = {}
+
+    Od = {} 
+    Ob = {}
+    Ou = {}
+
+    dl_pkts_total = {}
+    dl_pkts_good = {}
+    dl_pkts_known = {}
+    fb_pkts_good = {}
+    ul_pkts_total = {}
+    ul_pkts_good = {}
+    b_pkts_good = {}
+    b_pkts_known = {}
 
     figs = []
 
@@ -265,20 +236,34 @@ def initialize_figs():
             }
 
     # initialize figures    
-    figs.append( figure(figsize=(12,6)) )
+    fig = figure(figsize=(12,6))
     ax1=subplot(311)
     subplot(312,sharex=ax1)
     subplot(313,sharex=ax1)
+    figs.append( StreamingPlot(fig, max_plot_points) )
 
-    figs.append( figure(figsize=(12,6)) )
+    fig = figure(figsize=(12,6))
     ax1=subplot(211)
-    subplot(212,sharex=ax1)
+    ax2=subplot(212,sharex=ax1)
+    ax2.set_ylim(-.1,1.1)
+    figs.append( StreamingPlot(fig, max_plot_points) )
 
-    figs.append( figure(figsize=(12,6)) )
+    fig = figure(figsize=(12,6))
     ax1=subplot(411)
     subplot(412,sharex=ax1)
     subplot(413,sharex=ax1)
     subplot(414,sharex=ax1)
+    figs.append( StreamingPlot(fig, max_plot_points) )
+    
+    for plot in figs:
+        for ax in plot.fig.axes:
+            ax.grid(True)
+            plot.add_artist(ax.title)
+    
+    figs[1].fig.axes[1].set_title('Verbose Network State')
+    figs[2].fig.axes[1].set_title('Uplink Packets')
+    figs[2].fig.axes[2].set_title('Beacon Packets')
+    figs[2].fig.axes[3].set_title('Feedback Packets')
 
     return data, figs
 
@@ -347,7 +332,7 @@ def main():
     log_name = os.path.expandvars(os.path.expanduser(log_name))
     log_name = os.path.abspath(log_name)
     
-    fp = open(log_name, 'r')
+    tailer = LogTailer(log_name)
 
 
 
@@ -366,35 +351,37 @@ def main():
         data, figs = initialize_figs()
         
         # read in the backlog in one go
-        entries = bulk_data_reader(fp)
+        entries = tailer.read_entries()
         
         # process and plot the accumulated data
         process_data_points(entries,data)
         update_plots(data, figs)
         
         reader_stop = threading.Event()
-        reader = readerThread(threadID, tName, workQueue, fp, reader_stop)
+        reader = readerThread(threadID, tName, workQueue, tailer, reader_stop)
         reader.start()
 
 
         while plt.get_fignums():
             
-            if not workQueue.empty():
-                d = workQueue.get()
-                print "processing new data"
-                process_data_points([d],data)
+            # take everything the reader has queued up and plot it in one update
+            entries = get_queued_entries(workQueue)
+            if entries:
+                process_data_points(entries,data)
                 plotLock.acquire()
                 update_plots(data, figs)
                 plotLock.release()
             else:
-                print "waiting for new data from reader"
-                pause(.5)
+                wait_for_events(figs, .1)
                 
         reader_stop.set()
+        reader.join()
             
     except KeyboardInterrupt: 
         shut_down(reader, reader_stop, plotLock)  
         print "shut down complete"
+        
+    tailer.close()
 
 if __name__ == '__main__':
     main()
@@ -19,8 +19,6 @@
 
 # standard python library imports
 import argparse
-from copy import deepcopy
-import cPickle
 import os
 import time
 
@@ -33,6 +31,7 @@ from matplotlib.pyplot import xlabel
 from matplotlib.pyplot import ylabel
 from matplotlib.pyplot import MaxNLocator
 import matplotlib.pyplot as plt
+from matplotlib.transforms import Bbox
 
 import numpy as np
 from numpy import ma
@@ -40,6 +39,7 @@ from numpy import ma
 # project specific imports
 from mac_ll import DataInterface
 from mac_ll import base_slot_manager_ber_feedback
+from mac_ll import reinforcement_learner
 
 
 
@@ -159,56 +159,98 @@ def initialize_figures(db_int):
     return debug_figs, debug_meshes, debug_axes, num_freq_slots, num_time_slots
 
 
-def plot_masks(figs, axes, meshes, db_int):#valid_slots, peer_id, link_num, link_dir, ):
+def get_new_rows(c, table, columns, last_rowids):
+    '''
+    Get the newest row for each link in table that was added since the last call.
+    
+    last_rowids maps table names to the last rowid already plotted and is updated in
+    place, so each call only touches rows the radio added since the previous one
+    '''
+    max_rowid = c.execute("SELECT max(rowid) FROM %s" % table).fetchone()[0]
+    
+    if max_rowid is None:
+        last_rowids[table] = 0
+        return []
+    
+    last_rowid = last_rowids.get(table, 0)
+    
+    # rowids restart if the table was emptied or recreated by a new run
+    if max_rowid < last_rowid:
+        last_rowid = 0
+    
+    rows = c.execute("""
+    SELECT %s FROM %s 
+    WHERE rowid IN(
+        SELECT max(rowid) FROM %s
+        WHERE rowid > ? AND rowid <= ?
+        GROUP BY owner, link_num, link_type)
+    """ % (columns, table, table), (last_rowid, max_rowid)).fetchall()
+    
+    last_rowids[table] = max_rowid
+    
+    return rows
+
+
+def plot_masks(figs, axes, meshes, db_int, last_rowids):
+    '''
+    Update the mask plots for links with new masks in the database. Returns the set of
+    plot keys that changed
+    '''
+    changed = set()
     
     # bail out if the database interface isn't fully initialized            
     if db_int.time_ref is None:
-        return
+        return changed
     
     with db_int.con as c:
         
-        # get data from most recent frame update
-        rows = c.execute("""
-        SELECT link_masks.frame_num, owner, link_num, link_type, data, frame_timestamp  
-        FROM link_masks LEFT JOIN frames 
-            ON link_masks.frame_num=frames.frame_num
-         WHERE link_masks.frame_num IN(
-             SELECT frames.frame_num 
-             FROM frames INNER JOIN link_masks
-                 ON frames.frame_num=link_masks.frame_num  
-             ORDER BY frame_timestamp DESC LIMIT 1)
-         """)
-        for row in rows:
-            valid_slots = cPickle.loads(row["data"])
-            frame_num = row["frame_num"]
-            link_dir = row["link_type"]
-            peer_id = row["owner"]
-            link_num = row["link_num"]
-    
-    
-            if link_dir == 'uplink':
-                plot_key = 'upmask'
-            elif link_dir == 'downlink':
-                plot_key = 'downmask'
-            else:
-                plot_key = ''
+        # get data from the most recent mask of each link
+        rows = get_new_rows(c, "link_masks", 
+                            "frame_num, owner, link_num, link_type, data, num_rows, num_cols",
+                            last_rowids)
+        
+    for row in rows:
+        frame_num = row["frame_num"]
+        link_dir = row["link_type"]
+        peer_id = row["owner"]
+        link_num = row["link_num"]
+
+
+        if link_dir == 'uplink':
+            plot_key = 'upmask'
+        elif link_dir == 'downlink':
+            plot_key = 'downmask'
+        else:
+            plot_key = ''
+        
+        key = (peer_id, link_num, plot_key)
+        if key in axes:
+            ax = axes[key]
+            mesh = meshes[key]
+            
+            valid_slots = reinforcement_learner.blob_to_table(row["data"], 
+                                                               row["num_rows"], 
+                                                               row["num_cols"])
             
-            if (peer_id, link_num, plot_key) in axes:
-                ax = axes[(peer_id, link_num, plot_key)]
-                mesh = meshes[(peer_id, link_num, plot_key)]
-                
-                
-                mask_vals = ma.getmaskarray(valid_slots)
-                
-                mesh.set_array(deepcopy(mask_vals.ravel()))
+            mask_vals = ma.getmaskarray(valid_slots)
             
-                ax.set_title('id %i:%i %s mask for frame %i'%(peer_id, link_num, link_dir, frame_num))
+            mesh.set_array(mask_vals.ravel())
+        
+            ax.set_title('id %i:%i %s mask for frame %i'%(peer_id, link_num, link_dir, frame_num))
+            changed.add(key)
+    
+    return changed
 
-def plot_bers(figs, axes, meshes, db_int):
+def plot_bers(figs, axes, meshes, db_int, last_rowids, blitter):
+    '''
+    Update the ber plots for links with new decisions in the database. Returns the set
+    of plot keys that changed
+    '''
+    changed = set()
     
     # bail out if the database interface isn't fully initialized            
     if db_int.time_ref is None:
-        return
+        return changed
     
     task_codes = {"explore":'R',
                   "exploit":'T'}
@@ -217,64 +259,155 @@ def plot_bers(figs, axes, meshes, db_int):
     
     with db_int.con as c:
         
-        # get data from most recent frame update
-        rows = c.execute("""
-        SELECT link_decisions.frame_num, owner, link_num, link_type, task, 
-            decision_order, slot_num, channel_num, rf_freq, data, frame_timestamp  
-        FROM link_decisions LEFT JOIN frames 
-            ON link_decisions.frame_num=frames.frame_num
-         WHERE link_decisions.frame_num IN(
-             SELECT frames.frame_num 
-             FROM frames INNER JOIN link_decisions
-                 ON frames.frame_num=link_decisions.frame_num  
-             ORDER BY frame_timestamp DESC LIMIT 1)
-         """)
-        for row in rows:
-            ber_table = cPickle.loads(row["data"])
-            frame_num = row["frame_num"]
-            link_dir = row["link_type"]
-            peer_id = row["owner"]
-            link_num = row["link_num"]
-            task = row["task"]
-            order = row["decision_order"]
-            slot_num = row["slot_num"]
-            channel_num = row["channel_num"]
-            rf_freq = row["rf_freq"]
+        # get data from the most recent decision for each link
+        rows = get_new_rows(c, "link_decisions", 
+                            """frame_num, owner, link_num, link_type, task, decision_order, 
+                            slot_num, channel_num, rf_freq, data, num_rows, num_cols""",
+                            last_rowids)
+        
+    for row in rows:
+        frame_num = row["frame_num"]
+        link_dir = row["link_type"]
+        peer_id = row["owner"]
+        link_num = row["link_num"]
+        task = row["task"]
+        order = row["decision_order"]
+        slot_num = row["slot_num"]
+        channel_num = row["channel_num"]
+        rf_freq = row["rf_freq"]
+        
+        key = (peer_id, link_num, link_dir)
+        if key in axes:
+            ax = axes[key]
+            mesh = meshes[key]
             
-            if (peer_id, link_num, link_dir) in axes:
-                ax = axes[(peer_id, link_num, link_dir)]
-                mesh = meshes[(peer_id, link_num, link_dir)]
-                
-                
-                mesh.set_array(deepcopy(ber_table.ravel()))
-                
-                # remove old text labels
-                labels = ax.texts
-                labels[:] = [] 
-                
-                ax.annotate("%s:%i"%(task_codes[task],order), 
-                            xy=( slot_num+.5,channel_num+.5),
-                            horizontalalignment='center', 
-                            verticalalignment='center',
-                            bbox=box_props)
+            ber_table = reinforcement_learner.blob_to_table(row["data"], 
+                                                            row["num_rows"], 
+                                                            row["num_cols"])
             
-                ax.set_title('id %i:%i %s for frame %i rf_freq: %f'%(peer_id, 
-                                                                     link_num, 
-                                                                     link_dir, 
-                                                                     frame_num,
-                                                                     rf_freq))        
+            mesh.set_array(ber_table.ravel())
+            
+            # remove old text labels
+            for label in list(ax.texts):
+                label.remove()
+            
+            label = ax.annotate("%s:%i"%(task_codes[task],order), 
+                                xy=( slot_num+.5,channel_num+.5),
+                                horizontalalignment='center', 
+                                verticalalignment='center',
+                                bbox=box_props)
+            label.set_animated(blitter.can_blit)
+        
+            ax.set_title('id %i:%i %s for frame %i rf_freq: %f'%(peer_id, 
+                                                                 link_num, 
+                                                                 link_dir, 
+                                                                 frame_num,
+                                                                 rf_freq))
+            changed.add(key)
+    
+    return changed
 
 
-def update_figures(db_int, figs, axes, meshes, num_freq_slots, num_time_slots):
+def update_figures(db_int, figs, axes, meshes, num_freq_slots, num_time_slots, 
+                   last_rowids, blitter):
+    '''
+    Pull new rows from the database into the plots. Returns the set of plot keys that
+    changed
+    '''
+    changed = plot_masks(figs, axes, meshes, db_int, last_rowids)
+    changed.update(plot_bers(figs, axes, meshes, db_int, last_rowids, blitter))
     
-    slot_codes = {"uplink":0,
-                  "beacon":1,
-                  "downlink":2,} 
+    return changed
+
+
+class MeshBlitter(object):
+    '''
+    Redraws only the subplots whose meshes changed.
     
+    Meshes, titles, and labels are animated so they stay out of the saved background.
+    A changed subplot gets its own area of the background restored and its animated
+    artists drawn on top, and only that area is blitted to the screen. Subplots whose
+    areas overlap, such as ones with long titles, are always redrawn together
+    '''
+    def __init__(self, fig, axes, meshes):
+        self.fig = fig
+        self.axes = axes
+        self.meshes = meshes
+        self.regions = {}
+        self.backgrounds = {}
+        self.groups = {}
+        
+        self.can_blit = hasattr(fig.canvas, "copy_from_bbox")
+        
+        for key, ax in axes.items():
+            meshes[key].set_animated(self.can_blit)
+            ax.title.set_animated(self.can_blit)
+            
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
     
-    plot_masks(figs, axes, meshes, db_int)
-    plot_bers(figs, axes, meshes, db_int)
-
+    def _on_draw(self, event):
+        '''
+        Save the background of each subplot after a full draw, then draw the animated
+        artists back in
+        '''
+        if not self.can_blit:
+            return
+        
+        canvas = self.fig.canvas
+        for key, ax in self.axes.items():
+            # cover the axes and its title, with some room for longer titles
+            title_box = ax.title.get_window_extent(event.renderer)
+            pad = 0.1*title_box.width
+            self.regions[key] = Bbox.from_extents(min(ax.bbox.x0, title_box.x0 - pad) - 2, 
+                                                  ax.bbox.y0 - 2,
+                                                  max(ax.bbox.x1, title_box.x1 + pad) + 2,
+                                                  max(ax.bbox.y1, title_box.y1) + 2)
+            self.backgrounds[key] = canvas.copy_from_bbox(self.regions[key])
+        
+        # group subplots with overlapping areas
+        self.groups = dict( (key, set([key])) for key in self.axes)
+        for key, region in self.regions.items():
+            for other_key, other_region in self.regions.items():
+                if (self.groups[key] is not self.groups[other_key] and 
+                        region.overlaps(other_region)):
+                    merged = self.groups[key] | self.groups[other_key]
+                    for k in merged:
+                        self.groups[k] = merged
+            
+        for key in self.axes:
+            self._draw_animated(key)
+            
+    def _draw_animated(self, key):
+        ax = self.axes[key]
+        ax.draw_artist(self.meshes[key])
+        for label in ax.texts:
+            ax.draw_artist(label)
+        ax.draw_artist(ax.title)
+        
+    def update(self, changed):
+        '''
+        Redraw the subplots with keys in changed
+        '''
+        if not changed:
+            return
+        
+        canvas = self.fig.canvas
+        
+        if not self.can_blit or any(key not in self.backgrounds for key in changed):
+            canvas.draw_idle()
+            return
+        
+        to_draw = set()
+        for key in changed:
+            to_draw.update(self.groups[key])
+        
+        for key in to_draw:
+            canvas.restore_region(self.backgrounds[key])
+        for key in to_draw:
+            self._draw_animated(key)
+        for key in to_draw:
+            canvas.blit(self.regions[key])
+            
 
 def show_short_gpl():
     print """
@@ -333,14 +466,21 @@ def main():
 
     debug_figs, debug_meshes, debug_axes, num_freq_slots, num_time_slots = outs
 
+    fig = debug_figs["reinforcement_learner_fig"]
+    blitter = MeshBlitter(fig, debug_axes, debug_meshes)
+    
+    # rowid of the last row plotted from each table
+    last_rowids = {}
+    
     plt.show(block=False)
     
-    while True:
-        update_figures(db, debug_figs, debug_axes, debug_meshes, 
-                                                 num_freq_slots, num_time_slots)
-        plt.draw()
-        plt.pause(1)
-    pass
+    while plt.fignum_exists(fig.number):
+        changed = update_figures(db, debug_figs, debug_axes, debug_meshes, 
+                                 num_freq_slots, num_time_slots, last_rowids, blitter)
+        blitter.update(changed)
+        
+        # wait without forcing a full redraw
+        fig.canvas.start_event_loop(1)
 
 
 
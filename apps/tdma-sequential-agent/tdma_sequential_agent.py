@@ -43,6 +43,7 @@ import numpy
 import digital_ll
 from digital_ll import beacon_consumer
 from digital_ll import channelizer
+from digital_ll import iq_capture_sink
 from digital_ll import lincolnlog
 from digital_ll.lincolnlog import dict_to_xml
 from digital_ll.lincolnlog import log_levels
@@ -56,6 +57,8 @@ from digital_ll import PatternFrameSchedule
 from digital_ll import uhd_error_codes
 from digital_ll import uhd_receiver
 from digital_ll import uhd_transmitter
+from digital_ll import virtual_radio_receiver
+from digital_ll import virtual_radio_transmitter
 
 import mac_ll
 from mac_ll import Infinite_Backlog_PDU_Streamer
@@ -72,6 +75,9 @@ from mac_ll import mobile_rl_agent_protocol_manager
 class my_top_block(gr.top_block):
     def __init__(self, modulator, demodulator, options, ll_logging, dev_log, start_tb_time, time_cal_timeout, start_controller_time):
         gr.top_block.__init__(self)
+
+        # fork the packet decode workers before any radio objects start threads
+        digital_ll.pkt2.start_decode_pool(options.rx_decode_workers)
         
         # Get the modulation's bits_per_symbol
         args = modulator.extract_kwargs_from_options(options)
@@ -83,7 +89,8 @@ class my_top_block(gr.top_block):
         options.sink_mac_addresses = [int(x) for x in sink_addresses.split(',')]        
 
         # Direct asynchronous notifications to callback function
-        if True:#self.options.show_async_msg:
+        # virtual radios log their own late bursts and underflows
+        if options.radio_backend == "uhd":
             self.async_msgq = gr.msg_queue(0)
             self.async_src = uhd.amsg_source("", self.async_msgq)
             self.async_rcv = gru.msgq_runner(self.async_msgq, self.async_callback)
@@ -93,25 +100,49 @@ class my_top_block(gr.top_block):
         # how much time should be spent calibrating time sync?
         self.cal_time = time_cal_timeout      
 
-        self.rx_channelizer = channelizer.rx_channelizer(options, dev_log)
+        # wideband beacon sync on a mobile needs every channel out of the channelizer
+        wideband_sync = (options.node_role != "tdma_base") and bool(options.beacon_sync_wideband)
+        self.rx_channelizer = channelizer.rx_channelizer(options, dev_log, 
+                                                         wideband_outputs=wideband_sync)
         self.tx_channelizer = channelizer.tx_channelizer(options, dev_log)
         self.rx_channelizer.set_beacon_channel(options.gpsbug_cal_channel)
         upsampled_symbol_rate = symbol_rate*options.digital_freq_hop_num_channels
         upsample_factor_usrp = options.digital_freq_hop_num_channels
 
         #setting up USRP RX
-        self.source = uhd_receiver(options.usrp_args, upsampled_symbol_rate,
-                                       options.modulation_samples_per_symbol,
-                                       options.rf_rx_freq, options.rf_rx_gain,
-                                       options.usrp_spec, "RX2",
-                                       options.verbose)
+        if options.radio_backend == "virtual":
+            self.source = virtual_radio_receiver(options, upsampled_symbol_rate,
+                                                 options.modulation_samples_per_symbol,
+                                                 options.rf_rx_freq, options.rf_rx_gain,
+                                                 options.verbose)
+        else:
+            self.source = uhd_receiver(options.usrp_args, upsampled_symbol_rate,
+                                           options.modulation_samples_per_symbol,
+                                           options.rf_rx_freq, options.rf_rx_gain,
+                                           options.usrp_spec, "RX2",
+                                           options.verbose)
+
+        # record everything the USRP receives if asked to
+        if options.rx_capture_file:
+            max_samples = int(round(options.rx_capture_max_seconds*
+                                    self.source.get_sample_rate()))
+            self.rx_capture = iq_capture_sink(options.rx_capture_file, max_samples)
+            self.connect(self.source, self.rx_capture)
+        else:
+            self.rx_capture = None
             
         #setting up USRP TX
-        self.sink = uhd_transmitter(options.usrp_args, upsampled_symbol_rate,
-                                        options.modulation_samples_per_symbol,
-                                        options.rf_tx_freq, options.rf_tx_gain,
-                                        options.usrp_spec, "TX/RX",
-                                        options.verbose)
+        if options.radio_backend == "virtual":
+            self.sink = virtual_radio_transmitter(options, upsampled_symbol_rate,
+                                                  options.modulation_samples_per_symbol,
+                                                  options.rf_tx_freq, options.rf_tx_gain,
+                                                  options.verbose)
+        else:
+            self.sink = uhd_transmitter(options.usrp_args, upsampled_symbol_rate,
+                                            options.modulation_samples_per_symbol,
+                                            options.rf_tx_freq, options.rf_tx_gain,
+                                            options.usrp_spec, "TX/RX",
+                                            options.verbose)
 
         if self.source._sps != options.modulation_samples_per_symbol:
             self.dev_log.warning("The USRP does not support the requested sample rate of %f. Using %f instead",
@@ -286,11 +317,13 @@ class my_top_block(gr.top_block):
             # set up beacon consumer
             self.beacon_consumer = beacon_consumer(options, overwrite_metadata=True)
             
-            beacon_rx_callback = self.beacon_consumer.beacon_callback
-            self.beacon_rx_path = receive_path_gmsk(demodulator, beacon_rx_callback, options,log_index=-1,use_new_pkt=True)
-         
             self.connect(self.source, self.rx_time_tag_shifter,self.rx_channelizer,self.scheduled_mux,self.beacon_consumer)
-            self.connect(self.scheduled_mux,self.beacon_rx_path)
+            
+            # with wideband sync, this listens on every non guard channel until synced
+            self.beacon_rx_paths = self.beacon_consumer.connect_rx_paths(self, demodulator, options,
+                                                                         self.rx_channelizer,
+                                                                         self.scheduled_mux)
+                
             self.connect((self.scheduled_mux,1),self.rx_path)
 
             
@@ -535,6 +568,7 @@ def initial_config():
 
     uhd_receiver.add_options(parser)
     uhd_transmitter.add_options(parser)
+    virtual_radio_receiver.add_options(parser, expert_grp)
 
     for mod in mods.values():
         mod.add_options(expert_grp)
@@ -556,6 +590,7 @@ def initial_config():
     Infinite_Backlog_PDU_Streamer.add_options(parser,expert_grp)
     Tunnel_Handler_PDU_Streamer.add_options(parser,expert_grp)
     beacon_consumer.add_options(parser,expert_grp)
+    iq_capture_sink.add_options(parser,expert_grp)
     
     # get list of all option defaults in the current option list
     opt_list = parser.defaults
@@ -909,6 +944,10 @@ def shut_down(tb, dev_log ):
     tb.wait()
     dev_log.debug("top block has shut down")
     
+    if tb.rx_capture is not None:
+        dev_log.debug("closing rx capture file")
+        tb.rx_capture.close()
+    
     if tb.traffic is not None:
         dev_log.debug("shutting down traffic generator")
         tb.traffic.shut_down()
@@ -46,6 +46,7 @@ from channel_charac_swig import *
 
 # import any pure python here
 #
+import sounding_analysis
 
 # ----------------------------------------------------------------
 # Tail of workaround
@@ -32,10 +32,12 @@ from math import log10
 from math import floor
 from math import ceil
 from math import sqrt
-import random
 import numpy as np
+import os
 import time
 from digital_ll.lincolnlog import dict_to_xml
+import sounding_analysis
+from digital_ll.power_control import get_pwr_equations
 
 
 class channel_char_run(gr.top_block):
@@ -172,13 +174,14 @@ class channel_char(gr.hier_block2):
         self.search_size    = options.search_size
         self.wait_quit      = options.run_duration
         self.wait_tx        = options.tx_delay
+        self.search_seed    = options.search_seed
+        self.search_cache_dir = options.search_cache_dir
 
         ##################################################
         # Set Default K and Lt
         ##################################################
         if self.K == -1:
-            usable = self.nfft/2 - 2
-            self.K = int(self.Lt*floor(usable/self.Lt))
+            self.K = sounding_analysis.default_num_rx_tones(self.nfft, self.Lt)
 
         ##################################################
         # Simple Checks
@@ -195,17 +198,14 @@ class channel_char(gr.hier_block2):
         ##################################################
         # Set default wait times if signalled to
         ##################################################
-        if self.wait_noise == -1:
-            self.wait_noise = int(round(0.5*self.samp_rate))
-        
-        if self.wait_tx   == -1:
-            self.wait_tx = int(round(self.wait_noise + 6*self.samp_rate + self.n_avg*self.nfft))
-        
-        if self.wait_sig == -1:
-            self.wait_sig = int(round(self.wait_tx + 6*self.samp_rate))
-        
-        if self.wait_quit == -1:
-            self.wait_quit = int(round(self.wait_sig + 6*self.samp_rate + self.n_avg*self.nfft))
+        (self.wait_noise, self.wait_tx,
+         self.wait_sig, self.wait_quit) = sounding_analysis.default_delays(self.samp_rate,
+                                                                           self.nfft,
+                                                                           self.n_avg,
+                                                                           self.wait_noise,
+                                                                           self.wait_tx,
+                                                                           self.wait_sig,
+                                                                           self.wait_quit)
 
 
         ##################################################
@@ -225,52 +225,41 @@ class channel_char(gr.hier_block2):
         ##################################################
         # Tx Chain
         ##################################################
-        upsample_factor = 2;
-        min_papr        = float('inf');
-        
         # Average power for a digital tx signal with digital scale = 1
-        self.avgpwr = 0.5
-        
-        # Search for a low PAPR signal
-        for n in range(0, self.search_size):
-            X   = [0,]*self.nfft
-            Xup = [0,]*(self.nfft*upsample_factor)
+        self.avgpwr = sounding_analysis.TX_AVG_POWER
+        
+        # Search for a low PAPR signal, or load the result of an earlier search
+        if self.search_seed >= 0 and self.search_cache_dir:
+            cache_file = os.path.join(
+                os.path.expandvars(os.path.expanduser(self.search_cache_dir)),
+                "papr_nfft%d_K%d_Lt%d_id%d_seed%d_size%d.npz" % (self.nfft, self.K, self.Lt,
+                                                                  self.id, self.search_seed,
+                                                                  self.search_size))
+        else:
+            cache_file = None
         
-            # Populate upper band
-            for k in range(0, int(ceil(self.K/2.0/self.Lt))):
-                r = random.sample([-1, 1], 1)
-                X[2*self.id + 2*self.Lt*k] = r[0]   
-            
-            # Populate lower band
-            for k in range(0, int(floor(self.K/2.0/self.Lt))):
-                r = random.sample([-1.0,1.0], 1)
-                offset = int(floor(k/float(self.Lt)))
-                X[self.nfft - 2*(self.Lt-self.id+1) - 2*self.Lt*k] = r[0]
-            
-            # Create the upsampled signal to calculate the PAPR
-            X_shift = np.fft.ifftshift(X)
-            pos     = int(ceil((upsample_factor-1)*self.nfft/2.0))
-            Xup[pos:pos+self.nfft] = X_shift
-            Xup     = np.fft.fftshift(Xup)
-            Xup     = np.array(Xup)
-            xup     = abs(np.fft.ifft(Xup))
-            
-            # Calculate the PAPR
-            xmax    = max(abs(xup)**2)                       # Maximum value
-            xvar    = np.sum(np.square(xup))/xup.size   # Power
-            papr    = xmax/xvar
+        if cache_file is not None and os.path.isfile(cache_file):
+            cached   = np.load(cache_file)
+            X        = cached["X"]
+            min_papr = float(cached["papr"])
+        else:
+            if self.search_seed >= 0:
+                rng = np.random.RandomState(self.search_seed)
+            else:
+                rng = np.random.RandomState()
+            X, min_papr = search_low_papr(self.nfft, self.K, self.Lt, self.id,
+                                          self.search_size, rng)
             
-            # If this is the minimum PAPR save off the transmit signal
-            if papr < min_papr:
-                min_papr = papr
-                X        = np.array(X)
-                x        = np.fft.ifft(X)
-                pwrx     = (self.K/self.Lt)/float(self.nfft**2) # Power before normalizing
-                for k in range(0, len(x)):
-                    x[k] = sqrt(self.avgpwr/pwrx)*x[k] # Normalize power to default amount
-                    x[k] = self.digital_scale*x[k]     # Apply the digital scaling
-                self.maxv = max(abs(x))
-                x_save   = x.tolist()
+            if cache_file is not None:
+                if not os.path.isdir(os.path.dirname(cache_file)):
+                    os.makedirs(os.path.dirname(cache_file))
+                np.savez(cache_file, X=X, papr=min_papr)
+        
+        # Normalize power to default amount and apply the digital scaling
+        pwrx      = (self.K/self.Lt)/float(self.nfft**2) # Power before normalizing
+        x         = np.fft.ifft(X)*(sqrt(self.avgpwr/pwrx)*self.digital_scale)
+        self.maxv = np.max(np.abs(x))
+        x_save    = x.tolist()
         
         self.papr = min_papr
         
@@ -427,58 +416,24 @@ class channel_char(gr.hier_block2):
             time.sleep(0.01)
             done = self.post_fft_analysis.SNR_calculation_ready()
         
-        print '************************************************************'
-        print 'Reporting for Node', self.id
-        print '    My Tx signal PAPR =', self.papr
-        if self.maxv <= 1:
-            print '    Maximum scaled sample =', self.maxv
-        else:
-            print '    Maximum scaled sample =', self.maxv, '(Warning: Clipping!)'
-        print '    Center Freq =', self.cf/1.0e6, 'MHz'
-        print '    Bandwidth  =', self.samp_rate/1.0e3, 'kHz'
-        print '    Tx Gain =', self.tx_gain, 'dB'
-        print '    Rx Gain = ', self.rx_gain, 'dB'
-        print '    Digital Scaling =', self.digital_scale
-        print '    K =', self.K, '(bins occupied)'
-        print '    NFFT =', self.nfft, '(bins total)'
-        print '-------------------------'
-        print 'Pathloss and SNR Results:'
-        
-        # Calculate the transmitted digital power
-        tx_dpwr    = (self.digital_scale**2)*self.avgpwr
-        tx_pwr_eq, rx_pwr_eq = get_pwr_equations( self.cf, self.tx_gain, self.rx_gain ) # returned in dB
-        
-        snr = [0,]*self.nfft
-        sinr= [0,]*self.nfft
-        pwr = [0,]*self.nfft
-        Np  = [0,]*self.nfft
-        Ip  = [0,]*self.nfft
+        # Get the results for each transmitter
+        results = {"sig_power":[],
+                   "noise_power":[],
+                   "odd_bin_power":[],
+                   "snr":[],
+                   "signal_to_floor":[]}
         for n in range(1, self.Lt+1):
-            # Get the results
-            snr[n] = self.post_fft_analysis.return_SNR_2step(n)
-            pwr[n] = self.post_fft_analysis.return_sig_power(n)
-            Np[n]   = self.post_fft_analysis.return_noise_power(n)
-            Ip[n]   = self.post_fft_analysis.return_odd_bin_power(n)
-            sinr[n]= self.post_fft_analysis.return_SNR(n)
-            
-            # Print the results to screen
-            if n == self.id:
-                print 'From Tx No.', n, '(ie, Me!)'
-            else:
-                print 'From Tx No.', n
-            print '    Transmitted Discrete Signal Power: %0.7f' % (10*log10(tx_dpwr)), 'dB/samp'
-            print '    Received Discretized Signal Power: %0.7f' % (10*log10(pwr[n])), 'dB/samp'
-            print '    Received Discretized Noise Power:  %0.7f' % (10*log10(Np[n])), 'dB/samp'
-            print '    Received Tx Floor Power:           %0.7f' % (10*log10(Ip[n])), 'dB/samp'
-            print '    Estimated Transmitted Power at Tx: %0.7f' % (tx_pwr_eq + 10*log10(tx_dpwr)), 'dBm'
-            print '    Estimated Received Power at Rx:    %0.7f' % (rx_pwr_eq + 10*log10(pwr[n])), 'dBm'
-            print '    Estimated Noise Power at Rx:       %0.7f' % (rx_pwr_eq + 10*log10(Np[n])), 'dBm'
-            print '    Estimated Power of Tx Floor at Rx: %0.7f' % (rx_pwr_eq + 10*log10(Ip[n])), 'dBm'
-            print '    Estimated Path Loss between Tx/Rx: %0.7f' % (tx_pwr_eq + 10*log10(tx_dpwr) - (rx_pwr_eq + 10*log10(pwr[n]))), 'dB'
-            print '    Signal to Noise Ratio:             %0.7f' % (10*log10(snr[n])), 'dB'
-            print '    Signal to Tx Floor Ratio:          %0.7f' % (10*log10(sinr[n])), 'dB'
-            
-        print '************************************************************'
+            results["sig_power"].append(self.post_fft_analysis.return_sig_power(n))
+            results["noise_power"].append(self.post_fft_analysis.return_noise_power(n))
+            results["odd_bin_power"].append(self.post_fft_analysis.return_odd_bin_power(n))
+            results["snr"].append(self.post_fft_analysis.return_SNR_2step(n))
+            results["signal_to_floor"].append(self.post_fft_analysis.return_SNR(n))
+        
+        # Print the results to screen
+        print sounding_analysis.format_report(self.id, self.papr, self.maxv, self.cf,
+                                              self.samp_rate, self.tx_gain, self.rx_gain,
+                                              self.digital_scale, self.avgpwr, self.K,
+                                              self.nfft, results)
 
     def poke(self):
         self.post_fft_analysis.poke()
@@ -513,15 +468,57 @@ class channel_char(gr.hier_block2):
         parser.add_option("","--rf-rx-gain",type="float",default=10,help="Channel Sounding: The USRP front-end adjustable receiver gain used during channel sounding technique")
         
         parser.add_option("","--search-size",type="int",default=20000,help="Channel Sounding: The number of tx signals to generate to find the one with the lowest PAPR")
+        parser.add_option("","--search-seed",type="int",default=-1,help="Channel Sounding: Random seed for the low PAPR search. -1 picks a new signal every run")
+        parser.add_option("","--search-cache-dir",type="string",default="",help="Channel Sounding: Directory to save low PAPR search results in and reuse them from. Only used with a --search-seed")
         parser.add_option("","--signal-scale",type="float",default=1,help="Channel Sounding: Scaling to apply to the discrete signal to transmit")
     # Make a static method to call before instantiation
     add_options = staticmethod(add_options) 
 
-def get_pwr_equations( cf, tx_gain, rx_gain ):
-    tx_pwr_eq  = -0.0056706*cf/1.0e6 +  6.176 + tx_gain # already in dB
-    rx_pwr_eq  =  0.0028850*cf/1.0e6 + -7.84  - rx_gain # already in dB
-    return tx_pwr_eq, rx_pwr_eq
-        
+def search_low_papr(nfft, K, Lt, node_id, search_size, rng, batch_size=1024):
+    '''
+    Search search_size random +/-1 tone patterns for the one with the lowest PAPR
+    
+    The tones used are the ones assigned to node_id out of Lt nodes. PAPR is measured
+    on a 2x upsampled version of each candidate. Candidates are drawn from rng and
+    evaluated batch_size at a time with one FFT per batch. Returns the nfft bin
+    frequency domain signal of the best candidate and its PAPR
+    '''
+    upsample_factor = 2
+    
+    # Upper band tones, then lower band tones
+    upper = [2*node_id + 2*Lt*k for k in range(0, int(ceil(K/2.0/Lt)))]
+    lower = [nfft - 2*(Lt-node_id+1) - 2*Lt*k for k in range(0, int(floor(K/2.0/Lt)))]
+    tones = np.array(upper + lower, dtype=int)
+    
+    # Find where each tone lands in the upsampled spectrum by zero padding the
+    # middle of the spectrum
+    pos      = int(ceil((upsample_factor-1)*nfft/2.0))
+    up_bins  = np.fft.fftshift(np.arange(nfft*upsample_factor))
+    up_tones = up_bins[pos + np.fft.fftshift(np.arange(nfft))[tones]]
+    
+    min_papr   = float('inf')
+    best_signs = None
+    for start in range(0, search_size, batch_size):
+        num_rows = min(batch_size, search_size - start)
+        signs    = 2.0*rng.randint(0, 2, size=(num_rows, len(tones))) - 1.0
+        
+        Xup = np.zeros((num_rows, nfft*upsample_factor), dtype=complex)
+        Xup[:, up_tones] = signs
+        
+        # PAPR of each row. The ifft scaling cancels out
+        xup  = np.abs(np.fft.ifft(Xup, axis=1))**2
+        papr = xup.max(axis=1)/xup.mean(axis=1)
+        
+        best = np.argmin(papr)
+        if papr[best] < min_papr:
+            min_papr   = float(papr[best])
+            best_signs = signs[best]
+    
+    X = np.zeros(nfft, dtype=complex)
+    X[tones] = best_signs
+    
+    return X, min_papr
+
 def main():
     # Take care of the inputs assigning defaults if necessary
     parser = OptionParser(option_class=eng_option, usage="%prog: [options]")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Offline channel sounding analysis of recorded IQ captures
+
+Computes the same signal, noise, tx floor (odd bin) and SNR measurements as the
+channel_charac.test block, but from an fc32 capture file instead of a running
+flowgraph. The capture is memory mapped and split into nfft sample frames counted
+from the start of the file, the same way the flowgraph counts samples after it is
+poked. The noise measurement uses the first n_avg frames starting at or after
+wait_noise and before wait_sig, and the signal measurements use the first n_avg
+frames starting at or after wait_sig. All frames in a measurement are processed
+together instead of one FFT at a time, so archived captures can be reprocessed in
+seconds.
+
+This module only depends on numpy and the digital_ll front end power equations, so
+it can be run directly as a script on a machine without a radio. See main() for
+usage.
+'''
+
+# standard python library imports
+from math import floor
+from math import log10
+from optparse import OptionParser
+import os
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+from digital_ll.power_control import get_pwr_equations
+
+
+# process at most this many samples at a time to keep memory use bounded
+CHUNK_SAMPLES = 2**20
+
+# Average power of the digital transmit signal before the digital scale is applied
+TX_AVG_POWER = 0.5
+
+# bin_owners() labels for bins that are not assigned to a transmitter
+UNUSED_BIN = -1
+NOISE_BIN = -2
+
+
+def default_num_rx_tones(nfft, Lt):
+    '''
+    Largest number of occupied bins that fits in nfft and is divisible by Lt
+    '''
+    usable = nfft/2 - 2
+    return int(Lt*floor(usable/Lt))
+
+def default_delays(samp_rate, nfft, n_avg, wait_noise, wait_tx, wait_sig, wait_quit):
+    '''
+    Fill in any delays left at -1 with the defaults channel_char uses. Returns
+    (wait_noise, wait_tx, wait_sig, wait_quit) in samples
+    '''
+    if wait_noise == -1:
+        wait_noise = int(round(0.5*samp_rate))
+
+    if wait_tx == -1:
+        wait_tx = int(round(wait_noise + 6*samp_rate + n_avg*nfft))
+
+    if wait_sig == -1:
+        wait_sig = int(round(wait_tx + 6*samp_rate))
+
+    if wait_quit == -1:
+        wait_quit = int(round(wait_sig + 6*samp_rate + n_avg*nfft))
+
+    return wait_noise, wait_tx, wait_sig, wait_quit
+
+def bin_owners(nfft, K, Lt):
+    '''
+    Label each bin of an fft shifted spectrum the way channel_charac.test does.
+
+    Returns an int array of nfft labels: the zero based number of the transmitter a
+    bin belongs to, NOISE_BIN for the unoccupied bins between transmit bins, and
+    UNUSED_BIN for bins outside the sounding band.
+    '''
+    k = np.arange(nfft)
+    center = nfft/2
+
+    owners = np.empty(nfft, dtype=int)
+    owners.fill(UNUSED_BIN)
+
+    in_band = (k >= center - K) & (k <= center + K) & (k != center)
+    offset = np.abs(k - center)
+
+    upper = in_band & (k > center) & (offset % 2 == 0)
+    lower = in_band & (k < center) & (offset % 2 == 0)
+
+    owners[in_band & (offset % 2 == 1)] = NOISE_BIN
+    owners[upper] = ((offset[upper] - 2)/2) % Lt
+    owners[lower] = Lt - 1 - ((offset[lower] - 2)/2) % Lt
+
+    return owners
+
+def find_frames(num_frames, nfft, n_avg, wait_noise, wait_sig):
+    '''
+    Get the first frame index of the noise and signal measurements
+
+    Returns (noise_start, num_noise_frames, signal_start). Raises ValueError if
+    a capture of num_frames frames is too short for the signal measurement.
+    '''
+    # first frame starting at or after each delay
+    noise_start = int(-(-wait_noise // nfft))
+    signal_start = int(-(-wait_sig // nfft))
+
+    num_noise_frames = max(0, min(n_avg, signal_start - noise_start, num_frames - noise_start))
+
+    if signal_start + n_avg > num_frames:
+        raise ValueError("capture has %d frames of %d samples but the signal measurement "
+                         "needs frames %d through %d" % (num_frames, nfft, signal_start,
+                                                         signal_start + n_avg - 1))
+
+    return noise_start, num_noise_frames, signal_start
+
+def frame_power(samples, nfft):
+    '''
+    Sum of the power in all fft bins of every frame in samples
+
+    By Parseval's theorem this is nfft times the power of the samples, so no fft
+    is needed.
+    '''
+    total = 0.0
+    for start in range(0, len(samples), CHUNK_SAMPLES):
+        chunk = np.asarray(samples[start:start+CHUNK_SAMPLES])
+        total += nfft*(np.sum(chunk.real.astype(np.float64)**2) +
+                       np.sum(chunk.imag.astype(np.float64)**2))
+    return total
+
+def bin_power(samples, nfft):
+    '''
+    Power in each bin of the fft shifted spectrum, summed over all the frames in
+    samples
+    '''
+    chunk_len = max(1, CHUNK_SAMPLES/nfft)*nfft
+
+    total = np.zeros(nfft)
+    for start in range(0, len(samples), chunk_len):
+        frames = np.asarray(samples[start:start+chunk_len]).reshape(-1, nfft)
+        spectra = np.fft.fftshift(np.fft.fft(frames, axis=1), axes=1)
+        total += np.sum(spectra.real**2 + spectra.imag**2, axis=0)
+    return total
+
+def analyze_capture(file_name, nfft, K, Lt, n_avg, wait_noise, wait_sig):
+    '''
+    Measure the channel from every transmitter in a recorded fc32 capture
+
+    Returns a dict of arrays indexed by transmitter number - 1, with the same
+    values as the channel_charac.test return_* methods:
+        "sig_power":       return_sig_power
+        "noise_power":     return_noise_power
+        "odd_bin_power":   return_odd_bin_power
+        "snr":             return_SNR_2step
+        "signal_to_floor": return_SNR
+    '''
+    file_name = os.path.abspath(os.path.expandvars(os.path.expanduser(file_name)))
+
+    num_samples = os.path.getsize(file_name)/np.dtype(np.complex64).itemsize
+    num_frames = num_samples/nfft
+
+    noise_start, num_noise_frames, signal_start = find_frames(num_frames, nfft, n_avg,
+                                                              wait_noise, wait_sig)
+
+    samples = np.memmap(file_name, dtype=np.complex64, mode='r',
+                        shape=(num_frames*nfft,))
+
+    # The noise measurement happens before anyone transmits, so it uses all bins
+    N_silent = frame_power(samples[noise_start*nfft:(noise_start+num_noise_frames)*nfft],
+                           nfft)
+
+    # During the signal measurement, split the spectrum between transmitters and
+    # the unoccupied bins between them
+    owners = bin_owners(nfft, K, Lt)
+    bins = bin_power(samples[signal_start*nfft:(signal_start+n_avg)*nfft], nfft)
+
+    is_tx = owners >= 0
+    P = np.bincount(owners[is_tx], weights=bins[is_tx], minlength=Lt)
+    N = np.sum(bins[owners == NOISE_BIN])
+
+    # normalize the same way channel_charac.test does. The noise average is over
+    # n_avg frames even if fewer were captured, like the block does
+    sig_power = P/float(nfft*nfft)/n_avg
+    noise_power = np.repeat(N_silent/float(nfft*nfft)/n_avg, Lt)
+    odd_bin_power = np.repeat(N/float(K*nfft)/n_avg, Lt)
+
+    return {"sig_power":sig_power,
+            "noise_power":noise_power,
+            "odd_bin_power":odd_bin_power,
+            "snr":sig_power/noise_power,
+            "signal_to_floor":sig_power/odd_bin_power}
+
+def format_report(node_id, papr, maxv, cf, samp_rate, tx_gain, rx_gain, digital_scale,
+                  avgpwr, K, nfft, results):
+    '''
+    Format channel sounding results the way channel_char.print_result shows them.
+
+    results is a dict like the one returned by analyze_capture. papr and maxv
+    describe this node's transmit signal and are left out of the report if None.
+    '''
+    lines = []
+    lines.append('************************************************************')
+    lines.append('Reporting for Node %s' % node_id)
+    if papr is not None:
+        lines.append('    My Tx signal PAPR = %s' % papr)
+    if maxv is not None:
+        if maxv <= 1:
+            lines.append('    Maximum scaled sample = %s' % maxv)
+        else:
+            lines.append('    Maximum scaled sample = %s (Warning: Clipping!)' % maxv)
+    lines.append('    Center Freq = %s MHz' % (cf/1.0e6))
+    lines.append('    Bandwidth  = %s kHz' % (samp_rate/1.0e3))
+    lines.append('    Tx Gain = %s dB' % tx_gain)
+    lines.append('    Rx Gain =  %s dB' % rx_gain)
+    lines.append('    Digital Scaling = %s' % digital_scale)
+    lines.append('    K = %s (bins occupied)' % K)
+    lines.append('    NFFT = %s (bins total)' % nfft)
+    lines.append('-------------------------')
+    lines.append('Pathloss and SNR Results:')
+
+    # Calculate the transmitted digital power
+    tx_dpwr    = (digital_scale**2)*avgpwr
+    tx_pwr_eq, rx_pwr_eq = get_pwr_equations( cf, tx_gain, rx_gain ) # returned in dB
+
+    for n in range(1, len(results["sig_power"])+1):
+        pwr  = results["sig_power"][n-1]
+        Np   = results["noise_power"][n-1]
+        Ip   = results["odd_bin_power"][n-1]
+        snr  = results["snr"][n-1]
+        sinr = results["signal_to_floor"][n-1]
+
+        if n == node_id:
+            lines.append('From Tx No. %s (ie, Me!)' % n)
+        else:
+            lines.append('From Tx No. %s' % n)
+        lines.append('    Transmitted Discrete Signal Power: %0.7f dB/samp' % (10*log10(tx_dpwr)))
+        lines.append('    Received Discretized Signal Power: %0.7f dB/samp' % (10*log10(pwr)))
+        lines.append('    Received Discretized Noise Power:  %0.7f dB/samp' % (10*log10(Np)))
+        lines.append('    Received Tx Floor Power:           %0.7f dB/samp' % (10*log10(Ip)))
+        lines.append('    Estimated Transmitted Power at Tx: %0.7f dBm' % (tx_pwr_eq + 10*log10(tx_dpwr)))
+        lines.append('    Estimated Received Power at Rx:    %0.7f dBm' % (rx_pwr_eq + 10*log10(pwr)))
+        lines.append('    Estimated Noise Power at Rx:       %0.7f dBm' % (rx_pwr_eq + 10*log10(Np)))
+        lines.append('    Estimated Power of Tx Floor at Rx: %0.7f dBm' % (rx_pwr_eq + 10*log10(Ip)))
+        lines.append('    Estimated Path Loss between Tx/Rx: %0.7f dB' % (tx_pwr_eq + 10*log10(tx_dpwr) - (rx_pwr_eq + 10*log10(pwr))))
+        lines.append('    Signal to Noise Ratio:             %0.7f dB' % (10*log10(snr)))
+        lines.append('    Signal to Tx Floor Ratio:          %0.7f dB' % (10*log10(sinr)))
+
+    lines.append('************************************************************')
+
+    return '\n'.join(lines)
+
+def main():
+
+    parser = OptionParser(usage="%prog: [options] --from-file=CAPTURE --node-id=ID",
+                          description=__doc__.strip().splitlines()[0])
+    parser.add_option("","--from-file",type="string",default=None,help="Recorded fc32 capture to analyze")
+    parser.add_option("","--output-dir",type="string",default=".",help="Directory to write pathloss_log_node<id>.txt to [default=%default]")
+    parser.add_option("","--samp-rate",default=1e6,type="float",help="The sample rate the capture was recorded at (SPS)")
+    parser.add_option("","--rf-cf",default=1111e6,type="float",help="The center frequency the capture was recorded at (Hz)")
+    parser.add_option("","--num-nodes",type="int",default=-1,help="The number of nodes that took part in the test")
+    parser.add_option("","--node-id",type=int,default=-1,help="The id number of the node that recorded the capture")
+    parser.add_option("","--num-tx-tones",default=64,type="int",help="The size of the FFT used")
+    parser.add_option("","--num-rx-tones",default=-1,type="int",help="The number of bins used. Default value chosen if not specified.")
+    parser.add_option("","--num-averages",type="int",default=10,help="The number of FFT frames to average the measurements over")
+    parser.add_option("","--noise-delay",type="int",default=-1,help="Samples from the start of the capture to wait before measuring noise")
+    parser.add_option("","--tx-delay",type="int",default=-1,help="Samples the nodes waited before transmitting. Only used to find the default rx delay")
+    parser.add_option("","--rx-delay",type="int",default=-1,help="Samples from the start of the capture to wait before measuring signal")
+    parser.add_option("","--rf-tx-gain",type="float",default=10,help="The transmitter gain used during the test")
+    parser.add_option("","--rf-rx-gain",type="float",default=10,help="The receiver gain used during the test")
+    parser.add_option("","--signal-scale",type="float",default=1,help="The digital scaling applied to the transmitted signal")
+    (options, args) = parser.parse_args()
+
+    if options.from_file is None:
+        parser.error("--from-file is required")
+    if options.node_id == -1 or options.num_nodes == -1:
+        parser.error("--node-id and --num-nodes are required")
+
+    nfft = options.num_tx_tones
+    Lt = options.num_nodes
+    n_avg = options.num_averages
+
+    K = options.num_rx_tones
+    if K == -1:
+        K = default_num_rx_tones(nfft, Lt)
+
+    if K % Lt != 0:
+        parser.error("K must be divisible by Lt for channel sounding technique")
+
+    wait_noise, wait_tx, wait_sig, wait_quit = default_delays(options.samp_rate, nfft, n_avg,
+                                                              options.noise_delay,
+                                                              options.tx_delay,
+                                                              options.rx_delay, -1)
+
+    try:
+        results = analyze_capture(options.from_file, nfft, K, Lt, n_avg, wait_noise, wait_sig)
+    except ValueError as err:
+        parser.error(str(err))
+
+    report = format_report(options.node_id, None, None, options.rf_cf, options.samp_rate,
+                           options.rf_tx_gain, options.rf_rx_gain, options.signal_scale,
+                           TX_AVG_POWER, K, nfft, results)
+
+    print report
+
+    output_dir = os.path.expandvars(os.path.expanduser(options.output_dir))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, "pathloss_log_node%d.txt" % options.node_id), 'w') as f:
+        f.write(report + '\n')
+
+if __name__ == '__main__':
+    main()
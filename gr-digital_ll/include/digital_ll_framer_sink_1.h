@@ -53,9 +53,7 @@ class digital_ll_framer_sink_1;
 typedef boost::shared_ptr<digital_ll_framer_sink_1> digital_ll_framer_sink_1_sptr;
 
 DIGITAL_LL_API digital_ll_framer_sink_1_sptr
-digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue,
-		gr_msg_queue_sptr time_queue,
-		gr_msg_queue_sptr chan_queue);
+digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue);
 
 /*!
  * \brief Given a stream of bits and access_code flags, assemble packets.
@@ -64,6 +62,11 @@ digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue,
  * input: stream of bytes from gr_correlate_access_code_bb
  * output: none. Pushes assembled packet into target queue
  *
+ * Each packet is pushed as one message. arg1 holds the whitener offset and
+ * arg2 the digital channel the packet was found on. The message body is the
+ * payload followed by the sync timestamp, as an int64_t of whole seconds and
+ * a double of fractional seconds in native byte order.
+ *
  * The framer expects a fixed length header of 2 16-bit shorts
  * containing the payload length, followed by the payload. If the
  * 2 16-bit shorts are not identical, this packet is ignored. Better
@@ -78,9 +81,7 @@ digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue,
 class DIGITAL_LL_API digital_ll_framer_sink_1 : public gr_sync_block
 {
   friend DIGITAL_LL_API digital_ll_framer_sink_1_sptr
-    digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue,
-    		gr_msg_queue_sptr time_queue,
-    		gr_msg_queue_sptr chan_queue);
+    digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue);
 
  private:
 
@@ -90,10 +91,9 @@ class DIGITAL_LL_API digital_ll_framer_sink_1 : public gr_sync_block
 
   static const int MAX_PKT_LEN    = 4096;
   static const int HEADERBITLEN   = 32;
+  static const int TIMESTAMP_LEN  = sizeof(int64_t) + sizeof(double);
 
   gr_msg_queue_sptr  d_packet_queue;		// where to send the packet when received
-  gr_msg_queue_sptr  d_time_queue;		// where to send the packet timestamp when received
-  gr_msg_queue_sptr  d_chan_queue;		// where to send the packet channel when received
   state_t            d_state;
   unsigned int       d_header;			// header bits
   int		     d_headerbitlen_cnt;	// how many so far
@@ -121,11 +121,10 @@ class DIGITAL_LL_API digital_ll_framer_sink_1 : public gr_sync_block
   std::vector<gr_tag_t>::iterator d_rate_itr;
 
  protected:
-  digital_ll_framer_sink_1(gr_msg_queue_sptr packet_queue,
-			gr_msg_queue_sptr time_queue,
-			gr_msg_queue_sptr chan_queue);
+  digital_ll_framer_sink_1(gr_msg_queue_sptr packet_queue);
 
   void enter_search();
+  void send_packet();
   void enter_have_sync();
   void enter_have_header(int payload_len, int whitener_offset);
 
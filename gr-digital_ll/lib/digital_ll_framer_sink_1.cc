@@ -141,24 +141,39 @@ digital_ll_framer_sink_1::enter_have_header(int payload_len,
   d_packet_byte_index = 0;
 }
 
+inline void
+digital_ll_framer_sink_1::send_packet()
+{
+  // build a single message holding the packet, its sync timestamp, and its channel
+  // NOTE: passing header field as arg1 is not scalable
+  gr_message_sptr msg =
+    gr_make_message(0, d_packet_whitener_offset, d_sync_channel,
+		    d_packetlen_cnt + TIMESTAMP_LEN);
+
+  int64_t int_s = d_sync_timestamp.int_s();
+  double frac_s = d_sync_timestamp.frac_s();
+
+  unsigned char *buf = msg->msg();
+  memcpy(buf, d_packet, d_packetlen_cnt);
+  memcpy(buf + d_packetlen_cnt, &int_s, sizeof(int_s));
+  memcpy(buf + d_packetlen_cnt + sizeof(int_s), &frac_s, sizeof(frac_s));
+
+  d_packet_queue->insert_tail(msg);		// send it
+  msg.reset();  				// free it up
+}
+
 digital_ll_framer_sink_1_sptr
-digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue,
-		gr_msg_queue_sptr time_queue,
-		gr_msg_queue_sptr chan_queue)
+digital_ll_make_framer_sink_1(gr_msg_queue_sptr packet_queue)
 {
-  return gnuradio::get_initial_sptr(new digital_ll_framer_sink_1(packet_queue, time_queue, chan_queue));
+  return gnuradio::get_initial_sptr(new digital_ll_framer_sink_1(packet_queue));
 }
 
 
-digital_ll_framer_sink_1::digital_ll_framer_sink_1(gr_msg_queue_sptr packet_queue,
-		gr_msg_queue_sptr time_queue,
-		gr_msg_queue_sptr chan_queue)
+digital_ll_framer_sink_1::digital_ll_framer_sink_1(gr_msg_queue_sptr packet_queue)
   : gr_sync_block ("framer_sink_1",
 		   gr_make_io_signature (1, 1, sizeof(unsigned char)),
 		   gr_make_io_signature (0, 0, 0)),
-    d_packet_queue(packet_queue),
-    d_time_queue(time_queue),
-    d_chan_queue(chan_queue)
+    d_packet_queue(packet_queue)
 {
   enter_search();
 
@@ -276,23 +291,8 @@ digital_ll_framer_sink_1::work (int noutput_items,
 	    enter_have_header(payload_len, whitener_offset);
 
 	    if (d_packetlen == 0){	    // check for zero-length payload
-	      // build a zero-length message
-	      // NOTE: passing header field as arg1 is not scalable
-	      gr_message_sptr msg =
-		gr_make_message(0, d_packet_whitener_offset, 0, 0);
-
-	      d_packet_queue->insert_tail(msg);		// send it
-	      msg.reset();  				// free it up
-
-	      // pass up timestamp
-	      msg = gr_make_message(0,d_sync_timestamp.int_s(),d_sync_timestamp.frac_s(),0);
-	      d_time_queue->insert_tail(msg);		// send it
-		  msg.reset();  				// free it up
-
-		  // pass up channel
-		  msg = gr_make_message(0,d_sync_channel,0,0);
-		  d_chan_queue->insert_tail(msg);		// send it
-		  msg.reset();  				// free it up
+	      // send a message with no payload
+	      send_packet();
 //		  fprintf(stderr,"framer sink found packet at offset %ld, channel %ld\n",
 //				  d_sync_ind,d_sync_channel);
 
@@ -318,28 +318,11 @@ digital_ll_framer_sink_1::work (int noutput_items,
 
 	  if (d_packetlen_cnt == d_packetlen){		// packet is filled
 
-	    // build a message
-	    // NOTE: passing header field as arg1 is not scalable
-	    gr_message_sptr msg =
-	      gr_make_message(0, d_packet_whitener_offset, 0, d_packetlen_cnt);
-	    memcpy(msg->msg(), d_packet, d_packetlen_cnt);
-
-	    d_packet_queue->insert_tail(msg);		// send it
-	    msg.reset();  				// free it up
-
-	      // pass up timestamp
-	    msg = gr_make_message(0,d_sync_timestamp.int_s(),d_sync_timestamp.frac_s(),0);
-	    d_time_queue->insert_tail(msg);		// send it
-	    msg.reset();  				// free it up
+	    send_packet();
 
 //	    fprintf(stderr,"framer sink found packet at offset %ld, channel %ld\n",
 //	    				  d_sync_ind,d_sync_channel);
 
-        // pass up channel
-		msg = gr_make_message(0,d_sync_channel,0,0);
-		d_chan_queue->insert_tail(msg);		// send it
-		msg.reset();  				// free it up
-
 	    enter_search();
 	    break;
 	  }
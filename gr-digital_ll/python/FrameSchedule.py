@@ -34,7 +34,9 @@ import numpy as np
 import numpy.ma as ma
 
 # project specific imports
+from digital_ll import sample_timebase
 from digital_ll import time_spec_t
+import pattern_set_file
 from SortedCollection import SortedCollection
 
 
@@ -43,6 +45,40 @@ SlotParamTuple = namedtuple('SlotParamTuple', 'owner len offset type rf_freq bb_
 
 GridUpdateTuple = namedtuple('GridUpdateTuple', 'owner type channel_num order rf_freq')
 
+# sample level timing of a frame. t0_index is the index of the start of frame 
+# t0_frame_num in timebase, and slot offsets are counted from the start of the frame
+FrameTiming = namedtuple('FrameTiming', 
+                         'timebase t0_index t0_frame_num frame_len_samples slot_offset_samples')
+
+def get_frame_timing(frame_config, fs):
+    '''
+    Get the FrameTiming of a frame config. Frame configs from pattern schedules carry
+    their schedule's timebase and sample indices, so those are used as is. Any other
+    frame config gets a timebase starting at its t0
+    '''
+    timebase = frame_config.get("timebase")
+
+    if timebase is not None and timebase.fs == fs:
+        return FrameTiming(timebase=timebase,
+                           t0_index=frame_config["t0_index"],
+                           t0_frame_num=frame_config["t0_frame_num"],
+                           frame_len_samples=frame_config["frame_len_samples"],
+                           slot_offset_samples=frame_config["slot_offset_samples"])
+
+    timebase = sample_timebase(fs, frame_config["t0"])
+    return FrameTiming(timebase=timebase,
+                       t0_index=0,
+                       t0_frame_num=frame_config["t0_frame_num"],
+                       frame_len_samples=timebase.num_samples(frame_config["frame_len"]),
+                       slot_offset_samples=tuple(timebase.num_samples(s.offset)
+                                                 for s in frame_config["slots"]))
+
+def frame_start_index(timing, frame_num):
+    '''
+    Index of the first sample of frame frame_num in timing.timebase
+    '''
+    return timing.t0_index + (frame_num - timing.t0_frame_num)*timing.frame_len_samples
+
 
 import time                                                
 
@@ -462,6 +498,12 @@ class PatternFrameSchedule(FrameScheduleBase):
     
     PatternTuple = namedtuple("PatternTuple", 'owner len offset type bb_freq')
     
+    # an action compiled by store_action_space. Slots are PatternTuples with owner ids
+    # already mapped, and frame_len_samples and offset_samples are None if no sample rate 
+    # was given
+    ActionTemplate = namedtuple("ActionTemplate", 
+                                'frame_len rf_freq slots frame_len_samples offset_samples')
+    
     
     gains = None
     slot_bw = None
@@ -472,6 +514,8 @@ class PatternFrameSchedule(FrameScheduleBase):
     # be sent across during pickle/unpickle operations but will rely on the classes on
     # remote machines being configured properly
     _action_space = None
+    _action_templates = None
+    _action_fs = None
     
     sync_space = None
     num_actions = None
@@ -508,6 +552,14 @@ class PatternFrameSchedule(FrameScheduleBase):
         
         self.slot_bw = slot_bw
         
+        # frame templates built from _action_templates and the current gains, keyed by
+        # action index. These are dropped whenever a gain changes
+        self._frame_templates = {}
+        
+        # sample timebases referenced to the time_ref of each schedule state, keyed by 
+        # the time_ref tuple
+        self._timebases = {}
+        
         first_state = (time_ref, frame_num_ref, first_frame_num, action_ind, epoch_num)
         # only add the initial state if all the necessary params are defined
         if all( v is not None for v in first_state):
@@ -528,6 +580,12 @@ class PatternFrameSchedule(FrameScheduleBase):
             # find the first element in the list when sorted by frame number
             self.schedule_seq.remove(self.schedule_seq[0])
             
+            # only keep timebases for schedule states that are still around
+            time_refs = set(sched[0] for sched in self.schedule_seq)
+            for time_ref in self._timebases.keys():
+                if time_ref not in time_refs:
+                    del self._timebases[time_ref]
+            
                     
     def compute_frame(self, frame_num=None):
         '''
@@ -546,50 +604,35 @@ class PatternFrameSchedule(FrameScheduleBase):
                 sched_tup = self.schedule_seq[0]
             sched = self.stateTup(*sched_tup)
         
-        #print "Frame num is %i, action ind is %i"%(frame_num, sched.action_ind)
-        #print "schedule sequence is %s"%self.schedule_seq
-            
-        action = self._action_space[sched.action_ind]     
-#        if "pattern" not in action:
-#            # TODO: Make a better exception for when there aren't any patterns
-#            raise KeyError("Expected at least one pattern object in the action space")  
-#        else:
-        frame_len = action["frame_len"]
+        template = self._get_frame_template(sched.action_ind)
+        frame_len = template[0]
+        action_template = template[2]
         frame_delta = frame_num - sched.frame_num_ref
         
-        t0 = time_spec_t(sched.time_ref) + frame_len*frame_delta
+        if action_template.frame_len_samples is not None:
+            # count whole frames of samples from the schedule's time reference so frame
+            # starts stay on the sample grid however far they are from time_ref
+            timebase = self._get_timebase(sched.time_ref)
+            t0_index = frame_delta*action_template.frame_len_samples
+            t0 = timebase.to_time(t0_index)
+        else:
+            timebase = None
+            t0_index = None
+            t0 = time_spec_t(sched.time_ref) + frame_len*frame_delta
         
+        # the template is shared between calls, so hand out a copy of the slot list
         frame_config = {"frame_len":frame_len,
                         "t0":t0,
                         "t0_frame_num":frame_num,
                         "first_frame_num":sched.first_frame_num,
                         "valid":self.valid,
                         "epoch_num":sched.epoch_num,
+                        "slots":list(template[1]),
+                        "timebase":timebase,
+                        "t0_index":t0_index,
+                        "frame_len_samples":action_template.frame_len_samples,
+                        "slot_offset_samples":action_template.offset_samples,
                         }
-        
-        # get all the parameters needed for computing each slot in frame_config
-        
-        if "rf_freq" in action:
-            rf_freq = action["rf_freq"]
-        else:
-            rf_freq = self.rf_freq
-        
-        # get the list of gains per slot
-        act_slots = action["slots"]
-        gains = [ self.gains[(s.owner, s.type)] for s in act_slots]  
-        
-         
-        slots = [SlotParamTuple(owner=s.owner, len=s.len, offset=s.offset, type=s.type,
-                                rf_freq=rf_freq, bb_freq=s.bb_freq, bw=self.slot_bw,
-                                tx_gain=gain) for gain, s in zip(gains, act_slots)]
-        
-        frame_config["slots"] = slots
-
-        for s in slots:
-            if s.type == "beacon":
-                pass
-                #print ("frame at time %s beacon slot at offset %f fr freq %f and "
-                #       +"channel %f")%(frame_config["t0"], s.offset, s.rf_freq, s.bb_freq)
        
         return frame_config
 
@@ -604,7 +647,53 @@ class PatternFrameSchedule(FrameScheduleBase):
         '''
         Update the gain setting for the current and next schedules by owner and link type
         '''    
-        self.gains[(owner, linktype)] = gain   
+        link = (owner, linktype)
+        
+        # the power controller sets every gain each frame, but most of those don't
+        # change anything, so only throw out the frame templates when one does
+        if link not in self.gains or self.gains[link] != gain:
+            self._frame_templates.clear()
+            
+        self.gains[link] = gain   
+        
+    def _get_frame_template(self, action_ind):
+        '''
+        Get the (frame_len, slots) tuple for an action, building it from the compiled
+        action template and the current gains if it isn't cached
+        '''
+        action_template = self._action_templates[action_ind]
+        
+        cached = self._frame_templates.get(action_ind)
+        # the action space may have been stored again since this was cached
+        if cached is not None and cached[2] is action_template:
+            return cached
+        
+        if action_template.rf_freq is not None:
+            rf_freq = action_template.rf_freq
+        else:
+            rf_freq = self.rf_freq
+            
+        slots = tuple(SlotParamTuple(owner=s.owner, len=s.len, offset=s.offset, 
+                                     type=s.type, rf_freq=rf_freq, bb_freq=s.bb_freq, 
+                                     bw=self.slot_bw, tx_gain=self.gains[(s.owner, s.type)]) 
+                      for s in action_template.slots)
+        
+        frame_template = (action_template.frame_len, slots, action_template)
+        self._frame_templates[action_ind] = frame_template
+        
+        return frame_template
+    
+    def _get_timebase(self, time_ref):
+        '''
+        Get the sample timebase referenced to a schedule state's time_ref, building it 
+        if it isn't cached
+        '''
+        timebase = self._timebases.get(time_ref)
+        if timebase is None or timebase.fs != self._action_fs:
+            timebase = sample_timebase(self._action_fs, time_ref)
+            self._timebases[time_ref] = timebase
+            
+        return timebase
                 
     
     def get_unique_links(self, frame_num):
@@ -654,6 +743,9 @@ class PatternFrameSchedule(FrameScheduleBase):
         try:
             
             inst_vars = self.__dict__.copy()
+            # frame templates and timebases are rebuilt on demand, so don't send them
+            inst_vars.pop("_frame_templates", None)
+            inst_vars.pop("_timebases", None)
             inst_vars["schedule_seq"] = list(inst_vars["schedule_seq"])
             inst_vars["gains"] = dict(inst_vars["gains"])
             temp_tup = self.varTup(**inst_vars)
@@ -683,6 +775,8 @@ class PatternFrameSchedule(FrameScheduleBase):
                                                  key=itemgetter(2))
             self.gains = defaultdict(self.constant_factory(self.tx_gain))
             self.gains.update(temp_tup.gains)
+            self._frame_templates = {}
+            self._timebases = {}
             
         except TypeError:
             raise TypeError(("The beacon class does not support adding or removing " +
@@ -691,7 +785,8 @@ class PatternFrameSchedule(FrameScheduleBase):
     def __cmp__(self, other):
         simp_vals_equal = all([ self.__dict__[key] == val for key,val 
                                in other.__dict__.iteritems() 
-                               if (key != "gains") and (key != "schedule_seq")])
+                               if key not in ("gains", "schedule_seq", "_frame_templates", 
+                                              "_timebases")])
         
         gains_equal = dict(self.__dict__["gains"]) == dict(other.__dict__["gains"])
         seq_equal = list(self.__dict__["schedule_seq"]) == list(other.__dict__["schedule_seq"])
@@ -701,7 +796,8 @@ class PatternFrameSchedule(FrameScheduleBase):
     def __eq__(self, other): 
         simp_vals_equal = all([ self.__dict__[key] == val for key,val 
                                in other.__dict__.iteritems() 
-                               if (key != "gains") and (key != "schedule_seq")])
+                               if key not in ("gains", "schedule_seq", "_frame_templates", 
+                                              "_timebases")])
         
         gains_equal = dict(self.__dict__["gains"]) == dict(other.__dict__["gains"])
         seq_equal = list(self.__dict__["schedule_seq"]) == list(other.__dict__["schedule_seq"])
@@ -752,6 +848,20 @@ class PatternFrameSchedule(FrameScheduleBase):
         abs_pattern_dir = os.path.dirname(abs_pattern_file)
         pattern_basename = os.path.basename(abs_pattern_file)
         
+        # declarative pattern set files are validated and rounded by the loader, which
+        # caches the result, so none of the checks below are needed
+        if os.path.splitext(pattern_basename)[1] == ".json":
+            try:
+                pattern_set = pattern_set_file.load_pattern_set(abs_pattern_file, set_name, fs)
+            except IOError:
+                dev_log.error("Could not read pattern file %s", abs_pattern_file)
+                raise
+            except pattern_set_file.InvalidPatternSetError, err:
+                dev_log.error("Invalid pattern set: %s", err)
+                raise
+            
+            return pattern_set
+        
         if os.path.isdir(abs_pattern_dir):
             sys.path.append(abs_pattern_dir)
         else:
@@ -864,7 +974,7 @@ class PatternFrameSchedule(FrameScheduleBase):
     
     
     @classmethod
-    def store_action_space(self, pattern_set, owner_ids, rf_freqs, **kwargs):
+    def store_action_space(self, pattern_set, owner_ids, rf_freqs, fs=None, **kwargs):
         dev_log = logging.getLogger('developer')
         
         ps_update = deepcopy(pattern_set)
@@ -909,13 +1019,39 @@ class PatternFrameSchedule(FrameScheduleBase):
         
         self.num_actions = len(self._action_space)
         
+        # compile each action into an immutable template so compute_frame doesn't have to
+        # walk the action dicts every frame
+        action_templates = []
+        for action in self._action_space:
+            slots = tuple(self.PatternTuple(owner=s.owner, len=s.len, offset=s.offset, 
+                                            type=s.type, bb_freq=s.bb_freq) 
+                          for s in action["slots"])
+            if fs is not None:
+                frame_len_samples = int(round(action["frame_len"]*fs))
+                offset_samples = tuple(int(round(s.offset*fs)) for s in slots)
+            else:
+                frame_len_samples = None
+                offset_samples = None
+                
+            action_templates.append(self.ActionTemplate(frame_len=action["frame_len"],
+                                                        rf_freq=action.get("rf_freq"),
+                                                        slots=slots,
+                                                        frame_len_samples=frame_len_samples,
+                                                        offset_samples=offset_samples))
+        self._action_templates = tuple(action_templates)
+        
+        if fs is not None:
+            self._action_fs = float(fs)
+        else:
+            self._action_fs = None
+        
         # configure sync space
         sync_labels = ["beacon_chan", "rf_freq"]      
         sync_prod = itertools.product(beacon_chans, rf_freqs)
         self.sync_space = [dict(zip(sync_labels, action)) for action in sync_prod]
 
     def log_action_space(self):
-        action_space = deepcopy(self._action_space)
+        action_space = self.get_action_space()
         [act.update({"action_index":ind}) for ind, act in enumerate(action_space)]
         
         action_list = [{"action":act} for act in action_space]
@@ -926,7 +1062,9 @@ class PatternFrameSchedule(FrameScheduleBase):
             print xml_str
             
     def get_action_space(self):
-        action_space = deepcopy(self._action_space)
+        # slots are namedtuples, so copying each action dict and its slot list is 
+        # enough to keep callers from modifying the stored action space
+        action_space = [dict(act, slots=list(act["slots"])) for act in self._action_space]
         
         return action_space
     
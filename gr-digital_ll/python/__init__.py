@@ -75,9 +75,12 @@ from scheduled_mux import *
 import pmt_to_python # injects into pmt 
 from pmt_rpc import pmt_rpc
 import packet_utils2
+import packet_batch
 from tdma_logger import *
 #from burst_gate import *
 from eob_shifter import *
+from iq_capture import *
+from virtual_radio import *
 from version import __version__
 from command_queue_manager import *
 from power_control import *
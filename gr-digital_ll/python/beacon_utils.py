@@ -43,6 +43,7 @@ import numpy
 import digital_ll
 from digital_ll import lincolnlog
 from digital_ll import packet_utils2
+from digital_ll import receive_path_gmsk
 from digital_ll import time_spec_t
 from digital_ll.lincolnlog import dict_to_xml
 from FrameSchedule import SimpleFrameSchedule
@@ -59,7 +60,8 @@ tdma_types_to_ints = {"other":0,
                       "data":2, 
                       "keepalive":3,
                       "feedback":4,
-                      "dummy":5}    
+                      "dummy":5,
+                      "aggregate":6}    
 
 
 # define the header format
@@ -125,6 +127,11 @@ class beacon_consumer(gr.sync_block):
         self._beacon_lock = Semaphore()
         self._sched_lock = Semaphore()
         
+        # serializes beacon callbacks when several receive paths share this consumer
+        self._callback_lock = Semaphore()
+        
+        self._wideband_sync = bool(options.beacon_sync_wideband)
+        
         self._has_sync = False
         
         self.found_time = False
@@ -179,6 +186,10 @@ class beacon_consumer(gr.sync_block):
         normal.add_option("--max-beacon-error", default=.01, type="eng_float",
                           help=("Maximum allowed magnitude of beacon timing error " +
                                 "[default=%default]"))
+        normal.add_option("--beacon-sync-wideband", default=0, type="int",
+                          help=("If 1, mobiles listen for beacons on every digital " + 
+                                "channel at once, so sync acquisition only has to " + 
+                                "search over rf frequencies [default=%default]"))
         
     # Make a static method to call before instantiation
     add_options = staticmethod(add_options)
@@ -196,6 +207,7 @@ class beacon_consumer(gr.sync_block):
                   "max_beacons": self._max_beacons,
                   "base_id":self._base_id,
                   "beacon_error_thresh":self._beacon_error_thresh,
+                  "wideband_sync":self._wideband_sync,
                   }
         logger.info(dict_to_xml(params, section_indent))
     
@@ -213,6 +225,69 @@ class beacon_consumer(gr.sync_block):
     def schedule_is_valid(self):
         return self._schedule_valid
     
+    def connect_rx_paths(self, tb, demodulator, options, rx_channelizer, scheduled_mux):
+        '''
+        Connect the receive paths that feed beacons to this consumer in top block tb,
+        and return a list of them
+        
+        A receive path on the beacon output of scheduled_mux always handles beacons 
+        while synced. With wideband sync, rx_channelizer must have been built with 
+        wideband_outputs set, and one receive path per non guard channel handles 
+        beacons until sync is acquired instead. All of the paths stay connected so 
+        their sample counts keep lining up with the rx_time tags, and each one's 
+        beacons are ignored while it isn't the one in use.
+        '''
+        if not self._wideband_sync:
+            rx_path = receive_path_gmsk(demodulator, self.beacon_callback, options,
+                                        log_index=-1, use_new_pkt=True)
+            tb.connect(scheduled_mux, rx_path)
+            return [rx_path]
+        
+        if len(options.digital_freq_hop_guard_channels) > 0:
+            guard_channels = [int(x) for x in options.digital_freq_hop_guard_channels.split(',')]
+        else:
+            guard_channels = []
+            
+        rx_paths = []
+        for chan in range(options.digital_freq_hop_num_channels):
+            if chan in guard_channels:
+                continue
+            
+            rx_path = receive_path_gmsk(demodulator, self.make_wideband_callback(chan), 
+                                        options, log_index=-1, use_new_pkt=True)
+            tb.connect((rx_channelizer, chan+1), rx_path)
+            rx_paths.append(rx_path)
+        
+        rx_path = receive_path_gmsk(demodulator, self.make_wideband_callback(None), 
+                                    options, log_index=-1, use_new_pkt=True)
+        tb.connect(scheduled_mux, rx_path)
+        rx_paths.append(rx_path)
+        
+        return rx_paths
+    
+    def make_wideband_callback(self, channel):
+        '''
+        Make a callback for one of the wideband sync receive paths. A channel number 
+        makes a callback for a receive path dedicated to that digital channel, which 
+        reports every packet as arriving on that channel and only passes beacons on 
+        while searching for sync. None makes the callback for the scheduled_mux 
+        receive path, which only passes beacons on while synced. Only one receive path 
+        is let into beacon_callback at a time.
+        '''
+        use_when_synced = channel is None
+        
+        def wideband_callback(ok, payload, timestamp, rx_channel):
+            self._callback_lock.acquire()
+            try:
+                if self._has_sync == use_when_synced:
+                    if channel is not None:
+                        rx_channel = channel
+                    self.beacon_callback(ok, payload, timestamp, rx_channel)
+            finally:
+                self._callback_lock.release()
+                
+        return wideband_callback
+    
     #@timeit
     def beacon_callback(self, ok, payload, timestamp, channel):
         
@@ -692,7 +767,9 @@ def generate_packet(packet_format, samples_per_symbol, bits_per_symbol, access_c
     return pkt
 
 def frame_config_to_xml(frame_config_in, indent_level):
-    fc = deepcopy(frame_config_in)
+    # the timebase is shared with the schedule and has nothing worth logging
+    fc = deepcopy(dict((key, val) for key, val in frame_config_in.iteritems() 
+                       if key != "timebase"))
     
     fc["t0"] = str(fc["t0"])
     for k, slot in enumerate(fc["slots"]):
@@ -136,15 +136,26 @@ class rx_channelizer(gr.hier_block2):
     """
     rx_channelizer(options, sample_rate)
     derives from gr.hier_block2
+    
+    Output 0 is the currently selected channel. If wideband_outputs is set, outputs 
+    1 through num_chan carry every digital channel, so digital channel n is on output n+1
     """
-    def __init__(self, options, dev_logger=None, digital_channel_number=0):
+    def __init__(self, options, dev_logger=None, digital_channel_number=0, 
+                 wideband_outputs=False):
+        
+        if wideband_outputs:
+            num_outputs = 1 + options.digital_freq_hop_num_channels
+        else:
+            num_outputs = 1
+        
         # Constructor
         gr.hier_block2.__init__(self, "rx_channelizer",
 		    gr.io_signature(1, 1, gr.sizeof_gr_complex), # Input signature
-	        gr.io_signature(1, 1, gr.sizeof_gr_complex)) # Output signature        
+	        gr.io_signature(num_outputs, num_outputs, gr.sizeof_gr_complex)) # Output signature        
 
         # Add the options as member variables
         self.dev_logger     = dev_logger
+        self.wideband_outputs = wideband_outputs
         self.num_chan       = options.digital_freq_hop_num_channels
         self.trans_bw       = options.rx_channelizer_transition_bandwidth
         self.att_dB         = options.rx_channelizer_attenuation_db
@@ -177,6 +188,11 @@ class rx_channelizer(gr.hier_block2):
         #self.connect((self.tagger, 0), (self.channelizer, 0))
         self.connect(self, (self.channelizer, 0))
         self.connect((self.mux, 0), self)
+        
+        # expose every channel for receivers that listen to all channels at once
+        if self.wideband_outputs:
+            for n in range(self.num_chan):
+                self.connect((self.channelizer, n), (self, n+1))
                
         #self.tag1 = tag_logger( gr.sizeof_gr_complex, '/home/g103homes/a/stahlbuhk/Desktop/beforeFB.dat' )
         #self.tag2 = tag_logger( gr.sizeof_gr_complex, '/home/g103homes/a/stahlbuhk/Desktop/afterFB.dat' )
@@ -210,6 +226,7 @@ class rx_channelizer(gr.hier_block2):
                     "channelizer_transition_bandwidth":self.trans_bw,
                     "channelizer_attenuation_db":self.att_dB,
                     "digital_channel_number":self.current_chan,
+                    "wideband_outputs":self.wideband_outputs,
                     "oversampling_rate":self.osr }
         logger.info(dict_to_xml(params, section_indent+1))   
         
@@ -49,6 +49,9 @@ class command_queue_manager(gr.basic_block):
         self.uhd_sink = uhd_sink
         self.uhd_source = uhd_source
         
+        # virtual radios share a clock that can run faster than the host clock
+        self.radio_clock = getattr(uhd_sink, "clock", None)
+        
         self.current_gain = 0.0
               
         self.reservation = threading.BoundedSemaphore(1)
@@ -99,8 +102,7 @@ class command_queue_manager(gr.basic_block):
             #current_time_spec_t_uhd_time = time_spec_t( math.floor(current_real_uhd_time), current_frac_uhd_time)
             
             #alternative to keep calling uhd time
-            t1 = time.time() - self.current_time_ahead
-            current_time_spec_t_uhd_time = time_spec_t(t1)
+            current_time_spec_t_uhd_time = self.current_radio_time()
             
             #print "current uhd time is                      %s" % current_time_spec_t_uhd_time
             #pprint(self.time_gain_tuple_list)
@@ -232,4 +234,13 @@ class command_queue_manager(gr.basic_block):
         self.statelog.info(tune_log_xml)
     
     def set_current_time_ahead(self, time_ahead):
-        self.current_time_ahead = time_ahead     
+        self.current_time_ahead = time_ahead
+
+    def current_radio_time(self):
+        '''
+        Estimate the radio's current time from the host clock, without asking the radio
+        '''
+        if self.radio_clock is not None:
+            return self.radio_clock.time_now()
+        else:
+            return time_spec_t(time.time() - self.current_time_ahead)     
@@ -0,0 +1,301 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Record received samples to disk and play them back into a receive path
+
+A capture is a raw fc32 file, the same format gr.file_sink writes, plus a sidecar
+file named <capture>.tags. The sidecar is JSON holding the number of samples in the
+capture and the rx_time, rx_rate and rx_freq tags the USRP attached to them, so a
+replay can hand the receive path the same timing information it saw live.
+
+Captures are written and read through numpy memory maps, so neither recording nor
+playback copies the samples through python more than once.
+'''
+
+# standard python library imports
+from bisect import bisect_left
+import json
+import logging
+import os
+
+# third party library imports
+from gnuradio import gr
+from gruel import pmt
+import numpy
+
+# project specific imports
+from digital_ll import time_spec_t
+
+
+# tags worth keeping with a capture
+CAPTURE_TAG_KEYS = ("rx_time", "rx_rate", "rx_freq")
+
+# grow capture files this many samples at a time
+CAPTURE_CHUNK_SAMPLES = 2**22
+
+SAMPLE_DTYPE = numpy.complex64
+
+
+def tags_file_name(file_name):
+    return file_name + ".tags"
+
+def write_capture_tags(file_name, num_samples, tags):
+    '''
+    Write the sidecar for a capture. tags is a list of (offset, key, value) tuples
+    '''
+    sidecar = {"num_samples":num_samples,
+               "tags":[{"offset":offset, "key":key, "value":value}
+                       for offset, key, value in tags]}
+
+    with open(tags_file_name(file_name), 'w') as f:
+        json.dump(sidecar, f, indent=1)
+
+def read_capture(file_name):
+    '''
+    Open a capture for reading. Returns a read only memory map of the samples and a
+    list of (offset, key, value) tag tuples sorted by offset. A capture without a
+    sidecar, such as one written by gr.file_sink, has no tags
+    '''
+    num_samples = os.path.getsize(file_name)//numpy.dtype(SAMPLE_DTYPE).itemsize
+    tags = []
+
+    if os.path.exists(tags_file_name(file_name)):
+        with open(tags_file_name(file_name), 'r') as f:
+            sidecar = json.load(f)
+
+        num_samples = min(num_samples, sidecar["num_samples"])
+
+        for tag in sidecar["tags"]:
+            # json turns tuples into lists, and rx_time seconds have to go back to
+            # being a uint64
+            key = str(tag["key"])
+            value = tag["value"]
+            if key == "rx_time":
+                value = (long(value[0]), float(value[1]))
+            elif isinstance(value, list):
+                value = tuple(value)
+            tags.append( (tag["offset"], key, value) )
+
+    tags.sort(key=lambda tag: tag[0])
+
+    if num_samples > 0:
+        samples = numpy.memmap(file_name, dtype=SAMPLE_DTYPE, mode='r',
+                               shape=(num_samples,))
+    else:
+        samples = numpy.zeros(0, dtype=SAMPLE_DTYPE)
+
+    return samples, tags
+
+def capture_sample_rate(tags):
+    '''
+    Get the sample rate from the first rx_rate tag of a capture, or None if there
+    isn't one
+    '''
+    for offset, key, value in tags:
+        if key == "rx_rate":
+            return float(value)
+    return None
+
+
+class iq_capture_sink(gr.sync_block):
+    """
+    Record a complex stream and its USRP timing tags to a capture file
+
+    The file is grown and memory mapped CAPTURE_CHUNK_SAMPLES at a time. Call close,
+    or stop the flow graph, to trim the file to the samples received and write the
+    tag sidecar.
+    """
+    def __init__(self, file_name, max_samples=0):
+        """
+        Inputs: complex stream from the USRP
+
+        file_name    (string) capture file to write
+        max_samples     (int) stop recording after this many samples. 0 records
+                              everything
+        """
+        gr.sync_block.__init__(
+            self,
+            name = "iq_capture_sink",
+            in_sig = [numpy.complex64],
+            out_sig = None
+        )
+
+        self.dev_logger = logging.getLogger('developer')
+
+        self.file_name = file_name
+        self.max_samples = int(max_samples)
+
+        self.num_samples = 0
+        self.tags = []
+        self.closed = False
+
+        self._file = open(file_name, 'w+b')
+        self._map = None
+        self._capacity = 0
+
+    def _grow(self, min_capacity):
+
+        self._capacity = max(min_capacity, self._capacity + CAPTURE_CHUNK_SAMPLES)
+
+        if self._map is not None:
+            self._map.flush()
+
+        self._file.truncate(self._capacity*numpy.dtype(SAMPLE_DTYPE).itemsize)
+        self._map = numpy.memmap(self._file, dtype=SAMPLE_DTYPE, mode='r+',
+                                 shape=(self._capacity,))
+
+    def work(self, input_items, output_items):
+
+        in0 = input_items[0]
+        nread = self.nitems_read(0) #number of items read on port 0
+        ninput_items = len(in0)
+
+        if self.closed:
+            return ninput_items
+
+        num_to_write = ninput_items
+        if self.max_samples > 0:
+            num_to_write = max(0, min(num_to_write, self.max_samples - self.num_samples))
+
+        if num_to_write > 0:
+            if self.num_samples + num_to_write > self._capacity:
+                self._grow(self.num_samples + num_to_write)
+
+            self._map[self.num_samples:self.num_samples+num_to_write] = in0[:num_to_write]
+
+            # store tag offsets relative to the start of the capture
+            tags = self.get_tags_in_range(0, nread, nread+num_to_write)
+            for tag in tags:
+                key_string = pmt.pmt_symbol_to_string(tag.key)
+                if key_string in CAPTURE_TAG_KEYS:
+                    self.tags.append( (tag.offset - nread + self.num_samples, key_string,
+                                       pmt.to_python(tag.value)) )
+
+            self.num_samples += num_to_write
+
+        return ninput_items
+
+    def close(self):
+        '''
+        Trim the capture to the samples received and write the tag sidecar
+        '''
+        if self.closed:
+            return
+        self.closed = True
+
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+
+        self._file.truncate(self.num_samples*numpy.dtype(SAMPLE_DTYPE).itemsize)
+        self._file.close()
+
+        write_capture_tags(self.file_name, self.num_samples, self.tags)
+
+        self.dev_logger.info("wrote %d samples and %d tags to capture %s",
+                             self.num_samples, len(self.tags), self.file_name)
+
+    def stop(self):
+        self.close()
+        return True
+
+    @staticmethod
+    def add_options(normal, expert):
+
+        normal.add_option("--rx-capture-file", type="string", default="",
+                          help=("Record all received samples and their timing tags to " +
+                                "this file. Leave empty to disable [default=%default]"))
+        expert.add_option("--rx-capture-max-seconds", type="float", default=0,
+                          help=("Stop recording received samples after this many " +
+                                "seconds. 0 records the whole run [default=%default]"))
+
+
+class iq_replay_source(gr.sync_block):
+    """
+    Play a capture back as fast as the flow graph will take it, reinjecting its
+    timing tags at their original offsets.
+
+    When a capture is played more than once, rx_time tags are moved forward by the
+    capture duration on each pass so time keeps increasing.
+    """
+    def __init__(self, file_name, num_passes=1):
+        """
+        Outputs: complex stream as it came out of the USRP
+
+        file_name    (string) capture file to play
+        num_passes      (int) number of times to play the capture. 0 plays it forever
+        """
+        gr.sync_block.__init__(
+            self,
+            name = "iq_replay_source",
+            in_sig = None,
+            out_sig = [numpy.complex64]
+        )
+
+        self.samples, self.tags = read_capture(file_name)
+        self.num_samples = len(self.samples)
+        self.num_passes = int(num_passes)
+
+        self.sample_rate = capture_sample_rate(self.tags)
+
+        if self.sample_rate is not None:
+            self.duration = self.num_samples/self.sample_rate
+        else:
+            self.duration = 0.0
+
+        self._tag_offsets = [tag[0] for tag in self.tags]
+        self._srcid = pmt.pmt_string_to_symbol("iq_replay_source")
+
+    def total_samples(self):
+        '''
+        Number of samples the source will produce, or None if it plays forever
+        '''
+        if self.num_passes == 0:
+            return None
+        return self.num_samples*self.num_passes
+
+    def work(self, input_items, output_items):
+
+        out = output_items[0]
+        nwritten = self.nitems_written(0)
+
+        if self.num_samples == 0:
+            return -1
+
+        pass_num = nwritten // self.num_samples
+        if self.num_passes > 0 and pass_num >= self.num_passes:
+            return -1 # done
+
+        # never cross the end of the capture in one call so each call stays in one pass
+        start = nwritten - pass_num*self.num_samples
+        num_out = min(len(out), self.num_samples - start)
+        out[:num_out] = self.samples[start:start+num_out]
+
+        first = bisect_left(self._tag_offsets, start)
+        last = bisect_left(self._tag_offsets, start+num_out)
+
+        for offset, key, value in self.tags[first:last]:
+            if key == "rx_time" and pass_num > 0:
+                value = (time_spec_t(value) + pass_num*self.duration).to_tuple()
+
+            self.add_item_tag(0, nwritten + offset - start,
+                              pmt.pmt_string_to_symbol(key), pmt.from_python(value),
+                              self._srcid)
+
+        return num_out
@@ -441,12 +441,14 @@ class ofdm_demod(gr.hier_block2):
 
 
 class _queue_watcher_thread(_threading.Thread):
-    def __init__(self, rcvd_pktq, callback, use_coding, coding_block_length, adaptive_coding, rfcenterfreq, bandwidth, logging):
+    def __init__(self, rcvd_pktq, callback, use_coding, coding_block_length, adaptive_coding, rfcenterfreq, bandwidth, logging,
+                 max_batch=32):
         _threading.Thread.__init__(self)
         self.setDaemon(1)
         self.rcvd_pktq = rcvd_pktq
         self.callback = callback
         self.keep_running = True
+        self._max_batch = max_batch
         self.start()
         self._use_coding = use_coding
         self._rfcenterfreq = rfcenterfreq
@@ -457,15 +459,22 @@ class _queue_watcher_thread(_threading.Thread):
 
     def run(self):
         while self.keep_running:
-            msg = self.rcvd_pktq.delete_head()
+            # wait for a packet, then decode it along with whatever else is already 
+            # queued behind it
+            msgs = [self.rcvd_pktq.delete_head()]
+            while len(msgs) < self._max_batch and self.rcvd_pktq.count() > 0:
+                msgs.append(self.rcvd_pktq.delete_head())
+                
+            pkts = [msg.to_string() for msg in msgs]
             if self._adaptive_coding_enabled:
-                ok, payload = digital_ll.ofdm_packet_util.unmake_packet(msg.to_string(), self._use_coding, -1,
+                decoded = digital_ll.ofdm_packet_util.unmake_packets(pkts, self._use_coding, -1,
                 self._rfcenterfreq, self._bandwidth, self._logging)
             else:
-                ok, payload = digital_ll.ofdm_packet_util.unmake_packet(msg.to_string(), self._use_coding, self._coding_block_length,
+                decoded = digital_ll.ofdm_packet_util.unmake_packets(pkts, self._use_coding, self._coding_block_length,
                 self._rfcenterfreq, self._bandwidth, self._logging)
-            if self.callback:
-                self.callback(ok, payload)
+            for ok, payload in decoded:
+                if self.callback:
+                    self.callback(ok, payload)
 
 # Generating known symbols with:
 # i = [2*random.randint(0,1)-1 for i in range(4512)]
@@ -49,6 +49,7 @@ import time
 from digital_ll import lincolnlog
 import struct
 import digital_ll
+import packet_batch
 
 def conv_packed_binary_string_to_1_0_string(s):
     """
@@ -108,17 +109,7 @@ def string_to_hex_list(s):
 
 
 def whiten(s, o):
-    sa = numpy.fromstring(s, numpy.uint8)
-    
-    try:
-        z = sa ^ random_mask_vec8[o:len(sa)+o]
-        success=True
-        
-    except ValueError as err:
-        success=False
-        z=sa
-                
-    return z.tostring(), success
+    return packet_batch.whiten(s, o, random_mask_vec8)
 
 def dewhiten(s, o):
     return whiten(s, o)        # self inverse
@@ -153,72 +144,14 @@ def make_packet(payload, samples_per_symbol, bits_per_symbol,
     if not whitener_offset >=0 and whitener_offset < 16:
         raise ValueError, "whitener_offset must be between 0 and 15, inclusive (%i)" % (whitener_offset,)
 
-    payload_with_crc = digital.crc.gen_and_append_crc32(payload)
+    payload_with_crc = packet_batch.gen_and_append_crc32(payload)
     #print "outbound crc =", string_to_hex_list(payload_with_crc[-4:])
 
-    # get info to record the packet transmit event
-    (pktno,) = struct.unpack('!H', payload[0:2])
-    (pad_bytes,) = struct.unpack('!H', payload[2:4])
-    (tx_id,) = struct.unpack('!H', payload[4:6])
-    (rx_id,) = struct.unpack('!H', payload[6:8])
-    (pcktcode,) = struct.unpack('!H', payload[8:10])
-    (phycode,) = struct.unpack('!H', payload[10:12])
-    (maccode,) = struct.unpack('!H', payload[12:14])
-
-    if use_coding:
-
-        #Use coding and interleaving
-        #Apply Reed-Solomon Code
-        if use_adaptive_coding:
-            packet_int_types = digital_ll.Payload_Packet.packet_types_to_ints()
-            if pcktcode == packet_int_types['DATA']:
-                # This is a data packet. Send it at the adapted rate.
-                # Coding block length is a dictionary indexed by to_whom id (as string)
-                if str(rx_id) in coding_block_length:
-                    N = coding_block_length[str(rx_id)]
-                else:
-                    # For some reason we don't know who this is. Print a warning and set block size to some default.
-                    print "Warning: We are generating packets for", rx_id, "but the coding rate doesn't know who that is"
-                    N = 8
-            else:
-                # This is a control packet (ie, RTS, CTS, ACK, etc.). Code it at a very low rate
-                N = 16
-        else:
-            # Coding block length in this case is an integer number
-            N = coding_block_length
-        K = 4
-        rs_encoder = Codec(N,K)
-        payload_with_crc_and_rs = ''
-        for n in range(0, len(payload_with_crc), K):
-            payload_with_crc_and_rs = payload_with_crc_and_rs + rs_encoder.encode(payload_with_crc[n:n+K])
-
-        #Interleave the RS symbols to put distance between the symbols under the same RS code
-        payload_with_crc_and_rs_interleaved = ''
-        for n in range(0, N, 1):
-            payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved + payload_with_crc_and_rs[n:len(payload_with_crc_and_rs):N]
-            
-        #We will also add a coding rate field (which itself will be encoded but at a fixed rate)
-        #which specifies at what rate the rest of this packet was encoded at.
-        code_rate = struct.pack('!H', N)
-        rs_fixed_encoder = Codec(8,2)
-        code_rate_encoded = rs_fixed_encoder.encode(code_rate)
-        payload_with_crc_and_rs_interleaved = code_rate_encoded + payload_with_crc_and_rs_interleaved
-        
-    else:
-        # Skip coding and interleaving (although the variable name kind of indicates otherwise)
-        N = 4
-        K = 4
-        payload_with_crc_and_rs_interleaved = payload_with_crc
-
-    # Record the transmit event
-    loginfo = {'direction' : 'transmit', 'packetid' : pktno,'timestamp' : '%0.50g' % time.time(), \
-     'messagelength' : len(payload), 'toID' : rx_id, 'fromID' : tx_id, \
-     'pktCode' : pcktcode, 'phyCode' : phycode, 'macCode' : maccode, 'codingmessagelength': K, 'codingblocklength': N, \
-     'bandwidth' : bandwidth, 'rfcenterfreq' : rfcenterfreq, 'frequency' : 0,
-     'percentBwOccupied':percent_bw_occupied}
-    if logging != -1:
-        # if logging not -1 then we have logging enabled
-        logging.packet(loginfo)
+    payload_with_crc_and_rs_interleaved = _code_payload(payload, payload_with_crc, use_coding,
+                                                        coding_block_length, 
+                                                        use_adaptive_coding, rfcenterfreq,
+                                                        bandwidth, logging, 
+                                                        percent_bw_occupied)
 
     L = len(payload_with_crc_and_rs_interleaved)
     MAXLEN = len(random_mask_tuple)
@@ -287,65 +220,15 @@ def unmake_packet(whitened_payload_with_crc, use_coding=False, coding_block_leng
     # check if dewhitening failed
     if success:
 
-        if use_coding:
-    
-            # Reed Solomon Variables
-            # NOTE: A coding_block_length == -1 means we are using adaptive decoding.
-            # In this case, the code rate field (first 8 bytes of message) is used to
-            # determine at what code rate the rest of the packet was transmitted at.
-            N = coding_block_length
-            K = 4
-            assert N >= K or N == -1, "The Reed Solomon block length must be greater than the message length"
-    
-            # Strip the code rate from the packet
-            # We will use this to decode the message if we have adaptive decoding.
-            if len(payload_with_crc_and_rs_interleaved) >= 8:
-                code_rate = payload_with_crc_and_rs_interleaved[0:8]
-                payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved[8:]
-                rs_fixed_encoder = Codec(8,2)
-                try:
-                    code_rate = rs_fixed_encoder.decode(code_rate)
-                except:
-                    ok = False
-                    payload = '0'*K
-                    return ok, payload
-                (code_rate,) = struct.unpack('!H', code_rate[0])
-                if N == -1:
-                    # We will use -1 to imply that we are using the code_rate field
-                    N = code_rate
-                if N < K:
-                    # This code rate makes no sense. Don't use it.
-                    ok = False
-                    payload = '0'*K
-                    return ok, payload
-            else:
-                ok = False
-                payload = '0'*K
-                return ok, payload
-    
-            #De-interleave
-            payload_with_crc_and_rs = ''
-            for n in range(0, len(payload_with_crc_and_rs_interleaved)/N, 1):
-                payload_with_crc_and_rs = payload_with_crc_and_rs + payload_with_crc_and_rs_interleaved[n:len(payload_with_crc_and_rs_interleaved):len(payload_with_crc_and_rs_interleaved)/N]
+        payload_with_crc, rs_ok, N, K = _decode_payload(payload_with_crc_and_rs_interleaved,
+                                                        use_coding, coding_block_length)
+        if payload_with_crc is None:
+            # the code rate field was unusable
+            ok = False
+            payload = '0'*K
+            return ok, payload
     
-            #Reed-Solomon Decode
-            rs_encoder = Codec(N,K)
-            payload_with_crc = ''
-            rs_ok = True
-            for n in range(0, len(payload_with_crc_and_rs), N):
-                try:
-                    decoded = rs_encoder.decode(payload_with_crc_and_rs[n:n+N]);
-                except:
-                    decoded = ('0'*K,)
-                    rs_ok = False
-                payload_with_crc = payload_with_crc + decoded[0]      
-        else:
-            N = 4
-            K = 4
-            payload_with_crc = payload_with_crc_and_rs_interleaved
-            rs_ok = True
-    
-        ok, payload = digital.crc.check_crc32(payload_with_crc)
+        ok, payload = packet_batch.check_crc32(payload_with_crc)
         ok = ok & rs_ok
         
         
@@ -362,6 +245,148 @@ def unmake_packet(whitened_payload_with_crc, use_coding=False, coding_block_leng
 
 
     # Record the results
+    _log_received(payload, ok, rs_ok, N, K, use_coding, rfcenterfreq, bandwidth, logging)
+
+    return ok, payload
+
+
+def _code_payload(payload, payload_with_crc, use_coding, coding_block_length, 
+                  use_adaptive_coding, rfcenterfreq, bandwidth, logging, 
+                  percent_bw_occupied):
+    """
+    Reed-Solomon encode and interleave a payload with its CRC if use_coding is set,
+    and log the transmit event
+    """
+    # get info to record the packet transmit event
+    (pktno,) = struct.unpack('!H', payload[0:2])
+    (pad_bytes,) = struct.unpack('!H', payload[2:4])
+    (tx_id,) = struct.unpack('!H', payload[4:6])
+    (rx_id,) = struct.unpack('!H', payload[6:8])
+    (pcktcode,) = struct.unpack('!H', payload[8:10])
+    (phycode,) = struct.unpack('!H', payload[10:12])
+    (maccode,) = struct.unpack('!H', payload[12:14])
+
+    if use_coding:
+
+        #Use coding and interleaving
+        #Apply Reed-Solomon Code
+        if use_adaptive_coding:
+            packet_int_types = digital_ll.Payload_Packet.packet_types_to_ints()
+            if pcktcode == packet_int_types['DATA']:
+                # This is a data packet. Send it at the adapted rate.
+                # Coding block length is a dictionary indexed by to_whom id (as string)
+                if str(rx_id) in coding_block_length:
+                    N = coding_block_length[str(rx_id)]
+                else:
+                    # For some reason we don't know who this is. Print a warning and set block size to some default.
+                    print "Warning: We are generating packets for", rx_id, "but the coding rate doesn't know who that is"
+                    N = 8
+            else:
+                # This is a control packet (ie, RTS, CTS, ACK, etc.). Code it at a very low rate
+                N = 16
+        else:
+            # Coding block length in this case is an integer number
+            N = coding_block_length
+        K = 4
+        rs_encoder = Codec(N,K)
+        payload_with_crc_and_rs = ''
+        for n in range(0, len(payload_with_crc), K):
+            payload_with_crc_and_rs = payload_with_crc_and_rs + rs_encoder.encode(payload_with_crc[n:n+K])
+
+        #Interleave the RS symbols to put distance between the symbols under the same RS code
+        payload_with_crc_and_rs_interleaved = ''
+        for n in range(0, N, 1):
+            payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved + payload_with_crc_and_rs[n:len(payload_with_crc_and_rs):N]
+            
+        #We will also add a coding rate field (which itself will be encoded but at a fixed rate)
+        #which specifies at what rate the rest of this packet was encoded at.
+        code_rate = struct.pack('!H', N)
+        rs_fixed_encoder = Codec(8,2)
+        code_rate_encoded = rs_fixed_encoder.encode(code_rate)
+        payload_with_crc_and_rs_interleaved = code_rate_encoded + payload_with_crc_and_rs_interleaved
+        
+    else:
+        # Skip coding and interleaving (although the variable name kind of indicates otherwise)
+        N = 4
+        K = 4
+        payload_with_crc_and_rs_interleaved = payload_with_crc
+
+    # Record the transmit event
+    loginfo = {'direction' : 'transmit', 'packetid' : pktno,'timestamp' : '%0.50g' % time.time(), \
+     'messagelength' : len(payload), 'toID' : rx_id, 'fromID' : tx_id, \
+     'pktCode' : pcktcode, 'phyCode' : phycode, 'macCode' : maccode, 'codingmessagelength': K, 'codingblocklength': N, \
+     'bandwidth' : bandwidth, 'rfcenterfreq' : rfcenterfreq, 'frequency' : 0,
+     'percentBwOccupied':percent_bw_occupied}
+    if logging != -1:
+        # if logging not -1 then we have logging enabled
+        logging.packet(loginfo)
+
+    return payload_with_crc_and_rs_interleaved
+
+def _decode_payload(payload_with_crc_and_rs_interleaved, use_coding, coding_block_length):
+    """
+    De-interleave and Reed-Solomon decode a payload if use_coding is set. 
+    Return (payload_with_crc, rs_ok, N, K). payload_with_crc is None if the code rate
+    field can't be used
+    """
+    if use_coding:
+
+        # Reed Solomon Variables
+        # NOTE: A coding_block_length == -1 means we are using adaptive decoding.
+        # In this case, the code rate field (first 8 bytes of message) is used to
+        # determine at what code rate the rest of the packet was transmitted at.
+        N = coding_block_length
+        K = 4
+        assert N >= K or N == -1, "The Reed Solomon block length must be greater than the message length"
+
+        # Strip the code rate from the packet
+        # We will use this to decode the message if we have adaptive decoding.
+        if len(payload_with_crc_and_rs_interleaved) >= 8:
+            code_rate = payload_with_crc_and_rs_interleaved[0:8]
+            payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved[8:]
+            rs_fixed_encoder = Codec(8,2)
+            try:
+                code_rate = rs_fixed_encoder.decode(code_rate)
+            except:
+                return None, False, N, K
+            (code_rate,) = struct.unpack('!H', code_rate[0])
+            if N == -1:
+                # We will use -1 to imply that we are using the code_rate field
+                N = code_rate
+            if N < K:
+                # This code rate makes no sense. Don't use it.
+                return None, False, N, K
+        else:
+            return None, False, N, K
+
+        #De-interleave
+        payload_with_crc_and_rs = ''
+        for n in range(0, len(payload_with_crc_and_rs_interleaved)/N, 1):
+            payload_with_crc_and_rs = payload_with_crc_and_rs + payload_with_crc_and_rs_interleaved[n:len(payload_with_crc_and_rs_interleaved):len(payload_with_crc_and_rs_interleaved)/N]
+
+        #Reed-Solomon Decode
+        rs_encoder = Codec(N,K)
+        payload_with_crc = ''
+        rs_ok = True
+        for n in range(0, len(payload_with_crc_and_rs), N):
+            try:
+                decoded = rs_encoder.decode(payload_with_crc_and_rs[n:n+N]);
+            except:
+                decoded = ('0'*K,)
+                rs_ok = False
+            payload_with_crc = payload_with_crc + decoded[0]      
+    else:
+        N = 4
+        K = 4
+        payload_with_crc = payload_with_crc_and_rs_interleaved
+        rs_ok = True
+
+    return payload_with_crc, rs_ok, N, K
+
+def _log_received(payload, ok, rs_ok, N, K, use_coding, rfcenterfreq, bandwidth, logging):
+    """
+    Log the receive event for a decoded packet
+    """
     if len(payload) >= 2:
         (pktno,) = struct.unpack('!H', payload[0:2])
     else:
@@ -401,8 +426,119 @@ def unmake_packet(whitened_payload_with_crc, use_coding=False, coding_block_leng
         # if logging not -1 then we have logging enabled
         logging.packet(loginfo)
 
+def make_packets(payloads, samples_per_symbol, bits_per_symbol,
+                 pad_for_usrp=True, use_coding=False, coding_block_length=8, 
+                 use_adaptive_coding=False, rfcenterfreq=-1, bandwidth=-1, logging = -1, 
+                 whitener_offsets=0, whitening=True, percent_bw_occupied=0):
+    """
+    Build a list of packets in one pass. Same as calling make_packet on each payload,
+    but the CRCs and whitening are done for all the payloads at once by packet_batch
 
-    return ok, payload
+    @param payloads:              list of packet payloads, each len [0, 4096]
+    @param whitener_offsets       offset into whitener string to use [0-16), either
+                                  one for all the packets or a sequence with one per
+                                  packet
+    
+    See make_packet for the rest of the parameters
+    """
+    whitener_offsets = numpy.zeros(len(payloads), dtype=numpy.int64) + whitener_offsets
+    if numpy.any((whitener_offsets < 0) | (whitener_offsets >= 16)):
+        raise ValueError, "whitener_offsets must be between 0 and 15, inclusive (%s)" % (whitener_offsets,)
+
+    buf, offsets = packet_batch.pack_payloads(payloads)
+    buf, offsets = packet_batch.append_crc32_batch(buf, offsets)
+    
+    MAXLEN = len(random_mask_tuple)
+    pkt_hds = []
+    pkt_dts = []
+    for payload, payload_with_crc, o in zip(payloads, 
+                                            packet_batch.unpack_payloads(buf, offsets),
+                                            whitener_offsets.tolist()):
+        payload_with_crc_and_rs_interleaved = _code_payload(payload, payload_with_crc, 
+                                                            use_coding, 
+                                                            coding_block_length,
+                                                            use_adaptive_coding, 
+                                                            rfcenterfreq, bandwidth, 
+                                                            logging, 
+                                                            percent_bw_occupied)
+        L = len(payload_with_crc_and_rs_interleaved)
+        if L > MAXLEN:
+            raise ValueError, "len(payload) must be in [0, %d]" % (MAXLEN,)
+        
+        pkt_hd = make_header(L, o)
+        pkt_dt = ''.join((payload_with_crc_and_rs_interleaved, '\x55'))
+        packet_length = len(pkt_hd) + len(pkt_dt)
+    
+        if pad_for_usrp:
+            usrp_packing = _npadding_bytes(packet_length, samples_per_symbol, bits_per_symbol) * '\x55'
+            pkt_dt = pkt_dt + usrp_packing
+            
+        pkt_hds.append(pkt_hd)
+        pkt_dts.append(pkt_dt)
+        
+    # the headers aren't whitened, so only the rest of each packet goes in the batch
+    if whitening:
+        buf, offsets = packet_batch.pack_payloads(pkt_dts)
+        buf, success = packet_batch.whiten_batch(buf, offsets, whitener_offsets, 
+                                                 random_mask_vec8)
+        pkt_dts = packet_batch.unpack_payloads(buf, offsets)
+        
+    return [pkt_hd + pkt_dt for pkt_hd, pkt_dt in zip(pkt_hds, pkt_dts)]
+
+def unmake_packets(whitened_payloads_with_crc, use_coding=False, coding_block_length=8, 
+                   rfcenterfreq=-1, bandwidth=-1, logging = -1, whitener_offsets=0, 
+                   dewhitening=1):
+    """
+    Return a list of (ok, payload), one for each of whitened_payloads_with_crc. Same 
+    as calling unmake_packet on each packet, but the dewhitening and CRC checks are 
+    done for all the packets at once by packet_batch
+
+    @param whitened_payloads_with_crc: list of strings
+    @param whitener_offsets: either one whitener offset for all the packets or a 
+                             sequence with one per packet
+    """
+    num_pkts = len(whitened_payloads_with_crc)
+    buf, offsets = packet_batch.pack_payloads(whitened_payloads_with_crc)
+    
+    if dewhitening:
+        buf, success = packet_batch.dewhiten_batch(buf, offsets, whitener_offsets, 
+                                                   random_mask_vec8)
+    else:
+        success = numpy.ones(num_pkts, dtype=bool)
+    
+    # decode everything that dewhitened and has a usable code rate, then check all 
+    # of their CRCs at once. Each result is (ok, payload, (rs_ok, N, K)), where the
+    # last field is None for packets that don't get logged
+    results = [None]*num_pkts
+    decoded = []
+    for k, payload_with_crc_and_rs_interleaved in enumerate(
+                                            packet_batch.unpack_payloads(buf, offsets)):
+        if not success[k]:
+            results[k] = (False, '', (False, None, None))
+            continue
+        
+        payload_with_crc, rs_ok, N, K = _decode_payload(payload_with_crc_and_rs_interleaved,
+                                                        use_coding, coding_block_length)
+        if payload_with_crc is None:
+            # the code rate field was unusable
+            results[k] = (False, '0'*K, None)
+        else:
+            decoded.append( (k, payload_with_crc, (rs_ok, N, K)) )
+            
+    buf, offsets = packet_batch.pack_payloads([d[1] for d in decoded])
+    crc_ok, buf, offsets = packet_batch.check_crc32_batch(buf, offsets)
+    
+    for (k, payload_with_crc, coding), crc_pass, payload in zip(decoded, crc_ok.tolist(),
+                                        packet_batch.unpack_payloads(buf, offsets)):
+        results[k] = (crc_pass & coding[0], payload, coding)
+        
+    for ok, payload, coding in results:
+        if coding is not None:
+            rs_ok, N, K = coding
+            _log_received(payload, ok, rs_ok, N, K, use_coding, rfcenterfreq, bandwidth, 
+                          logging)
+            
+    return [(ok, payload) for ok, payload, coding in results]
 
 
 # FYI, this PN code is the output of a 15-bit LFSR
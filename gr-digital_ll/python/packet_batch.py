@@ -0,0 +1,186 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Whitening and CRC32 over batches of packets
+
+A batch is a uint8 array holding the packets back to back and an int array of
+num_packets+1 offsets, where packet k is buf[offsets[k]:offsets[k+1]]. Whitening a
+batch is a single XOR against the whitener mask. CRCs use zlib's table driven CRC32,
+which is the same CRC-32 as gnuradio.digital.crc, run over views of one buffer, and
+appending or stripping them is done for the whole batch at once.
+
+The single packet functions at the end are drop in replacements for
+gnuradio.digital.crc and the whiten functions in the packet utilities. They skip
+the batch bookkeeping, which costs more than it saves for one packet.
+'''
+
+# standard python library imports
+import struct
+import zlib
+
+# third party library imports
+import numpy
+
+# project specific imports
+
+
+# CRC32 is appended to each packet as 4 bytes in network byte order
+CRC_LEN = 4
+
+
+def pack_payloads(payloads):
+    '''
+    Make a batch out of a list of strings. Returns (buf, offsets)
+    '''
+    lens = numpy.array([len(p) for p in payloads], dtype=numpy.int64)
+    offsets = numpy.zeros(len(payloads)+1, dtype=numpy.int64)
+    numpy.cumsum(lens, out=offsets[1:])
+
+    if offsets[-1] > 0:
+        buf = numpy.fromstring(''.join(payloads), numpy.uint8)
+    else:
+        buf = numpy.zeros(0, numpy.uint8)
+
+    return buf, offsets
+
+def unpack_payloads(buf, offsets):
+    '''
+    Split a batch back into a list of strings
+    '''
+    s = buf.tostring()
+    return [s[offsets[k]:offsets[k+1]] for k in range(len(offsets)-1)]
+
+def whiten_batch(buf, offsets, whitener_offsets, mask):
+    '''
+    XOR each packet in a batch with mask, starting whitener_offsets bytes into mask.
+
+    whitener_offsets is either one offset for every packet or an offset per packet.
+    Returns the whitened buffer and a bool array that is False for packets that run
+    past the end of mask. Those packets are passed through unchanged.
+    '''
+    num_pkts = len(offsets)-1
+    lens = numpy.diff(offsets)
+    whitener_offsets = numpy.zeros(num_pkts, dtype=numpy.int64) + whitener_offsets
+
+    success = (whitener_offsets >= 0) & (whitener_offsets + lens <= len(mask))
+
+    # line up a slice of the mask with every packet, then whiten them all at once
+    no_mask = numpy.zeros(lens.max() if num_pkts else 0, numpy.uint8)
+    mask_slices = [mask[o:o+n] if ok else no_mask[:n]
+                   for o, n, ok in zip(whitener_offsets.tolist(), lens.tolist(),
+                                       success.tolist())]
+
+    out = buf[offsets[0]:offsets[-1]].copy()
+    if len(out) > 0:
+        out ^= numpy.concatenate(mask_slices)
+
+    return out, success
+
+def dewhiten_batch(buf, offsets, whitener_offsets, mask):
+    return whiten_batch(buf, offsets, whitener_offsets, mask) # self inverse
+
+def _crc32_ranges(data, starts, ends):
+    '''
+    CRC32 of data[starts[k]:ends[k]] for each k, as a uint32 array
+    '''
+    return numpy.array([zlib.crc32(buffer(data, start, end-start)) & 0xffffffff
+                        for start, end in zip(starts.tolist(), ends.tolist())],
+                       dtype=numpy.uint32)
+
+def crc32_batch(buf, offsets):
+    '''
+    Get the CRC32 of each packet in a batch
+    '''
+    return _crc32_ranges(buf.tostring(), offsets[:-1], offsets[1:])
+
+def append_crc32_batch(buf, offsets):
+    '''
+    Append the CRC32 of each packet to the packet. Returns the new (buf, offsets)
+    '''
+    num_pkts = len(offsets)-1
+    crcs = crc32_batch(buf, offsets)
+
+    crc_bytes = crcs.astype('>u4').view(numpy.uint8)
+    out = numpy.insert(buf[offsets[0]:offsets[-1]], 
+                       numpy.repeat(offsets[1:] - offsets[0], CRC_LEN), crc_bytes)
+
+    new_offsets = offsets - offsets[0] + CRC_LEN*numpy.arange(num_pkts+1)
+
+    return out, new_offsets
+
+def check_crc32_batch(buf, offsets):
+    '''
+    Check and strip the CRC32 at the end of each packet in a batch.
+
+    Returns a bool array of which packets passed and the (buf, offsets) of the
+    packets with their CRCs removed. Packets too short to hold a CRC fail and come
+    back empty.
+    '''
+    lens = numpy.diff(offsets)
+    has_crc = lens >= CRC_LEN
+    starts = offsets[:-1]
+    ends = numpy.where(has_crc, offsets[1:] - CRC_LEN, starts)
+
+    actual = _crc32_ranges(buf.tostring(), starts, ends)
+
+    crc_inds = (ends[has_crc,numpy.newaxis] + numpy.arange(CRC_LEN)).ravel()
+    expected = numpy.zeros(len(lens), dtype=numpy.uint32)
+    expected[has_crc] = buf[crc_inds].view('>u4')
+
+    ok = has_crc & (actual == expected)
+
+    # drop the crcs, and drop packets too short for a crc entirely
+    drop_inds = [crc_inds]
+    drop_inds.extend(numpy.arange(start, end) for start, end in 
+                     zip(starts[~has_crc].tolist(), offsets[1:][~has_crc].tolist()))
+
+    new_buf = numpy.delete(buf[offsets[0]:offsets[-1]], 
+                           numpy.concatenate(drop_inds) - offsets[0])
+    new_offsets = numpy.zeros(len(offsets), dtype=numpy.int64)
+    numpy.cumsum(ends - starts, out=new_offsets[1:])
+
+    return ok, new_buf, new_offsets
+
+def gen_and_append_crc32(s):
+    '''
+    Append the CRC32 of string s to s
+    '''
+    return s + struct.pack('>I', zlib.crc32(s) & 0xffffffff)
+
+def check_crc32(s):
+    '''
+    Check and strip the CRC32 at the end of string s. Returns (ok, payload)
+    '''
+    if len(s) < CRC_LEN:
+        return False, ''
+
+    payload = s[:-CRC_LEN]
+    (expected,) = struct.unpack('>I', s[-CRC_LEN:])
+    return (zlib.crc32(payload) & 0xffffffff) == expected, payload
+
+def whiten(s, o, mask):
+    '''
+    Whiten string s starting o bytes into mask. Returns (whitened string, success),
+    and passes s through unchanged if it runs past the end of mask
+    '''
+    sa = numpy.fromstring(s, numpy.uint8)
+    if o < 0 or o + len(sa) > len(mask):
+        return s, False
+
+    return (sa ^ mask[o:o+len(sa)]).tostring(), True
@@ -105,6 +105,9 @@ class packet_framer(gr.sync_block):
 #        self.in_packets = Queue()
         self.in_packets = deque()
         
+        # (meta, packet) pairs that have been built but not sent yet
+        self._framed = deque()
+        
         self.message_port_register_in(self.IN_PORT)
         self.set_msg_handler(self.IN_PORT, self.handle_pdu)
         
@@ -172,11 +175,11 @@ class packet_framer(gr.sync_block):
         item_index = 0
         
         while not len(self._pkt):
-#            try: meta, payload = self.in_packets.get(True,.1)
+            if not self._framed:
+                self.frame_queued_packets()
+                
             try: 
-                meta, payload = self.in_packets.popleft()
-                if len(payload) == 0:
-                    payload = ""
+                meta, pkt = self._framed.popleft()
             
             # FIXME meta["frequency"] will be baseband frequency. 
             except IndexError: 
@@ -201,23 +204,11 @@ class packet_framer(gr.sync_block):
                 #print payload
                 self.has_tx_time = False
             
-            pkt = packet_utils2.make_packet(payload, 
-                                            self._samples_per_symbol, 
-                                            self._bits_per_symbol,
-                                            None, # options
-                                            self._access_code,
-                                            False, #pad_for_usrp 
-                                            self._use_coding,
-                                            None, # logging
-                                            self._whitener_offset)   
-
             # add any metadata params that don't belong in the over the air packet
             meta["direction"] = "transmit" # packet framer is always in transmit direction
             meta["messagelength"] = len(pkt)
              
             self._pkt = numpy.fromstring(pkt, numpy.uint8)
-            if self._use_whitener_offset:
-                self._whitener_offset = (self._whitener_offset + 1) % 16
 
             #shouldn't really need to send start of burst
             #only need to do sob if looking for timed transactions
@@ -288,6 +279,46 @@ class packet_framer(gr.sync_block):
             return item_index + num_items
     
     
+    def frame_queued_packets(self):
+        '''
+        Build every packet waiting in in_packets at once, so their CRCs and whitening
+        are done as one batch
+        '''
+        metas = []
+        payloads = []
+        while True:
+            try:
+                meta, payload = self.in_packets.popleft()
+            except IndexError:
+                break
+            
+            if len(payload) == 0:
+                payload = ""
+            metas.append(meta)
+            payloads.append(payload)
+            
+        if len(payloads) == 0:
+            return
+        
+        if self._use_whitener_offset:
+            whitener_offsets = [(self._whitener_offset + k) % 16 
+                                for k in range(len(payloads))]
+            self._whitener_offset = (self._whitener_offset + len(payloads)) % 16
+        else:
+            whitener_offsets = self._whitener_offset
+        
+        pkts = packet_utils2.make_packets(payloads, 
+                                          self._samples_per_symbol, 
+                                          self._bits_per_symbol,
+                                          None, # options
+                                          self._access_code,
+                                          False, #pad_for_usrp 
+                                          self._use_coding,
+                                          None, # logging
+                                          whitener_offsets)
+        
+        self._framed.extend(zip(metas, pkts))
+    
     def num_bytes_to_num_samples(self, payload_len): 
         '''
         Compute the number of samples a packet will occupy based on the length of the
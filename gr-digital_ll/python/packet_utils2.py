@@ -46,12 +46,12 @@ import time
 
 # third party library imports
 from gnuradio import gru
-from gnuradio.digital import crc
 import numpy
 from reedsolomon import Codec
 
 # project specific imports
 from digital_ll import lincolnlog
+import packet_batch
 
 
 def conv_packed_binary_string_to_1_0_string(s):
@@ -117,17 +117,7 @@ def string_to_hex_list(s):
 
 
 def whiten(s, o):
-    sa = numpy.fromstring(s, numpy.uint8)
-    
-    try:
-        z = sa ^ random_mask_vec8[o:len(sa)+o]
-        success=True
-        
-    except ValueError as err:
-        success=False
-        z=sa
-                
-    return z.tostring(), success
+    return packet_batch.whiten(s, o, random_mask_vec8)
 
 def dewhiten(s, o):
     return whiten(s, o)        # self inverse
@@ -169,26 +159,14 @@ def make_packet(payload, samples_per_symbol, bits_per_symbol,
     
     #print "Length of payload is %d" % len(payload)
     
-    payload_with_crc = crc.gen_and_append_crc32(payload)
+    payload_with_crc = packet_batch.gen_and_append_crc32(payload)
     #print "outbound crc =", string_to_hex_list(payload_with_crc[-4:])
     
     #use_coding section copied from Thomas' ofdm_packet_util.py
     #added by Tri on 09/20/2012
     if use_coding:
         #print "use_coding is activated on tx"
-        #Use coding and interleaving
-        #Apply Reed-Solomon Code
-        N = 8
-        K = 4
-        rs_encoder = Codec(N,K)
-        payload_with_crc_and_rs = ''
-        for n in range(0, len(payload_with_crc), K):
-            payload_with_crc_and_rs = payload_with_crc_and_rs + rs_encoder.encode(payload_with_crc[n:n+K])
-
-        #Interleave the RS symbols to put distance between the symbols under the same RS code
-        payload_with_crc_and_rs_interleaved = ''
-        for n in range(0, N, 1):
-            payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved + payload_with_crc_and_rs[n:len(payload_with_crc_and_rs):N]
+        payload_with_crc_and_rs_interleaved = _rs_encode(payload_with_crc)
     else:
         # Skip coding and interleaving (although the variable name kind of indicates otherwise)
         payload_with_crc_and_rs_interleaved = payload_with_crc
@@ -321,32 +299,13 @@ def unmake_packet(whitened_payload_with_crc,
         #added by Tri on 09/20/2012
         if use_coding:
             #print "use_coding is activated on rx"
-            # Reed Solomon Variables
-            N = 8
-            K = 4  #if K is changed, copy it to benchmark_tx.py as well
-    
-            #De-interleave
-            payload_with_crc_and_rs = ''
-            for n in range(0, len(payload_with_crc_and_rs_interleaved)/N, 1):
-                payload_with_crc_and_rs = payload_with_crc_and_rs + payload_with_crc_and_rs_interleaved[n:len(payload_with_crc_and_rs_interleaved):len(payload_with_crc_and_rs_interleaved)/N]
-    
-            #Reed-Solomon Decode
-            rs_encoder = Codec(N,K)
-            payload_with_crc = ''
-            rs_ok = 1
-            for n in range(0, len(payload_with_crc_and_rs), N):
-                try:
-                    decoded = rs_encoder.decode(payload_with_crc_and_rs[n:n+N]);
-                except:
-                    decoded = ('0'*K,)
-                    rs_ok = 0
-                payload_with_crc = payload_with_crc + decoded[0]      
+            payload_with_crc, rs_ok = _rs_decode(payload_with_crc_and_rs_interleaved)
         else:
             payload_with_crc = payload_with_crc_and_rs_interleaved
             rs_ok = True
 
 
-        crc_ok, payload = crc.check_crc32(payload_with_crc)
+        crc_ok, payload = packet_batch.check_crc32(payload_with_crc)
         ok = crc_ok & rs_ok
         
         if 0:
@@ -363,6 +322,143 @@ def unmake_packet(whitened_payload_with_crc,
 
     return ok, payload
 
+def _rs_encode(payload_with_crc):
+    """
+    Reed-Solomon encode and interleave a payload with its CRC
+    """
+    #Use coding and interleaving
+    #Apply Reed-Solomon Code
+    N = 8
+    K = 4
+    rs_encoder = Codec(N,K)
+    payload_with_crc_and_rs = ''
+    for n in range(0, len(payload_with_crc), K):
+        payload_with_crc_and_rs = payload_with_crc_and_rs + rs_encoder.encode(payload_with_crc[n:n+K])
+
+    #Interleave the RS symbols to put distance between the symbols under the same RS code
+    payload_with_crc_and_rs_interleaved = ''
+    for n in range(0, N, 1):
+        payload_with_crc_and_rs_interleaved = payload_with_crc_and_rs_interleaved + payload_with_crc_and_rs[n:len(payload_with_crc_and_rs):N]
+        
+    return payload_with_crc_and_rs_interleaved
+
+def _rs_decode(payload_with_crc_and_rs_interleaved):
+    """
+    De-interleave and Reed-Solomon decode a payload. Return (payload_with_crc, rs_ok)
+    """
+    # Reed Solomon Variables
+    N = 8
+    K = 4  #if K is changed, copy it to benchmark_tx.py as well
+
+    #De-interleave
+    payload_with_crc_and_rs = ''
+    for n in range(0, len(payload_with_crc_and_rs_interleaved)/N, 1):
+        payload_with_crc_and_rs = payload_with_crc_and_rs + payload_with_crc_and_rs_interleaved[n:len(payload_with_crc_and_rs_interleaved):len(payload_with_crc_and_rs_interleaved)/N]
+
+    #Reed-Solomon Decode
+    rs_encoder = Codec(N,K)
+    payload_with_crc = ''
+    rs_ok = 1
+    for n in range(0, len(payload_with_crc_and_rs), N):
+        try:
+            decoded = rs_encoder.decode(payload_with_crc_and_rs[n:n+N]);
+        except:
+            decoded = ('0'*K,)
+            rs_ok = 0
+        payload_with_crc = payload_with_crc + decoded[0]
+        
+    return payload_with_crc, rs_ok
+
+def make_packets(payloads, samples_per_symbol, bits_per_symbol,
+                 options, access_code=default_access_code, pad_for_usrp=True,
+                 use_coding=False, logging=-1, whitener_offsets=0, whitening=True):
+    """
+    Build a list of packets in one pass. Same as calling make_packet on each payload,
+    but the CRCs and whitening are done for all the payloads at once by packet_batch
+
+    @param payloads:              list of packet payloads, each len [0, 4096]
+    @param whitener_offsets       offset into whitener string to use [0-16), either
+                                  one for all the packets or a sequence with one per
+                                  packet
+    
+    See make_packet for the rest of the parameters
+    """
+    if not is_1_0_string(access_code):
+        raise ValueError, "access_code must be a string containing only 0's and 1's (%r)" % (access_code,)
+
+    whitener_offsets = numpy.zeros(len(payloads), dtype=numpy.int64) + whitener_offsets
+    if numpy.any((whitener_offsets < 0) | (whitener_offsets >= 16)):
+        raise ValueError, "whitener_offsets must be between 0 and 15, inclusive (%s)" % (whitener_offsets,)
+
+    (packed_access_code, padded) = conv_1_0_string_to_packed_binary_string(access_code)
+    (packed_preamble, ignore) = conv_1_0_string_to_packed_binary_string(preamble)
+    
+    buf, offsets = packet_batch.pack_payloads(payloads)
+    buf, offsets = packet_batch.append_crc32_batch(buf, offsets)
+    
+    if use_coding:
+        coded = [_rs_encode(p) for p in packet_batch.unpack_payloads(buf, offsets)]
+        buf, offsets = packet_batch.pack_payloads(coded)
+        
+    lens = numpy.diff(offsets)
+    MAXLEN = len(random_mask_tuple)
+    if numpy.any(lens > MAXLEN):
+        raise ValueError, "len(payload) must be in [0, %d]" % (MAXLEN,)
+    
+    if whitening:
+        buf, success = packet_batch.whiten_batch(buf, offsets, whitener_offsets, 
+                                                 random_mask_vec8)
+    
+    pkts = []
+    for body, L, o in zip(packet_batch.unpack_payloads(buf, offsets), lens.tolist(), 
+                          whitener_offsets.tolist()):
+        pkt = ''.join((packed_preamble, packed_access_code, make_header(L, o),
+                       body, packed_preamble))
+        
+        if pad_for_usrp:
+            Nbytes_to_pad = _npadding_bytes(len(pkt), int(samples_per_symbol), bits_per_symbol)
+            pkt = pkt + (Nbytes_to_pad * '\x55')
+            
+        pkts.append(pkt)
+        
+    return pkts
+
+def unmake_packets(whitened_payloads_with_crc, options, use_coding=False, logging=-1,
+                   whitener_offsets=0, dewhitening=True):
+    """
+    Return a list of (ok, payload), one for each of whitened_payloads_with_crc. Same 
+    as calling unmake_packet on each packet, but the dewhitening and CRC checks are 
+    done for all the packets at once by packet_batch
+
+    @param whitened_payloads_with_crc: list of strings
+    @param whitener_offsets: either one whitener offset for all the packets or a 
+                             sequence with one per packet
+    """
+    num_pkts = len(whitened_payloads_with_crc)
+    buf, offsets = packet_batch.pack_payloads(whitened_payloads_with_crc)
+    
+    if dewhitening:
+        buf, success = packet_batch.dewhiten_batch(buf, offsets, whitener_offsets, 
+                                                   random_mask_vec8)
+    else:
+        success = numpy.ones(num_pkts, dtype=bool)
+        
+    if use_coding:
+        decoded = [_rs_decode(p) for p in packet_batch.unpack_payloads(buf, offsets)]
+        rs_ok = numpy.array([d[1] for d in decoded], dtype=bool)
+        buf, offsets = packet_batch.pack_payloads([d[0] for d in decoded])
+    else:
+        rs_ok = numpy.ones(num_pkts, dtype=bool)
+        
+    crc_ok, buf, offsets = packet_batch.check_crc32_batch(buf, offsets)
+    ok = crc_ok & rs_ok & success
+    
+    # packets that failed dewhitening aren't trusted at all
+    return [(pkt_ok, payload if whitened else '') 
+            for pkt_ok, payload, whitened in zip(ok.tolist(), 
+                                                 packet_batch.unpack_payloads(buf, offsets), 
+                                                 success.tolist())]
+
 
 
 # FYI, this PN code is the output of a 15-bit LFSR
@@ -0,0 +1,334 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Declarative pattern set files
+
+A pattern set file is a JSON object mapping set names to lists of frames:
+
+    {"SET_N1": [{"frame_len": 0.22,
+                 "rf_freq_ind": 0,
+                 "slots": [{"owner": 0, "len": 0.04, "offset": 0.0,
+                            "type": "beacon", "bb_freq": 2},
+                           [1, 0.04, 0.04, "downlink", 1]]}]}
+
+Slots are either objects or lists in PatternTuple field order. A set can also be an
+object with a "generate" key holding PatternSetGenerator arguments, in which case its
+frames are generated rather than listed. A set is validated and
+rounded to the sample rate once, then saved as a numpy array in a hidden file next
+to the pattern file. The cache file name includes a hash of the pattern file
+contents, the set name, and the sample rate, so later loads of the same set can
+read the array back instead of parsing and checking every slot again.
+'''
+
+# standard python library imports
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+# FrameSchedule imports this module, so only look up PatternFrameSchedule when it's used
+import FrameSchedule
+from pattern_set_generator import PatternSetGenerator
+
+
+# one row per slot. Frame level fields are repeated in each slot of the frame
+CACHE_DTYPE = np.dtype([("frame_ind", "<i4"),
+                        ("frame_len", "<f8"),
+                        ("rf_freq_ind", "<i4"),
+                        ("owner", "<i4"),
+                        ("len", "<f8"),
+                        ("offset", "<f8"),
+                        ("type", "S16"),
+                        ("bb_freq", "<i4")])
+
+MAX_TYPE_LEN = CACHE_DTYPE["type"].itemsize
+
+# number of slots compiled at a time
+COMPILE_CHUNK_ROWS = 65536
+
+
+class InvalidPatternSetError(ValueError):
+    """Invalid pattern set file"""
+    pass
+
+
+def load_pattern_set(pattern_file, set_name, fs):
+    '''
+    Load a pattern set from a JSON pattern set file, using the compiled cache if it
+    is current. Returns a list of frame dicts with slots as PatternTuples, sorted by
+    offset and rounded to integer samples
+    '''
+    dev_log = logging.getLogger('developer')
+
+    with open(pattern_file, 'rb') as f:
+        contents = f.read()
+
+    cache_file = cache_file_name(pattern_file, set_name, fs, contents)
+
+    if os.path.isfile(cache_file):
+        try:
+            slots = np.load(cache_file)
+            if slots.dtype == CACHE_DTYPE:
+                dev_log.info("using compiled pattern set %s from %s", set_name,
+                             cache_file)
+                return array_to_pattern_set(slots)
+
+            dev_log.warning("compiled pattern set %s has an unexpected format",
+                            cache_file)
+        except (IOError, ValueError) as err:
+            dev_log.warning("could not read compiled pattern set %s: %s", cache_file,
+                            err)
+
+    try:
+        all_sets = json.loads(contents)
+    except ValueError as err:
+        raise InvalidPatternSetError("could not parse %s: %s" % (pattern_file, err))
+
+    if not isinstance(all_sets, dict):
+        raise InvalidPatternSetError("%s must contain a JSON object of pattern sets" %
+                                     pattern_file)
+    if set_name not in all_sets:
+        raise InvalidPatternSetError("pattern set %s not found in %s" % (set_name,
+                                                                         pattern_file))
+
+    frames = all_sets[set_name]
+    if isinstance(frames, dict) and "generate" in frames:
+        frames = make_generator(frames["generate"])
+
+    dev_log.info("compiling pattern set %s from %s", set_name, pattern_file)
+    slots = compile_pattern_set(frames, fs)
+
+    write_cache(cache_file, slots)
+
+    return array_to_pattern_set(slots)
+
+
+def cache_file_name(pattern_file, set_name, fs, contents):
+    '''
+    Name of the compiled cache for a set, next to the pattern file
+    '''
+    digest = hashlib.sha1()
+    digest.update(contents)
+    digest.update("\0%s\0%r" % (set_name, float(fs)))
+
+    pattern_dir, pattern_basename = os.path.split(os.path.abspath(pattern_file))
+    return os.path.join(pattern_dir, ".%s.%s.%s.npy" % (pattern_basename, set_name,
+                                                        digest.hexdigest()[:16]))
+
+
+def write_cache(cache_file, slots):
+    '''
+    Save a compiled pattern set, replacing any older compiled versions of the same set.
+    A pattern directory that can't be written to just means the set gets compiled on
+    every load
+    '''
+    dev_log = logging.getLogger('developer')
+
+    cache_dir, cache_basename = os.path.split(cache_file)
+    # the hash is the last dotted field before the extension
+    cache_prefix = cache_basename.rsplit(".", 2)[0]
+
+    try:
+        # write to a temp file and rename so other nodes never see a partial file
+        fd, temp_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, slots)
+        os.rename(temp_name, cache_file)
+    except (IOError, OSError) as err:
+        dev_log.warning("could not write compiled pattern set %s: %s", cache_file, err)
+        return
+
+    for old_cache in glob.glob(os.path.join(cache_dir, cache_prefix + ".*.npy")):
+        if old_cache != cache_file:
+            try:
+                os.remove(old_cache)
+            except OSError:
+                pass
+
+
+def make_generator(generator_args):
+    '''
+    Build a PatternSetGenerator from the "generate" object of a pattern set file
+    '''
+    if not isinstance(generator_args, dict):
+        raise InvalidPatternSetError("generate must be an object of generator arguments")
+
+    try:
+        return PatternSetGenerator(**generator_args)
+    except (TypeError, ValueError) as err:
+        raise InvalidPatternSetError("could not generate pattern set: %s" % err)
+
+
+def compile_pattern_set(frames, fs):
+    '''
+    Validate frames parsed from JSON or produced by a generator, and round frame
+    lengths, slot offsets, and slot lengths to integer samples. frames may be any 
+    iterable, and is only walked once. Returns the set as a CACHE_DTYPE array with the
+    slots of each frame sorted by offset
+    '''
+    dev_log = logging.getLogger('developer')
+
+    if not isinstance(frames, (list, PatternSetGenerator)):
+        raise InvalidPatternSetError("a pattern set must be a list of frames")
+
+    # rows are gathered into fixed size chunks so a large generated set never needs
+    # a python tuple for every one of its slots at once
+    chunks = []
+    rows = []
+    for frame_ind, frame in enumerate(frames):
+        if not isinstance(frame, dict):
+            raise InvalidPatternSetError("frame %d is not a JSON object" % frame_ind)
+
+        for key in ("frame_len", "rf_freq_ind", "slots"):
+            if key not in frame:
+                raise InvalidPatternSetError("frame %d is missing %s" % (frame_ind, key))
+
+        frame_len = _check_number(frame["frame_len"], "frame_len", frame_ind)
+        rf_freq_ind = _check_int(frame["rf_freq_ind"], "rf_freq_ind", frame_ind)
+
+        if not isinstance(frame["slots"], list) or len(frame["slots"]) == 0:
+            raise InvalidPatternSetError("frame %d must have a non empty list of slots" %
+                                         frame_ind)
+
+        frame_len_rounded = round(frame_len*fs)/fs
+        if frame_len != frame_len_rounded:
+            dev_log.warn("rounding frame len from %.15f to %.15f", frame_len,
+                         frame_len_rounded)
+            frame_len = frame_len_rounded
+
+        slots = [_parse_slot(slot, frame_ind, slot_ind)
+                 for slot_ind, slot in enumerate(frame["slots"])]
+        slots.sort(key=lambda slot: slot.offset)
+
+        for slot_ind, slot in enumerate(slots):
+            offset_rounded = round(slot.offset*fs)/fs
+            len_rounded = round(slot.len*fs)/fs
+
+            if slot.offset != offset_rounded:
+                dev_log.warn("rounding frame %d slot %d offset from %.15f to %.15f",
+                             frame_ind, slot_ind, slot.offset, offset_rounded)
+
+            if slot.len != len_rounded:
+                dev_log.warn("rounding frame %d slot %d len from %.15f to %.15f",
+                             frame_ind, slot_ind, slot.len, len_rounded)
+
+            end_of_slot = round( (offset_rounded + len_rounded)*fs)/fs
+            if end_of_slot > frame_len:
+                raise InvalidPatternSetError(("frame %d slot %d with offset %f and len %f " +
+                                              "extends past the end of the frame, len %f") %
+                                             (frame_ind, slot_ind, slot.offset, slot.len,
+                                              frame_len))
+
+            rows.append( (frame_ind, frame_len, rf_freq_ind, slot.owner, len_rounded,
+                          offset_rounded, slot.type, slot.bb_freq) )
+
+        if len(rows) >= COMPILE_CHUNK_ROWS:
+            chunks.append(np.array(rows, dtype=CACHE_DTYPE))
+            rows = []
+
+    if len(rows) > 0:
+        chunks.append(np.array(rows, dtype=CACHE_DTYPE))
+
+    if len(chunks) == 0:
+        raise InvalidPatternSetError("a pattern set must have at least one frame")
+
+    return np.concatenate(chunks)
+
+
+def array_to_pattern_set(slots):
+    '''
+    Convert a compiled pattern set array back to the list of frame dicts the frame
+    schedules use
+    '''
+    pattern_set = []
+
+    # pull each column out in one go rather than indexing the array per slot
+    columns = zip(slots["frame_ind"].tolist(), slots["frame_len"].tolist(),
+                  slots["rf_freq_ind"].tolist(), slots["owner"].tolist(),
+                  slots["len"].tolist(), slots["offset"].tolist(),
+                  slots["type"].tolist(), slots["bb_freq"].tolist())
+
+    PatternTuple = FrameSchedule.PatternFrameSchedule.PatternTuple
+
+    last_frame_ind = None
+    for frame_ind, frame_len, rf_freq_ind, owner, slot_len, offset, slot_type, bb_freq in columns:
+        if frame_ind != last_frame_ind:
+            frame = {"frame_len":frame_len,
+                     "rf_freq_ind":rf_freq_ind,
+                     "slots":[]}
+            pattern_set.append(frame)
+            last_frame_ind = frame_ind
+
+        frame["slots"].append(PatternTuple(owner=owner, len=slot_len, offset=offset,
+                                           type=str(slot_type), bb_freq=bb_freq))
+
+    return pattern_set
+
+
+def _parse_slot(slot, frame_ind, slot_ind):
+
+    PatternTuple = FrameSchedule.PatternFrameSchedule.PatternTuple
+
+    if isinstance(slot, list):
+        if len(slot) != len(PatternTuple._fields):
+            raise InvalidPatternSetError("frame %d slot %d should have %d fields" %
+                                         (frame_ind, slot_ind, len(PatternTuple._fields)))
+        slot = dict(zip(PatternTuple._fields, slot))
+
+    if not isinstance(slot, dict):
+        raise InvalidPatternSetError("frame %d slot %d is not a list or object" %
+                                     (frame_ind, slot_ind))
+
+    missing = [field for field in PatternTuple._fields if field not in slot]
+    if len(missing) > 0:
+        raise InvalidPatternSetError("frame %d slot %d is missing %s" %
+                                     (frame_ind, slot_ind, ", ".join(missing)))
+
+    slot_type = slot["type"]
+    if not isinstance(slot_type, basestring) or len(slot_type) > MAX_TYPE_LEN:
+        raise InvalidPatternSetError("frame %d slot %d has an invalid type %r" %
+                                     (frame_ind, slot_ind, slot_type))
+
+    where = " slot %d" % slot_ind
+    return PatternTuple(owner=_check_int(slot["owner"], "owner", frame_ind, where),
+                        len=_check_number(slot["len"], "len", frame_ind, where),
+                        offset=_check_number(slot["offset"], "offset", frame_ind, where),
+                        type=str(slot_type),
+                        bb_freq=_check_int(slot["bb_freq"], "bb_freq", frame_ind, where))
+
+
+def _check_int(val, field, frame_ind, where=""):
+    # bools are ints in python, but not in a pattern file
+    if isinstance(val, bool) or not isinstance(val, (int, long)):
+        raise InvalidPatternSetError("frame %d%s field %s should be an integer, not %r" %
+                                     (frame_ind, where, field, val))
+    return int(val)
+
+
+def _check_number(val, field, frame_ind, where=""):
+    if isinstance(val, bool) or not isinstance(val, (int, long, float)):
+        raise InvalidPatternSetError("frame %d%s field %s should be a number, not %r" %
+                                     (frame_ind, where, field, val))
+    return float(val)
@@ -0,0 +1,205 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Generate pattern sets instead of writing every action by hand
+
+Every generated frame has the same slot layout: a beacon slot owned by the base
+(owner 0), then a downlink slot for each mobile (owners 1 to num_mobiles), then an
+uplink slot for each mobile, back to back from the start of the frame. The generator
+enumerates the rf frequency index and the digital channel of every slot, skipping
+assignments that break the constraints as soon as a partial assignment breaks them
+rather than filtering complete frames.
+
+Pattern set files can ask for a generated set instead of listing frames, for example
+
+    {"SET_GEN_N2": {"generate": {"num_mobiles": 2, "num_channels": 4,
+                                 "frame_len": 0.22, "beacon_len": 0.04,
+                                 "downlink_len": 0.04, "uplink_len": 0.05}}}
+
+and the frames are compiled and cached like any other set.
+'''
+
+# standard python library imports
+
+# third party library imports
+
+# project specific imports
+
+
+# number of decimal places generated slot offsets are rounded to
+OFFSET_DIGITS = 12
+
+
+class PatternSetGenerator(object):
+    '''
+    Enumerates frames for a fixed slot layout
+    '''
+
+    def __init__(self, num_mobiles, num_channels, frame_len, beacon_len, downlink_len,
+                 uplink_len, num_rf_freqs=1, guard_channels=(), beacon_channels=None,
+                 max_distinct_channels=None, share_channels=True,
+                 interchangeable_mobiles=False, max_actions=None):
+        '''
+        num_mobiles            (int) number of mobiles in each frame
+        num_channels           (int) number of digital channels
+        frame_len            (float) frame length in seconds
+        beacon_len           (float) beacon slot length in seconds
+        downlink_len         (float) length of each downlink slot in seconds
+        uplink_len           (float) length of each uplink slot in seconds
+        num_rf_freqs           (int) number of rf frequency indices to enumerate
+        guard_channels        (list) digital channels no slot may use
+        beacon_channels       (list) digital channels the beacon may use. Defaults to
+                                     every non guard channel
+        max_distinct_channels  (int) max number of different channels in one frame, or
+                                     None for no limit
+        share_channels        (bool) if False, every slot in a frame gets its own channel
+        interchangeable_mobiles (bool) if True, frames that only differ by which mobile
+                                     gets which pair of downlink and uplink channels
+                                     are treated as duplicates, and only one is kept
+        max_actions            (int) stop after this many frames, or None for no limit
+        '''
+        if num_mobiles < 1:
+            raise ValueError("num_mobiles must be at least 1")
+
+        if num_rf_freqs < 1:
+            raise ValueError("num_rf_freqs must be at least 1")
+
+        if beacon_len + num_mobiles*(downlink_len + uplink_len) > frame_len:
+            raise ValueError(("a beacon, %d downlinks, and %d uplinks do not fit in a " +
+                              "frame of len %f") % (num_mobiles, num_mobiles, frame_len))
+
+        self.num_mobiles = num_mobiles
+        self.frame_len = frame_len
+        self.beacon_len = beacon_len
+        self.downlink_len = downlink_len
+        self.uplink_len = uplink_len
+        self.num_rf_freqs = num_rf_freqs
+        self.max_distinct_channels = max_distinct_channels
+        self.share_channels = share_channels
+        self.interchangeable_mobiles = interchangeable_mobiles
+        self.max_actions = max_actions
+
+        guard_channels = set(guard_channels)
+        self.channels = [c for c in range(num_channels) if c not in guard_channels]
+
+        if beacon_channels is None:
+            self.beacon_channels = list(self.channels)
+        else:
+            self.beacon_channels = [c for c in beacon_channels if c in self.channels]
+
+        if len(self.beacon_channels) == 0:
+            raise ValueError("no usable beacon channels")
+
+        # slot offsets, in layout order. Round off the float error from adding up slot
+        # lengths so offsets land on the same values a hand written set would use
+        uplink_start = beacon_len + num_mobiles*downlink_len
+        self.downlink_offsets = [round(beacon_len + m*downlink_len, OFFSET_DIGITS) 
+                                 for m in range(num_mobiles)]
+        self.uplink_offsets = [round(uplink_start + m*uplink_len, OFFSET_DIGITS) 
+                               for m in range(num_mobiles)]
+
+    def __iter__(self):
+        '''
+        Yield frames as dicts in pattern set file form, with each slot as a
+        [owner, len, offset, type, bb_freq] list
+        '''
+        num_frames = 0
+
+        for rf_freq_ind in range(self.num_rf_freqs):
+            for beacon_chan in self.beacon_channels:
+
+                if not self._channels_ok({}, beacon_chan):
+                    continue
+
+                for link_chans in self._assign_links(0, [], {beacon_chan:1}):
+                    yield self._make_frame(rf_freq_ind, beacon_chan, link_chans)
+
+                    num_frames += 1
+                    if self.max_actions is not None and num_frames >= self.max_actions:
+                        return
+
+    def _assign_links(self, mobile, link_chans, chan_counts):
+        '''
+        Recursively pick (downlink, uplink) channel pairs for mobiles mobile onwards.
+        chan_counts tracks how many slots use each channel in the partial frame
+        '''
+        if mobile == self.num_mobiles:
+            yield list(link_chans)
+            return
+
+        for dl_chan in self.channels:
+
+            if not self._channels_ok(chan_counts, dl_chan):
+                continue
+            chan_counts[dl_chan] = chan_counts.get(dl_chan, 0) + 1
+
+            for ul_chan in self.channels:
+
+                # with interchangeable mobiles, only keep the frame with the channel
+                # pairs in sorted order
+                if self.interchangeable_mobiles and mobile > 0:
+                    if (dl_chan, ul_chan) < link_chans[-1]:
+                        continue
+
+                if not self._channels_ok(chan_counts, ul_chan):
+                    continue
+                chan_counts[ul_chan] = chan_counts.get(ul_chan, 0) + 1
+
+                link_chans.append( (dl_chan, ul_chan) )
+                for frame_chans in self._assign_links(mobile+1, link_chans, chan_counts):
+                    yield frame_chans
+                link_chans.pop()
+
+                _release(chan_counts, ul_chan)
+            _release(chan_counts, dl_chan)
+
+    def _channels_ok(self, chan_counts, chan):
+        '''
+        Check whether one more slot can use chan given the channels already in use
+        '''
+        in_use = chan_counts.get(chan, 0) > 0
+
+        if not self.share_channels and in_use:
+            return False
+
+        if (self.max_distinct_channels is not None and not in_use and
+                len(chan_counts) >= self.max_distinct_channels):
+            return False
+
+        return True
+
+    def _make_frame(self, rf_freq_ind, beacon_chan, link_chans):
+
+        slots = [[0, self.beacon_len, 0.0, "beacon", beacon_chan]]
+        for m, (dl_chan, ul_chan) in enumerate(link_chans):
+            slots.append([m+1, self.downlink_len, self.downlink_offsets[m], "downlink",
+                          dl_chan])
+        for m, (dl_chan, ul_chan) in enumerate(link_chans):
+            slots.append([m+1, self.uplink_len, self.uplink_offsets[m], "uplink",
+                          ul_chan])
+
+        return {"frame_len":self.frame_len,
+                "rf_freq_ind":rf_freq_ind,
+                "slots":slots}
+
+
+def _release(chan_counts, chan):
+    chan_counts[chan] -= 1
+    if chan_counts[chan] == 0:
+        del chan_counts[chan]
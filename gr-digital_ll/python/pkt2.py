@@ -41,7 +41,12 @@
 # 
 
 # standard python library imports
+import atexit
+import logging
 from math import pi
+import multiprocessing
+import Queue
+import struct
 
 # third party library imports
 from gnuradio import digital
@@ -229,15 +234,15 @@ class demod_pkts(gr.hier_block2):
             threshold = 4              # FIXME raise exception
 
         self._rcvd_pktq = gr.msg_queue()          # holds packets from the PHY
-        self._time_pktq = gr.msg_queue()          # holds packet timestamps from the PHY
-        self._chan_pktq = gr.msg_queue()          # holds packet channels from the PHY
         
         self.correlator = digital.correlate_access_code_bb(access_code, threshold)
 
-        self.framer_sink = framer_sink_1(self._rcvd_pktq, self._time_pktq, self._chan_pktq)
+        self.framer_sink = framer_sink_1(self._rcvd_pktq)
         self.connect(self, self._demodulator, self.correlator, self.framer_sink)
         
-        self._watcher = _queue_watcher_thread(self._rcvd_pktq, self._time_pktq, self._chan_pktq, callback, self._use_coding, self._logging, self._options)
+        self._watcher = _queue_watcher_thread(self._rcvd_pktq, callback, self._use_coding, 
+                                              self._logging, self._options,
+                                              options.rx_decode_workers)
 
 
     
@@ -252,31 +257,184 @@ class demod_pkts(gr.hier_block2):
     # make channel_busy flag from sync watcher available at the demod_pkts object level    
 
 
+# layout of the sync timestamp framer_sink_1 appends to each packet
+_FRAME_TIMESTAMP_FMT = "=qd"
+_FRAME_TIMESTAMP_LEN = struct.calcsize(_FRAME_TIMESTAMP_FMT)
+
+def unpack_frame_msg(msg):
+    """
+    Split a message from framer_sink_1 into 
+    (whitened payload, whitener offset, (int_s, frac_s) timestamp, channel)
+    """
+    data = msg.to_string()
+    int_s, frac_s = struct.unpack(_FRAME_TIMESTAMP_FMT, data[-_FRAME_TIMESTAMP_LEN:])
+    
+    return (data[:-_FRAME_TIMESTAMP_LEN], int(msg.arg1()), (long(int_s), float(frac_s)), 
+            long(msg.arg2()))
+
+def _decode_packets(whitened_payloads, use_coding, whitener_offsets):
+    """
+    Dewhiten, RS decode, and check the CRC of a batch of packets. Runs in the decode 
+    workers, so this has to be a module level function and all its arguments have to
+    be picklable
+    """
+    # unmake_packets does not use its options argument, and its logging argument is 
+    # deprecated
+    return packet_utils.unmake_packets(whitened_payloads, None, use_coding, -1,
+                                       whitener_offsets)
+
+
+_dev_log = logging.getLogger('developer')
+
+# every receive path in the process shares one pool of decode workers, so running a
+# receive path per digital channel doesn't multiply the number of worker processes
+_decode_pool = None
+_decode_pool_started = False
+_decode_pool_lock = _threading.Lock()
+
+def start_decode_pool(num_workers):
+    """
+    Start the shared pool of num_workers decode workers. This forks the workers, so it
+    has to be called before any radio objects are built: forking once UHD and the flow 
+    graph have threads running can leave the workers holding locks those threads had.
+    Does nothing if num_workers is 0 or the pool was already started
+    """
+    global _decode_pool
+    global _decode_pool_started
+    
+    with _decode_pool_lock:
+        if num_workers > 0 and not _decode_pool_started:
+            _decode_pool = multiprocessing.Pool(num_workers)
+            _decode_pool_started = True
+
+def _get_decode_pool():
+    """
+    Get the shared decode worker pool, or None if it has been closed
+    """
+    with _decode_pool_lock:
+        if not _decode_pool_started:
+            raise RuntimeError("rx decode workers were requested but " +
+                               "pkt2.start_decode_pool was not called before the " +
+                               "receive paths were built")
+        return _decode_pool
+
+def close_decode_pool():
+    """
+    Stop the shared decode worker pool after it finishes the packets it already has.
+    Receive paths decode any later packets in their own threads
+    """
+    global _decode_pool
+    
+    with _decode_pool_lock:
+        pool = _decode_pool
+        _decode_pool = None
+        
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+atexit.register(close_decode_pool)
+
+
+class _decoded_result(object):
+    """
+    Stands in for the AsyncResult of a batch that was decoded without the pool
+    """
+    def __init__(self, value):
+        self._value = value
+        
+    def get(self):
+        return self._value
+
+
 class _queue_watcher_thread(_threading.Thread):
-    def __init__(self, rcvd_pktq, time_pktq, chan_pktq, callback, use_coding, logging, options):
+    """
+    Pull packets from the framer and pass them to the callback after decoding.
+    
+    Whatever packets are waiting in the queue, up to max_batch of them, are decoded
+    together as one batch. With no decode workers, batches are decoded in this 
+    thread. Otherwise decoding is farmed out to a pool of worker processes, and a 
+    separate delivery thread hands the results to the callback in the order the 
+    packets arrived.
+    """
+    def __init__(self, rcvd_pktq, callback, use_coding, logging, options, 
+                 num_workers=0, max_pending=64, max_batch=32):
         _threading.Thread.__init__(self)
         self.setDaemon(1)
         self.rcvd_pktq = rcvd_pktq
-        self.time_pktq = time_pktq
-        self.chan_pktq = chan_pktq
         self.callback = callback
         self.keep_running = True
-        self.start()
         self._use_coding = use_coding
         self._logging = logging
         self._options = options
+        self._max_batch = max_batch
+        
+        if num_workers > 0:
+            # the workers were forked by start_decode_pool before any radio threads
+            # existed
+            self._pool = _get_decode_pool()
+            
+            # batches being decoded, in arrival order. Bounded so a backed up pool
+            # pushes back on this thread rather than queueing without limit
+            self._pending = Queue.Queue(max_pending)
+            self._delivery = _threading.Thread(target=self._deliver)
+            self._delivery.setDaemon(1)
+            self._delivery.start()
+        else:
+            self._pool = None
+            self._pending = None
+            
+        self.start()
 
     def run(self):
         while self.keep_running:
-            msg = self.rcvd_pktq.delete_head()
-            timestamp = self.time_pktq.delete_head()
-            channel = self.chan_pktq.delete_head()
-            #channel = 0
-            ok, payload = packet_utils.unmake_packet(msg.to_string(),
-                                                     self._options,    #added on 9/28/12
-                                                     self._use_coding, #added on 09/20/2012
-                                                     self._logging,    #added on 09/24/2012
-                                                     int(msg.arg1()))
-            if self.callback:
-                #print "found packet"
-                self.callback(ok, payload, (long(timestamp.arg1()), float(timestamp.arg2())), long(channel.arg1()) )
+            # wait for a packet, then take whatever else is already queued behind it.
+            # This thread is the only reader, so count() can't go stale
+            msgs = [self.rcvd_pktq.delete_head()]
+            while len(msgs) < self._max_batch and self.rcvd_pktq.count() > 0:
+                msgs.append(self.rcvd_pktq.delete_head())
+                
+            frames = [unpack_frame_msg(msg) for msg in msgs]
+            payloads = [frame[0] for frame in frames]
+            whitener_offsets = [frame[1] for frame in frames]
+            
+            result = None
+            if self._pool is not None:
+                try:
+                    result = self._pool.apply_async(_decode_packets, 
+                                                    (payloads, self._use_coding, 
+                                                     whitener_offsets))
+                except ValueError:
+                    # the pool has been closed for shutdown
+                    self._pool = None
+            
+            if result is None and self._pending is None:
+                decoded = _decode_packets(payloads, self._use_coding, whitener_offsets)
+                for (ok, payload), frame in zip(decoded, frames):
+                    if self.callback:
+                        self.callback(ok, payload, frame[2], frame[3])
+            else:
+                if result is None:
+                    # batches still in the pool go first, so decode here but deliver
+                    # through the same queue
+                    result = _decoded_result(_decode_packets(payloads, self._use_coding, 
+                                                             whitener_offsets))
+                self._pending.put( (result, frames) )
+            
+    def _deliver(self):
+        """
+        Hand decoded packets to the callback in arrival order
+        """
+        while self.keep_running:
+            result, frames = self._pending.get()
+            
+            try:
+                decoded = result.get()
+            except Exception as e:
+                # a worker failure costs this batch, not the receive path
+                _dev_log.warning("packet decode failed in worker: %s", e)
+                decoded = [(False, frame[0]) for frame in frames]
+            
+            for (ok, payload), frame in zip(decoded, frames):
+                if self.callback:
+                    self.callback(ok, payload, frame[2], frame[3])
@@ -23,11 +23,77 @@ import sys
 import threading
 import time
 # third party library imports
+import numpy as np
 
 # project specific imports
 from digital_ll import time_spec_t
 
 
+def get_pwr_equations( cf, tx_gain, rx_gain ):
+    '''
+    Front end power equations measured for the USRP daughterboards, in dB, as a 
+    function of center frequency in Hz and the tx and rx gain settings
+    '''
+    tx_pwr_eq  = -0.0056706*cf/1.0e6 +  6.176 + tx_gain # already in dB
+    rx_pwr_eq  =  0.0028850*cf/1.0e6 + -7.84  - rx_gain # already in dB
+    return tx_pwr_eq, rx_pwr_eq
+
+
+class link_gain_state(object):
+    '''
+    Transmit gain state for every owner of one link direction, kept in numpy arrays 
+    indexed by the order owners were first seen so all owners can be updated at once
+    '''
+    
+    def __init__(self, init_gain, no_feedback_ber):
+        
+        self.init_gain = init_gain
+        
+        # ber to assume for an owner when no packets have been heard over the sense window
+        self.no_feedback_ber = no_feedback_ber
+        
+        self.owner_inds = {}
+        self.gains = np.zeros(0)
+        self.total_bits = np.zeros(0, dtype=np.int64)
+        self.fail_bits = np.zeros(0, dtype=np.int64)
+        self.recent_frame_nums = np.zeros(0, dtype=np.int64)
+        self.last_updated_frames = np.zeros(0, dtype=np.int64)
+        
+        # pathloss each owner's gain was last matched to, nan until the first estimate
+        self.ref_pathloss = np.zeros(0)
+        
+    def __len__(self):
+        return len(self.owner_inds)
+        
+    def register_owners(self, owners):
+        '''
+        Add state for any owners not seen before. Returns a boolean array marking which 
+        of the owners were new
+        '''
+        is_new = np.array([owner not in self.owner_inds for owner in owners], dtype=bool)
+        num_new = int(np.count_nonzero(is_new))
+        
+        if num_new > 0:
+            for owner in [o for o, new in zip(owners, is_new) if new]:
+                self.owner_inds[owner] = len(self.owner_inds)
+                
+            self.gains = np.append(self.gains, np.repeat(float(self.init_gain), num_new))
+            self.total_bits = np.append(self.total_bits, np.zeros(num_new, dtype=np.int64))
+            self.fail_bits = np.append(self.fail_bits, np.zeros(num_new, dtype=np.int64))
+            self.recent_frame_nums = np.append(self.recent_frame_nums, 
+                                               np.zeros(num_new, dtype=np.int64))
+            self.last_updated_frames = np.append(self.last_updated_frames, 
+                                                 np.zeros(num_new, dtype=np.int64))
+            self.ref_pathloss = np.append(self.ref_pathloss, np.repeat(np.nan, num_new))
+        
+        return is_new
+    
+    def get_gain(self, owner):
+        return float(self.gains[self.owner_inds[owner]])
+    
+    def max_gain(self):
+        return float(self.gains.max())
+    
 
 class power_controller():
 
@@ -42,156 +108,166 @@ class power_controller():
 
         options.rf_power_control_thresholds = [float(x) for x in options.rf_power_control_thresholds.split(',')]
         self.ber_thresholds = options.rf_power_control_thresholds
+        
+        # the gain step ladder: a ber above ber_thresholds[k] but not above 
+        # ber_thresholds[k+1] gets gain_steps[k], and a ber at or below 
+        # ber_thresholds[1] gets gain_steps[0]
+        self.step_thresholds = np.array(self.ber_thresholds[1:4])
+        self.step_sizes = np.array(self.gain_steps[0:4])
 
         self.agc_N_frames = options.rf_power_control_sense_window
+        self.pathloss_deadband = options.rf_power_control_pathloss_deadband
 
         self.beacon_gain = options.rf_tx_gain
         self.beacon_step = 1.0
         self.beacon_margin = 6.0 
 
         self.num_mobiles = len(options.sink_mac_addresses)
-        self.downlink_owner_gain_dict = {}
+        
+        # with no downlink feedback, increase gain slowly
+        self.downlink_state = link_gain_state(self.init_tx_gain, self.ber_thresholds[3])
         
         #uplink power control parameters
         self.pwr_control_up = options.rf_power_control_enabled
         self.init_uplink_tx_gain = self.init_tx_gain        
-        self.uplink_owner_gain_dict = {}
-        
-    def optimize_power(self, frame_count, next_sched, link_database, dev_log):    
-        time_gain_tuple_list = []
-            
-        def adjust_downlink_gain(owner, total_bits, fail_bits, recent_frame_num):
-            if owner in self.downlink_owner_gain_dict:
-                (previous_gain, previous_total_bits, previous_fail_bits, previous_frame_num, last_updated_frame) = self.downlink_owner_gain_dict[owner]
-                if previous_total_bits == 0:
-                    previous_ber = 1.0
-                else:
-                    previous_ber = float(previous_fail_bits)/float(previous_total_bits)
-                    
-                if (total_bits == 0):
-                    #ber = 1.0
-                    #increase gain slowly when no feedbacks
-                    ber = self.ber_thresholds[3]
-                else:
-                    ber = float(fail_bits)/float(total_bits) 
-                                                           
-                dev_log.debug("downlink owner %i, total bits %i, fail bits %i, recent frame num %i", owner, total_bits, fail_bits, recent_frame_num)
-
-                if (((previous_ber <= self.ber_thresholds[2]) and (ber > self.ber_thresholds[2])) or (recent_frame_num == -1) or
-                    (recent_frame_num > last_updated_frame + self.agc_N_frames)):
-
-                    #dev_log.debug("Previous BER: %f. Current BER: %f", previous_ber, ber)
-                    #dev_log.debug("Previous gain : %.1f", previous_gain)
-                    
-                    if ber > self.ber_thresholds[3]:
-                        new_gain = min(previous_gain + self.gain_steps[3], self.max_tx_gain)
-                    elif ber > self.ber_thresholds[2]:
-                        new_gain = min(previous_gain + self.gain_steps[2], self.max_tx_gain)
-                    elif ber > self.ber_thresholds[1]:
-                        new_gain = min(previous_gain + self.gain_steps[1], self.max_tx_gain)
-                    else:
-                        new_gain = max(previous_gain + self.gain_steps[0], self.min_tx_gain)
-
-                    #dev_log.debug("New gain : %0.1f", new_gain)                        
-                    updated_frame = recent_frame_num                                
-                else:
-                    new_gain = previous_gain
-                    updated_frame = last_updated_frame
-                                        
-                self.downlink_owner_gain_dict[owner] = (new_gain, total_bits, fail_bits, recent_frame_num, updated_frame)            
-            else:
-                #register owner first time, don't know anything, just use default gain
-                self.downlink_owner_gain_dict[owner] = (self.init_tx_gain, total_bits, fail_bits, recent_frame_num, 0)
-            
-            return self.downlink_owner_gain_dict[owner][0]
-           
-        def adjust_uplink_gain(owner, total_bits, fail_bits, recent_frame_num):
-            if owner in self.uplink_owner_gain_dict:
-                (previous_gain, previous_total_bits, previous_fail_bits, previous_frame_num, last_updated_frame) = self.uplink_owner_gain_dict[owner]
-                if previous_total_bits == 0:
-                    previous_ber = 1.0
-                else:
-                    previous_ber = float(previous_fail_bits)/float(previous_total_bits)
-                    
-                if (total_bits == 0):
-                    ber = 1.0
-                else:
-                    ber = float(fail_bits)/float(total_bits) 
-                
-                dev_log.debug("uplink owner %i, total bits %i, fail bits %i, recent frame num %i", owner, total_bits, fail_bits, recent_frame_num)
-                                                           
-                if (((previous_ber <= self.ber_thresholds[2]) and (ber > self.ber_thresholds[2])) or (recent_frame_num == -1) or
-                    (recent_frame_num > last_updated_frame + self.agc_N_frames)):
-
-                    #dev_log.debug("Previous BER: %f. Current BER: %f", previous_ber, ber)
-                    #dev_log.debug("Previous gain : %.1f", previous_gain)
-                    
-                    if ber > self.ber_thresholds[3]:
-                        new_gain = min(previous_gain + self.gain_steps[3], self.max_tx_gain)
-                    elif ber > self.ber_thresholds[2]:
-                        new_gain = min(previous_gain + self.gain_steps[2], self.max_tx_gain)
-                    elif ber > self.ber_thresholds[1]:
-                        new_gain = min(previous_gain + self.gain_steps[1], self.max_tx_gain)
-                    else:
-                        new_gain = max(previous_gain + self.gain_steps[0], self.min_tx_gain)
-
-                    #dev_log.debug("New gain : %0.1f", new_gain)                        
-                    updated_frame = recent_frame_num                                
-                else:
-                    new_gain = previous_gain
-                    updated_frame = last_updated_frame
-                                        
-                self.uplink_owner_gain_dict[owner] = (new_gain, total_bits, fail_bits, recent_frame_num, updated_frame)            
-            else:
-                #register owner first time, don't know anything, just use default gain
-                self.uplink_owner_gain_dict[owner] = (self.init_uplink_tx_gain, total_bits, fail_bits, recent_frame_num, 0)
-            
-            return self.uplink_owner_gain_dict[owner][0]
-           
-
-        ##################################################################
+        self.uplink_state = link_gain_state(self.init_uplink_tx_gain, 1.0)
+        
+    def adjust_gains(self, state, owners, link_totals, link_direction, dev_log):
+        '''
+        Update the gains of all owners of one link direction at once
+        
+        state          (link_gain_state) gain state for this link direction
+        owners         (list) owner ids to update
+        link_totals    (dict) keyed by (link_direction, owner). Each value is a 
+                              (total_bits, fail_bits, recent_frame_num) tuple
+        link_direction (str) 'down' or 'up'
+        '''
+        if len(owners) == 0:
+            return
+        
+        totals = np.array([link_totals.get((link_direction, owner), (0, 0, -1)) 
+                           for owner in owners], dtype=np.int64).reshape(-1, 3)
+        total_bits = totals[:,0]
+        fail_bits = totals[:,1]
+        recent_frame_nums = totals[:,2]
+        
+        dev_log.debug("%slink owners %s, total bits %s, fail bits %s, recent frame nums %s", 
+                      link_direction, owners, total_bits, fail_bits, recent_frame_nums)
+        
+        # owners seen for the first time keep the default gain, since nothing is known
+        # about them yet
+        is_new = state.register_owners(owners)
+        inds = np.array([state.owner_inds[owner] for owner in owners])
+        
+        prev_total_bits = state.total_bits[inds]
+        prev_ber = np.where(prev_total_bits == 0, 1.0, 
+                            state.fail_bits[inds]/np.maximum(prev_total_bits, 1.0))
+        ber = np.where(total_bits == 0, state.no_feedback_ber, 
+                       fail_bits/np.maximum(total_bits, 1.0))
+        
+        last_updated_frames = state.last_updated_frames[inds]
+        
+        needs_update = ( ((prev_ber <= self.ber_thresholds[2]) & (ber > self.ber_thresholds[2])) |
+                         (recent_frame_nums == -1) |
+                         (recent_frame_nums > last_updated_frames + self.agc_N_frames) )
+        needs_update &= ~is_new
+        
+        # count the ladder thresholds each ber is above to pick its gain step 
+        step_inds = np.searchsorted(self.step_thresholds, ber, side='left')
+        stepped_gains = state.gains[inds] + self.step_sizes[step_inds]
+        stepped_gains = np.where(step_inds > 0, 
+                                 np.minimum(stepped_gains, self.max_tx_gain),
+                                 np.maximum(stepped_gains, self.min_tx_gain))
+        
+        state.gains[inds] = np.where(needs_update, stepped_gains, state.gains[inds])
+        state.last_updated_frames[inds] = np.where(needs_update, recent_frame_nums, 
+                                                   last_updated_frames)
+        state.total_bits[inds] = total_bits
+        state.fail_bits[inds] = fail_bits
+        state.recent_frame_nums[inds] = recent_frame_nums
+        
+    def track_pathloss(self, state, owners, pathloss, dev_log):
+        '''
+        Move the gains of owners whose pathloss estimate has changed by at least the 
+        pathloss deadband by the same amount, so the gains follow the channel without 
+        waiting for the BER feedback to catch up
+        
+        state          (link_gain_state) gain state for this link direction
+        owners         (list) owner ids to update
+        pathloss       (dict) keyed by owner id. Pathloss estimates in dB
+        '''
+        owners = [owner for owner in owners if owner in pathloss]
+        if len(owners) == 0:
+            return
+        
+        state.register_owners(owners)
+        inds = np.array([state.owner_inds[owner] for owner in owners])
+        
+        new_pathloss = np.array([pathloss[owner] for owner in owners], dtype=float)
+        
+        # the first estimate of an owner's pathloss is the reference its gain is matched to
+        ref_pathloss = np.where(np.isnan(state.ref_pathloss[inds]), new_pathloss, 
+                                state.ref_pathloss[inds])
+        delta = new_pathloss - ref_pathloss
+        needs_update = np.abs(delta) >= self.pathloss_deadband
+        
+        if np.any(needs_update):
+            dev_log.debug("pathloss changes of %s dB for owners %s", 
+                          delta[needs_update], np.array(owners)[needs_update])
+        
+        state.gains[inds] = np.where(needs_update, 
+                                     np.clip(state.gains[inds] + delta, self.min_tx_gain, 
+                                             self.max_tx_gain),
+                                     state.gains[inds])
+        state.ref_pathloss[inds] = np.where(needs_update, new_pathloss, ref_pathloss)
+        
+    def optimize_power(self, frame_count, next_sched, link_database, dev_log, 
+                       pathloss=None):    
+
         unique_links = next_sched.get_unique_links()
+        
+        downlink_owners = [owner for (owner, linktype) in unique_links 
+                           if linktype == 'downlink' and owner > 0]
+        uplink_owners = [owner for (owner, linktype) in unique_links 
+                         if linktype == 'uplink' and owner > 0]
+        
+        # get the bit counts for every link with a single query
+        link_totals = link_database.get_link_bit_totals(self.agc_N_frames)
+        
+        self.adjust_gains(self.downlink_state, downlink_owners, link_totals, 'down', 
+                          dev_log)
+        if self.pwr_control_up:
+            self.adjust_gains(self.uplink_state, uplink_owners, link_totals, 'up', 
+                              dev_log)
+        
+        # pathloss is measured on the uplink, and by reciprocity applies to the 
+        # downlink as well
+        if pathloss is not None:
+            self.track_pathloss(self.downlink_state, downlink_owners, pathloss, dev_log)
+            if self.pwr_control_up:
+                self.track_pathloss(self.uplink_state, uplink_owners, pathloss, dev_log)
+        
         for (owner,linktype) in unique_links:
             if (linktype == 'downlink') and (owner > 0):                
-                packet_list = link_database.get_total_bits_to_user(owner, self.agc_N_frames)
-                total_bits = 0
-                fail_bits = 0
-                recent_frame_num = -1                    
-                if len(packet_list) > 0:
-                    total_bits = sum([p[1] for p in packet_list])
-                    fail_bits = sum([p[1] for p in packet_list if p[0] == 'fail'])
-                    recent_frame_num = max([p[2] for p in packet_list])
-                
-                downlink_tx_gain = adjust_downlink_gain(owner, total_bits, fail_bits, recent_frame_num)
-                next_sched.store_tx_gain(owner, linktype, downlink_tx_gain)
+                next_sched.store_tx_gain(owner, linktype, 
+                                         self.downlink_state.get_gain(owner))
                               
             elif (linktype == 'beacon'):
                 #case when not all downlink gains are established yet
-                if len(self.downlink_owner_gain_dict) < self.num_mobiles:
+                if len(self.downlink_state) < self.num_mobiles:
                     self.beacon_gain = self.beacon_gain + self.beacon_step
                 #case when all downlink gains are available
                 else:
-                    self.beacon_gain = max([mobile_tuple[0] for mobile_tuple in self.downlink_owner_gain_dict.itervalues()]) + self.beacon_margin
+                    self.beacon_gain = self.downlink_state.max_gain() + self.beacon_margin
                 
                 self.beacon_gain = min(self.beacon_gain, self.max_tx_gain)
                 next_sched.store_tx_gain(owner, linktype, self.beacon_gain)
                 
             elif (linktype == 'uplink') and (owner > 0):
                 if self.pwr_control_up:
-                    packet_list = link_database.get_total_bits_from_user(owner, self.agc_N_frames)
-                    total_bits = 0
-                    fail_bits = 0
-                    recent_frame_num = -1                    
-                    if len(packet_list) > 0:
-                        total_bits = sum([p[1] for p in packet_list])
-                        fail_bits = sum([p[1] for p in packet_list if p[0] == 'fail'])
-                        recent_frame_num = max([p[2] for p in packet_list])
-                
-                    uplink_tx_gain = adjust_uplink_gain(owner, total_bits, fail_bits, recent_frame_num)
-                    next_sched.store_tx_gain(owner, linktype, uplink_tx_gain)
+                    next_sched.store_tx_gain(owner, linktype, 
+                                             self.uplink_state.get_gain(owner))
                 else:
                     next_sched.store_tx_gain(owner, linktype, self.init_uplink_tx_gain)            
 
         return next_sched
-        
-
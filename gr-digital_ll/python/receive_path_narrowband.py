@@ -76,6 +76,7 @@ class receive_path_narrowband(gr.hier_block2):
         self._demod_class = demod_class  # the demodulator_class we're using
     
         self._chbw_factor = options.chbw_factor # channel filter bandwidth factor
+        self._rx_decode_workers = options.rx_decode_workers
     
         self._access_code   = options.rx_access_code
         self._threshold     = options.access_code_threshold
@@ -301,6 +302,11 @@ class receive_path_narrowband(gr.hier_block2):
                           help="Log all parts of flow graph to files (CAUTION: lots of data)")
         expert.add_option("", "--chbw-factor", type="float", default=1.0,
                           help="Channel bandwidth = chbw_factor x signal bandwidth [defaut=%default]")
+        if not expert.has_option("--rx-decode-workers"):
+            expert.add_option("", "--rx-decode-workers", type="int", default=0,
+                              help="number of processes to decode received packets " +
+                                   "with, or 0 to decode them in the receive thread " +
+                                   "[default=%default]")
 
     def log_my_settings(self, indent_level,logger):
         '''
@@ -327,6 +333,7 @@ class receive_path_narrowband(gr.hier_block2):
                   "constellation_points":self._constellation_points,
                   "excess_bw":self._excess_bw,
                   "chbw_factor":self._chbw_factor,
+                  "rx_decode_workers":self._rx_decode_workers,
                   "freq_bw":self._freq_bw,
                   "phase_bw":self._phase_bw,
                   "timing_bw":self._timing_bw,
@@ -199,4 +199,70 @@ class time_spec_t():
         self._normalize()
         
         return self
-                
\ No newline at end of file
+                
+
+class sample_timebase(object):
+    '''
+    Maps timestamps onto sample indices counted from a reference time t0
+
+    Scheduling arithmetic done on sample indices is exact, so frame, slot and packet
+    boundaries stay on the sample grid no matter how many of them are added up.
+    Timestamps only need to be built from indices where they leave the MAC, such as
+    the tx_time of a burst.
+    '''
+    def __init__(self, fs, t0):
+        '''
+        fs         (float) sample rate
+        t0   (time_spec_t) time of sample index 0
+        '''
+        self.fs = float(fs)
+        self.t0 = time_spec_t(t0)
+
+        # a whole number sample rate lets indices convert to timestamps without any
+        # floating point error
+        if self.fs == floor(self.fs):
+            self._fs_int = long(self.fs)
+        else:
+            self._fs_int = None
+
+    def num_samples(self, duration):
+        '''
+        Number of whole samples closest to duration seconds
+        '''
+        return long(round(float(duration)*self.fs))
+
+    def to_index(self, t):
+        '''
+        Index of the sample closest to timestamp t
+        '''
+        delta = time_spec_t(t) - self.t0
+
+        if self._fs_int is not None:
+            return delta._int_s*self._fs_int + long(round(delta._frac_s*self.fs))
+        else:
+            return long(round(float(delta)*self.fs))
+
+    def to_time(self, index):
+        '''
+        Timestamp of sample index
+        '''
+        if self._fs_int is not None:
+            int_s, rem = divmod(long(index), self._fs_int)
+            return self.t0 + time_spec_t(int_s, rem/self.fs)
+        else:
+            return self.t0 + time_spec_t(index/self.fs)
+
+    def round(self, t):
+        '''
+        Round timestamp t to the nearest sample. Same as t.round_to_sample(fs, t0)
+        without the floating point error
+        '''
+        return self.to_time(self.to_index(t))
+
+    def __copy__(self):
+        # timebases are never modified after they are built, so copies of a frame
+        # config can share their schedule's timebase
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
@@ -0,0 +1,832 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Virtual radio front end that connects node processes on one host through shared
+memory instead of USRPs
+
+Every node of a virtual network owns a ring buffer file in the network's directory
+under /dev/shm. A node's transmitter writes each timestamped burst into its own ring
+at the sample index its tx_time maps to. A node's receiver sums what every other
+node's ring holds for the current sample indices, scaled by the link gains, and adds
+noise. Sample indices count samples of a virtual clock that all nodes share through
+a small clock file in the same directory. The clock runs at wall clock speed or a
+multiple of it.
+
+Gains follow a simple model where everything adds in dB. A sample written at tx gain
+Gt dB reaches a receiver at rx gain Gr dB over a link with gain Gl dB at amplitude
+10**((Gt + Gl + Gr)/20) relative to what the modulator put out. Receiver noise has
+power 10**((N + Gr)/10) for a noise power of N dB. A receiver only hears nodes whose
+transmitter is tuned to its own receive frequency.
+
+virtual_radio_transmitter and virtual_radio_receiver stand in for uhd_transmitter
+and uhd_receiver. Their u attribute accepts the timed gain and tune commands the
+command queue manager sends a usrp.
+'''
+
+# standard python library imports
+from collections import namedtuple
+import fcntl
+import logging
+import os
+import sys
+import threading
+import time
+
+# third party library imports
+from gnuradio import eng_notation
+from gnuradio import gr
+from gruel import pmt
+import numpy
+
+# project specific imports
+from digital_ll import sample_timebase
+from digital_ll import time_spec_t
+from digital_ll.lincolnlog import dict_to_xml
+
+
+VIRTUAL_RADIO_ROOT = "/dev/shm"
+
+SAMPLE_DTYPE = numpy.complex64
+
+# layout of the clock file, float64 fields
+CLOCK_FIELDS = ("ready", "t0", "speed", "sample_rate", "heartbeat")
+CLOCK_LEN = 8
+
+# a clock nobody has touched for this many wall clock seconds belongs to an old run
+CLOCK_STALE_SECS = 10.0
+
+# layout of the header at the start of each node's ring buffer file, float64 fields.
+# cleared_to is one past the last sample index the ring holds valid data for
+NODE_FIELDS = ("cleared_to", "tx_freq")
+NODE_HEADER_LEN = 8
+
+# receivers wait until at least this much of the virtual clock has passed before
+# producing more samples
+MIN_RX_CHUNK_SECS = 0.001
+
+# untimed transmit samples are scheduled this far ahead of the clock
+UNTIMED_TX_LEAD_SECS = 0.005
+
+# receivers look for nodes that joined the network this often, in wall clock seconds
+NODE_RESCAN_SECS = 1.0
+
+TimedCommand = namedtuple('TimedCommand', 'index kind value')
+
+
+def parse_link_gains(link_gains):
+    '''
+    Parse a comma separated list of node:node:gain entries into a dict keyed by
+    (node, node) pairs. Links are symmetric, so each entry is stored both ways
+    '''
+    gains = {}
+    for entry in link_gains.split(','):
+        if not entry.strip():
+            continue
+
+        fields = entry.split(':')
+        if len(fields) != 3:
+            raise ValueError("link gain %s is not of the form node:node:gain" % entry)
+
+        a, b, gain = int(fields[0]), int(fields[1]), float(fields[2])
+        gains[(a, b)] = gain
+        gains[(b, a)] = gain
+
+    return gains
+
+
+class virtual_clock(object):
+    '''
+    Clock shared by every node of a virtual network
+
+    The clock file holds the wall clock time t0 the network started at and the clock
+    speed. Virtual time is t0 + (wall time - t0)*speed, so at speed 1 virtual time is
+    the host time. Samples are indexed from the epoch, so sample index k is at
+    virtual time k/sample_rate.
+    '''
+    def __init__(self, file_name, sample_rate, speed):
+
+        self.dev_logger = logging.getLogger('developer')
+
+        # virtual sample indices have to map exactly onto whole seconds
+        self.fs = int(round(sample_rate))
+        self.speed = float(speed)
+
+        if self.speed <= 0:
+            sys.stderr.write("Virtual radio speed must be positive, is %f\n" % self.speed)
+            sys.exit(1)
+
+        fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            # only one node at a time gets to decide whether to start a new clock
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            if os.fstat(fd).st_size != CLOCK_LEN*8:
+                os.ftruncate(fd, CLOCK_LEN*8)
+
+            self._hdr = numpy.memmap(file_name, dtype=numpy.float64, mode='r+',
+                                     shape=(CLOCK_LEN,))
+            self._fields = dict((name, k) for k, name in enumerate(CLOCK_FIELDS))
+
+            now = time.time()
+            if (self._get("ready") != 1 or
+                now - self._get("heartbeat") > CLOCK_STALE_SECS):
+
+                self._set("t0", now)
+                self._set("speed", self.speed)
+                self._set("sample_rate", self.fs)
+                self._set("heartbeat", now)
+                self._set("ready", 1)
+                self._hdr.flush()
+
+                self.dev_logger.info("started virtual clock %s at %f, %.2f times realtime",
+                                     file_name, now, self.speed)
+
+            elif (self._get("speed") != self.speed or
+                  self._get("sample_rate") != self.fs):
+
+                sys.stderr.write(("Virtual clock %s runs at %f times realtime with a " +
+                                  "sample rate of %f, but this node asked for %f and " +
+                                  "%f\n") % (file_name, self._get("speed"),
+                                             self._get("sample_rate"), self.speed,
+                                             self.fs))
+                sys.exit(1)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        self.timebase = sample_timebase(self.fs, 0)
+
+        self.t0 = self._get("t0")
+        self.t0_index = self.time_to_sample(self.t0)
+
+    def _get(self, name):
+        return float(self._hdr[self._fields[name]])
+
+    def _set(self, name, value):
+        self._hdr[self._fields[name]] = value
+
+    def heartbeat(self):
+        self._set("heartbeat", time.time())
+
+    def sample_now(self):
+        '''
+        Index of the sample at the current virtual time
+        '''
+        return self.t0_index + long((time.time() - self.t0)*self.speed*self.fs)
+
+    def time_now(self):
+        return self.sample_to_time(self.sample_now())
+
+    def time_to_sample(self, t):
+        '''
+        Convert a time_spec_t, (int_s, frac_s) tuple or float seconds to the index of
+        the nearest sample
+        '''
+        return self.timebase.to_index(t)
+
+    def sample_to_time(self, index):
+        return self.timebase.to_time(index)
+
+    def wait_for_sample(self, index):
+        '''
+        Sleep until the virtual clock reaches the sample index
+        '''
+        remaining = index - self.sample_now()
+        if remaining > 0:
+            time.sleep(float(remaining)/self.fs/self.speed)
+
+
+class virtual_node_buffer(object):
+    '''
+    One node's transmit ring buffer, shared with every receiver of the network
+
+    Sample index k lives at ring position k % ring_len. The writer zeroes the ring
+    ahead of each burst and then advances cleared_to, so readers treat everything at
+    or past cleared_to, and everything a full ring behind it, as silence.
+    '''
+    def __init__(self, file_name, ring_len=None):
+        '''
+        file_name    (string) ring buffer file
+        ring_len        (int) number of samples in the ring. Creates the file if
+                              given, opens an existing ring read only if None
+        '''
+        self.file_name = file_name
+
+        header_bytes = NODE_HEADER_LEN*numpy.dtype(numpy.float64).itemsize
+        sample_bytes = numpy.dtype(SAMPLE_DTYPE).itemsize
+
+        if ring_len is not None:
+            # build the file under another name so receivers still mapping a ring
+            # left by an earlier run never see it shrink
+            mode = 'r+'
+            tmp_name = "%s.%d" % (file_name, os.getpid())
+            with open(tmp_name, 'w+b') as f:
+                f.truncate(header_bytes + ring_len*sample_bytes)
+            os.rename(tmp_name, file_name)
+        else:
+            mode = 'r'
+            ring_len = (os.path.getsize(file_name) - header_bytes)//sample_bytes
+
+        self.ring_len = ring_len
+        self.inode = os.stat(file_name).st_ino
+
+        self._hdr = numpy.memmap(file_name, dtype=numpy.float64, mode=mode,
+                                 shape=(NODE_HEADER_LEN,))
+        self._ring = numpy.memmap(file_name, dtype=SAMPLE_DTYPE, mode=mode,
+                                  offset=header_bytes, shape=(ring_len,))
+
+        self._fields = dict((name, k) for k, name in enumerate(NODE_FIELDS))
+
+    def cleared_to(self):
+        return long(self._hdr[self._fields["cleared_to"]])
+
+    def tx_freq(self):
+        return float(self._hdr[self._fields["tx_freq"]])
+
+    def set_tx_freq(self, freq):
+        self._hdr[self._fields["tx_freq"]] = freq
+
+    def _ring_slices(self, start, num):
+        '''
+        Split num samples starting at sample index start into (ring position, offset,
+        length) pieces that don't wrap
+        '''
+        pieces = []
+        offset = 0
+        while offset < num:
+            pos = (start + offset) % self.ring_len
+            length = min(num - offset, self.ring_len - pos)
+            pieces.append( (pos, offset, length) )
+            offset += length
+        return pieces
+
+    def write(self, start, samples):
+        '''
+        Write a burst segment at sample index start, zeroing any part of the ring
+        between the previous write and this one
+        '''
+        end = start + len(samples)
+        cleared_to = self.cleared_to()
+
+        if end > cleared_to:
+            clear_start = max(cleared_to, end - self.ring_len)
+            for pos, offset, length in self._ring_slices(clear_start, end - clear_start):
+                self._ring[pos:pos+length] = 0
+
+        for pos, offset, length in self._ring_slices(start, len(samples)):
+            self._ring[pos:pos+length] = samples[offset:offset+length]
+
+        # publish the new samples only after they are in the ring
+        if end > cleared_to:
+            self._hdr[self._fields["cleared_to"]] = end
+
+    def add_to(self, out, start, scale):
+        '''
+        Add scale times the samples held for indices start to start+len(out) to out
+        '''
+        cleared_to = self.cleared_to()
+        first = max(start, cleared_to - self.ring_len)
+        last = min(start + len(out), cleared_to)
+
+        if last <= first:
+            return
+
+        for pos, offset, length in self._ring_slices(first, last - first):
+            out_start = first - start + offset
+            out[out_start:out_start+length] += scale*self._ring[pos:pos+length]
+
+
+class virtual_usrp(object):
+    '''
+    Takes the usrp calls the command queue manager makes and turns them into
+    commands the virtual radio applies at the matching sample
+    '''
+    def __init__(self, radio):
+        self._radio = radio
+        self._command_time = None
+
+    def set_command_time(self, uhd_time):
+        self._command_time = time_spec_t(uhd_time.get_full_secs(),
+                                         uhd_time.get_frac_secs())
+
+    def clear_command_time(self):
+        self._command_time = None
+
+    def set_gain(self, gain, chan=0):
+        self._radio.schedule_command("gain", float(gain), self._command_time)
+
+    def set_center_freq(self, tune_request, chan=0):
+        freq = getattr(tune_request, "target_freq", tune_request)
+        self._radio.schedule_command("freq", float(freq), self._command_time)
+
+    def get_samp_rate(self):
+        return self._radio.get_sample_rate()
+
+    def get_time_now(self):
+        return self._radio.clock.time_now()
+
+
+class virtual_radio_interface(object):
+    '''
+    Parts shared by the virtual transmitter and receiver: the network's directory,
+    its clock, the node's sample rate and the queue of timed commands
+    '''
+    def __init__(self, options, sym_rate, sps, freq, gain):
+
+        self.dev_logger = logging.getLogger('developer')
+
+        if freq is None:
+            sys.stderr.write("You must specify -f FREQ or --freq FREQ\n")
+            sys.exit(1)
+
+        self.node_id = options.source_mac_address
+        self.network = options.virtual_radio_network
+        self.network_dir = os.path.join(VIRTUAL_RADIO_ROOT, self.network)
+
+        if not os.path.isdir(self.network_dir):
+            try:
+                os.makedirs(self.network_dir)
+            except OSError:
+                # another node got there first
+                if not os.path.isdir(self.network_dir):
+                    raise
+
+        # the virtual clock runs at a whole number of samples per second
+        self._sps = sps
+        self._rate = float(round(sym_rate*sps))
+        if self._rate != sym_rate*sps:
+            print "\nRequested sample rate: %f" % (sym_rate*sps)
+            print "Actual sample rate: %f" % (self._rate)
+
+        self.clock = virtual_clock(os.path.join(self.network_dir, "clock"), self._rate,
+                                   options.virtual_radio_speed)
+
+        self.ring_len = int(round(options.virtual_radio_buffer_seconds*self._rate))
+
+        self._freq = freq
+        self._gain = 0.0 if gain is None else float(gain)
+
+        self.u = virtual_usrp(self)
+
+        self._commands = []
+        self._command_lock = threading.Lock()
+
+    def node_file_name(self, node_id):
+        return os.path.join(self.network_dir, "node%d.iq" % node_id)
+
+    def get_sample_rate(self):
+        return self._rate
+
+    def schedule_command(self, kind, value, cmd_time=None):
+        '''
+        Queue a gain or frequency change for the sample at cmd_time, or for the next
+        sample if cmd_time is None
+        '''
+        if cmd_time is None:
+            index = self.clock.sample_now()
+        else:
+            index = self.clock.time_to_sample(cmd_time)
+
+        with self._command_lock:
+            self._commands.append(TimedCommand(index, kind, value))
+            self._commands.sort(key=lambda cmd: cmd.index)
+
+    def apply_commands(self, index):
+        '''
+        Apply every queued command due at or before sample index. Returns the index
+        of the next queued command, or None if the queue is empty
+        '''
+        with self._command_lock:
+            while self._commands and self._commands[0].index <= index:
+                cmd = self._commands.pop(0)
+                if cmd.kind == "gain":
+                    self._gain = cmd.value
+                elif cmd.kind == "freq":
+                    self._freq = cmd.value
+                    self.frequency_changed()
+
+            if self._commands:
+                return self._commands[0].index
+            return None
+
+    def frequency_changed(self):
+        pass
+
+    def frontend_params(self):
+        return {"backend":"virtual",
+                "network":self.network,
+                "node_id":self.node_id,
+                "rf_frequency":self._freq,
+                "sample_rate":self._rate,
+                "clock_speed":self.clock.speed,
+                "buffer_seconds":float(self.ring_len)/self._rate}
+
+    @staticmethod
+    def add_options(normal, expert):
+        '''
+        Adds virtual radio options to the parser. The receiver and transmitter share
+        them, so register them once per app
+        '''
+        normal.add_option("--radio-backend", type="choice", choices=["uhd", "virtual"],
+                          default="uhd",
+                          help=("Radio front end to use. virtual connects the nodes " +
+                                "running on this host through shared memory instead of " +
+                                "USRPs [default=%default]"))
+        normal.add_option("--virtual-radio-network", type="string", default="extrasy",
+                          help=("Name of the virtual network to join. Nodes only hear " +
+                                "nodes on the same network [default=%default]"))
+        normal.add_option("--virtual-radio-link-gains", type="string", default="",
+                          help=("Comma separated link gains in dB, each as " +
+                                "node:node:gain, for example 1:2:-40,1:3:-55. Links are " +
+                                "symmetric [default=%default]"))
+        expert.add_option("--virtual-radio-default-link-gain", type="float", default=-30.0,
+                          help=("Gain in dB of links not listed in " +
+                                "--virtual-radio-link-gains [default=%default]"))
+        expert.add_option("--virtual-radio-noise-power", type="float", default=-60.0,
+                          help=("Noise power in dB added by this node's virtual " +
+                                "receiver [default=%default]"))
+        expert.add_option("--virtual-radio-speed", type="float", default=1.0,
+                          help=("How many times faster than realtime the virtual clock " +
+                                "runs. Every node of a network must use the same " +
+                                "speed [default=%default]"))
+        expert.add_option("--virtual-radio-buffer-seconds", type="float", default=2.0,
+                          help=("Length of each node's transmit ring buffer. Bursts " +
+                                "can be queued up to half of this ahead of the virtual " +
+                                "clock [default=%default]"))
+        expert.add_option("--virtual-radio-seed", type="int", default=-1,
+                          help=("Seed for the receiver noise. -1 seeds from the " +
+                                "system [default=%default]"))
+
+
+#-------------------------------------------------------------------#
+#   TRANSMITTER
+#-------------------------------------------------------------------#
+
+class virtual_radio_transmitter(virtual_radio_interface, gr.sync_block):
+    """
+    Writes timestamped bursts into this node's ring buffer
+
+    Samples between a tx_time tag and the next tx_eob tag go to the ring starting at
+    the sample index of the tx_time. Samples without a tx_time go out as soon as the
+    virtual clock allows. Like a usrp, the transmitter drops a burst whose start time
+    has already passed, and sends the rest of a burst that falls behind the clock
+    partway through as soon as it can. A burst more than half a ring ahead of the
+    clock waits until it fits.
+    """
+    def __init__(self, options, sym_rate, sps, freq=None, gain=None, verbose=False):
+        """
+        Inputs: complex stream tagged with tx_time, tx_sob and tx_eob
+
+        options               options with the virtual radio settings and
+                              source_mac_address
+        sym_rate      (float) symbol rate
+        sps             (int) samples per symbol
+        freq          (float) transmit frequency
+        gain          (float) transmit gain in dB. None uses 0
+        """
+        gr.sync_block.__init__(
+            self,
+            name = "virtual_radio_transmitter",
+            in_sig = [numpy.complex64],
+            out_sig = None
+        )
+
+        virtual_radio_interface.__init__(self, options, sym_rate, sps, freq, gain)
+
+        self.buffer = virtual_node_buffer(self.node_file_name(self.node_id),
+                                          self.ring_len)
+        self.buffer.set_tx_freq(self._freq)
+
+        self.max_lead = self.ring_len//2
+
+        # samples without a tx_time go out this far ahead of the clock
+        self.untimed_lead = max(1, int(UNTIMED_TX_LEAD_SECS*self._rate))
+
+        # sample index of the next input sample, or None between bursts
+        self._next_index = None
+        self._burst_started = False
+        self._dropping = False
+
+        self.num_late = 0
+        self.num_underflows = 0
+
+        if(verbose):
+            self._print_verbage()
+
+    def frequency_changed(self):
+        self.buffer.set_tx_freq(self._freq)
+
+    def _send(self, samples):
+
+        while len(samples) > 0 and not self._dropping:
+            if self._next_index is None:
+                self._next_index = self.clock.sample_now() + self.untimed_lead
+                self._burst_started = True
+
+            late = self.clock.sample_now() - self._next_index
+            if late > 0 and not self._burst_started:
+                # usrps drop a timed burst that arrives after its start time
+                self.num_late += 1
+                self._dropping = True
+                self.dev_logger.warning("virtual radio dropped a burst %d samples late " +
+                                        "at %s", late,
+                                        self.clock.sample_to_time(self._next_index))
+                return
+
+            elif late > 0:
+                # and send the rest of a burst that underflows as soon as they can
+                self.num_underflows += 1
+                self.dev_logger.warning("virtual radio underflow of %d samples at %s",
+                                        late, self.clock.sample_to_time(self._next_index))
+                self._next_index += late + self.untimed_lead
+
+            next_cmd = self.apply_commands(self._next_index)
+
+            num = len(samples)
+            if next_cmd is not None:
+                num = max(1, min(num, next_cmd - self._next_index))
+
+            self.clock.wait_for_sample(self._next_index + num - self.max_lead)
+
+            scale = 10**(self._gain/20.0)
+            self.buffer.write(self._next_index, scale*samples[:num])
+
+            self._burst_started = True
+            self._next_index += num
+            samples = samples[num:]
+
+    def work(self, input_items, output_items):
+
+        in0 = input_items[0]
+        nread = self.nitems_read(0) #number of items read on port 0
+        ninput_items = len(in0)
+
+        tags = self.get_tags_in_range(0, nread, nread+ninput_items)
+        tags = sorted(tags, key=lambda tag: tag.offset)
+
+        start = 0
+        for tag in tags:
+            key_string = pmt.pmt_symbol_to_string(tag.key)
+            offset = tag.offset - nread
+
+            if key_string == "tx_time":
+                self._send(in0[start:offset])
+                start = offset
+                self._next_index = self.clock.time_to_sample(pmt.to_python(tag.value))
+                self._burst_started = False
+                self._dropping = False
+
+            elif key_string == "tx_eob":
+                self._send(in0[start:offset+1])
+                start = offset+1
+                self._next_index = None
+                self._dropping = False
+
+        self._send(in0[start:ninput_items])
+
+        return ninput_items
+
+    def log_my_settings(self, indent_level,logger):
+        '''
+        Write out all initial parameter values to XML formatted file
+        '''
+
+        section_indent = indent_level
+
+        # tx front end section start
+        logger.info("%s<tx_frontend>", section_indent*'\t')
+        section_indent += 1
+
+        # tx front end section param values
+        params = self.frontend_params()
+        params["tx_gain"] = self._gain
+        logger.info(dict_to_xml(params, section_indent))
+
+        # tx front end section end
+        section_indent -= 1
+        logger.info("%s</tx_frontend>", section_indent*'\t')
+
+    def _print_verbage(self):
+        """
+        Prints information about the virtual transmitter
+        """
+        print "\nVirtual Radio Transmitter:"
+        print "Network:     %s"    % (self.network)
+        print "Node:        %d"    % (self.node_id)
+        print "Freq:        %sHz"  % (eng_notation.num_to_str(self._freq))
+        print "Gain:        %f dB" % (self._gain)
+        print "Sample Rate: %ssps" % (eng_notation.num_to_str(self._rate))
+
+
+#-------------------------------------------------------------------#
+#   RECEIVER
+#-------------------------------------------------------------------#
+
+class virtual_radio_receiver(virtual_radio_interface, gr.sync_block):
+    """
+    Produces what this node hears on the virtual network, paced by the virtual clock
+
+    Each output sample is the sum of every other node's ring buffer at that sample
+    index, scaled by the link gain, plus noise. The first sample is tagged with
+    rx_time, rx_rate and rx_freq like a usrp source. If the flow graph falls more
+    than half a ring behind the clock, the receiver skips ahead and tags the new
+    rx_time, the way a usrp reports an overflow.
+    """
+    def __init__(self, options, sym_rate, sps, freq=None, gain=None, verbose=False):
+        """
+        Outputs: complex stream tagged with rx_time, rx_rate and rx_freq
+
+        options               options with the virtual radio settings and
+                              source_mac_address
+        sym_rate      (float) symbol rate
+        sps             (int) samples per symbol
+        freq          (float) receive frequency
+        gain          (float) receive gain in dB. None uses 0
+        """
+        gr.sync_block.__init__(
+            self,
+            name = "virtual_radio_receiver",
+            in_sig = None,
+            out_sig = [numpy.complex64]
+        )
+
+        virtual_radio_interface.__init__(self, options, sym_rate, sps, freq, gain)
+
+        self.link_gains = parse_link_gains(options.virtual_radio_link_gains)
+        self.default_link_gain = options.virtual_radio_default_link_gain
+        self.noise_power = options.virtual_radio_noise_power
+
+        if options.virtual_radio_seed < 0:
+            self._rng = numpy.random.RandomState()
+        else:
+            self._rng = numpy.random.RandomState(options.virtual_radio_seed)
+
+        self.max_lag = self.ring_len//2
+        self.min_chunk = max(1, int(MIN_RX_CHUNK_SECS*self._rate))
+
+        # peer node buffers keyed by node id
+        self._peers = {}
+        self._last_scan = 0
+
+        # sample index of the next output sample, set on the first call to work
+        self._next_index = None
+        self._retag = True
+
+        self.num_overflows = 0
+
+        self._srcid = pmt.pmt_string_to_symbol("virtual_radio_receiver")
+
+        if(verbose):
+            self._print_verbage()
+
+    def frequency_changed(self):
+        self._retag = True
+
+    def link_gain(self, node_id):
+        return self.link_gains.get((node_id, self.node_id), self.default_link_gain)
+
+    def _scan_peers(self):
+        '''
+        Open the ring buffers of nodes that joined the network, and reopen any a
+        restarted node replaced
+        '''
+        self._last_scan = time.time()
+
+        for file_name in os.listdir(self.network_dir):
+            if not (file_name.startswith("node") and file_name.endswith(".iq")):
+                continue
+
+            try:
+                node_id = int(file_name[len("node"):-len(".iq")])
+            except ValueError:
+                continue
+
+            if node_id == self.node_id:
+                continue
+
+            path = os.path.join(self.network_dir, file_name)
+            peer = self._peers.get(node_id)
+            try:
+                if peer is None or peer.inode != os.stat(path).st_ino:
+                    self._peers[node_id] = virtual_node_buffer(path)
+                    self.dev_logger.info("virtual radio node %d hears node %d with " +
+                                         "link gain %f dB", self.node_id, node_id,
+                                         self.link_gain(node_id))
+            except (OSError, ValueError):
+                # the node left between listing the directory and opening its file
+                pass
+
+    def _add_tags(self, offset):
+        key = pmt.pmt_string_to_symbol("rx_time")
+        value = pmt.from_python(self.clock.sample_to_time(self._next_index).to_tuple())
+        self.add_item_tag(0, offset, key, value, self._srcid)
+
+        key = pmt.pmt_string_to_symbol("rx_rate")
+        self.add_item_tag(0, offset, key, pmt.from_python(self._rate), self._srcid)
+
+        key = pmt.pmt_string_to_symbol("rx_freq")
+        self.add_item_tag(0, offset, key, pmt.from_python(self._freq), self._srcid)
+
+    def work(self, input_items, output_items):
+
+        out = output_items[0]
+        nwritten = self.nitems_written(0)
+
+        self.clock.heartbeat()
+
+        if time.time() - self._last_scan > NODE_RESCAN_SECS:
+            self._scan_peers()
+
+        now = self.clock.sample_now()
+
+        if self._next_index is None:
+            self._next_index = now
+
+        # the transmitters have already started reusing the ring past this point
+        elif now - self._next_index > self.max_lag:
+            self.num_overflows += 1
+            self.dev_logger.warning("virtual radio receiver overflow, skipping %d samples",
+                                    now - self._next_index)
+            self._next_index = now
+            self._retag = True
+
+        while now - self._next_index < self.min_chunk:
+            self.clock.wait_for_sample(self._next_index + self.min_chunk)
+            now = self.clock.sample_now()
+
+        num_out = min(len(out), now - self._next_index)
+
+        next_cmd = self.apply_commands(self._next_index)
+        if next_cmd is not None:
+            num_out = max(1, min(num_out, next_cmd - self._next_index))
+
+        if self._retag:
+            self._add_tags(nwritten)
+            self._retag = False
+
+        rx = numpy.zeros(num_out, dtype=SAMPLE_DTYPE)
+        for node_id, peer in self._peers.items():
+            if abs(peer.tx_freq() - self._freq) < 1.0:
+                peer.add_to(rx, self._next_index, 10**(self.link_gain(node_id)/20.0))
+
+        noise_std = numpy.sqrt(10**(self.noise_power/10.0)/2)
+        noise = self._rng.standard_normal(2*num_out).astype(numpy.float32)
+        rx += noise_std*noise.view(SAMPLE_DTYPE)
+
+        out[:num_out] = 10**(self._gain/20.0)*rx
+
+        self._next_index += num_out
+
+        return num_out
+
+    def log_my_settings(self, indent_level,logger):
+        '''
+        Write out all initial parameter values to XML formatted file
+        '''
+
+        section_indent = indent_level
+
+        # rx front end section start
+        logger.info("%s<rx_frontend>", section_indent*'\t')
+        section_indent += 1
+
+        # rx front end section param values
+        params = self.frontend_params()
+        params.update({"rx_gain":self._gain,
+                       "noise_power":self.noise_power,
+                       "default_link_gain":self.default_link_gain,
+                       "link_gains":",".join("%d:%d:%g" % (a, b, gain) for (a, b), gain
+                                             in sorted(self.link_gains.items()) if a < b)})
+        logger.info(dict_to_xml(params, section_indent))
+
+        # rx front end section end
+        section_indent -= 1
+        logger.info("%s</rx_frontend>", section_indent*'\t')
+
+    def _print_verbage(self):
+        """
+        Prints information about the virtual receiver
+        """
+        print "\nVirtual Radio Receiver:"
+        print "Network:     %s"    % (self.network)
+        print "Node:        %d"    % (self.node_id)
+        print "Freq:        %sHz"  % (eng_notation.num_to_str(self._freq))
+        print "Gain:        %f dB" % (self._gain)
+        print "Noise:       %f dB" % (self.noise_power)
+        print "Sample Rate: %ssps" % (eng_notation.num_to_str(self._rate))
@@ -31,7 +31,6 @@ from itertools import izip
 import logging
 from math import floor
 from math import ceil
-from operator import itemgetter
 import random
 import struct
 import sqlite3
@@ -47,11 +46,15 @@ import numpy.ma as ma
 
 # project specific imports
 from dataInt import DataInterface
+from frame_history import FrameHistory
+from link_sounding import link_sounder
+from packet_queues import flow_key
 from digital_ll import beacon_utils
 from digital_ll import GridFrameSchedule as grid_sched
 from digital_ll import GridUpdateTuple
 from digital_ll import lincolnlog
 from digital_ll import power_controller
+from digital_ll import sample_timebase
 from digital_ll import SimpleFrameSchedule
 from digital_ll import time_spec_t
 from digital_ll.beacon_utils import TDMA_HEADER_MAX_FIELD_VAL
@@ -59,11 +62,21 @@ from digital_ll.beacon_utils import TDMA_HEADER_LEN
 from digital_ll.beacon_utils import PHY_HEADER_LEN
 from digital_ll.beacon_utils import frame_config_to_xml
 from digital_ll.FrameSchedule import SlotParamTuple
+from digital_ll.FrameSchedule import get_frame_timing
 from digital_ll.lincolnlog import dict_to_xml
 import sm
 from sm import SM
 
 
+# aggregate packets start with the number of packets they carry, and each packet 
+# inside is prefixed with its length and the header fields that differ between the
+# packets in an aggregate
+AGGREGATE_HEADER_FORMAT = '!H'
+AGGREGATE_HEADER_LEN = struct.calcsize(AGGREGATE_HEADER_FORMAT)
+AGGREGATE_SUBHEADER_FORMAT = '!HHHH'
+AGGREGATE_SUBHEADER_LEN = struct.calcsize(AGGREGATE_SUBHEADER_FORMAT)
+AGGREGATE_SUBHEADER_FIELDS = ("packetid", "sourceID", "destinationID")
+
 #=========================================================================================
 # Slot Manager Abstract Base Class
 #=========================================================================================
@@ -99,7 +112,12 @@ class SlotManager(object):
             self.ints_to_types[self.types_to_ints[key]] = key
         
         self.frame_window = options.frame_validaton_history_depth
-        self.frame_history = {}
+        self.frame_history = FrameHistory()
+        
+        # settings for how fill_slot packs data packets into slots
+        self.packing_mode = options.slot_packing_mode
+        self.packing_lookahead = max(1, options.slot_packing_lookahead)
+        self.aggregate_max_bytes = options.slot_aggregate_max_bytes
     
         # append any subclass specific headers here 
         self.slot_manager_header_names = ''
@@ -130,11 +148,9 @@ class SlotManager(object):
     #@timeit
     def prune_frame_history(self, frame_num):
         
-        for k in self.frame_history.keys():
-            if k < frame_num-self.frame_window:
-                del self.frame_history[k]  
+        self.frame_history.prune(frame_num-self.frame_window)
 
-    def timestamp_to_slot_and_frame(self, timestamp, frame_tuples, frame_times):
+    def timestamp_to_slot_and_frame(self, timestamp):
         '''
         Find the slot and frame number in which a timestamp occurred
         
@@ -145,15 +161,14 @@ class SlotManager(object):
         out_params = (None, None)
     
 
-        ins_point = bisect_right(frame_times, timestamp)
-        if ins_point >= 1:
-            frame_num = frame_tuples[ins_point-1][0]
+        frame_num = self.frame_history.find_frame(timestamp)
+        if frame_num is not None:
             frame = self.frame_history[frame_num]
             
             # now figure out what slot this timestamp is in
             pkt_offset = float(timestamp - frame["t0"])
             
-            slot_offsets = [s.offset for s in frame["slots"]]
+            slot_offsets = self.frame_history.slot_offsets(frame_num)
             
             ins_point = bisect_right(slot_offsets, pkt_offset)
             # check if packet is newer than any frames currently known about
@@ -190,14 +205,6 @@ class SlotManager(object):
         
         if len(self.frame_history) > 0:
             
-            frame_tuples = [ (key, time_spec_t(val["t0"])) for key,val in self.frame_history.items()]
-    
-            # sort by timestamp
-            frame_tuples.sort( key=itemgetter(1)) 
-            frame_times = [el[1] for el in frame_tuples]
-    
-            # subtract first frame's timestamp from all frames (helps with precision issues)
-            
             # figure out what frame this timestamp is in
             for meta, data in rf_in:
                 
@@ -210,9 +217,7 @@ class SlotManager(object):
                 packet_timestamp = time_spec_t(meta["timestamp"])
                 
                 frame_num, slot_num = self.timestamp_to_slot_and_frame(packet_timestamp + 
-                                                                       packet_middle,
-                                                                       frame_tuples, 
-                                                                       frame_times)
+                                                                       packet_middle)
                 if frame_num is not None and slot_num is not None:  
                     out_params.append((meta, data, frame_num, slot_num))
             
@@ -263,7 +268,7 @@ class SlotManager(object):
     
     
     def fill_slot(self, mac_config, packet_count, slot, slot_num, cur_frame_ts, frame_num, 
-                  pkt_in, link_dir, pre_guard, toID, control_packets=[]):
+                  pkt_in, link_dir, pre_guard, toID, control_packets=[], frame_config=None):
         '''
         Add as many packets to slot as will fit without exceeding the slot length
         
@@ -296,6 +301,9 @@ class SlotManager(object):
         types_to_ints         (dict) maps packet type to packet codes
         pre_guard            (float) time in seconds to reserve at the start of a slot
         toID                   (int) MAC address of the intended receiver
+        control_packets       (list) (meta,data) tuples to send ahead of pkt_in
+        frame_config          (dict) frame config slot belongs to. If given, packet times
+                                     are counted in its schedule's timebase
               
         Returns:
         
@@ -375,17 +383,26 @@ class SlotManager(object):
                 if current_dur + pkt_dur <= slot_dur:
                        
                     packet_count = (packet_count+ 1) % TDMA_HEADER_MAX_FIELD_VAL
-                    
-                    pkt_timestamp = time_spec_t(cur_frame_ts.int_s(), 
-                                         round((slot_offset + cur_frame_ts.frac_s())*fs)/fs)     
                                     
                     slot_packets.append( (deepcopy(meta),payload) )
                     num_slot_bytes += len(data)
                     current_dur += pkt_dur
                     
         
-        # now try to add in data packets               
-        while (len(pkt_in) > 0) and (current_dur < slot_dur):
+        # now try to add in data packets. The packing modes look past the head of the
+        # queue for packets that fit the time left in the slot
+        if self.packing_mode != "fifo":
+            result = self.pack_data_packets(mac_config, packet_count, slot, slot_num, 
+                                            frame_num, pkt_in, link_dir, toID, 
+                                            slot_dur, current_dur)
+            packed_pkts, packet_count, packed_dropped, packed_bytes = result
+            
+            slot_packets += packed_pkts
+            dropped_pkts += packed_dropped
+            num_slot_bytes += packed_bytes
+            
+        # in fifo mode, send packets in queue order until the next one doesn't fit
+        while (self.packing_mode == "fifo") and (len(pkt_in) > 0) and (current_dur < slot_dur):
             
             
             
@@ -402,22 +419,9 @@ class SlotManager(object):
             # should already be in the packet metadata. 
             # sourceID is set by the handler function that first adds in the packet to an 
             # input queue. 
-            h_meta={"fromID":mac_config["my_id"],
-                    "toID":toID,
-                    "packetid":packet_count,
-                    "pktCode":self.types_to_ints["data"],
-                    "phyCode":mac_config["phyCode"],
-                    "macCode":mac_config["macCode"],
-                    "linkdirection":link_dir,
-                    "rfcenterfreq":slot.rf_freq,
-                    "frequency":slot.bb_freq, 
-                    "bandwidth":slot.bw,
-                    "tx_gain": slot.tx_gain,
-                    "timeslotID":int(slot_num),
-                    "frameID":int(frame_num % TDMA_HEADER_MAX_FIELD_VAL )   
-                    }       
             # adding new header info to meta
-            meta.update(h_meta)
+            meta.update(self.make_data_header_meta(mac_config, packet_count, slot, 
+                                                   slot_num, frame_num, link_dir, toID))
             
             # build the class specific header tuple and add it to the payload
             slot_manager_header_tuple = self.make_slot_manager_header_tuple(meta,data)
@@ -461,40 +465,273 @@ class SlotManager(object):
                 current_dur += pkt_dur
             
         
-        # add timestamp and tx time fields
-        current_dur = 0    
+        # add timestamp and tx time fields. Packets go out back to back, so each one
+        # starts a whole number of samples after the start of the frame
+        if frame_config is not None:
+            timing = get_frame_timing(frame_config, fs)
+            timebase = timing.timebase
+            pkt_index = (timebase.to_index(cur_frame_ts) + 
+                         timing.slot_offset_samples[slot_num] + 
+                         timebase.num_samples(pre_guard))
+        else:
+            timebase = sample_timebase(fs, cur_frame_ts)
+            pkt_index = timebase.num_samples(slot_offset)
         for k, (meta,payload) in enumerate(slot_packets):
             
             self.dev_log.debug("sending packet number %i in frame %i, slot %i",
                                        meta["packetid"], meta["frameID"], meta["timeslotID"])
             
-            
-            # calculate how many samples this packet will take
-            num_packet_samples = self.tdma_mac.num_bytes_to_num_samples(len(payload))
-            
-            pkt_dur = float(num_packet_samples)/fs
-            
-            pkt_timestamp = time_spec_t(cur_frame_ts.int_s(), 
-                                        round((slot_offset + 
-                                               cur_frame_ts.frac_s() + 
-                                               current_dur)*fs)/fs)
-                    
+            pkt_timestamp = timebase.to_time(pkt_index)
            
             # TODO: update header fields for correct timestamp
             slot_packets[k][0]["timestamp"] = pkt_timestamp.to_tuple()
             
             # add a tx_time field to the first packet of every slot
-            if current_dur == 0:
+            if k == 0:
                 
                 slot_packets[k][0]["tx_time"] = pkt_timestamp.to_tuple()
                 
-            current_dur += pkt_dur         
+            # calculate how many samples this packet will take
+            pkt_index += self.tdma_mac.num_bytes_to_num_samples(len(payload))
                     
         if len(slot_packets) >0:
             slot_packets[0][0]["more_pkt_cnt"] = len(slot_packets)-1
                        
         return slot_packets, packet_count, pkt_in, dropped_pkts, num_slot_bytes   
     
+    def make_data_header_meta(self, mac_config, packet_count, slot, slot_num, frame_num,
+                              link_dir, toID):
+        '''
+        Build the header fields fill_slot adds to each outgoing data packet
+        '''
+        # destinationID is set by whatever is generating packets in the first place, and 
+        # should already be in the packet metadata. 
+        # sourceID is set by the handler function that first adds in the packet to an 
+        # input queue. 
+        h_meta={"fromID":mac_config["my_id"],
+                "toID":toID,
+                "packetid":packet_count,
+                "pktCode":self.types_to_ints["data"],
+                "phyCode":mac_config["phyCode"],
+                "macCode":mac_config["macCode"],
+                "linkdirection":link_dir,
+                "rfcenterfreq":slot.rf_freq,
+                "frequency":slot.bb_freq, 
+                "bandwidth":slot.bw,
+                "tx_gain": slot.tx_gain,
+                "timeslotID":int(slot_num),
+                "frameID":int(frame_num % TDMA_HEADER_MAX_FIELD_VAL )   
+                }
+        return h_meta
+    
+    def pack_data_packets(self, mac_config, packet_count, slot, slot_num, frame_num, 
+                          pkt_in, link_dir, toID, slot_dur, current_dur):
+        '''
+        Choose data packets from the first packing_lookahead packets of pkt_in to fill 
+        the slot time left after current_dur
+        
+        In first_fit mode the earliest queued packet that fits is taken next. In 
+        best_fit mode the largest packet that fits is taken next. Only the oldest 
+        unsent packet of each flow is ever a candidate, so packets within a flow are 
+        never reordered. If aggregate_max_bytes is nonzero, consecutive chosen packets 
+        going directly to toID are merged into aggregate packets to save per packet 
+        overhead, and the saved time is offered back to the remaining packets.
+        
+        Returns:
+        
+        slot_packets  (list) (meta,payload) tuples in transmit order, without timing
+        packet_count   (int) updated count of packets sent
+        dropped_pkts  (list) packets too long to ever fit a slot 
+        num_slot_bytes (int) number of data bytes sent in slot_packets
+        '''
+        fs = mac_config["fs"]
+        slot_packets = []
+        dropped_pkts = []
+        num_slot_bytes = 0
+        
+        # gather up the look-ahead window
+        window = []
+        for ind in range(min(self.packing_lookahead, len(pkt_in))):
+            try:
+                window.append(pkt_in[ind])
+            except IndexError:
+                break
+        
+        # drop any packets that will never fit any slot
+        durations = [self._payload_dur(len(data) + self.slot_manager_header_len, fs) 
+                     for meta, data in window] 
+        
+        removed = set()
+        for ind, (meta, data) in enumerate(window):
+            if durations[ind] > slot_dur:
+                meta.update(self.make_data_header_meta(mac_config, packet_count, slot, 
+                                                       slot_num, frame_num, link_dir, 
+                                                       toID))
+                payload = self.pack_slot_manager_header(
+                    self.make_slot_manager_header_tuple(meta,data), data)
+                
+                self.dev_log.warn(("packet code %i packet ID %i cannot fit slot %i in frame % i and " +
+                                   "will be dropped. Packet length of %i bytes " + 
+                                   "and %f seconds exceeds slot of %f seconds."),
+                                  meta["pktCode"], meta["packetid"], meta["timeslotID"], meta["frameID"],
+                                  len(payload), durations[ind], slot_dur)
+                # add the drop direction to metadata
+                meta["direction"] = "drop"
+                packet_count = ( packet_count + 1) % TDMA_HEADER_MAX_FIELD_VAL
+                dropped_pkts.append((meta,payload))
+                removed.add(ind)
+        
+        flows = [flow_key(meta, data) for meta, data in window]
+        
+        # greedily add packets to the plan until nothing else fits
+        planned = []
+        time_left = slot_dur - current_dur
+        while True:
+            # the candidates are the oldest unplanned packet of each flow
+            seen_flows = set()
+            candidates = []
+            for ind in range(len(window)):
+                if ind in removed or ind in planned or flows[ind] in seen_flows:
+                    continue
+                seen_flows.add(flows[ind])
+                candidates.append(ind)
+            
+            best = None
+            for ind in candidates:
+                groups = self._group_planned_packets(sorted(planned + [ind]), window, toID)
+                if self._planned_dur(groups, window, fs) <= time_left:
+                    if self.packing_mode == "first_fit":
+                        best = ind
+                        break
+                    elif best is None or durations[ind] > durations[best]:
+                        best = ind
+            
+            if best is None:
+                break
+            planned.append(best)
+        
+        # build the packets for the slot in queue order
+        for group in self._group_planned_packets(sorted(planned), window, toID):
+            meta, data = window[group[0]]
+            meta.update(self.make_data_header_meta(mac_config, packet_count, slot, 
+                                                   slot_num, frame_num, link_dir, toID))
+            
+            if len(group) > 1:
+                # every packet in the aggregate gets its own packet id, and the 
+                # aggregate goes out under the id of the first one
+                for ind in group:
+                    window[ind][0]["packetid"] = packet_count
+                    packet_count = (packet_count+ 1) % TDMA_HEADER_MAX_FIELD_VAL
+                
+                meta["pktCode"] = self.types_to_ints["aggregate"]
+                data = self.pack_aggregate([window[ind] for ind in group])
+                num_slot_bytes += sum(len(window[ind][1]) for ind in group)
+            else:
+                packet_count = (packet_count+ 1) % TDMA_HEADER_MAX_FIELD_VAL
+                num_slot_bytes += len(data)
+            
+            payload = self.pack_slot_manager_header(
+                self.make_slot_manager_header_tuple(meta,data), data)
+            
+            slot_packets.append( (meta,payload) )
+            
+        # take everything sent or dropped out of the queue. Going from the back keeps
+        # the remaining indices valid
+        for ind in sorted(removed.union(planned), reverse=True):
+            del pkt_in[ind]
+                
+        return slot_packets, packet_count, dropped_pkts, num_slot_bytes
+    
+    def _payload_dur(self, num_bytes, fs):
+        '''
+        Time in seconds to send a slot manager payload of num_bytes
+        '''
+        return float(self.tdma_mac.num_bytes_to_num_samples(num_bytes))/fs
+    
+    def _group_planned_packets(self, planned, window, toID):
+        '''
+        Split the sorted list of planned window indices into lists of indices that 
+        will go out as one packet. Without aggregation every packet is its own group.
+        '''
+        groups = []
+        group_bytes = 0
+        group_open = False
+        for ind in planned:
+            meta, data = window[ind]
+            
+            # only packets ending their trip at toID can share a packet, otherwise they
+            # would need to be split apart again for routing
+            can_aggregate = (self.aggregate_max_bytes > 0 and 
+                             meta.get("destinationID") == toID)
+            pkt_bytes = len(data) + AGGREGATE_SUBHEADER_LEN
+            
+            # only packets next to each other in the queue are combined, so the
+            # aggregate can't jump ahead of anything left behind
+            if (can_aggregate and group_open and groups[-1][-1] == ind - 1 and 
+                group_bytes + pkt_bytes <= self.aggregate_max_bytes):
+                groups[-1].append(ind)
+                group_bytes += pkt_bytes
+            else:
+                groups.append([ind])
+                group_bytes = AGGREGATE_HEADER_LEN + pkt_bytes
+                group_open = can_aggregate
+        
+        return groups
+    
+    def _planned_dur(self, groups, window, fs):
+        '''
+        Total time needed to send a list of packet groups
+        '''
+        total_dur = 0
+        for group in groups:
+            if len(group) > 1:
+                num_bytes = (AGGREGATE_HEADER_LEN + 
+                             sum(len(window[ind][1]) + AGGREGATE_SUBHEADER_LEN 
+                                 for ind in group))
+            else:
+                num_bytes = len(window[group[0]][1])
+            total_dur += self._payload_dur(num_bytes + self.slot_manager_header_len, fs)
+        
+        return total_dur
+    
+    def pack_aggregate(self, pkt_list):
+        '''
+        Combine several (meta, data) packets into the body of one aggregate packet. 
+        Each packet keeps its own AGGREGATE_SUBHEADER_FIELDS
+        '''
+        parts = [struct.pack(AGGREGATE_HEADER_FORMAT, len(pkt_list))]
+        for meta, data in pkt_list:
+            parts.append(struct.pack(AGGREGATE_SUBHEADER_FORMAT, len(data),
+                                     *[meta[field] for field in AGGREGATE_SUBHEADER_FIELDS]))
+            parts.append(data)
+        return ''.join(parts)
+    
+    def unpack_aggregate(self, meta, payload):
+        '''
+        The inverse of pack_aggregate: split the body of an aggregate packet back into
+        the list of (meta, data) packets it carries. Each packet gets its own copy of
+        the aggregate's meta, updated with the packet's own header fields
+        '''
+        num_pkts = struct.unpack_from(AGGREGATE_HEADER_FORMAT, payload)[0]
+        offset = AGGREGATE_HEADER_LEN
+        
+        pkt_list = []
+        for k in range(num_pkts):
+            subheader = struct.unpack_from(AGGREGATE_SUBHEADER_FORMAT, payload, offset)
+            offset += AGGREGATE_SUBHEADER_LEN
+            data_len = subheader[0]
+            
+            sub_meta = deepcopy(meta)
+            sub_meta.update(zip(AGGREGATE_SUBHEADER_FIELDS, subheader[1:]))
+            sub_meta["pktCode"] = self.types_to_ints["data"]
+            if "messagelength" in sub_meta:
+                sub_meta["messagelength"] = data_len
+            
+            pkt_list.append( (sub_meta, payload[offset:offset+data_len]) )
+            offset += data_len
+            
+        return pkt_list
+    
     def make_slot_manager_header_tuple(self, meta, data):
         '''
         This should be overloaded in subclasses
@@ -507,7 +744,10 @@ class SlotManager(object):
     def append_my_settings(self, indent_level, settings_xml):
         
         params = {
-                  "pkt_stat_frame_window":self.frame_window}
+                  "pkt_stat_frame_window":self.frame_window,
+                  "slot_packing_mode":self.packing_mode,
+                  "slot_packing_lookahead":self.packing_lookahead,
+                  "slot_aggregate_max_bytes":self.aggregate_max_bytes}
         
         settings_xml+= "\n" + dict_to_xml(params, indent_level)
         
@@ -525,6 +765,19 @@ class SlotManager(object):
                           help=("Number of frames used to compute packet statistics. " +
                                 "In general this set to beacon_timeout*frame_rate " +
                                 "[default=%default]"))
+        expert.add_option("--slot-packing-mode", type="choice", 
+                          choices=["fifo", "first_fit", "best_fit"], default="fifo",
+                          help=("How data packets are chosen to fill a slot. fifo stops " +
+                                "at the first packet that doesn't fit. first_fit and " +
+                                "best_fit look ahead in the queue for packets that do " +
+                                "[default=%default]"))
+        expert.add_option("--slot-packing-lookahead", default=8, type="int",
+                          help=("Number of queued packets the packing modes consider " +
+                                "for each slot [default=%default]"))
+        expert.add_option("--slot-aggregate-max-bytes", default=0, type="int",
+                          help=("Max size of an aggregate packet built from several " +
+                                "small data packets by the packing modes. 0 disables " +
+                                "aggregation [default=%default]"))
         
 
         
@@ -694,7 +947,8 @@ class BaseSlotManager(SlotManager):
                 toID = slot.owner
                 result = self.fill_slot(mac_config, packet_count, slot, k, cur_frame_ts,   
                                         frame_num, mobile_queues[toID], "down", 
-                                        pre_guard, slot.owner)
+                                        pre_guard, slot.owner, 
+                                        frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, mobile_queues[toID], dropped, num_slot_bytes = result
@@ -861,7 +1115,8 @@ class MobileSlotManager(SlotManager):
             if slot.type == 'uplink' and slot.owner == mac_config["my_id"]:
                 result = self.fill_slot( mac_config, packet_count, slot, k, frame_ts,   
                                         frame_num, app_in, "up",
-                                        pre_guard, mac_config["base_id"])
+                                        pre_guard, mac_config["base_id"], 
+                                        frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, app_in, dropped, num_slot_bytes = result
@@ -1147,6 +1402,48 @@ class shared_slot_manager_ber_feedback(object):
             new_tup = self.SlotManagerHeaderTuple(slot_total_bytes=0,
                                                   slot_payload_bytes=0,)
         return new_tup
+
+    def setup_link_sounder(self, options):
+        '''
+        Start background channel sounding if it is enabled
+        '''
+        if options.sounding_enabled:
+            self.link_sounder = link_sounder(options)
+        else:
+            self.link_sounder = None
+
+    def sound_links(self, mac_config, cur_frame_num, pkt_tups):
+        '''
+        Measure the links packets in pkt_tups arrived on and update the link estimates.
+        Returns the set of node ids whose pathloss estimate changed
+        '''
+        if self.link_sounder is None:
+            return set()
+
+        pkt_overhead = (self.slot_manager_header_len +
+                        self.tdma_mac.get_tdma_header_len() +
+                        self.tdma_mac.get_phy_header_len())
+
+        self.link_sounder.measure_packets(pkt_tups, self.frame_history, mac_config,
+                                          pkt_overhead)
+        changed_links = self.link_sounder.update(cur_frame_num)
+
+        for from_id in changed_links:
+            self.dev_log.info("sounding: pathloss from node %i changed to %0.2f dB",
+                              from_id, self.link_sounder.estimates.get_pathloss(from_id))
+
+        return changed_links
+
+    def append_sounding_settings(self, indent_level, opts_xml):
+
+        if self.link_sounder is not None:
+            opts_xml += "\n%s<link_sounder>"%(indent_level*'\t')
+            indent_level+=1
+            opts_xml = self.link_sounder.append_my_settings(indent_level, opts_xml)
+            indent_level-=1
+            opts_xml += "\n%s</link_sounder>"%(indent_level*'\t')
+
+        return opts_xml
      
 #=========================================================================================
 # Base Packet Bit Error Rate based slot manager with performance feedback
@@ -1206,6 +1503,9 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
         if self.pwr_control:
             self.power_controller = power_controller(options)
 
+        self.setup_link_sounder(options)
+        self.changed_links = set()
+
         self.link_summary = {}
         self.grid_fig = None
         
@@ -1306,6 +1606,8 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
                                
             pkt_tups = self.packets_to_slot_and_frame(rf_in, mac_config)
             
+            # uplink packets double as sounding signals
+            self.changed_links.update(self.sound_links(mac_config, cur_frame_num, pkt_tups))
             
             valid_pkts = [(pkt[0], pkt[1]) for pkt in pkt_tups 
                              if pkt[0]["crcpass"] == True and 
@@ -1497,8 +1799,10 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
                "peer_ids":mac_config["peer_ids"],
                "rf_freq":rf_freq,
                "state_counter":self.state_counter,
+               "changed_links":self.changed_links,
                }
         outp = self.sm.step( (inp, False))    
+        self.changed_links = set()
         
         self.link_ids = outp["link_ids"]
         self.link_summary = outp["link_summary"]
@@ -1524,10 +1828,17 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
         # self.dev_log.debug("checking that power control is %i",self.pwr_control)  
         if self.pwr_control:
             self.dev_log.debug("calling power controller optimization function")
+            
+            if self.link_sounder is not None:
+                pathloss = self.link_sounder.estimates.pathloss_dict()
+            else:
+                pathloss = None
+            
             next_sched = self.power_controller.optimize_power(frame_num,
                                                               next_sched,
                                                               self.db,
-                                                              self.dev_log)     
+                                                              self.dev_log,
+                                                              pathloss)     
             
         if self.state_counter < outp["state_counter"]:            
             fc = next_sched.compute_frame(frame_change)
@@ -1659,7 +1970,8 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
                 toID = slot.owner
                 result = self.fill_slot( mac_config, packet_count, slot, k, 
                                    cur_frame_ts, frame_num, mobile_queues[toID], 
-                                   "down", pre_guard, slot.owner)
+                                   "down", pre_guard, slot.owner, 
+                                   frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, mobile_queues[toID], dropped, num_slot_bytes = result
@@ -1777,6 +2089,8 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
         opts_xml = self.rf_sm.append_my_settings(indent_level, opts_xml) 
         indent_level-=1
         opts_xml += "\n%s</rf_hopper>"%(indent_level*'\t')
+        
+        opts_xml = self.append_sounding_settings(indent_level, opts_xml)
            
         opts_xml = super(base_slot_manager_ber_feedback, self).append_my_settings(indent_level,
                                                                                   opts_xml)    
@@ -1818,6 +2132,7 @@ class base_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, BaseSlotM
         reinforcement_learner.add_options(normal, expert)
         frame_rf_hopper_base.add_options(normal, expert)
         beacon_hopper_base.add_options(normal, expert)
+        link_sounder.add_options(normal, expert)
         
         
     def log_my_settings(self, indent_level, logger): 
@@ -1869,9 +2184,15 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
         self.pwr_control_up = options.rf_power_control_enabled
         self.beacon_hopping_enabled = options.berf_beacon_hopping_enabled
         
+        # with wideband sync, beacons are heard on every digital channel at once, so 
+        # only rf frequencies need to be searched
+        self.wideband_sync = bool(options.beacon_sync_wideband)
+        
         self.rf_sm = frame_rf_hopper_mobile(types_to_ints, options)
         self.rf_sm.start()
         
+        self.setup_link_sounder(options)
+        
         if self.beacon_hopping_enabled:
             self.beacon_sm = beacon_hopper_mobile(types_to_ints, options)
             self.beacon_sm.start()
@@ -1942,6 +2263,9 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
                 
                 
             verified_pkts = self.packets_to_slot_and_frame(rf_in, mac_config)
+            
+            # downlink packets double as sounding signals
+            self.sound_links(mac_config, cur_frame_num, verified_pkts)
         
             for meta, data, frame_num, slot_num in verified_pkts:
                 # only process packets that pass CRC, otherwise we can't trust any of the data
@@ -2081,7 +2405,8 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
             if slot.type == 'uplink' and slot.owner == mac_config["my_id"]:
                 result = self.fill_slot( mac_config, packet_count, slot, k, frame_ts, 
                                         frame_num, app_in, "up",
-                                        pre_guard, mac_config["base_id"], [control_tuple])
+                                        pre_guard, mac_config["base_id"], [control_tuple],
+                                        frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, app_in, dropped, num_slot_bytes = result
@@ -2147,20 +2472,12 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
             
         '''  
         
-        frame_tuples = [ (key, time_spec_t(val["t0"])) for key,val in self.frame_history.items()]
-    
-        # sort by timestamp
-        frame_tuples.sort( key=itemgetter(1)) 
-        frame_times = [el[1] for el in frame_tuples]
-        
         # get the current timestamp, but subtract off 10 samples worth of time to ensure
         # precision issues don't cause us to dither at slot boundaries
         
         timestamp = frame_ts - mac_config["lead_limit"] - 10.0/mac_config["fs"]
         # find frame num and slot num for the current real time
-        end_frame_num, slot_num = self.timestamp_to_slot_and_frame(timestamp,
-                                                                   frame_tuples, 
-                                                                   frame_times)
+        end_frame_num, slot_num = self.timestamp_to_slot_and_frame(timestamp)
         
         # hard limit parameters to 0 to prevent crashes when the timestamp doesn't occur 
         # in a frame the state machine knows about
@@ -2213,7 +2530,7 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
                }
         last_beacon_chan = self.beacon_channel
         
-        if self.beacon_hopping_enabled:
+        if self.beacon_hopping_enabled and not self.wideband_sync:
             outp = self.beacon_sm.step( (inp, False) )
         
             self.beacon_channel = outp["beacon_chan"]
@@ -2255,6 +2572,12 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
         else:
             frame_config = self.current_schedule.compute_frame(frame_num)
             self.frame_history[frame_num] = deepcopy(frame_config)
+        
+        # a wideband search can find the beacon on any channel, so follow the channel
+        # the latest beacon was heard on
+        if (self.beacon_hopping_enabled and self.wideband_sync and 
+            self.current_meta is not None and "frequency" in self.current_meta):
+            self.beacon_channel = int(self.current_meta["frequency"])
             
         if self.beacon_hopping_enabled:    
             for k, slot in enumerate(frame_config["slots"]):    
@@ -2265,12 +2588,19 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
 
     def append_my_settings(self, indent_level, opts_xml):
         
+        params = {
+                  "wideband_sync":self.wideband_sync,
+                  }
+        opts_xml += "\n" + dict_to_xml(params, indent_level)
+        
         # add components
         opts_xml += "%s<rf_hopper>\n"%(indent_level*'\t')
         indent_level+=1
         opts_xml = self.rf_sm.append_my_settings(indent_level, opts_xml) 
         indent_level-=1
         opts_xml += "%s</rf_hopper>\n"%(indent_level*'\t')
+        
+        opts_xml = self.append_sounding_settings(indent_level, opts_xml)
            
         opts_xml = super(mobile_slot_manager_ber_feedback, self).append_my_settings(indent_level,
                                                                                     opts_xml)  
@@ -2284,6 +2614,7 @@ class mobile_slot_manager_ber_feedback(shared_slot_manager_ber_feedback, MobileS
         
         frame_rf_hopper_mobile.add_options(normal, expert)
         beacon_hopper_mobile.add_options(normal, expert)
+        link_sounder.add_options(normal, expert)
         
         
     def log_my_settings(self, indent_level, logger): 
@@ -2362,7 +2693,8 @@ class shared_agent_protocol_manager(object):
         # store action space to class variable
         pfs.store_action_space(pattern_set=pattern_set, 
                                owner_ids=options.agent_mac_address_mapping,
-                               rf_freqs=rf_freq)        
+                               rf_freqs=rf_freq,
+                               fs=fs)        
          
       
 #=========================================================================================
@@ -2391,6 +2723,9 @@ class reinforcement_learner(SM):
         self.slot_exploration_alg = options.berf_exploration_protocol
         self.types_to_ints = types_to_ints
         
+        # peers whose links changed according to channel sounding since the last reset
+        self.changed_peers = set()
+        
         # if this is not inf, the reinforment learner should verify that it has
         # received at least one packet from any mobile over the last sync_timeout_frames  
         # before storing results for learning
@@ -2429,7 +2764,9 @@ class reinforcement_learner(SM):
             slot_num INTEGER NOT NULL,
             channel_num INTEGER NOT NULL,
             rf_freq REAL NOT NULL,
-            data TEXT NOT NULL,
+            data BLOB NOT NULL,
+            num_rows INTEGER NOT NULL,
+            num_cols INTEGER NOT NULL,
             PRIMARY KEY (frame_num, owner, link_num, link_type),
             -- FOREIGN KEY(frame_num, owner, link_num, link_type) REFERENCES 
             --     link_masks(frame_num, owner, link_num, link_type),
@@ -2443,7 +2780,9 @@ class reinforcement_learner(SM):
             owner INTEGER NOT NULL,
             link_num INTEGER NOT NULL,
             link_type TEXT NOT NULL,
-            data TEXT NOT NULL,
+            data BLOB NOT NULL,
+            num_rows INTEGER NOT NULL,
+            num_cols INTEGER NOT NULL,
             PRIMARY KEY (frame_num, owner, link_num, link_type),
             FOREIGN KEY (frame_num) REFERENCES frame_nums(frame_num) ON DELETE CASCADE
             );   
@@ -2592,6 +2931,8 @@ class reinforcement_learner(SM):
         slot_assignments = beacon_assignments
         rf_freq = inp["rf_freq"]
         
+        self.changed_peers.update(inp.get("changed_links", ()))
+        
 
         # handle first state machine iteration
         if state == "init":
@@ -2697,6 +3038,15 @@ class reinforcement_learner(SM):
             for link_id in link_ids:
                 downlink_states[link_id] = self.choose_explore_or_exploit(had_recent_traffic)
                 uplink_states[link_id] = self.choose_explore_or_exploit(had_recent_traffic)
+            
+            # what was learned about links that have since changed no longer applies, 
+            # so go back to exploring them
+            changed_link_ids = [link_id for link_id in link_ids 
+                                if link_id[0] in self.changed_peers]
+            for link_id in changed_link_ids:
+                self.dev_log.info("link to node %i changed, exploring", link_id[0])
+                downlink_states[link_id] = "explore"
+                uplink_states[link_id] = "explore"
                 
             # sort out into explorers and exploiters so we can service the exploit nodes
             # first
@@ -2719,6 +3069,15 @@ class reinforcement_learner(SM):
                                                        rf_freq)
             else:
                 new_link_summary=old_link_summary
+            
+            if len(changed_link_ids) > 0:
+                new_link_summary = dict(new_link_summary)
+                for (peer_id, link_dir, freq) in new_link_summary.keys():
+                    if peer_id in self.changed_peers:
+                        new_link_summary[(peer_id, link_dir, freq)] = ma.array(
+                            ma.empty( (num_freq_slots, num_time_slots) ), mask=True)
+            
+            self.changed_peers = set()
                 
             # uplink exploiters get first dibs since the uplink slots are most critical to
             # algorithm performance
@@ -2796,94 +3155,71 @@ class reinforcement_learner(SM):
         """
         update the performance summary of the node. alpha is the forgetting factor applied
         to old data
+        
+        Where a slot has both an old BER and a new one, the new summary holds 
+        (1-alpha)*old + alpha*new. Where it only has one of them, that one is used 
+        unweighted.
         """        
         
-        # copy the old summary into the new sumamry. The relevant part of new_summary
-        # will be overwritten in the following loops        
-        new_summary = deepcopy(old_summary)
+        # summaries on other rf frequencies carry over as they are. The entries for 
+        # rf_freq are replaced with new arrays below, so no copy of the old ones is needed
+        new_summary = dict(old_summary)
         
-        for (peer_id, direction) in self.link_dirs:
-            
-            # make new empty masked array for peer_id, direction combo
-            new_summary[(peer_id, direction, rf_freq)] = ma.array(ma.empty((num_freq_slots, 
-                                                                            num_time_slots)),
-                                                                  mask=True)
-            
+        # index each (to_id, from_id) pair by its position in link_dirs
+        link_inds = {}
+        for k, (peer_id, direction) in enumerate(self.link_dirs):
             if direction == "uplink":
-                from_id = peer_id
-                to_id = base_id
+                link_inds[(base_id, peer_id)] = k
             else:
-                from_id = base_id
-                to_id = peer_id
-                
-            results = self._db.get_slot_sums(to_id, from_id, self.slot_learning_window,
-                                             rf_freq)
-            pass_fails = {}
-            for r in results:
-                self.dev_log.debug("Processing result set: %s", tuple(r))
-                # initialize storage for intermediate results for each slot and channel
-                # number in the results
-                if (r["channel_num"],r["slot_num"]) not in pass_fails:
-                    pass_fails[ (r["channel_num"],r["slot_num"])] = {'pass':0, 'fail':0}  
-                # store intermediate result
-                pass_fails[ (r["channel_num"],r["slot_num"])][r["status"]] = float(
-                  r["slot_total_bits"])    
-            
-            # compute BER for each channel and slot in results (This also sets mask in 
-            # the new_summary slot appropriately)
-            for (row,col), bits in pass_fails.iteritems():
-                #self.dev_log.debug("updating chan %i, timeslot %i for slot_perf:\n%s",
-                #                   row, col, slot_perf)
-                if bits["fail"]+bits["pass"]>0:
-                    new_summary[ (peer_id, direction, rf_freq)][row,col] = bits["fail"]/(bits["fail"]+bits["pass"])    
-            
-            
-            for num, key in enumerate(old_summary.keys()):
-                self.dev_log.debug("old summary key %i:  %s",num, key)
-                self.dev_log.debug("old summary val %s", old_summary[key])
-            for num, key in enumerate(new_summary.keys()):
-                self.dev_log.debug("new summary key %i:  %s",num, key)
-                self.dev_log.debug("new summary val %s", new_summary[key])    
-             
-            new_summary[ (peer_id, direction,rf_freq)] = self.combine_arrays(old_summary[ (peer_id, direction, rf_freq)], 
-                                                                new_summary[ (peer_id, direction, rf_freq)],
-                                                                self.learning_rate)
-            
-            for num, key in enumerate(new_summary.keys()):
-                self.dev_log.debug("combined summary key %i:  %s",num, key)
-                self.dev_log.debug("combined summary val %s", new_summary[key])  
+                link_inds[(peer_id, base_id)] = k
+        
+        num_links = len(self.link_dirs)
+        shape = (num_links, num_freq_slots, num_time_slots)
+        
+        # pass/fail bits of every link, channel and slot from a single query
+        results = self._db.get_link_slot_sums(base_id, self.slot_learning_window, rf_freq)
+        
+        row_inds = np.array([link_inds.get((int(to_id), int(from_id)), -1) 
+                             for to_id, from_id in results[:,:2]], dtype=int)
+        keep = row_inds >= 0
+        inds = (row_inds[keep], 
+                results[keep,3].astype(int),  # channel_num
+                results[keep,2].astype(int))  # slot_num
+        
+        pass_bits = np.zeros(shape)
+        fail_bits = np.zeros(shape)
+        np.add.at(pass_bits, inds, results[keep,4])
+        np.add.at(fail_bits, inds, results[keep,5])
+        
+        self.dev_log.debug("updating link summary from %i slot results", np.count_nonzero(keep))
+        
+        # new BER of each slot with traffic, in place in fail_bits
+        total_bits = pass_bits
+        total_bits += fail_bits
+        has_new = total_bits > 0
+        fail_bits[has_new] /= total_bits[has_new]
+        new_bers = fail_bits
+        
+        # old summaries with masked elements as nan
+        bers = np.empty(shape)
+        for k, (peer_id, direction) in enumerate(self.link_dirs):
+            bers[k] = ma.filled(old_summary[(peer_id, direction, rf_freq)], np.nan)
+        
+        # apply the forgetting factor in place where there are both old and new values
+        # and take the new values where there are no old ones
+        has_old = ~np.isnan(bers)
+        both = has_new & has_old
+        bers[both] *= 1 - self.learning_rate
+        bers[both] += self.learning_rate*new_bers[both]
+        new_only = has_new & ~has_old
+        bers[new_only] = new_bers[new_only]
+        
+        for k, (peer_id, direction) in enumerate(self.link_dirs):
+            new_summary[(peer_id, direction, rf_freq)] = ma.masked_invalid(bers[k], 
+                                                                          copy=False)
     
         return new_summary
     
-    @staticmethod
-    def combine_arrays(a,b,alpha):
-        """
-        Where elements exist in both a and b, apply the forgetting factor to the sum. 
-        
-        ie, (1-alpha)*a + alpha*b
-        Where an element exists in only one array, use the unweighted value
-        """
-        c = (1-alpha)*a + alpha*b
-        ab_xor_vals = ma.array(np.zeros(ma.shape(a)), mask=True)
-        
-        # assign the elements from b that are not masked in b but masked in a into ab_xor_vals
-        ab_xor_vals = ma.where(ma.getmask(a) & ~ma.getmask(b), b, ab_xor_vals )
-        
-        # assign the elements from a that are not masked in a but masked in b into ab_xor_vals
-        ab_xor_vals = ma.where(ma.getmask(b) & ~ma.getmask(a), a, ab_xor_vals )
-        
-        c = reinforcement_learner.masked_sum( c, ab_xor_vals)
-        
-        return c
-    
-    @staticmethod     
-    def masked_sum(a,b):
-        """
-        Compute the sum of two masked arrays, where elements in the exlusive OR of the
-        two masks are assumed to be zero
-        """
-        return ma.masked_array(a.filled(0)+b.filled(0), (ma.getmask(a) & ma.getmask(b)))   
-         
     def choose_explore_or_exploit(self, had_recent_traffic=None):
         """
         Decide whether to explore the space or exploit what we know
@@ -3054,17 +3390,36 @@ class reinforcement_learner(SM):
 
         return channel_num, slot_num    
     
+    @staticmethod
+    def table_to_blob(table):
+        '''
+        Pack a 2d (masked) array into a raw float32 blob for the database, with masked
+        elements stored as nan. Returns the blob and the table shape
+        '''
+        vals = np.ascontiguousarray(ma.filled(ma.asarray(table, dtype=np.float32), np.nan))
+        return sqlite3.Binary(vals.tostring()), vals.shape
+    
+    @staticmethod
+    def blob_to_table(data, num_rows, num_cols):
+        '''
+        Unpack a blob written by table_to_blob into a masked array, with nan elements
+        masked
+        '''
+        vals = np.frombuffer(data, dtype=np.float32).reshape(num_rows, num_cols)
+        return ma.masked_invalid(vals)
+    
     #@timeit
     def store_mask(self, frame_num, peer_id, link_num, link_dir, valid_slots):
            
         with self._db.con as c:
             try:
                 # store this grid update to database    
+                data, (num_rows, num_cols) = self.table_to_blob(valid_slots)
                 c.execute("""
                 insert into link_masks
-                (frame_num, owner, link_num, link_type, data) values
-                (?,?,?,?,?)""",
-                (frame_num, peer_id, link_num, link_dir, cPickle.dumps(valid_slots)))
+                (frame_num, owner, link_num, link_type, data, num_rows, num_cols) values
+                (?,?,?,?,?,?,?)""",
+                (frame_num, peer_id, link_num, link_dir, data, num_rows, num_cols))
                 
             except sqlite3.IntegrityError as err:
                 self.dev_log.exception("Integrity error inserting mask for frame %i", frame_num)
@@ -3074,17 +3429,19 @@ class reinforcement_learner(SM):
     #@timeit
     def store_bers(self, frame_num, peer_id, link_num, link_dir, ber_table, slot_assignment, slot_num, task):
         
+        data, (num_rows, num_cols) = self.table_to_blob(ber_table)
+        
         # store this grid update to database
         with self._db.con as c:    
             c.execute("""
             insert into link_decisions
             (frame_num, owner, link_num, link_type, task, decision_order, 
-             slot_num, channel_num, rf_freq, data) values
-            (?,?,?,?,?,?,?,?,?,?)
+             slot_num, channel_num, rf_freq, data, num_rows, num_cols) values
+            (?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             (frame_num, peer_id, link_num, link_dir, task, slot_assignment.order, 
              int(slot_num), int(slot_assignment.channel_num), slot_assignment.rf_freq, 
-             cPickle.dumps(ber_table)))
+             data, num_rows, num_cols))
             
     def log_bers(self, frame_num, peer_id, link_num, link_dir, ber_table, slot_assignment, slot_num, task):
         
@@ -3629,11 +3986,12 @@ def make_beacon(mac_config, frame_config, next_sched, frame_num, packet_count,
     # compute the offset to the start of the schedule
     frame_offset = float(t0 - cur_frame_ts)-slot.offset - pre_guard
 
-    packet_offset = slot.offset + pre_guard
-
-    # round beacon packet tx timestamp to nearest sample
-    pkt_timestamp = time_spec_t(cur_frame_ts.int_s(), 
-                                round((packet_offset + cur_frame_ts.frac_s())*fs)/fs)
+    # beacons go out a whole number of samples after the start of the frame
+    timing = get_frame_timing(frame_config, fs)
+    pkt_index = (timing.timebase.to_index(cur_frame_ts) + 
+                 timing.slot_offset_samples[slot_num] + 
+                 timing.timebase.num_samples(pre_guard))
+    pkt_timestamp = timing.timebase.to_time(pkt_index)
     
        
     
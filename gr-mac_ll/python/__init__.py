@@ -52,6 +52,10 @@ from tdma_mac_sm import *
 from sm import *
 #from pkt_conversions import *
 from traffic_gen import *
+from packet_queues import *
+from frame_history import *
+from link_sounding import *
+from lead_control import *
 from tdma_mac_sm import *
 from SlotManager import *
 from tdma_controller import *
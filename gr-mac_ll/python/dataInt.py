@@ -29,6 +29,7 @@ import sys
 import time 
 
 # third party library imports
+import numpy as np
 
 # project specific imports
 from digital_ll import time_spec_t
@@ -764,6 +765,54 @@ class DataInterface(object):
                                    err.message)        
             return []        
     
+    def get_link_bit_totals(self, frame_window):
+        """
+        Get the bit totals of every link over the past frame_window frames in one query.
+
+        Returns a dict keyed by (link_direction, owner) where link_direction is 'down' or
+        'up' and owner is the to_id of downlink packets or the from_id of uplink packets.
+        Each value is a (total_bits, fail_bits, recent_frame_num) tuple. The packets
+        counted match get_total_bits_to_user and get_total_bits_from_user
+        """
+
+        # if time_ref hasn't been loaded yet, try to load it
+        if self.time_ref is None:
+            self.load_time_ref()
+
+        try:
+            with self.con as c:
+                rows = c.execute("""
+                  SELECT link_direction,
+                      CASE link_direction WHEN 'down' THEN to_id ELSE from_id END AS owner,
+                      SUM(total_bits) AS total_bits,
+                      SUM(CASE status WHEN 'fail' THEN total_bits ELSE 0 END) AS fail_bits,
+                      MAX(frame_num) AS recent_frame_num
+                  FROM packets
+                  WHERE frame_num IN(
+                      SELECT frame_num
+                      FROM frames
+                      ORDER BY rowid DESC LIMIT ?
+                      )
+                      AND link_direction IN ('down', 'up')
+                      AND status<>'pending'
+                      AND NOT (link_direction='down' AND status='imminentfail')
+                  GROUP BY link_direction, owner""",
+                 (frame_window,))
+
+                result = dict( ((row["link_direction"], row["owner"]),
+                                (row["total_bits"], row["fail_bits"],
+                                 row["recent_frame_num"])) for row in rows )
+
+            return result
+
+
+        except sqlite3.Error as err:
+
+            self.dev_log.exception("error retrieving link bit totals: %s.%s: %s",
+                                   err.__module__, err.__class__.__name__,
+                                   err.message)
+            return {}
+
 #    @timeit    
     def prune_tables(self, frame_window):
         """
@@ -796,7 +845,14 @@ class DataInterface(object):
                                    err.message)
     
 #    @timeit        
-    def get_slot_sums(self, to_id, from_id, frame_window, rf_freq):
+    def get_link_slot_sums(self, node_id, frame_window, rf_freq):
+        """
+        Get the pass and fail bit totals of every slot and channel for all links to or
+        from node_id on rf_freq over the last frame_window frames, as one query.
+        
+        Returns a float array with one row per (to_id, from_id, slot_num, channel_num)
+        and columns to_id, from_id, slot_num, channel_num, pass_bits, fail_bits
+        """
         # if time_ref hasn't been loaded yet, try to load it
         if self.time_ref is None:
             self.load_time_ref()
@@ -805,35 +861,33 @@ class DataInterface(object):
             
             with self.con as c:
                 rows = c.execute("""
-                         SELECT packets.slot_num, packets.channel_num, status, 
-                             SUM(total_bits) AS slot_total_bits, 
-                             SUM(payload_bits) as slot_payload_bits 
+                         SELECT to_id, from_id, packets.slot_num, packets.channel_num, 
+                             SUM(CASE status WHEN 'pass' THEN total_bits ELSE 0 END) 
+                                 AS pass_bits,
+                             SUM(CASE status WHEN 'fail' THEN total_bits ELSE 0 END) 
+                                 AS fail_bits
                          FROM packets INNER JOIN slots ON 
                              packets.frame_num = slots.frame_num AND
                              packets.slot_num = slots.slot_num AND
                              packets.channel_num = slots.channel_num
-                         WHERE status<>'pending' AND status<>'unknown' AND status<>'imminentfail'
-                             AND to_id=? AND from_id = ? AND slots.rf_freq=?
+                         WHERE status IN ('pass', 'fail') 
+                             AND ? IN (to_id, from_id) AND slots.rf_freq=?
                              AND packets.frame_num IN(
                                  SELECT frame_num 
                                  FROM frames 
                                  ORDER BY rowid DESC LIMIT ?
                                  )
-                         GROUP BY packets.slot_num, packets.channel_num, status""",
-                         ( to_id, from_id, rf_freq, frame_window)) 
+                         GROUP BY to_id, from_id, packets.slot_num, packets.channel_num""",
+                         ( node_id, rf_freq, frame_window)).fetchall()
                 
-                if rows.rowcount==0:
-                    self.dev_log.debug("zero packets returned in slot sums query for to_id: %i from_id: %i frame_win: %i rf_freq: %f",
-                                       to_id, from_id, frame_window, rf_freq)   
-        
-            return rows
+            return np.array([tuple(r) for r in rows], dtype=float).reshape(-1, 6)
         
         except sqlite3.Error as err:
         
-            self.dev_log.exception("error retrieving number of bits by slot: %s.%s: %s", 
+            self.dev_log.exception("error retrieving number of bits by link and slot: %s.%s: %s", 
                                    err.__module__, err.__class__.__name__, 
                                    err.message)
-            return []        
+            return np.empty((0, 6))
         
 
 #    @timeit        
@@ -0,0 +1,229 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# standard python library imports
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+from digital_ll import time_spec_t
+
+
+class FrameHistory(object):
+    '''
+    Frame configs the slot manager has recently used, keyed by frame number
+
+    This behaves like the dict it replaces, but also keeps the frame numbers and frame
+    start times in parallel numpy arrays sorted by start time. Frames normally arrive
+    in time order, so storing a frame is an append, pruning old frames moves the start
+    of the live region forward, and finding the frame covering a timestamp is a binary
+    search rather than a sort of the whole history on every call.
+
+    Start times are stored as float offsets from the first frame stored since the
+    history was last empty, which keeps sub-nanosecond precision over long runs.
+    '''
+
+    def __init__(self, capacity=64):
+        '''
+        capacity (int) initial number of frames the arrays can hold before they need to
+                       be compacted or grown
+        '''
+        self._configs = {}
+
+        # cached slot offsets of each frame, for finding the slot a timestamp is in
+        self._slot_offsets = {}
+
+        self._frame_nums = np.zeros(capacity, dtype=np.int64)
+        self._t0_offsets = np.zeros(capacity, dtype=np.float64)
+
+        # the live region of the arrays is [_start, _end)
+        self._start = 0
+        self._end = 0
+
+        self._time_ref = None
+
+        # True while frame numbers increase along with start times, which lets pruning
+        # work from the front of the arrays
+        self._frames_in_order = True
+
+    def __len__(self):
+        return len(self._configs)
+
+    def __contains__(self, frame_num):
+        return frame_num in self._configs
+
+    def __iter__(self):
+        return iter(self._configs)
+
+    def __getitem__(self, frame_num):
+        return self._configs[frame_num]
+
+    def __setitem__(self, frame_num, frame_config):
+
+        if frame_num in self._configs:
+            # storing the same frame again is common (the frame is computed and then
+            # sent) and only needs the config swapped out unless the start time moved
+            if time_spec_t(frame_config["t0"]) == time_spec_t(self._configs[frame_num]["t0"]):
+                self._store_config(frame_num, frame_config)
+                return
+            del self[frame_num]
+
+        t0 = time_spec_t(frame_config["t0"])
+        if self._time_ref is None:
+            self._time_ref = t0
+        t0_offset = float(t0 - self._time_ref)
+
+        if self._end == len(self._frame_nums):
+            self._make_room()
+
+        # the usual case: the new frame starts after every frame already stored
+        if self._start == self._end or t0_offset >= self._t0_offsets[self._end-1]:
+            if self._start < self._end and frame_num < self._frame_nums[self._end-1]:
+                self._frames_in_order = False
+            ind = self._end
+        else:
+            ind = self._start + int(np.searchsorted(self._t0_offsets[self._start:self._end],
+                                                    t0_offset, side='right'))
+            # shift the later frames back one place to open up a spot
+            self._frame_nums[ind+1:self._end+1] = self._frame_nums[ind:self._end]
+            self._t0_offsets[ind+1:self._end+1] = self._t0_offsets[ind:self._end]
+            self._frames_in_order = False
+
+        self._frame_nums[ind] = frame_num
+        self._t0_offsets[ind] = t0_offset
+        self._end += 1
+
+        self._store_config(frame_num, frame_config)
+
+    def __delitem__(self, frame_num):
+
+        del self._configs[frame_num]
+        del self._slot_offsets[frame_num]
+
+        live_nums = self._frame_nums[self._start:self._end]
+        ind = self._start + int(np.flatnonzero(live_nums == frame_num)[0])
+
+        if ind == self._start:
+            self._start += 1
+        else:
+            self._frame_nums[ind:self._end-1] = self._frame_nums[ind+1:self._end]
+            self._t0_offsets[ind:self._end-1] = self._t0_offsets[ind+1:self._end]
+            self._end -= 1
+
+        self._reset_if_empty()
+
+    def keys(self):
+        return self._configs.keys()
+
+    def values(self):
+        return self._configs.values()
+
+    def items(self):
+        return self._configs.items()
+
+    def iteritems(self):
+        return self._configs.iteritems()
+
+    def prune(self, min_frame_num):
+        '''
+        Remove every frame numbered below min_frame_num
+        '''
+        if self._frames_in_order:
+            # old frames are all at the front of the live region
+            live_nums = self._frame_nums[self._start:self._end]
+            num_old = int(np.searchsorted(live_nums, min_frame_num, side='left'))
+            for frame_num in live_nums[:num_old].tolist():
+                del self._configs[frame_num]
+                del self._slot_offsets[frame_num]
+            self._start += num_old
+        else:
+            live_nums = self._frame_nums[self._start:self._end]
+            keep = live_nums >= min_frame_num
+            for frame_num in live_nums[~keep].tolist():
+                del self._configs[frame_num]
+                del self._slot_offsets[frame_num]
+
+            kept_nums = live_nums[keep]
+            kept_offsets = self._t0_offsets[self._start:self._end][keep]
+            num_kept = len(kept_nums)
+
+            self._frame_nums[self._start:self._start+num_kept] = kept_nums
+            self._t0_offsets[self._start:self._start+num_kept] = kept_offsets
+            self._end = self._start + num_kept
+
+            self._frames_in_order = bool(np.all(np.diff(kept_nums) > 0))
+
+        self._reset_if_empty()
+
+    def find_frame(self, timestamp):
+        '''
+        Get the number of the latest frame starting at or before timestamp, or None if
+        timestamp is before every frame in the history
+        '''
+        if self._start == self._end:
+            return None
+
+        t_offset = float(time_spec_t(timestamp) - self._time_ref)
+        ind = int(np.searchsorted(self._t0_offsets[self._start:self._end], t_offset,
+                                  side='right'))
+        if ind == 0:
+            return None
+
+        return int(self._frame_nums[self._start+ind-1])
+
+    def slot_offsets(self, frame_num):
+        '''
+        Get the start offsets of each slot in a frame as a sorted list
+        '''
+        return self._slot_offsets[frame_num]
+
+    def _store_config(self, frame_num, frame_config):
+        self._configs[frame_num] = frame_config
+        self._slot_offsets[frame_num] = [s.offset for s in frame_config["slots"]]
+
+    def _make_room(self):
+        '''
+        Slide the live region back to the start of the arrays, or grow the arrays if
+        the live region already fills them
+        '''
+        num_live = self._end - self._start
+        capacity = len(self._frame_nums)
+
+        if num_live > capacity/2:
+            capacity *= 2
+
+            frame_nums = np.zeros(capacity, dtype=np.int64)
+            t0_offsets = np.zeros(capacity, dtype=np.float64)
+            frame_nums[:num_live] = self._frame_nums[self._start:self._end]
+            t0_offsets[:num_live] = self._t0_offsets[self._start:self._end]
+            self._frame_nums = frame_nums
+            self._t0_offsets = t0_offsets
+        else:
+            self._frame_nums[:num_live] = self._frame_nums[self._start:self._end]
+            self._t0_offsets[:num_live] = self._t0_offsets[self._start:self._end]
+
+        self._start = 0
+        self._end = num_live
+
+    def _reset_if_empty(self):
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+            self._time_ref = None
+            self._frames_in_order = True
@@ -0,0 +1,201 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Adaptive frame lead limit for the tdma controller
+
+The lead limit is how far ahead of the received sample stream the tdma controller
+prepares frames. It has to cover the time the controller spends preparing a frame
+plus the time the framer, modulator and radio need after the frame is handed off.
+A fixed lead limit has to be set for the worst case, which adds latency to every
+packet.
+
+The lead limit controller measures the wall time the controller spends per prepared
+frame and the margin each frame has when it is handed off, which is how far its
+first transmit time is ahead of the radio's current time. The lead limit is set to
+the transmit latency plus a safety factor times a decaying peak of the frame cost,
+plus a decaying peak of any shortfall seen in the margin, and is kept between
+frame_lead_min and frame_lead_limit. The controller also sets the wall time budget
+for each call to the tdma controller's work function, so a burst of frames can't
+keep the flow graph thread busy.
+'''
+
+# project specific imports
+from digital_ll.lincolnlog import dict_to_xml
+
+
+class lead_limit_controller(object):
+    '''
+    Track frame preparation cost and transmit margin, and adapt the lead limit to them
+    '''
+
+    def __init__(self, options):
+
+        self.adaptive = bool(options.frame_lead_adaptive)
+        self.max_lead = float(options.frame_lead_limit)
+        self.min_lead = min(float(options.frame_lead_min), self.max_lead)
+        self.tx_latency = float(options.frame_lead_tx_latency)
+        self.safety_factor = float(options.frame_lead_safety_factor)
+        self.decay = float(options.frame_lead_decay)
+        self.work_budget = float(options.controller_work_budget)
+
+        # start from the configured lead limit and only move once frames are measured
+        self.lead_limit = self.max_lead
+
+        # wall time spent stepping the state machine and the smallest transmit margin
+        # seen since the last frame was prepared
+        self.pending_cost = 0.0
+        self.pending_margin = None
+
+        # decaying peaks of the wall time per frame and of the margin shortfall
+        self.cost_peak = 0.0
+        self.shortfall_peak = 0.0
+
+        # stats since the last call to pop_stats
+        self.num_frames = 0
+        self.total_cost = 0.0
+        self.min_margin = None
+        self.num_short = 0
+        self.num_deferred = 0
+
+        # margin of the most recent frame that had something to transmit
+        self.margin = None
+
+    def add_step(self, wall_delta, margin=None):
+        '''
+        Add one state machine step to the frame in progress. wall_delta is the wall time
+        the step took and margin is how far ahead of the radio's current time the
+        earliest packet the step handed off was scheduled to transmit, or None if the
+        step handed off nothing timed
+        '''
+        self.pending_cost += wall_delta
+
+        if margin is not None:
+            if self.pending_margin is None or margin < self.pending_margin:
+                self.pending_margin = margin
+
+    def frame_prepared(self):
+        '''
+        Called each time the state machine finishes preparing a frame. Returns the lead
+        limit to use from now on
+        '''
+        cost = self.pending_cost
+        margin = self.pending_margin
+        self.pending_cost = 0.0
+        self.pending_margin = None
+
+        self.num_frames += 1
+        self.total_cost += cost
+        self.cost_peak = max(cost, self.cost_peak*self.decay)
+
+        shortfall = 0.0
+        if margin is not None:
+            self.margin = margin
+
+            if self.min_margin is None or margin < self.min_margin:
+                self.min_margin = margin
+
+            if margin < self.tx_latency:
+                self.num_short += 1
+                shortfall = self.tx_latency - margin
+
+        self.shortfall_peak = max(shortfall, self.shortfall_peak*self.decay)
+
+        if self.adaptive:
+            target = (self.tx_latency + self.safety_factor*self.cost_peak +
+                      self.shortfall_peak)
+            self.lead_limit = min(self.max_lead, max(self.min_lead, target))
+
+        return self.lead_limit
+
+    def over_budget(self, wall_delta):
+        '''
+        Check whether a work call that has spent wall_delta seconds stepping the state
+        machine should stop and pick up again on the next call
+        '''
+        if self.work_budget > 0 and wall_delta >= self.work_budget:
+            self.num_deferred += 1
+            return True
+        else:
+            return False
+
+    def pop_stats(self):
+        '''
+        Return the stats gathered since the last call and start gathering new ones
+        '''
+        if self.num_frames > 0:
+            mean_cost = self.total_cost/self.num_frames
+        else:
+            mean_cost = None
+
+        stats = {
+                 "lead_limit":self.lead_limit,
+                 "frames":self.num_frames,
+                 "mean_frame_cost":mean_cost,
+                 "peak_frame_cost":self.cost_peak,
+                 "min_margin":self.min_margin,
+                 "short_frames":self.num_short,
+                 "deferred_work_calls":self.num_deferred,
+                 }
+
+        self.num_frames = 0
+        self.total_cost = 0.0
+        self.min_margin = None
+        self.num_short = 0
+        self.num_deferred = 0
+
+        return stats
+
+    def append_my_settings(self, indent_level, opts_xml):
+
+        params = {
+                  "frame_lead_adaptive":int(self.adaptive),
+                  "frame_lead_min":self.min_lead,
+                  "frame_lead_tx_latency":self.tx_latency,
+                  "frame_lead_safety_factor":self.safety_factor,
+                  "frame_lead_decay":self.decay,
+                  "controller_work_budget":self.work_budget,
+                  }
+        opts_xml += "\n" + dict_to_xml(params, indent_level)
+
+        return opts_xml
+
+    @staticmethod
+    def add_options(normal, expert):
+
+        normal.add_option("--frame-lead-adaptive", type="int", default=0,
+                          help=("Set to 1 to adapt the lead limit to the measured frame " +
+                                "preparation time, between --frame-lead-min and " +
+                                "--frame-lead-limit [default=%default]"))
+        normal.add_option("--frame-lead-min", type="eng_float", default=0.05,
+                          help=("Smallest lead limit the adaptive lead limit may use, " +
+                                "in seconds [default=%default]"))
+        normal.add_option("--frame-lead-tx-latency", type="eng_float", default=0.02,
+                          help=("Time the framer, modulator and radio need after a frame " +
+                                "is handed off, in seconds. Frames handed off with less " +
+                                "margin than this count as short [default=%default]"))
+        expert.add_option("--frame-lead-safety-factor", type="float", default=2.0,
+                          help=("Multiple of the peak frame preparation time added to " +
+                                "the adaptive lead limit [default=%default]"))
+        expert.add_option("--frame-lead-decay", type="float", default=0.99,
+                          help=("Per frame decay of the peak frame preparation time and " +
+                                "margin shortfall [default=%default]"))
+        expert.add_option("--controller-work-budget", type="eng_float", default=0.02,
+                          help=("Wall time in seconds the tdma controller may spend " +
+                                "preparing frames in one call before yielding to the " +
+                                "flow graph. 0 means no limit [default=%default]"))
@@ -24,6 +24,7 @@ from collections import deque
 from functools import partial
 import itertools
 from itertools import islice
+import os
 import pickle
 import random
 import sys
@@ -78,22 +79,248 @@ class Agent(object):
 #        pass
 
 
+class Dense_Q_Table(object):
+    '''
+    State-action value and visit tables stored as full (num_states x num_actions)
+    arrays
+    
+    Instance Variables:
+    
+    _q     (masked array) records the expected reward for each state-action 
+                          transition. Invalid actions are masked
+    _visits (int array)   number of times each state-action pair was chosen
+    '''
+    
+    def __init__(self, num_states, num_actions, q_mask=None, q_seed=None):
+        
+        if q_seed is None:
+            # initialize q with random values on the order of magnitude of rounding errors
+            initial_q_values = np.spacing(1)*np.random.rand(num_states, num_actions)
+
+        else:
+            # TODO: check dimensions of q_seed are num_states x num_actions, throw error
+            # if not
+            initial_q_values = q_seed
+        
+        if q_mask is None:
+            # initialize q table    
+            self._q = ma.array( initial_q_values )
+        else:    
+            self._q = ma.array( initial_q_values, mask=q_mask )
+        
+        # initialize a table to track state visitations
+        self._visits = np.array(np.zeros_like(self._q), dtype='int') 
+        
+    def get(self, state, action):
+        return self._q[state, action]
+    
+    def set(self, state, action, value):
+        self._q[state, action] = value
+        
+    def row_max(self, state):
+        return ma.max(self._q[state, :])
+    
+    def row_argmax(self, state):
+        return ma.argmax(self._q[state, :])
+    
+    def valid_actions(self, state):
+        # the valid actions are at unmasked array positions, so compute the inverse
+        # of the mask of the relevant row
+        return np.flatnonzero(~ma.getmaskarray(self._q[state, :]))
+    
+    def visits(self, state):
+        return self._visits[state, :]
+    
+    def visit_count(self, state, action):
+        return self._visits[state, action]
+    
+    def add_visit(self, state, action):
+        self._visits[state, action] +=1
+        
+    def reset_visits(self, state):
+        self._visits[state, :] = 0
+        
+    def log_vars(self):
+        
+        # convert numpy arrays to lists for serialization
+        return {"q_table":self._q.tolist(),
+                "q_mask":ma.getmaskarray(self._q).tolist(),
+                "visit_table":self._visits.tolist(),}
+        
+        
+class Sparse_Q_Table(object):
+    '''
+    State-action value and visit tables stored as rows in a dict keyed by state
+    
+    A row is only created the first time its state is used, so memory grows with the 
+    number of states the agent actually sees rather than with 
+    num_states x num_actions. The index and value of the maximum of each row are 
+    cached and kept up to date on writes, since the learners look up the best action
+    for a state far more often than a write changes it.
+    
+    Instance Variables:
+    
+    _rows   (dict) state -> float array of expected rewards, one per action
+    _masks  (dict) state -> bool array, True for invalid actions. Empty if no q_mask 
+                   was given
+    _visits (dict) state -> int array of the number of times each action was chosen
+    _best   (dict) state -> (argmax, max) over the valid actions in the row
+    '''
+    
+    def __init__(self, num_states, num_actions, q_mask=None, q_seed=None):
+        '''
+        q_mask and q_seed are optional (num_states x num_actions) arrays, with the same
+        meaning as for Dense_Q_Table. Rows are only read from them as they are needed
+        '''
+        self._num_states = num_states
+        self._num_actions = num_actions
+        self._q_mask = q_mask
+        self._q_seed = q_seed
+        
+        self._rows = {}
+        self._masks = {}
+        self._visits = {}
+        self._best = {}
+        
+        self._all_actions = np.arange(num_actions)
+        
+    def _row(self, state):
+        
+        row = self._rows.get(state)
+        if row is None:
+            if self._q_seed is None:
+                # initialize q with random values on the order of magnitude of rounding 
+                # errors
+                row = np.spacing(1)*np.random.rand(self._num_actions)
+            else:
+                row = np.array(self._q_seed[state], dtype=np.float64)
+            
+            self._rows[state] = row
+            self._visits[state] = np.zeros(self._num_actions, dtype='int')
+            
+            if self._q_mask is not None:
+                self._masks[state] = np.array(self._q_mask[state], dtype=bool)
+                
+        return row
+    
+    def _find_best(self, state):
+        
+        best = self._best.get(state)
+        if best is None:
+            row = self._row(state)
+            mask = self._masks.get(state)
+            
+            if mask is None:
+                ind = int(np.argmax(row))
+            else:
+                ind = int(np.argmax(np.where(mask, -np.inf, row)))
+            
+            best = (ind, row[ind])
+            self._best[state] = best
+            
+        return best
+    
+    def get(self, state, action):
+        return self._row(state)[action]
+    
+    def set(self, state, action, value):
+        
+        row = self._row(state)
+        row[action] = value
+        
+        best = self._best.get(state)
+        if best is None:
+            return
+        
+        best_ind, best_val = best
+        
+        mask = self._masks.get(state)
+        if mask is not None and mask[action]:
+            # masked values never change the best action
+            return
+        
+        # argmax picks the first of any tied values
+        if value > best_val or (value == best_val and action < best_ind):
+            self._best[state] = (action, value)
+        elif action == best_ind:
+            # the best value went down, so another action may be better now
+            del self._best[state]
+        
+    def row_max(self, state):
+        return self._find_best(state)[1]
+    
+    def row_argmax(self, state):
+        return self._find_best(state)[0]
+    
+    def valid_actions(self, state):
+        
+        self._row(state)
+        mask = self._masks.get(state)
+        
+        if mask is None:
+            return self._all_actions
+        else:
+            return np.flatnonzero(~mask)
+    
+    def visits(self, state):
+        self._row(state)
+        return self._visits[state]
+    
+    def visit_count(self, state, action):
+        return self.visits(state)[action]
+    
+    def add_visit(self, state, action):
+        self.visits(state)[action] +=1
+        
+    def reset_visits(self, state):
+        self.visits(state)[:] = 0
+        
+    def log_vars(self):
+        '''
+        Log only the rows that exist. States are listed in increasing order, and the
+        q, mask, and visit rows are in the same order as the states
+        '''
+        states = sorted(self._rows)
+        
+        if self._q_mask is None:
+            masks = [[False]*self._num_actions for state in states]
+        else:
+            masks = [self._masks[state].tolist() for state in states]
+            
+        return {"num_states":self._num_states,
+                "num_actions":self._num_actions,
+                "q_table_states":states,
+                "q_table_rows":[self._rows[state].tolist() for state in states],
+                "q_mask_rows":masks,
+                "visit_table_rows":[self._visits[state].tolist() for state in states],}
+        
+
+# map from the --agent-q-table-type option to the table class
+Q_TABLE_TYPES = {"dense":Dense_Q_Table,
+                 "sparse":Sparse_Q_Table}
+
+# tag stored with value functions saved by save_value_function. Files saved before the
+# table classes existed hold a bare masked array of q values
+VALUE_FUNCTION_FORMAT = "q_table_v2"
+
+
 class State_Action_Learner(Agent):
     '''
     Base class for agents that have a concept of a state-value table
     
     Instance Variables:
      
-    _q_table (masked array) Has dimensions of (num_states x num_actions). This table 
-                            records the expected reward for each state-action transistion.
-                            Invalid actions are denoted by setting the mask for the 
-                            corresponding table element. Each element is a float.
+    _q_table (Dense_Q_Table or Sparse_Q_Table) Records the expected reward for each 
+                            (num_states x num_actions) state-action transistion, and the
+                            number of visits to each. Invalid actions are denoted by 
+                            masking the corresponding table element. 
     '''
 
     # TODO: add counter for number of visits per state 
 
     def __init__(self, num_states, num_actions, greedy_epsilon, q_mask=None, q_seed=None, 
-                 reward_history_len=(0,0,0), dynamic_epsilon=False, min_visit_count=2):
+                 reward_history_len=(0,0,0), dynamic_epsilon=False, min_visit_count=2,
+                 q_table_type="dense"):
         '''
         Constructor
         
@@ -113,6 +340,8 @@ class State_Action_Learner(Agent):
                                    history length. Each deque in the reward history 
                                    will have a max length of old vals + guard region + 
                                    new vals.  
+        q_table_type (string)   "dense" or "sparse". Sparse tables only allocate rows
+                                for states that have been seen
         '''
         super(State_Action_Learner, self).__init__()
         
@@ -122,23 +351,12 @@ class State_Action_Learner(Agent):
         self._policyFrozen = False
         self._exploringFrozen = False
         
-        if q_seed is None:
-            # initialize q with random values on the order of magnitude of rounding errors
-            initial_q_values = np.spacing(1)*np.random.rand(num_states, num_actions)
-
-        else:
-            # TODO: check dimensions of q_seed are num_states x num_actions, throw error
-            # if not
-            initial_q_values = q_seed
-        
-        if q_mask is None:
-            # initialize q table    
-            self._q_table = ma.array( initial_q_values )
-        else:    
-            self._q_table = ma.array( initial_q_values, mask=q_mask )
+        if q_table_type not in Q_TABLE_TYPES:
+            raise ValueError("unknown q table type %s, expected one of %s" %
+                             (q_table_type, sorted(Q_TABLE_TYPES.keys())))
         
-        # initialize a table to track state visitations
-        self._visitation_table = np.array(np.zeros_like(self._q_table), dtype='int') 
+        self._q_table = Q_TABLE_TYPES[q_table_type](num_states, num_actions, q_mask, 
+                                                    q_seed)
         
         # initialize a dictionary to track reward history
         self._num_old_reward_vals = reward_history_len[0]
@@ -167,19 +385,50 @@ class State_Action_Learner(Agent):
           
     def save_value_function(self, fileName):
         theFile = open(fileName, "w")
-        pickle.dump(self._q_table, theFile)
+        pickle.dump({"format":VALUE_FUNCTION_FORMAT, "q_table":self._q_table}, theFile)
         theFile.close()
 
     def load_value_function(self, fileName):
         theFile = open(fileName, "r")
-        self._q_table=pickle.load(theFile)
+        saved = pickle.load(theFile)
         theFile.close()
         
+        if isinstance(saved, dict) and saved.get("format") == VALUE_FUNCTION_FORMAT:
+            self._q_table = saved["q_table"]
+            
+        elif isinstance(saved, ma.MaskedArray):
+            # old files only have the q values, so load them into a table of the type 
+            # in use with no visits
+            q_mask = ma.getmask(saved)
+            if q_mask is ma.nomask:
+                q_mask = None
+                
+            num_states, num_actions = saved.shape
+            self._q_table = type(self._q_table)(num_states, num_actions, q_mask, 
+                                                np.array(saved.data, dtype=np.float64))
+        else:
+            raise ValueError("%s is not a value function saved by save_value_function" %
+                             fileName)
+        
+    @staticmethod
+    def load_q_seed(file_name, num_states, num_actions):
+        '''
+        Load a (num_states x num_actions) array of initial q values saved with 
+        numpy.save, for example by the offline agent trainer
+        '''
+        q_seed = np.load(os.path.expandvars(os.path.expanduser(file_name)))
+        
+        if q_seed.shape != (num_states, num_actions):
+            raise ValueError("q seed in %s has shape %s, expected %s" % 
+                             (file_name, q_seed.shape, (num_states, num_actions)))
+        
+        return q_seed
+        
     def update_visitation_table(self, state, action):
-        self._visitation_table[state, action] +=1
+        self._q_table.add_visit(state, action)
         
     def reset_visitation_table_state(self, state):
-        self._visitation_table[state, :] =0    
+        self._q_table.reset_visits(state)    
     
     def update_reward_history(self, state, action, reward):
         self._reward_history[ (state, action)].append(reward)
@@ -225,15 +474,13 @@ class State_Action_Learner(Agent):
 
     def get_random_valid_action(self, next_state, exploit_action):
         
-        # the valid actions are at unmasked array positions, so compute the inverse
-        # of the mask of the relevant row
-        valid_action_flags = ~ma.getmaskarray(self._q_table[next_state,:])
+        valid_actions = self._q_table.valid_actions(next_state)
         
         # disallow the action we would have chosen if exploiting
-        valid_action_flags[exploit_action] = False
+        valid_actions = valid_actions[valid_actions != exploit_action]
         
-        # get the indices of the valid actions and pick one at random
-        next_action = random.choice(np.flatnonzero(valid_action_flags))
+        # pick one of the valid actions at random
+        next_action = random.choice(valid_actions)
         
         return next_action
           
@@ -250,13 +497,15 @@ class State_Action_Learner(Agent):
 
     def two_state_decaying_eps_greedy_exploration(self, next_state, exploit_action ):
         
+        visits = self._q_table.visits(next_state)
+        
         # determine which stage of decaying epsilon we're in
-        if np.min(self._visitation_table[next_state,:]) < self._minimum_visit_count:
+        if np.min(visits) < self._minimum_visit_count:
             self._epsilon_decay_state = "median"
-            self._epsilon = self._epsilon0/np.max([np.median(self._visitation_table[next_state,:]),1.0])
+            self._epsilon = self._epsilon0/np.max([np.median(visits),1.0])
         else:
             self._epsilon_decay_state = "sum"
-            self._epsilon = self._epsilon0/np.max([np.sum(self._visitation_table[next_state,:]),1.0])
+            self._epsilon = self._epsilon0/np.max([np.sum(visits),1.0])
         
         do_exploit = random.random() > self._epsilon
 
@@ -266,7 +515,7 @@ class State_Action_Learner(Agent):
     
     def decaying_eps_greedy_exploration(self, next_state, exploit_action ):
         
-        self._epsilon = self._epsilon0/np.max([np.median(self._visitation_table[next_state,:]),1.0])
+        self._epsilon = self._epsilon0/np.max([np.median(self._q_table.visits(next_state)),1.0])
         
         do_exploit = random.random() > self._epsilon
 
@@ -311,6 +560,17 @@ class State_Action_Learner(Agent):
                           help="Probablility of chosing a random location to explore " +
                                "instead of using the available location with lowest BER" +
                                " [default=%default]")
+        
+        normal.add_option("--agent-q-seed-file", type="string", default="",
+                          help="Start the agent from the q table in this .npy file, " +
+                               "such as one made by agent_trainer.py, instead of " +
+                               "from scratch [default=%default]")
+        
+        normal.add_option("--agent-q-table-type", type="choice", default="dense",
+                          choices=sorted(Q_TABLE_TYPES.keys()),
+                          help="Storage for the agent state-action tables. Sparse " +
+                               "tables only store states the agent has seen, for large " +
+                               "action spaces [default=%default]")
                     
 
 class Q_Learner(State_Action_Learner):
@@ -320,10 +580,10 @@ class Q_Learner(State_Action_Learner):
     
     Instance Variables: 
     
-    _q_table (masked array) Has dimensions of (num_states x num_actions). This table 
-                            records the expected reward for each state-action transistion.
-                            Invalid actions are denoted by setting the mask for the 
-                            corresponding table element. Each element is a float.
+    _q_table (Dense_Q_Table or Sparse_Q_Table) Records the expected reward for each 
+                            (num_states x num_actions) state-action transistion.
+                            Invalid actions are denoted by masking the corresponding 
+                            table element. 
     _alpha0         (float) Initial value to use for _alpha in the case of a decaying 
                             _alpha value. Otherwise _alpha = _alpha0                             
     _alpha          (float) Scale factor on new information between 0 and 1 inclusive. 
@@ -346,7 +606,7 @@ class Q_Learner(State_Action_Learner):
     def __init__(self, num_states, num_actions, learning_rate, 
                  discount_factor, greedy_epsilon, q_mask=None, q_seed=None,
                  dynamic_alpha=False, dynamic_epsilon=False, reward_history_len=(0,0,0),
-                 use_change_detection=False, min_visit_count=2):
+                 use_change_detection=False, min_visit_count=2, q_table_type="dense"):
         '''
         Keyword Arguments:
         
@@ -364,12 +624,14 @@ class Q_Learner(State_Action_Learner):
                                 elements will be initialized to zero
         dynamic_alpha (bool)    If true, compute alpha dynamically\
         dynamic_epsilon (bool)  If true, compute epsilon dynamically                           
+        q_table_type (string)   "dense" or "sparse" state-action table storage
         '''
         
         super(Q_Learner, self).__init__(num_states, num_actions, greedy_epsilon, q_mask, q_seed,
                                         dynamic_epsilon=dynamic_epsilon,
                                         reward_history_len=reward_history_len,
-                                        min_visit_count=min_visit_count)
+                                        min_visit_count=min_visit_count,
+                                        q_table_type=q_table_type)
         
         self._alpha0 = learning_rate
         self._alpha = learning_rate
@@ -403,12 +665,8 @@ class Q_Learner(State_Action_Learner):
         '''
         next_state = observation
         
-        # the valid actions are at unmasked array positions, so compute the inverse
-        # of the mask of the relevant row
-        valid_action_flags = ~ma.getmaskarray(self._q_table[next_state,:])
-        
-        # get the indices of the valid actions and pick one at random
-        next_action = random.choice(np.flatnonzero(valid_action_flags))
+        # pick one of the valid actions at random
+        next_action = random.choice(self._q_table.valid_actions(next_state))
 
         # store off state for the next iteration
         self._last_state = next_state
@@ -441,20 +699,20 @@ class Q_Learner(State_Action_Learner):
         else:
             self._alpha = self._alpha0
             
-        qt = self._q_table[self._last_state, self._last_action]
-        max_qt1 = ma.max(self._q_table[next_state, :])
+        qt = self._q_table.get(self._last_state, self._last_action)
+        max_qt1 = self._q_table.row_max(next_state)
         
         # update value function
         qt_next = (1-self._alpha)*qt + self._alpha*(reward + self._gamma*max_qt1)
         
         if not self._policyFrozen:
-            self._q_table[self._last_state, self._last_action] = qt_next
+            self._q_table.set(self._last_state, self._last_action, qt_next)
 
         # update the reward history only for 
         self.update_reward_history(self._last_state, self._last_action, reward)   
         
         # get the index to the maximum value in the relevant row
-        exploit_action = ma.argmax(self._q_table[next_state, :])
+        exploit_action = self._q_table.row_argmax(next_state)
         
      
         
@@ -510,7 +768,7 @@ class Q_Learner(State_Action_Learner):
         nothing
         '''
         
-        qt = self._q_table[self._last_state, self._last_action]
+        qt = self._q_table.get(self._last_state, self._last_action)
         
         if self._dynamic_alpha:
             self._alpha = self.compute_alpha(self._last_state, self._last_action)
@@ -521,27 +779,28 @@ class Q_Learner(State_Action_Learner):
         qt_next = (1-self._alpha)*qt + self._alpha*(reward + qt)
         
         if not self._policyFrozen:
-            self._q_table[self._last_state, self._last_action] = qt_next
+            self._q_table.set(self._last_state, self._last_action, qt_next)
             
     def log_vars(self):
         
         # convert numpy arrays to lists for serialization
         
-        return {"q_table":self._q_table.tolist(),
-                "q_mask":ma.getmaskarray(self._q_table).tolist(),
-                "exploiting":bool(self._do_exploit | self._exploringFrozen),
-                "alpha":float(self._alpha),
-                "epsilon":float(self._epsilon),
-                "visit_table":self._visitation_table.tolist(),
-                "epsilon_decay_state":self._epsilon_decay_state,
-                "change_detected":bool(self._change_detected),
-                "old_reward_median":float(self._old_reward_median),
-                "new_reward_median":float(self._new_reward_median),
-                "exploring_frozen":bool(self._exploringFrozen),
-                "policy_frozen":bool(self._policyFrozen),}
+        agent_vars = {"exploiting":bool(self._do_exploit | self._exploringFrozen),
+                      "alpha":float(self._alpha),
+                      "epsilon":float(self._epsilon),
+                      "epsilon_decay_state":self._epsilon_decay_state,
+                      "change_detected":bool(self._change_detected),
+                      "old_reward_median":float(self._old_reward_median),
+                      "new_reward_median":float(self._new_reward_median),
+                      "exploring_frozen":bool(self._exploringFrozen),
+                      "policy_frozen":bool(self._policyFrozen),}
+        
+        agent_vars.update(self._q_table.log_vars())
+        
+        return agent_vars
         
     def compute_alpha(self, state, action):
-        alpha = self._alpha0/float(self._visitation_table[state,action])
+        alpha = self._alpha0/float(self._q_table.visit_count(state, action))
         return alpha
 
     @staticmethod
@@ -570,10 +829,10 @@ class Sarsa_Learner(State_Action_Learner):
     
     Instance Variables: 
     
-    _q_table (masked array) Has dimensions of (num_states x num_actions). This table 
-                            records the expected reward for each state-action transistion.
-                            Invalid actions are denoted by setting the mask for the 
-                            corresponding table element. Each element is a float.
+    _q_table (Dense_Q_Table or Sparse_Q_Table) Records the expected reward for each 
+                            (num_states x num_actions) state-action transistion.
+                            Invalid actions are denoted by masking the corresponding 
+                            table element. 
     _alpha0         (float) Initial value to use for _alpha in the case of a decaying 
                             _alpha value. Otherwise _alpha = _alpha0                            
     _alpha          (float) Scale factor on new information between 0 and 1 inclusive. 
@@ -601,7 +860,7 @@ class Sarsa_Learner(State_Action_Learner):
     def __init__(self, num_states, num_actions, learning_rate, 
                  discount_factor, greedy_epsilon, q_mask=None, q_seed=None,
                  dynamic_alpha=False, dynamic_epsilon=False, reward_history_len=(0,0,0),
-                 use_change_detection=False):
+                 use_change_detection=False, q_table_type="dense"):
         '''
         Keyword Arguments:
         
@@ -618,11 +877,13 @@ class Sarsa_Learner(State_Action_Learner):
                                 assign to the q_table. If nothing is specified, all 
                                 elements will be initialized to zero
         dynamic_alpha (bool)    If true, compute alpha dynamically
+        q_table_type (string)   "dense" or "sparse" state-action table storage
         '''
         
         super(Sarsa_Learner, self).__init__(num_states, num_actions, greedy_epsilon, q_mask, q_seed, 
                                             dynamic_epsilon=dynamic_epsilon, 
-                                            reward_history_len=reward_history_len)
+                                            reward_history_len=reward_history_len,
+                                            q_table_type=q_table_type)
         
         self._alpha0 = learning_rate
         self._alpha = learning_rate
@@ -654,12 +915,8 @@ class Sarsa_Learner(State_Action_Learner):
         '''
         next_state = observation
         
-        # the valid actions are at unmasked array positions, so compute the inverse
-        # of the mask of the relevant row
-        valid_action_flags = ~ma.getmaskarray(self._q_table[next_state,:])
-        
-        # get the indices of the valid actions and pick one at random
-        next_action = random.choice(np.flatnonzero(valid_action_flags))
+        # pick one of the valid actions at random
+        next_action = random.choice(self._q_table.valid_actions(next_state))
 
         # store off state for the next iteration
         self._last_state = next_state
@@ -693,7 +950,7 @@ class Sarsa_Learner(State_Action_Learner):
             self._alpha = self._alpha0
 
         # get the index to the maximum value in the relevant row
-        exploit_action = ma.argmax(self._q_table[next_state, :])
+        exploit_action = self._q_table.row_argmax(next_state)
 
         if self._dynamic_epsilon:
             self._do_exploit, explore_action = self.two_state_decaying_eps_greedy_exploration(next_state, exploit_action )
@@ -706,15 +963,15 @@ class Sarsa_Learner(State_Action_Learner):
         else:
             next_action = explore_action     
 
-        qt = self._q_table[self._last_state, self._last_action]
-        qt1 = self._q_table[next_state, next_action]
+        qt = self._q_table.get(self._last_state, self._last_action)
+        qt1 = self._q_table.get(next_state, next_action)
         
 
         # update value function
         qt_next = (1-self._alpha)*qt + self._alpha*(reward + self._gamma*qt1)
         
         if not self._policyFrozen:
-            self._q_table[self._last_state, self._last_action] = qt_next
+            self._q_table.set(self._last_state, self._last_action, qt_next)
 
         # store off state for the next iteration
         self._last_state = next_state
@@ -735,7 +992,7 @@ class Sarsa_Learner(State_Action_Learner):
         Returns: 
         nothing
         '''
-        qt = self._q_table[self._last_state, self._last_action]
+        qt = self._q_table.get(self._last_state, self._last_action)
 
         if self._dynamic_alpha:
             self._alpha = self.compute_alpha(self._last_state, self._last_action)
@@ -746,23 +1003,24 @@ class Sarsa_Learner(State_Action_Learner):
 #        qt_next = (1-self._alpha0)*qt + self._alpha0*(reward + self._gamma*qt)
         qt_next = (1-self._alpha)*qt + self._alpha*(reward + qt)
         if not self._policyFrozen:
-            self._q_table[self._last_state, self._last_action] = qt_next
+            self._q_table.set(self._last_state, self._last_action, qt_next)
 
     def log_vars(self):
         
         # convert numpy arrays to lists for serialization
         
-        return {"q_table":self._q_table.tolist(),
-                "q_mask":ma.getmaskarray(self._q_table).tolist(),
-                "exploiting":bool(self._do_exploit),
-                "alpha":float(self._alpha),
-                "epsilon":float(self._epsilon),
-                "visit_table":self._visitation_table.tolist(),
-                "epsilon_decay_state":self._epsilon_decay_state,
-                }
+        agent_vars = {"exploiting":bool(self._do_exploit),
+                      "alpha":float(self._alpha),
+                      "epsilon":float(self._epsilon),
+                      "epsilon_decay_state":self._epsilon_decay_state,
+                      }
+        
+        agent_vars.update(self._q_table.log_vars())
+        
+        return agent_vars
         
     def compute_alpha(self, state, action):
-        alpha = self._alpha0/float(self._visitation_table[state,action])
+        alpha = self._alpha0/float(self._q_table.visit_count(state, action))
         return alpha  
 
     @staticmethod
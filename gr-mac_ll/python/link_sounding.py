@@ -0,0 +1,387 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Background channel sounding during normal TDMA operation
+
+Instead of a separate channel sounding phase before the network starts, every
+sounding_frame_interval frames the packets received in slots of the sounding slot
+types are used as sounding signals. The received power over each packet is measured
+from the raw sample stream the tdma controller sees, and the noise power is measured
+over the slot's pre guard, when nobody should be transmitting. These measurements
+are turned into pathloss and SNR estimates for the link from each transmitter to this
+node and smoothed with an exponentially weighted moving average, so they track link
+changes without restarting the network.
+
+Pathloss uses the same front end power equations as the channel sounding technique.
+'''
+
+# standard python library imports
+from collections import namedtuple
+import logging
+from math import ceil
+
+# third party library imports
+import numpy as np
+
+# project specific imports
+from digital_ll import time_spec_t
+from digital_ll.power_control import get_pwr_equations
+from digital_ll.lincolnlog import dict_to_xml
+
+
+SoundingTuple = namedtuple('SoundingTuple', 'from_id frame_num packet_ts packet_dur ' +
+                                            'noise_ts noise_dur rf_freq tx_gain')
+
+
+class link_estimates(object):
+    '''
+    Smoothed pathloss and SNR of the link from each transmitter, kept in numpy arrays
+    indexed by the order transmitters were first heard
+    '''
+
+    def __init__(self, alpha):
+
+        # weight given to each new sounding measurement
+        self.alpha = alpha
+
+        self.id_inds = {}
+        self.pathloss = np.zeros(0)
+        self.snr = np.zeros(0)
+        self.rx_pwr = np.zeros(0)
+        self.noise_pwr = np.zeros(0)
+        self.num_updates = np.zeros(0, dtype=np.int64)
+        self.last_frames = np.zeros(0, dtype=np.int64)
+
+        # pathloss as of the last time each link was reported as changed
+        self.ref_pathloss = np.zeros(0)
+
+    def __len__(self):
+        return len(self.id_inds)
+
+    def __contains__(self, from_id):
+        return from_id in self.id_inds
+
+    def register_ids(self, from_ids):
+        '''
+        Add state for any transmitters not seen before
+        '''
+        new_ids = [from_id for from_id in from_ids if from_id not in self.id_inds]
+        num_new = len(new_ids)
+
+        if num_new > 0:
+            for from_id in new_ids:
+                self.id_inds[from_id] = len(self.id_inds)
+
+            self.pathloss = np.append(self.pathloss, np.zeros(num_new))
+            self.snr = np.append(self.snr, np.zeros(num_new))
+            self.rx_pwr = np.append(self.rx_pwr, np.zeros(num_new))
+            self.noise_pwr = np.append(self.noise_pwr, np.zeros(num_new))
+            self.num_updates = np.append(self.num_updates, np.zeros(num_new, dtype=np.int64))
+            self.last_frames = np.append(self.last_frames, np.zeros(num_new, dtype=np.int64))
+            self.ref_pathloss = np.append(self.ref_pathloss, np.zeros(num_new))
+
+    def update(self, from_ids, frame_num, pathloss, snr, rx_pwr, noise_pwr):
+        '''
+        Fold one round of measurements into the averages. from_ids must be unique, and
+        all values are in dB
+        '''
+        self.register_ids(from_ids)
+        inds = np.array([self.id_inds[from_id] for from_id in from_ids], dtype=int)
+
+        # the first measurement of a link sets its starting point
+        first = self.num_updates[inds] == 0
+        weight = np.where(first, 1.0, self.alpha)
+
+        for field, vals in ((self.pathloss, pathloss), (self.snr, snr),
+                            (self.rx_pwr, rx_pwr), (self.noise_pwr, noise_pwr)):
+            field[inds] += weight*(vals - field[inds])
+
+        self.ref_pathloss[inds] = np.where(first, self.pathloss[inds],
+                                           self.ref_pathloss[inds])
+        self.num_updates[inds] += 1
+        self.last_frames[inds] = frame_num
+
+    def get_pathloss(self, from_id):
+        return float(self.pathloss[self.id_inds[from_id]])
+
+    def get_snr(self, from_id):
+        return float(self.snr[self.id_inds[from_id]])
+
+    def pathloss_dict(self):
+        '''
+        Get the pathloss estimate of each link, keyed by transmitter id
+        '''
+        return dict( (from_id, float(self.pathloss[ind]))
+                     for from_id, ind in self.id_inds.iteritems())
+
+    def pop_changed_links(self, threshold):
+        '''
+        Get the set of transmitter ids whose pathloss has moved by at least threshold dB
+        since they were last reported, and make their current pathloss the new reference
+        '''
+        changed = np.abs(self.pathloss - self.ref_pathloss) >= threshold
+        self.ref_pathloss[changed] = self.pathloss[changed]
+
+        return set(from_id for from_id, ind in self.id_inds.iteritems() if changed[ind])
+
+
+class link_sounder(object):
+    '''
+    Measure links from the received sample stream during designated sounding slots
+
+    The tdma controller passes every block of received samples to add_samples, which
+    keeps the power of the last sounding_history seconds of samples. The slot manager
+    passes received packets to measure_packets and calls update once per frame to fold
+    the measurements into the link estimates.
+    '''
+
+    def __init__(self, options):
+
+        self.dev_log = logging.getLogger('developer')
+
+        self.frame_interval = max(1, options.sounding_frame_interval)
+        self.slot_types = set(x.strip() for x in options.sounding_slot_types.split(','))
+        self.history_len = options.sounding_history
+        self.change_threshold = options.sounding_change_threshold
+
+        self.rx_gain = options.rf_rx_gain
+        self.default_tx_gain = options.rf_tx_gain
+
+        # the transmitters' digital power. GMSK has a constant unit envelope before the
+        # digital scaling
+        self.tx_dpwr = options.digital_scale_factor**2
+
+        self.estimates = link_estimates(options.sounding_ewma_alpha)
+
+        # ring buffer holding the power of each received sample. It is allocated when
+        # the sample rate is known
+        self.fs = None
+        self.sample_pwr = None
+        self.end_index = 0
+        self.ref_index = 0
+        self.ref_ts = time_spec_t(0)
+
+        # measurements waiting for their samples to arrive, and measurements ready to
+        # be folded into the estimates
+        self.pending = []
+        self.measured = []
+
+    def is_sounding_frame(self, frame_num):
+        return frame_num % self.frame_interval == 0
+
+    def add_samples(self, start_index, start_ts, samples, fs):
+        '''
+        Store the power of a block of received samples
+
+        start_index is the absolute index of the first sample in the block and start_ts
+        is its timestamp.
+        '''
+        if self.sample_pwr is None or fs != self.fs:
+            self.fs = float(fs)
+            self.sample_pwr = np.zeros(int(ceil(self.history_len*self.fs)),
+                                       dtype=np.float32)
+            self.end_index = start_index
+
+        self.ref_index = start_index
+        self.ref_ts = time_spec_t(start_ts)
+
+        ring_len = len(self.sample_pwr)
+
+        # only the newest ring_len samples can be kept
+        skip = max(0, len(samples) - ring_len)
+        pwr = samples[skip:].real**2 + samples[skip:].imag**2
+
+        # write the block into the ring, wrapping around at most once
+        ring_start = (start_index + skip) % ring_len
+        num_head = min(len(pwr), ring_len - ring_start)
+        self.sample_pwr[ring_start:ring_start+num_head] = pwr[:num_head]
+        self.sample_pwr[:len(pwr)-num_head] = pwr[num_head:]
+
+        self.end_index = start_index + len(samples)
+
+    def mean_power(self, start_ts, duration):
+        '''
+        Mean power of the received samples starting at start_ts and lasting duration
+        seconds. Returns None if the samples haven't arrived yet, and nan if they are
+        no longer kept
+        '''
+        start = self.ref_index + int(round(float(start_ts - self.ref_ts)*self.fs))
+        stop = start + max(1, int(round(duration*self.fs)))
+
+        if stop > self.end_index:
+            return None
+        if start < self.end_index - len(self.sample_pwr):
+            return np.nan
+
+        return float(np.mean(np.take(self.sample_pwr, np.arange(start, stop),
+                                     mode='wrap'), dtype=np.float64))
+
+    def measure_packets(self, pkt_tups, frame_history, mac_config, pkt_overhead):
+        '''
+        Queue a measurement for each packet received in a sounding slot
+
+        pkt_tups are the (meta, data, frame_num, slot_num) tuples of packets that
+        passed CRC, and pkt_overhead is the number of bytes each packet carries on top
+        of its data
+        '''
+        bitrate = mac_config["fs"]/mac_config["samples_per_symbol"]*mac_config["bits_per_symbol"]
+        is_base = mac_config["my_id"] == mac_config["base_id"]
+
+        for meta, data, frame_num, slot_num in pkt_tups:
+
+            if (not self.is_sounding_frame(frame_num) or frame_num not in frame_history or
+                meta.get("fromID", mac_config["my_id"]) == mac_config["my_id"]):
+                continue
+
+            frame = frame_history[frame_num]
+            slot = frame["slots"][slot_num]
+
+            if slot.type not in self.slot_types:
+                continue
+
+            if data is None:
+                data_len = 0
+            else:
+                data_len = len(data)
+
+            # on the base, an uplink packet's uplink_gain is the gain the mobile sent
+            # it with. Anywhere else uplink_gain is the gain the base is ordering this
+            # node to use, which says nothing about how the packet was sent
+            if is_base and slot.type == "uplink":
+                tx_gain = meta.get("uplink_gain", self.default_tx_gain)
+            else:
+                tx_gain = self.default_tx_gain
+
+            self.pending.append(SoundingTuple(from_id=meta["fromID"],
+                                              frame_num=frame_num,
+                                              packet_ts=time_spec_t(meta["timestamp"]),
+                                              packet_dur=(data_len + pkt_overhead)*8/bitrate,
+                                              noise_ts=frame["t0"] + slot.offset,
+                                              noise_dur=mac_config["pre_guard"],
+                                              rf_freq=slot.rf_freq,
+                                              tx_gain=tx_gain))
+
+    def update(self, frame_num):
+        '''
+        Measure any pending packets whose samples have arrived and fold the results into
+        the link estimates. Returns the set of transmitter ids whose pathloss has moved
+        by at least sounding_change_threshold dB since they were last returned
+        '''
+        if self.sample_pwr is None:
+            return set()
+
+        still_pending = []
+        for tup in self.pending:
+            rx_pwr = self.mean_power(tup.packet_ts, tup.packet_dur)
+            noise_pwr = self.mean_power(tup.noise_ts, tup.noise_dur)
+
+            if rx_pwr is None or noise_pwr is None:
+                still_pending.append(tup)
+            # drop measurements that are too old or where the packet can't be told apart
+            # from the noise
+            elif np.isnan(rx_pwr) or np.isnan(noise_pwr) or rx_pwr <= noise_pwr:
+                self.dev_log.debug("dropping sounding measurement from node %i in frame %i",
+                                   tup.from_id, tup.frame_num)
+            else:
+                self.measured.append((tup, rx_pwr, noise_pwr))
+
+        self.pending = still_pending
+
+        if len(self.measured) == 0:
+            return set()
+
+        tups, rx_pwrs, noise_pwrs = zip(*self.measured)
+        self.measured = []
+
+        from_ids = np.array([tup.from_id for tup in tups])
+        rf_freqs = np.array([tup.rf_freq for tup in tups], dtype=float)
+        tx_gains = np.array([tup.tx_gain for tup in tups], dtype=float)
+        rx_pwrs = np.array(rx_pwrs)
+        noise_pwrs = np.array(noise_pwrs)
+
+        # the packet power includes the noise
+        sig_pwrs = rx_pwrs - noise_pwrs
+
+        tx_pwr_eq, rx_pwr_eq = get_pwr_equations(rf_freqs, tx_gains, self.rx_gain)
+
+        # average everything heard from each transmitter this round in linear units
+        # before converting to dB
+        ids, id_inds = np.unique(from_ids, return_inverse=True)
+        counts = np.bincount(id_inds).astype(float)
+
+        def id_mean(vals):
+            return np.bincount(id_inds, weights=vals)/counts
+
+        tx_pwr = id_mean(10**((tx_pwr_eq + 10*np.log10(self.tx_dpwr))/10))
+        sig_pwr = id_mean(10**((rx_pwr_eq + 10*np.log10(sig_pwrs))/10))
+        noise_pwr = id_mean(10**((rx_pwr_eq + 10*np.log10(noise_pwrs))/10))
+
+        tx_pwr_db = 10*np.log10(tx_pwr)
+        sig_pwr_db = 10*np.log10(sig_pwr)
+        noise_pwr_db = 10*np.log10(noise_pwr)
+
+        self.estimates.update(ids.tolist(), frame_num,
+                              pathloss=tx_pwr_db - sig_pwr_db,
+                              snr=sig_pwr_db - noise_pwr_db,
+                              rx_pwr=sig_pwr_db,
+                              noise_pwr=noise_pwr_db)
+
+        for from_id in ids.tolist():
+            self.dev_log.debug("sounding: link from node %i pathloss %0.2f dB snr %0.2f dB",
+                               from_id, self.estimates.get_pathloss(from_id),
+                               self.estimates.get_snr(from_id))
+
+        return self.estimates.pop_changed_links(self.change_threshold)
+
+    def append_my_settings(self, indent_level, opts_xml):
+
+        params = {
+                  "sounding_frame_interval":self.frame_interval,
+                  "sounding_slot_types":",".join(sorted(self.slot_types)),
+                  "sounding_ewma_alpha":self.estimates.alpha,
+                  "sounding_history":self.history_len,
+                  "sounding_change_threshold":self.change_threshold,
+                  }
+        opts_xml += "\n" + dict_to_xml(params, indent_level)
+
+        return opts_xml
+
+    @staticmethod
+    def add_options(normal, expert):
+
+        normal.add_option("--sounding-enabled", type="int", default=0,
+                          help=("Set to 1 to keep estimating pathloss and SNR from packets " +
+                                "received in sounding slots while the network runs " +
+                                "[default=%default]"))
+        normal.add_option("--sounding-frame-interval", type="int", default=10,
+                          help=("Number of frames between sounding frames " +
+                                "[default=%default]"))
+        normal.add_option("--sounding-slot-types", type="string", default="uplink,downlink",
+                          help=("Comma separated list of slot types used for sounding. " +
+                                "Nodes only measure the slots they receive " +
+                                "[default=%default]"))
+        normal.add_option("--sounding-ewma-alpha", type="float", default=0.25,
+                          help=("Weight of each new sounding measurement in the pathloss " +
+                                "and SNR averages [default=%default]"))
+        expert.add_option("--sounding-history", type="float", default=2.0,
+                          help=("Seconds of received samples to keep for measuring " +
+                                "packets after they are decoded [default=%default]"))
+        expert.add_option("--sounding-change-threshold", type="float", default=3.0,
+                          help=("Pathloss change in dB that marks a link as changed " +
+                                "[default=%default]"))
@@ -0,0 +1,347 @@
+#
+# This file is part of ExtRaSy
+#
+# Copyright (C) 2013-2014 Massachusetts Institute of Technology
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# standard python library imports
+from collections import deque
+import logging
+import struct
+import time
+
+# third party library imports
+
+# project specific imports
+from digital_ll.lincolnlog import dict_to_xml
+
+
+# traffic classes, in the order deficit round robin visits them
+TRAFFIC_CLASSES = ("control", "data")
+
+# ethertypes that are treated as control traffic when packets come in from a tap
+# device: ARP and RARP
+CONTROL_ETHERTYPES = (0x0806, 0x8035)
+ETHERTYPE_OFFSET = 12
+
+# offsets into an ethernet frame carrying IPv4 used to tell flows apart: the protocol
+# byte, then the source and destination addresses
+IPV4_ETHERTYPE = 0x0800
+IPV4_PROTO_OFFSET = 23
+IPV4_ADDR_OFFSET = 26
+IPV4_ADDR_END = 34
+
+
+def classify_packet(meta, data):
+    '''
+    Pick the traffic class for a (meta, data) packet
+
+    Packets can request a class directly with a "traffic_class" metadata field.
+    Otherwise ethernet frames carrying ARP are treated as control traffic and
+    everything else is data
+    '''
+
+    traffic_class = meta.get("traffic_class")
+    if traffic_class in TRAFFIC_CLASSES:
+        return traffic_class
+
+    if data is not None and len(data) >= ETHERTYPE_OFFSET + 2:
+        ethertype = struct.unpack_from('!H', data, ETHERTYPE_OFFSET)[0]
+        if ethertype in CONTROL_ETHERTYPES:
+            return "control"
+
+    return "data"
+
+
+def flow_key(meta, data):
+    '''
+    Identify the flow a (meta, data) packet belongs to. Packets in the same flow must 
+    be sent in the order they were queued.
+    
+    IPv4 packets from a tap device are keyed by protocol and address pair. Anything 
+    else falls back to the source and destination IDs in the metadata
+    '''
+    if data is not None and len(data) >= IPV4_ADDR_END:
+        ethertype = struct.unpack_from('!H', data, ETHERTYPE_OFFSET)[0]
+        if ethertype == IPV4_ETHERTYPE:
+            return (data[IPV4_PROTO_OFFSET], data[IPV4_ADDR_OFFSET:IPV4_ADDR_END])
+    
+    return (meta.get("sourceID"), meta.get("destinationID"))
+
+
+class DestinationQueue(object):
+    '''
+    Per destination packet queue with one sub queue per traffic class
+
+    The sub queues share a byte limit and are served with deficit round robin, so a
+    burst of bulk data can't lock out control traffic. This keeps the subset of the
+    deque interface that fill_slot uses: len(q), q[0] and q.popleft() all refer to
+    the packet deficit round robin will send next, and q.append() enqueues a packet.
+    For slot packing look-ahead, q[k] and del q[k] reach the packets queued behind 
+    the head in the same traffic class. Only packets the class has already earned the
+    credit for are reachable: q[k] raises IndexError unless the head class's deficit
+    covers the bytes of q[0] through q[k], so taking any of the reachable packets
+    never overdraws the deficit.
+    '''
+
+    def __init__(self, max_bytes, quanta):
+        '''
+        max_bytes  (int) max number of payload bytes held across all traffic classes
+        quanta    (dict) keyed by traffic class. Bytes of credit each class gets per
+                         round robin visit
+        '''
+        self.max_bytes = max_bytes
+        
+        # a class with no quantum would never earn enough credit to send
+        self.quanta = dict( (c, max(1, q)) for c, q in quanta.iteritems())
+
+        # each entry is a (meta, data, enqueue_time) tuple
+        self._queues = dict( (c, deque()) for c in TRAFFIC_CLASSES)
+        self._deficits = dict( (c, 0) for c in TRAFFIC_CLASSES)
+
+        # index into TRAFFIC_CLASSES of the class round robin is currently serving
+        self._rr_ind = 0
+
+        # class the current head packet was taken from. None means the head needs to
+        # be selected again
+        self._head_class = None
+
+        self.num_pkts = 0
+        self.num_bytes = 0
+
+        self.stats = dict( (c, {"enqueued":0, "dequeued":0, "dropped":0,
+                                "total_delay":0.0, "max_delay":0.0})
+                          for c in TRAFFIC_CLASSES)
+
+    def __len__(self):
+        return self.num_pkts
+
+    def __nonzero__(self):
+        return self.num_pkts > 0
+
+    def __getitem__(self, ind):
+        if ind < 0:
+            raise IndexError("destination queues only support indexing from the head")
+
+        if self.num_pkts == 0:
+            raise IndexError("destination queue is empty")
+
+        head_class = self._select_head()
+        self._check_credit(head_class, ind)
+        meta, data, enqueue_time = self._queues[head_class][ind]
+        return (meta, data)
+    
+    def __delitem__(self, ind):
+        self._remove(ind)
+
+    def append(self, pkt):
+        '''
+        Add a (meta, data) tuple to the queue for its traffic class. If the packet
+        would push the queue past its byte limit, it is dropped and counted. Returns
+        True if the packet was queued.
+        '''
+        meta, data = pkt
+        traffic_class = classify_packet(meta, data)
+        pkt_bytes = _pkt_len(data)
+
+        if self.num_bytes + pkt_bytes > self.max_bytes:
+            self.stats[traffic_class]["dropped"] += 1
+            return False
+
+        self._queues[traffic_class].append( (meta, data, time.time()) )
+        self.num_pkts += 1
+        self.num_bytes += pkt_bytes
+        self.stats[traffic_class]["enqueued"] += 1
+
+        return True
+
+    def popleft(self):
+        '''
+        Remove and return the packet deficit round robin selected as the head
+        '''
+        return self._remove(0)
+    
+    def _remove(self, ind):
+        '''
+        Remove and return the packet ind places behind the head, in the head's traffic
+        class
+        '''
+        if self.num_pkts == 0:
+            raise IndexError("pop from an empty destination queue")
+
+        head_class = self._select_head()
+        class_q = self._queues[head_class]
+        if ind < 0 or ind >= len(class_q):
+            raise IndexError("destination queue index out of range")
+        self._check_credit(head_class, ind)
+        
+        meta, data, enqueue_time = class_q[ind]
+        del class_q[ind]
+        pkt_bytes = _pkt_len(data)
+
+        # charge the class for the bytes it sent
+        self._deficits[head_class] -= pkt_bytes
+
+        # an empty class doesn't get to bank credit
+        if len(self._queues[head_class]) == 0:
+            self._deficits[head_class] = 0
+
+        # only taking the head out can change which packet is next
+        if ind == 0:
+            self._head_class = None
+        self.num_pkts -= 1
+        self.num_bytes -= pkt_bytes
+
+        delay = time.time() - enqueue_time
+        class_stats = self.stats[head_class]
+        class_stats["dequeued"] += 1
+        class_stats["total_delay"] += delay
+        class_stats["max_delay"] = max(class_stats["max_delay"], delay)
+
+        return (meta, data)
+
+    def _check_credit(self, head_class, ind):
+        '''
+        Raise IndexError if the head class's deficit doesn't cover the packets up to and
+        including the one ind places behind the head. The head itself was selected 
+        because the deficit covers it, so it always passes
+        '''
+        if ind == 0:
+            return
+        
+        class_q = self._queues[head_class]
+        if ind >= len(class_q):
+            raise IndexError("destination queue index out of range")
+        
+        needed = sum(_pkt_len(class_q[k][1]) for k in range(ind+1))
+        if needed > self._deficits[head_class]:
+            raise IndexError("not enough deficit round robin credit to look that far " +
+                             "ahead")
+        
+    def _select_head(self):
+        '''
+        Run deficit round robin until some class has enough credit for its head packet
+        '''
+        if self._head_class is not None:
+            return self._head_class
+
+        num_classes = len(TRAFFIC_CLASSES)
+
+        while True:
+            traffic_class = TRAFFIC_CLASSES[self._rr_ind]
+            class_q = self._queues[traffic_class]
+
+            if len(class_q) > 0:
+                if _pkt_len(class_q[0][1]) <= self._deficits[traffic_class]:
+                    self._head_class = traffic_class
+                    return traffic_class
+
+                # not enough credit, so top up this class and move on to the next
+                self._deficits[traffic_class] += self.quanta[traffic_class]
+
+            self._rr_ind = (self._rr_ind + 1) % num_classes
+
+
+class PacketSwitchQueues(dict):
+    '''
+    Maps each toID to its own DestinationQueue, creating queues on first use like a
+    defaultdict.
+    '''
+
+    def __init__(self, max_bytes, control_quantum, data_quantum):
+        super(PacketSwitchQueues, self).__init__()
+
+        self.max_bytes = max_bytes
+        self.quanta = {"control":control_quantum,
+                       "data":data_quantum}
+
+        self.dev_log = logging.getLogger('developer')
+
+    def __missing__(self, toID):
+        dest_q = DestinationQueue(self.max_bytes, self.quanta)
+        self[toID] = dest_q
+        return dest_q
+
+    def get_stats(self):
+        '''
+        Summarize the queue counters, keyed by toID and then traffic class. Delays are
+        in seconds.
+        '''
+
+        stats = {}
+        for toID, dest_q in self.iteritems():
+            dest_stats = {"num_pkts":dest_q.num_pkts,
+                          "num_bytes":dest_q.num_bytes}
+
+            for traffic_class, class_stats in dest_q.stats.iteritems():
+                dequeued = class_stats["dequeued"]
+                if dequeued > 0:
+                    mean_delay = class_stats["total_delay"]/dequeued
+                else:
+                    mean_delay = 0.0
+
+                dest_stats[traffic_class] = {"enqueued":class_stats["enqueued"],
+                                             "dequeued":dequeued,
+                                             "dropped":class_stats["dropped"],
+                                             "mean_delay":mean_delay,
+                                             "max_delay":class_stats["max_delay"]}
+            stats[toID] = dest_stats
+
+        return stats
+
+    def log_stats(self):
+
+        for toID, dest_stats in sorted(self.get_stats().iteritems()):
+            for traffic_class in TRAFFIC_CLASSES:
+                class_stats = dest_stats[traffic_class]
+                self.dev_log.info(("queue to %d class %s: %d enqueued, %d dequeued, " +
+                                   "%d dropped, mean delay %f, max delay %f"),
+                                  toID, traffic_class, class_stats["enqueued"],
+                                  class_stats["dequeued"], class_stats["dropped"],
+                                  class_stats["mean_delay"], class_stats["max_delay"])
+
+    def append_my_settings(self, indent_level, settings_xml):
+
+        params = {
+                  "max_bytes":self.max_bytes,
+                  "control_quantum":self.quanta["control"],
+                  "data_quantum":self.quanta["data"],
+                  }
+
+        settings_xml+= "\n" + dict_to_xml(params, indent_level)
+
+        return settings_xml
+
+    @staticmethod
+    def add_options(normal, expert):
+        """
+        Adds packet switch queue specific options to the Options Parser
+        """
+
+        normal.add_option("--mac-tx-queue-byte-limit", default=75000, type="int",
+                          help=("Max number of payload bytes queued for each " +
+                                "destination on a base station [default=%default]"))
+        expert.add_option("--mac-tx-queue-control-quantum", default=3000, type="int",
+                          help=("Deficit round robin quantum in bytes for control " +
+                                "traffic such as ARP [default=%default]"))
+        expert.add_option("--mac-tx-queue-data-quantum", default=1500, type="int",
+                          help=("Deficit round robin quantum in bytes for data " +
+                                "traffic [default=%default]"))
+
+
+def _pkt_len(data):
+    if data is None:
+        return 0
+    return len(data)
@@ -25,7 +25,6 @@ import logging
 import logging.config
 import math
 from math import floor
-from operator import itemgetter
 import os
 import pickle
 import random
@@ -575,7 +574,8 @@ class shared_rl_agent_protocol_manager(object):
         # store action space to class variable
         pfs.store_action_space(pattern_set=pattern_set, 
                                owner_ids=options.agent_mac_address_mapping,
-                               rf_freqs=rf_freq)
+                               rf_freqs=rf_freq,
+                               fs=fs)
         
         if len(options.agent_rendezvous_rf_band_list) > 0 and len(options.agent_rendezvous_dig_chan_list) > 0:
             
@@ -877,7 +877,8 @@ class base_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, BaseSlotM
                 toID = slot.owner
                 result = self.fill_slot( mac_config, packet_count, slot, k, 
                                    cur_frame_ts, frame_num, mobile_queues[toID], 
-                                   "down", pre_guard, slot.owner)
+                                   "down", pre_guard, slot.owner, 
+                                   frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, mobile_queues[toID], dropped, num_slot_bytes = result
@@ -1098,6 +1099,12 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
         self.sync_timeout = options.agent_rendezvous_interval
         self.beacon_channel = 0
         
+        # with wideband sync, beacons are heard on every digital channel at once, so 
+        # only rf frequencies need to be searched
+        self.wideband_sync = bool(options.beacon_sync_wideband)
+        self._sync_space_src = None
+        self._sync_space = None
+        
         self.first_epoch_packet = 0
         self.epoch_num = None
         
@@ -1320,7 +1327,8 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
             if slot.type == 'uplink' and slot.owner == mac_config["my_id"]:
                 result = self.fill_slot( mac_config, packet_count, slot, k, frame_ts, 
                                         frame_num, app_in, "up",
-                                        pre_guard, mac_config["base_id"], [control_tuple])
+                                        pre_guard, mac_config["base_id"], [control_tuple],
+                                        frame_config=frame_config)
                 
                 # unpack results
                 slot_pkts, packet_count, app_in, dropped, num_slot_bytes = result
@@ -1379,20 +1387,12 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
             
         '''  
         
-        frame_tuples = [ (key, time_spec_t(val["t0"])) for key,val in self.frame_history.items()]
-    
-        # sort by timestamp
-        frame_tuples.sort( key=itemgetter(1)) 
-        frame_times = [el[1] for el in frame_tuples]
-        
         # get the current timestamp, but subtract off 10 samples worth of time to ensure
         # precision issues don't cause us to dither at slot boundaries
         
         timestamp = frame_ts - mac_config["lead_limit"] - 10.0/mac_config["fs"]
         # find frame num and slot num for the current real time
-        end_frame_num, slot_num = self.timestamp_to_slot_and_frame(timestamp,
-                                                                   frame_tuples, 
-                                                                   frame_times)
+        end_frame_num, slot_num = self.timestamp_to_slot_and_frame(timestamp)
         
         # hard limit parameters to 0 to prevent crashes when the timestamp doesn't occur 
         # in a frame the state machine knows about
@@ -1441,8 +1441,33 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
     
     
     
+    def get_sync_space(self):
+        '''
+        Get the list of sync actions to step through while acquiring sync. A wideband
+        search hears every beacon channel at once, so it only keeps the first action 
+        for each rf frequency
+        '''
+        sync_space = PatternFrameSchedule.sync_space
+        
+        if not self.wideband_sync:
+            return sync_space
+        
+        # only rebuild when the class level sync space has been replaced
+        if self._sync_space_src is not sync_space:
+            rf_freqs = set()
+            self._sync_space = []
+            for sync_action in sync_space:
+                if sync_action["rf_freq"] not in rf_freqs:
+                    rf_freqs.add(sync_action["rf_freq"])
+                    self._sync_space.append(sync_action)
+                    
+            self._sync_space_src = sync_space
+            
+        return self._sync_space
+    
     def acquire_sync(self, frame_config, current_ts, mac_config, reset):
         
+        sync_space = self.get_sync_space()
         
         # handle first run
         if self.sync_deadline is None:
@@ -1452,14 +1477,16 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
             
         elif self.sync_deadline < current_ts:
             self.sync_deadline = self.sync_timeout + current_ts
-            self.last_action_ind = (self.last_action_ind +1)%len(PatternFrameSchedule.sync_space)
+            self.last_action_ind = (self.last_action_ind +1)%len(sync_space)
             
             is_updated = True
         else:
             is_updated = False
         
+        # the sync space may have shrunk since the last call
+        self.last_action_ind = self.last_action_ind % len(sync_space)
         
-        sync_action = PatternFrameSchedule.sync_space[self.last_action_ind]
+        sync_action = sync_space[self.last_action_ind]
         frame_len = PatternFrameSchedule._action_space[0]["frame_len"]
         new_frame_config = {
                         "t0":current_ts,
@@ -1473,7 +1500,12 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
                                                 bw=0,
                                                 tx_gain=0)]}
         
-        if is_updated:
+        if is_updated and self.wideband_sync:
+            
+            self.dev_log.info("New Sync schedule: rf freq is %f, listening on all beacon chans", 
+                              sync_action["rf_freq"])
+            
+        elif is_updated:
 
             self.dev_log.info("New Sync schedule: rf freq is %f, beacon chan is %s", 
                               sync_action["rf_freq"],
@@ -1499,7 +1531,10 @@ class mobile_rl_agent_protocol_manager(shared_rl_agent_protocol_manager, MobileS
     def append_my_settings(self, indent_level, opts_xml):
         
         # add components
-        
+        params = {
+                  "wideband_sync":self.wideband_sync,
+                  }
+        opts_xml += "\n" + dict_to_xml(params, indent_level)
            
         opts_xml = super(mobile_rl_agent_protocol_manager, self).append_my_settings(indent_level,
                                                                                     opts_xml)  
@@ -41,13 +41,16 @@ import digital_ll
 from digital_ll import beacon_utils
 from digital_ll import lincolnlog
 from digital_ll import packet_utils2
+from digital_ll import sample_timebase
 from digital_ll import SimpleFrameSchedule
 from digital_ll import SlotParamTuple
 from digital_ll import time_spec_t
 from digital_ll.beacon_utils import TDMA_HEADER_MAX_FIELD_VAL
 from digital_ll.lincolnlog import dict_to_xml
 
+from lead_control import lead_limit_controller
 from mac_ll import tdma_mobile_sm
+from packet_queues import PacketSwitchQueues
 
 
 
@@ -149,12 +152,17 @@ class tdma_controller(gr.sync_block):
 
 
         # dictionary mapping between node ID and the queue holding packets addressed to
-        # that ID. Using defaultdict so that deques for new toIDs are automatically
-        # created as needed. In general, mobiles will only have one queue, since they
-        # only communicate directly with the base, but bases will have one queue per 
-        # associated mobile
-        self.pkt_switch_queues = defaultdict(deque)
+        # that ID. Queues for new toIDs are automatically created as needed. In general,
+        # mobiles will only have one queue, since they only communicate directly with 
+        # the base, but bases will have one queue per associated mobile. Each queue 
+        # splits traffic into classes served by deficit round robin under a byte limit
+        self.pkt_switch_queues = PacketSwitchQueues(options.mac_tx_queue_byte_limit,
+                                                    options.mac_tx_queue_control_quantum,
+                                                    options.mac_tx_queue_data_quantum)
     
+        # sets how far ahead frames are prepared and how long each work call may run
+        self.lead_control = lead_limit_controller(options)
+        
         
         if start_time is None:
             self.start_time = ceil(time.time())
@@ -167,6 +175,9 @@ class tdma_controller(gr.sync_block):
         self.ref_timestamp = time_spec_t(0)
         self.ref_time_offset = 0
         
+        # counts samples from the reference timestamp, so block boundaries are exact
+        self.rx_timebase = sample_timebase(self.fs, self.ref_timestamp)
+        
 
         self.current_timestamp = time_spec_t(0)
         
@@ -237,7 +248,7 @@ class tdma_controller(gr.sync_block):
                            "bits_per_symbol":1, # TODO: Always true for GMSK...will have to fix later
                            "fhss_flag":fhss_flag,
                            "fs":self.fs,
-                           "lead_limit":options.frame_lead_limit,
+                           "lead_limit":self.lead_control.lead_limit,
                            "macCode":macCode,
                            "mux_command":self.mux_name + ".set_schedules",
                            "my_id":options.source_mac_address,
@@ -266,6 +277,9 @@ class tdma_controller(gr.sync_block):
                           help=("Max size of the phy layer packet queue " +
                                 "[default=%default]"))
         
+        PacketSwitchQueues.add_options(normal, expert)
+        lead_limit_controller.add_options(normal, expert)
+        
         normal.add_option("--frame-file", type='string', default="frame.xml",
                           help=("Base station only option " 
                           + "to specify where to load the frame parameters from"))
@@ -311,6 +325,17 @@ class tdma_controller(gr.sync_block):
         #logger.info(dict_to_xml(params, section_indent))
         logger.info(dict_to_xml(params, section_indent))
         
+        # packet switch queue section
+        logger.info("%s<pkt_switch_queues>", (section_indent*'\t'))
+        queue_xml = self.pkt_switch_queues.append_my_settings(section_indent+1, "")
+        logger.info(queue_xml)
+        logger.info("%s</pkt_switch_queues>", (section_indent*'\t'))
+        
+        # lead limit section
+        logger.info("%s<lead_control>", (section_indent*'\t'))
+        lead_xml = self.lead_control.append_my_settings(section_indent+1, "")
+        logger.info(lead_xml)
+        logger.info("%s</lead_control>", (section_indent*'\t'))
         
         self.manage_slots.log_my_settings(section_indent,logger)
         
@@ -526,6 +551,24 @@ class tdma_controller(gr.sync_block):
             msg = pmt.pmt_cons(pmt.from_python(meta), pmt.from_python(data))
             self.message_port_pub(OUTGOING_PKT_PORT, msg)
             
+    def tx_margin(self, tx_list, block_end_ts, wall_start_ts):
+        '''
+        Return how many seconds the earliest timed packet in the tx_list is ahead of the
+        radio's current time, or None if none of the packets are timed
+        '''
+        tx_times = [time_spec_t(meta["tx_time"]) for meta, data in tx_list 
+                    if "tx_time" in meta]
+        
+        if len(tx_times) == 0:
+            return None
+        
+        if hasattr(self.mac_sm, "cq_manager"):
+            current_ts = self.mac_sm.cq_manager.current_radio_time()
+        else:
+            current_ts = block_end_ts + (time.time() - wall_start_ts)
+            
+        return float(min(tx_times) - current_ts)
+    
     def log_dropped_pkts(self, dropped_pkts, **kwargs):
         '''
         Log any packets the MAC drops
@@ -646,7 +689,7 @@ class tdma_controller(gr.sync_block):
         ninput_items = len(input_items[0])
         
         # update the starting timestamp for this block
-        start_timestamp =  self.ref_timestamp + (nread - self.ref_time_offset)/self.fs
+        start_timestamp = self.rx_timebase.to_time(nread - self.ref_time_offset)
 
         #read all tags associated with port 0 for items in this work function
         tags = self.get_tags_in_range(0, nread, nread+ninput_items)
@@ -659,6 +702,7 @@ class tdma_controller(gr.sync_block):
             if key_string == "rx_time":
                 self.ref_time_offset = tag.offset
                 self.ref_timestamp = time_spec_t(pmt.to_python(tag.value))
+                self.rx_timebase = sample_timebase(self.fs, self.ref_timestamp)
                 
                 # only set host offset at the start
                 if not self.found_time:
@@ -682,23 +726,20 @@ class tdma_controller(gr.sync_block):
                 # if this tag occurs at the start of the sample block, update the 
                 # starting timestamp
                 if tag.offset == nread:
-                    start_timestamp =  self.ref_timestamp + (nread - 
-                                           self.ref_time_offset)/self.fs
+                    start_timestamp = self.ref_timestamp
                     
             elif key_string == "rx_rate":
                 self.fs = pmt.to_python(tag.value)
+                self.rx_timebase = sample_timebase(self.fs, self.ref_timestamp)
                 self.found_rate = True
                 
                 #print "mobile controller found time"   
                 # if this tag occurs at the start of the sample block, update the 
                 # starting timestamp
                 if tag.offset == nread:
-                    start_timestamp =  self.ref_timestamp + float(nread - 
-                                           self.ref_time_offset)/self.fs
+                    start_timestamp = self.rx_timebase.to_time(nread - self.ref_time_offset)
 #        self.dev_logger.debug("tag processing complete")
         
-        if not (self.current_sched is None):
-            start_timestamp = start_timestamp.round_to_sample(self.fs, self.current_sched["t0"])
         #determine first transmit slot when we learn the time
         if not self.know_time:
             if self.found_time and self.found_rate:
@@ -709,8 +750,8 @@ class tdma_controller(gr.sync_block):
                 # message
                 if hasattr(self.mac_sm, "cq_manager"):
                     # calibrate the command queue to uhd timing errors
-                    cal_ts = self.ref_timestamp  + float(nread + ninput_items - 
-                                                         self.ref_time_offset)/self.fs
+                    cal_ts = self.rx_timebase.to_time(nread + ninput_items - 
+                                                      self.ref_time_offset)
                     self.mac_sm.cq_manager.add_command_to_queue([(cal_ts, 0, "time_cal")])
                     
          
@@ -719,14 +760,16 @@ class tdma_controller(gr.sync_block):
             # point between now and the end of the current block plus the lead limit. 
             # This should guarantee that packets are always submitted at least one lead
             # limit ahead of their transmit time
-            end_timestamp = self.ref_timestamp + self.mac_config["lead_limit"] + float(nread + 
-                                ninput_items - self.ref_time_offset)/self.fs 
+            end_index = (nread + ninput_items - self.ref_time_offset + 
+                         self.rx_timebase.num_samples(self.mac_config["lead_limit"]))
+            end_timestamp = self.rx_timebase.to_time(end_index)
                                            
         else:
             end_timestamp = start_timestamp
-        
-        if not (self.current_sched is None):
-            end_timestamp = end_timestamp.round_to_sample(self.fs, self.current_sched["t0"])
+
+        # keep the received samples around for background channel sounding
+        if self.know_time and getattr(self.manage_slots, "link_sounder", None) is not None:
+            self.manage_slots.link_sounder.add_samples(nread, start_timestamp, in0, self.fs)
         
         # only update the current timestamp if it is further along than the state machine
         if self.current_timestamp < start_timestamp:
@@ -754,11 +797,16 @@ class tdma_controller(gr.sync_block):
             # handle any incoming packets
             self.process_raw_incoming_queue()
 
-            # start timers
+            # start timers. The wall clock is always needed for the work budget
+            wall_start_ts = time.time()
             if self.monitor_timing == True:
-                wall_start_ts = time.time()
                 state_start_ts = self.current_timestamp
         
+            # stream time of the newest received sample, used to estimate the radio
+            # time if there is no command queue manager to ask
+            block_end_ts = self.rx_timebase.to_time(nread + ninput_items - 
+                                                    self.ref_time_offset)
+        
             outp = None
             #print "mobile controller state machine loop"   
             # iterate state machine until the current timestamp exceeds the ending timestamp
@@ -766,6 +814,7 @@ class tdma_controller(gr.sync_block):
             while self.current_timestamp < end_timestamp:
 #                self.dev_logger.debug("iterating state machine")
                 last_ts = self.current_timestamp
+                step_start_ts = time.time()
                 rf_in = []
                 
                 
@@ -793,6 +842,7 @@ class tdma_controller(gr.sync_block):
                 # handle outputs
                 #print "sending tx frames"                   
                 self.tx_frames(**outp)
+                margin = self.tx_margin(outp["tx_list"], block_end_ts, wall_start_ts)
                 #print "sending commands"
                 self.send_commands(**outp)
                 #print "sending application packets"
@@ -802,6 +852,12 @@ class tdma_controller(gr.sync_block):
                 self.log_mac_behavior(inp,outp)
                 #print "output handling complete"
                 
+                # charge the step to the frame it worked on, and adapt the lead limit
+                # each time a frame is finished
+                self.lead_control.add_step(time.time() - step_start_ts, margin)
+                if outp["frame_count"] != self.frame_count:
+                    self.mac_config["lead_limit"] = self.lead_control.frame_prepared()
+                
                 # update node state with results
                 self.current_timestamp = time_spec_t(outp["current_ts"])
                 self.packet_count = outp["packet_count"]
@@ -823,6 +879,16 @@ class tdma_controller(gr.sync_block):
                     self.dev_logger.warn("INFINITE (PROBABLY) LOOP DETECTED - breaking out after %d loops",loop_counter)
                     self.dev_logger.warn("current timestamp is: %s  end timestamp is %s",self.current_timestamp, end_timestamp)
                     break
+                
+                # give the thread back to the flow graph if this call has run long. The
+                # next call picks up where this one left off
+                if (self.current_timestamp < end_timestamp and 
+                    self.lead_control.over_budget(time.time() - wall_start_ts)):
+                    
+                    self.dev_logger.debug("work budget used up with current timestamp %s " +
+                                          "and end timestamp %s", self.current_timestamp,
+                                          end_timestamp)
+                    break
             #print "tdma controller work complete"  
 #                self.dev_logger.debug("iteration complete")
             # do timer calcs at end of work function
@@ -845,6 +911,20 @@ class tdma_controller(gr.sync_block):
                 if self.state_time_deltas >= self.poll_interval:
                     
                     self.dev_logger.info("runtime ratio was %f wall seconds per state second",self.wall_time_deltas/self.state_time_deltas)
+                    
+                    lead_stats = self.lead_control.pop_stats()
+                    self.dev_logger.info(("lead limit %s s, %d frames, mean frame cost %s s, " +
+                                          "peak frame cost %s s, min tx margin %s s, " +
+                                          "%d short frames, %d deferred work calls"), 
+                                         lead_stats["lead_limit"], lead_stats["frames"],
+                                         lead_stats["mean_frame_cost"], 
+                                         lead_stats["peak_frame_cost"], 
+                                         lead_stats["min_margin"], 
+                                         lead_stats["short_frames"],
+                                         lead_stats["deferred_work_calls"])
+                    
+                    if self.mac_sm.is_base():
+                        self.pkt_switch_queues.log_stats()
                     self.state_time_deltas = 0
                     self.wall_time_deltas = 0
                     
@@ -871,9 +951,8 @@ class tdma_controller(gr.sync_block):
                     frame_ts = (self.current_timestamp + self.mac_config["lead_limit"] + 
                                 k*self.cal_frame_config["frame_len"])
                     
-                    # round fractional part to an integer sample so we don't break the 
-                    # slot selector
-                    frame_ts = time_spec_t(frame_ts.int_s(), round(frame_ts.frac_s()*self.fs)/self.fs )
+                    # round to an integer sample so we don't break the slot selector
+                    frame_ts = self.rx_timebase.round(frame_ts)
                     
                     config = self.mac_config
                     mobile_queues=defaultdict(deque)
@@ -42,6 +42,8 @@ from digital_ll.beacon_utils import TDMA_HEADER_FORMAT
 from digital_ll.beacon_utils import TDMA_HEADER_LEN
 from digital_ll.beacon_utils import TDMA_HEADER_MAX_FIELD_VAL
 from digital_ll.FrameSchedule import SlotParamTuple
+from digital_ll.FrameSchedule import frame_start_index
+from digital_ll.FrameSchedule import get_frame_timing
 
 import sm
 from sm import SM
@@ -705,6 +707,11 @@ class tdma_mobile_sm(tdma_shared,SM):
             if (meta["pktCode"] == self._types_to_ints["data"]) and (meta["toID"] == mac_config["my_id"]):
                 meta, payload = manager.unpack_slot_manager_header(meta, data)
                 app_out_list.append( (meta, payload) )
+            
+            # aggregate packets carry several data packets, so split them back out
+            elif (meta["pktCode"] == self._types_to_ints["aggregate"]) and (meta["toID"] == mac_config["my_id"]):
+                meta, payload = manager.unpack_slot_manager_header(meta, data)
+                app_out_list.extend(manager.unpack_aggregate(meta, payload))
         
         return app_out_list
     
@@ -798,20 +805,16 @@ class tdma_mobile_sm(tdma_shared,SM):
         This is used by mobiles to derive the next frame start time
         '''
         
-        t0 = time_spec_t(frame_config['t0'])
-        frame_len = frame_config['frame_len'] 
-        
-        time_delta = float(current_time - t0)
+        timing = get_frame_timing(frame_config, fs)
         
-    
-        frame_delta = ceil(time_delta/frame_len)
+        # find the lowest frame start time greater than or equal to the current time
+        samples_past_t0 = timing.timebase.to_index(current_time) - timing.t0_index
+        frame_delta = -(-samples_past_t0//timing.frame_len_samples)
         next_frame_num = frame_config["t0_frame_num"] + frame_delta
         
-        # find the lowest frame start time greater than or equal to the current time
-        next_frame_ts = t0 + frame_delta*frame_len
-        next_frame_ts = next_frame_ts.round_to_sample(fs, t0)
+        next_frame_ts = timing.timebase.to_time(frame_start_index(timing, next_frame_num))
         self.dev_log.debug("find_next_frame: sched t0: %s current_ts: %s sched t0 frame num: %i",
-                           t0, current_time, frame_config["t0_frame_num"] )
+                           frame_config["t0"], current_time, frame_config["t0_frame_num"] )
         
         return next_frame_ts, next_frame_num
     
@@ -1037,7 +1040,8 @@ class tdma_base_sm(tdma_shared, SM):
                 pass
                     
         
-        current_ts = current_ts.round_to_sample(mac_config["fs"], cur_frame_config["t0"])
+        timebase = get_frame_timing(cur_frame_config, mac_config["fs"]).timebase
+        current_ts = timebase.round(current_ts)
         
         # add tdma headers to all the packets in the tx list
         tx_list = [ (meta, self.pack_tdma_header(data, **meta)) for meta, data in tx_list  ]
@@ -1070,7 +1074,7 @@ class tdma_base_sm(tdma_shared, SM):
         state_name = state[0]
         fs = inp["mac_config"]["fs"]
         
-        current_ts = current_ts.round_to_sample(fs, frame_config["t0"])
+        current_ts = get_frame_timing(frame_config, fs).timebase.round(current_ts)
         next_frame_ts = compute_next_frame_start(current_ts, frame_count, frame_config, fs)
         
 #        self.dev_log.debug("t0 is %s, current_time is %s, next_frame_ts is %s",
@@ -1103,7 +1107,8 @@ class tdma_base_sm(tdma_shared, SM):
     def switch_packets(self,mac_config, app_in, mobile_queues):
         '''
         Store packets in output queues by toID. This is distinct from routing, which
-        operates on destinationID. 
+        operates on destinationID. The queues enforce their own byte limits and count
+        any packets they have to drop.
         '''
         
         app_in_len = len(app_in)
@@ -1120,8 +1125,7 @@ class tdma_base_sm(tdma_shared, SM):
             if "toID" not in meta:
                 meta["toID"] = meta["destinationID"]
             
-            if( (meta["toID"] != mac_config["my_id"]) and (meta["toID"] > 0) and
-              (len(mobile_queues[meta["toID"]]) < mac_config["app_in_q_size"]) ):
+            if (meta["toID"] != mac_config["my_id"]) and (meta["toID"] > 0):
                 mobile_queues[meta["toID"]].append( (meta,data) )
         
         return mobile_queues
@@ -1145,6 +1149,11 @@ class tdma_base_sm(tdma_shared, SM):
                     meta, payload = manager.unpack_slot_manager_header(meta, data)
 #                    print "packet was data addressed to me"
                     app_out_list.append( (meta, payload) )
+                
+                # aggregate packets carry several data packets, so split them back out
+                elif (meta["pktCode"] == self._types_to_ints["aggregate"]):
+                    meta, payload = manager.unpack_slot_manager_header(meta, data)
+                    app_out_list.extend(manager.unpack_aggregate(meta, payload))
             
             # if the packet wasn't addressed to me, and wasn't from me, try to route it        
             elif meta["fromID"] != mac_config["my_id"]:
@@ -1238,15 +1247,11 @@ def compute_next_frame_start(current_time, frame_num, schedule, fs):
     This is used by base stations to compute the next frame start time
     '''
     
-    t0 = time_spec_t(schedule['t0'])
-    frame_len = schedule['frame_len'] 
-    
-    # find the lowest frame start time greater than or equal to the current time
-    next_frame_ts = float(frame_num-schedule['t0_frame_num'])*frame_len + t0
-    next_frame_ts = next_frame_ts.round_to_sample(fs, t0)
-    
+    timing = get_frame_timing(schedule, fs)
     
-    return next_frame_ts
+    # frame lengths are whole samples, so frame starts are exact sample counts from the
+    # schedule's time reference
+    return timing.timebase.to_time(frame_start_index(timing, frame_num))
                       
 def remove_redundancy(time_gain_tuple_list):
     
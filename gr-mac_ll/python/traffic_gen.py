@@ -18,6 +18,8 @@
 
 # standard python library imports
 from collections import deque
+import errno
+import fcntl
 from fcntl import ioctl
 import logging
 from math import ceil
@@ -25,6 +27,7 @@ from math import floor
 import os
 import pwd
 import random
+import select
 import socket
 import struct
 import sys
@@ -216,11 +219,15 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
     into a queue for transmission by the MAC layer. Any valid data packets the MAC layer gets from
     a remote node are passed out to the network layer
     
+    The device may be opened with several queues, each read by its own thread. Any 
+    set of packet preserving file descriptors, such as socketpair ends, can be passed 
+    in as tun_fds to stand in for the device queues when no tap device is available.
+    
     See /usr/src/linux/Documentation/networking/tuntap.txt 
     '''
 
         
-    def __init__(self, options):
+    def __init__(self, options, tun_fds=None):
         
         gr.basic_block.__init__(
               self,
@@ -234,6 +241,10 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         
         self.max_pkt_size = int(options.tuntap_mtu)
         
+        self.num_queues = max(1, int(options.tuntap_num_queues))
+        self.read_batch_size = max(1, int(options.tuntap_read_batch_size))
+        self.read_size = 10*1024
+        
         # TODO: Don't set up interface if options are wrong
         
         # process the mac and IP address lists from strings to lists
@@ -256,6 +267,7 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         # define initial values for tun_fd and self.tun_ifname in case the node source
         # address is invalid
         self.tun_fd = -1; 
+        self.tun_fds = []
         self.tun_ifname = "error"
         self.keep_going = False
         #self.ip_address = "0.0.0.0"
@@ -276,23 +288,68 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         # register message handler for input port
         self.set_msg_handler(self.IN_PKT_PORT, self.write_to_network)
         
-        # open the TUN/TAP interface
-        (self.tun_fd, self.tun_ifname) = self.open_tun_interface()
-    
-        # set up the mac and ip address for the tunnel device
-        self.configure_tun_device()
-         
-        # set up the arp cache
-        self.add_arp_entries() 
-         
-        self._network_read_thread = threading.Thread(target=self.read_from_network)
+        # build the metadata pmts once so they can be shared by every packet going to
+        # the same destination. Broadcasts fan out over all the other nodes in the 
+        # network
+        self._dest_meta_pmts = {}
+        self._broadcast_meta_pmts = [self.get_dest_meta_pmt(mac_id) 
+                                     for mac_id in self.mac_id_list 
+                                     if mac_id != self.mac_id]
+        
+        # the reader threads all publish on the same port, so serialize access to it 
+        self._pub_lock = threading.Lock()
+        
+        # held while writing to the tunnel, so shut_down can wait out a write in 
+        # progress before closing the tunnel queues
+        self._write_lock = threading.Lock()
+        
+        # the read side of this pipe is watched by every reader thread so shut_down can 
+        # wake them up without waiting on network traffic
+        self._wake_r, self._wake_w = os.pipe()
         
-        # mark this thread as a daemon so the program doesn't wait for it when
-        # closing
-        self._network_read_thread.daemon = True
+        # set once shut_down has run, so a second call doesn't touch closed fds
+        self._closed = False
         
-        # don't start the thread until you're ready to deal with traffic
-        self._network_read_thread.start()
+        # only set up and tear down the tunnel device if this block opened it
+        self.owns_tun_device = tun_fds is None
+        
+        if self.owns_tun_device:
+            # open the TUN/TAP interface
+            (self.tun_fds, self.tun_ifname) = self.open_tun_interface()
+        
+            # set up the mac and ip address for the tunnel device
+            self.configure_tun_device()
+             
+            # set up the arp cache
+            self.add_arp_entries() 
+        else:
+            # caller supplied stand-ins for the tunnel queues, such as one end of a 
+            # socketpair per queue, so skip all device configuration
+            self.tun_fds = list(tun_fds)
+            self.tun_ifname = "external"
+            self.num_queues = len(self.tun_fds)
+            
+        # keep tun_fd pointing at the first queue. Writes to the network go out on it
+        self.tun_fd = self.tun_fds[0]
+        
+        # reads are multiplexed with select, so don't let any single read block
+        for tun_fd in self.tun_fds:
+            flags = fcntl.fcntl(tun_fd, fcntl.F_GETFL)
+            fcntl.fcntl(tun_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        
+        # start one reader thread per tunnel queue
+        self._network_read_threads = []
+        for tun_fd in self.tun_fds:
+            read_thread = threading.Thread(target=self.read_from_network, args=(tun_fd,))
+            
+            # mark this thread as a daemon so the program doesn't wait for it when
+            # closing
+            read_thread.daemon = True
+            self._network_read_threads.append(read_thread)
+        
+        # don't start the threads until you're ready to deal with traffic
+        for read_thread in self._network_read_threads:
+            read_thread.start()
         
 
         
@@ -310,23 +367,37 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         
         if self.use_persistent_tunnel == False:
             cmd= 'sudo ip tuntap add dev ' + self.tun_device_name + ' mode tap user ' + user
+            if self.num_queues > 1:
+                cmd += ' multi_queue'
             os.system(cmd)
         
         
         IFF_TUN        = 0x0001   # tunnel IP packets
         IFF_TAP        = 0x0002   # tunnel ethernet frames
+        IFF_MULTI_QUEUE = 0x0100  # attach several file descriptors to one device
         IFF_NO_PI    = 0x1000   # don't pass extra packet info
         IFF_ONE_QUEUE    = 0x2000   # beats me ;)
 
         # using TAP mode with no Packet Information so read calls will return at packet
         # boundaries and the kernel won't add extra packet information
         mode = IFF_TAP | IFF_NO_PI
+        
+        # in multi queue mode every open of the device with the same name attaches 
+        # another queue. The kernel steers each flow to a single queue, so per flow
+        # ordering is preserved even with one reader per queue
+        if self.num_queues > 1:
+            mode = mode | IFF_MULTI_QUEUE
         TUNSETIFF = 0x400454ca
 
+        tun_fds = []
         try:
-            tun = os.open(self.tun_device_filename, os.O_RDWR)
-            ifs = ioctl(tun, TUNSETIFF, struct.pack("16sH", self.tun_device_name, mode))
+            for k in range(self.num_queues):
+                tun = os.open(self.tun_device_filename, os.O_RDWR)
+                tun_fds.append(tun)
+                ifs = ioctl(tun, TUNSETIFF, struct.pack("16sH", self.tun_device_name, mode))
         except IOError:
+            for tun in tun_fds:
+                os.close(tun)
             print
             print "----------------------------------------------------------------------"
             print "-"
@@ -345,7 +416,7 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
             raise
         
         ifname = ifs[:16].strip("\x00")
-        return (tun, ifname)
+        return (tun_fds, ifname)
 
     def configure_tun_device(self):
         self.logger.debug("configuring tun/tap device")
@@ -423,65 +494,94 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         
         return  low_bytes       
           
-    def read_from_network(self):
+    def get_dest_meta_pmt(self, mac_id):
         '''
-        This function reads packets from the network layer and puts them in a queue for the MAC
-        layer to handle.
+        Get the metadata pmt for packets headed to mac_id, building it on first use
         '''
-        
-        self.logger.debug("starting tuntap read from network")
-        
-        while self.keep_going:  
-           
-            data = os.read(self.tun_fd, 10*1024)
+        try:
+            meta_pmt = self._dest_meta_pmts[mac_id]
+        except KeyError:
+            meta_pmt = pmt.from_python({"destinationID":mac_id})
+            self._dest_meta_pmts[mac_id] = meta_pmt
+        return meta_pmt
+    
+    def read_batch(self, tun_fd):
+        '''
+        Read up to read_batch_size packets from a non-blocking tunnel queue. Returns the
+        list of packets read and False if the queue has been closed
+        '''
+        batch = []
+        while len(batch) < self.read_batch_size:
+            try:
+                data = os.read(tun_fd, self.read_size)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
             
-            #print data.encode('hex')
             # if there's an error with the tunnel interface
             if not data:
-                self.logger.error("Error reading from tunnel device")
-                break
+                return batch, False
             
-            # only add packet to queue if it is under the maximum allowed size
+            batch.append(data)
             
-#            if len(data) < self.max_pkt_size:  
-            # map ip destination address to appropriate mac address
-            to_id = self.read_mac_dest(data)
-            self.logger.debug("read returned. len data is %d", len(data))
-#                self.logger.debug("data is %s", data)
-            if to_id >0:    
-                self.logger.debug("sending message to mac id %d", to_id)
-                meta= {"destinationID":to_id}
-                self.message_port_pub(self.OUT_PKT_PORT, 
-                              pmt.pmt_cons(pmt.from_python(meta), 
-                                           pmt.from_python(data)))
-            # handle broadcast case
-            elif to_id == -1:
-                for mac_id in self.mac_id_list:
-                    if mac_id != self.mac_id:
-                        self.logger.debug("sending broadcast message to mac id %d", mac_id)
-                        meta= {"destinationID":mac_id} 
+        return batch, True
+    
+    def publish_batch(self, batch):
+        '''
+        Map each packet in batch to its mac destination and send it out to the MAC layer
+        '''
+        with self._pub_lock:
+            for data in batch:
+                # map ip destination address to appropriate mac address
+                to_id = self.read_mac_dest(data)
+                self.logger.debug("read returned. len data is %d", len(data))
+                if to_id >0:    
+                    self.logger.debug("sending message to mac id %d", to_id)
+                    self.message_port_pub(self.OUT_PKT_PORT, 
+                                  pmt.pmt_cons(self.get_dest_meta_pmt(to_id), 
+                                               pmt.from_python(data)))
+                # handle broadcast case. Convert the payload once and share it across
+                # every copy
+                elif to_id == -1:
+                    data_pmt = pmt.from_python(data)
+                    for meta_pmt in self._broadcast_meta_pmts:
                         self.message_port_pub(self.OUT_PKT_PORT, 
-                                              pmt.pmt_cons(pmt.from_python(meta), 
-                                                           pmt.from_python(data)))
-#            else:
-#                self.logger.debug("type of len(data) is %s. Type of max_pkt_size is %s", type(len(data)), type(self.max_pkt_size))
-#                msg = ()
-#                self.logger.warning("provided packet length of %s exceeds maximum " + 
-#                                    "allowed packet length of %s. Dropping this packet",
-#                                    len(data), self.max_pkt_size)
-
-             
+                                              pmt.pmt_cons(meta_pmt, data_pmt))
+          
+    def read_from_network(self, tun_fd):
+        '''
+        This function reads packets from one queue of the network layer and puts them in
+        a queue for the MAC layer to handle.
+        '''
         
+        self.logger.debug("starting tuntap read from network on fd %d", tun_fd)
         
-        try: 
-            os.close(self.tun_fd)
-        except OSError as e:
-            if e.errno == os.errno.EBADF:
-                self.logger.warning("Tunnel file descriptor is bad");
-            else:
-                self.logger.error("unexpected error when closing tunnel file descriptor")
-                raise    
+        queue_open = True
+        while self.keep_going and queue_open:  
+           
+            try:
+                readable, _, _ = select.select([tun_fd, self._wake_r], [], [])
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            
+            # shut_down writes to the wake pipe. Leave the byte in the pipe so the
+            # other reader threads see it too
+            if self._wake_r in readable:
+                break
+            
+            batch, queue_open = self.read_batch(tun_fd)
             
+            if not queue_open:
+                self.logger.error("Error reading from tunnel device")
+            
+            if len(batch) > 0:
+                self.publish_batch(batch)
+        
+        # the tunnel queues are shared with the writer, so shut_down closes them once 
+        # every thread is done with them
         self.logger.debug("tunnel interface read from network complete")
             
     def write_to_network(self,payload):
@@ -491,38 +591,77 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         data = str(pmt.to_python(payload))
         #self.logger.debug("Write to network called. Keep going is %s", self.keep_going)
         # only forward packets while tunned is active
-        if self.keep_going:
-            self.logger.debug("sending packet to app layer, length %i", 
-                              len(data))
-            os.write(self.tun_fd, data)
+        with self._write_lock:
+            if self.keep_going:
+                self.logger.debug("sending packet to app layer, length %i", 
+                                  len(data))
+                
+                # each write to a tap device is one ethernet frame, so packets can't be 
+                # gathered into a single write. The queue is non-blocking, so wait for 
+                # room if the kernel pushes back, until shut down
+                while self.keep_going:
+                    try:
+                        os.write(self.tun_fd, data)
+                        break
+                    except OSError as e:
+                        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                            raise
+                        select.select([], [self.tun_fd], [], 0.1)
+    
+    def close_fd(self, fd):
+        '''
+        Close one of the tunnel queues or wake pipe ends
+        '''
+        try: 
+            os.close(fd)
+        except OSError as e:
+            if e.errno == errno.EBADF:
+                self.logger.warning("Tunnel file descriptor is bad");
+            else:
+                self.logger.error("unexpected error when closing tunnel file descriptor")
+                raise    
     
     def shut_down(self):
         '''
         This function makes the traffic generator break out of any infinite loops and shut down
         '''
+        if self._closed:
+            return
+        self._closed = True
+        
         self.logger.info("Shutting down tunnel interface")
         self.keep_going = False
         
+        # wake up the reader threads waiting in select so they can exit
+        os.write(self._wake_w, "x")
         
-        ip_split = self.ip_address.split('.')
-        # send a ping to the current interface to break out of the blocking read on the 
-        # tunnel device
+        for read_thread in self._network_read_threads:
+            read_thread.join(1.0)
         
-        ping_address = '.'.join(ip_split[:3]) + '.0'
-
-        # send a ping out the broadcast address and wait for 1 second before
-        # exiting. This will force the read_from_network out of it's 
-        # blocking read call
-        cmd = 'ping -c 1 -b -w 1 %s' % ping_address
-        os.system(cmd)
+        # wait for any write in progress. Nothing is written once keep_going is False
+        with self._write_lock:
+            pass
         
+        if any(read_thread.is_alive() for read_thread in self._network_read_threads):
+            self.logger.warning("tunnel reader threads did not stop, leaving the " +
+                                "tunnel queues open")
+        else:
+            # tunnel queues supplied by the caller are the caller's to close
+            if self.owns_tun_device:
+                for fd in self.tun_fds:
+                    self.close_fd(fd)
+                    
+            self.close_fd(self._wake_r)
+            self.close_fd(self._wake_w)
         
         # sleep to make sure all traffic finishes
         time.sleep(.1)
         # TODO: Add try catch statement with description of common fixes to problems if
         # 'ip tuntap del dev' command fails
         
-        if self.use_persistent_tunnel == False:
+        if not self.owns_tun_device:
+            self.logger.debug("tunnel queues supplied externally, leaving them in place")
+        elif self.use_persistent_tunnel == False:
             # remove tunnel
             self.logger.debug("taking down interface")
             cmd= 'sudo ifconfig ' + self.tun_device_name + ' down'
@@ -580,6 +719,13 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         
         expert.add_option("--tuntap-mtu", default="1500",
                           help="Max packet size for tuntap device [default=%default]")
+        expert.add_option("--tuntap-num-queues", default=1, type="int",
+                          help=("Number of tuntap device queues to open, with one reader " +
+                                "thread per queue. Values above 1 use a multi queue " + 
+                                "device [default=%default]"))
+        expert.add_option("--tuntap-read-batch-size", default=16, type="int",
+                          help=("Max number of packets to read from a tuntap queue " +
+                                "each time it becomes readable [default=%default]"))
         # TODO: Am I missing any options? How do you pick your IP?
        
         
@@ -596,7 +742,9 @@ class Tunnel_Handler_PDU_Streamer(gr.basic_block):
         
         # tunnel section param values
         params = {"tun_device_filename":self.tun_device_filename,
-                  "tun_ifname":self.tun_ifname}
+                  "tun_ifname":self.tun_ifname,
+                  "num_queues":self.num_queues,
+                  "read_batch_size":self.read_batch_size}
         
                 
         # TODO: Am I missing any interesting parameters?